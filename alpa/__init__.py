@@ -25,8 +25,8 @@ from alpa.api import (init, shutdown, parallelize, grad, value_and_grad,
 from alpa.data_loader import DataLoader, MeshDriverDataLoader
 from alpa.device_mesh import (
     DeviceCluster, PhysicalDeviceMesh, LocalPhysicalDeviceMesh,
-    DistributedPhysicalDeviceMesh, DistributedArray, prefetch,
-    get_global_cluster, get_global_physical_mesh,
+    DistributedPhysicalDeviceMesh, DistributedArray, prefetch, device_get,
+    flush_deletes, get_global_cluster, get_global_physical_mesh,
     get_global_virtual_physical_mesh, set_global_virtual_physical_mesh,
     set_seed, get_global_num_devices)
 from alpa.global_env import global_config
@@ -46,6 +46,7 @@ from alpa.pipeline_parallel.stage_construction import (ManualStageOption,
                                                        UniformStageOption)
 from alpa.shard_parallel.auto_sharding import AutoShardingOption
 from alpa.shard_parallel.manual_sharding import ManualShardingOption
-from alpa.serialization import save_checkpoint, restore_checkpoint
+from alpa.serialization import (save_checkpoint, restore_checkpoint,
+                                wait_checkpoint, convert_checkpoint_to_chunked)
 from alpa.timer import timers
 from alpa.version import __version__
@@ -1,4 +1,5 @@
 """Top-level user API."""
+import time
 from typing import Callable, Optional, Sequence, Union
 
 from jax import linear_util as lu
@@ -10,6 +11,8 @@ from jax.core import AbstractValue
 from jax.experimental.maps import FrozenDict
 from jax.tree_util import tree_flatten, tree_unflatten, PyTreeDef
 
+from alpa.compilation_cache import (apply_cached_plan, can_apply_cached_plan,
+                                    get_compilation_cache)
 from alpa.device_mesh import init_global_cluster, shutdown_global_cluster
 from alpa.parallel_method import ParallelMethod, ShardParallel
 from alpa.pipeline_parallel.primitive_def import mark_gradient
@@ -219,10 +222,29 @@ def _compile_parallel_executable(
             batch_invars[idx] = False
     batch_invars = tuple(batch_invars)
 
+    # Reuse the decisions of previous runs from the on-disk cache
+    cache = get_compilation_cache()
+    if cache is not None and not can_apply_cached_plan(method):
+        cache = None
+    if cache is not None:
+        key = cache.compute_key(fun, static_argnums, donated_invars,
+                                batch_invars, method, *avals)
+        for store in fun.stores:
+            if store:
+                store.reset()
+        entry = cache.lookup(key)
+        if entry is not None:
+            method = apply_cached_plan(method, entry)
+        tic = time.time()
+
     # Compile a callable
-    return method.compile_executable(fun, in_tree, out_tree_thunk,
-                                     static_argnums, donated_invars,
-                                     batch_invars, *avals)
+    executable = method.compile_executable(fun, in_tree, out_tree_thunk,
+                                           static_argnums, donated_invars,
+                                           batch_invars, *avals)
+
+    if cache is not None and entry is None:
+        cache.insert(key, fun.__name__, executable, time.time() - tic)
+    return executable
 
 
 def clear_executable_cache():
@@ -3,19 +3,23 @@
 from alpa.collective.collective import (
     nccl_available, gloo_available, is_group_initialized, init_collective_group,
     destroy_collective_group, create_collective_group, get_rank,
-    get_collective_group_size, allreduce, allreduce_multigpu, barrier, reduce,
-    reduce_multigpu, broadcast, broadcast_partialgpu, broadcast_multigpu,
-    allgather, allgather_multigpu, reducescatter, reducescatter_multigpu, send,
-    send_multigpu, recv, recv_multigpu, check_and_get_group, record_events,
-    wait_events, comm_wait_compute, compute_wait_comm)
+    get_collective_group_size, allreduce, allreduce_coalesced,
+    allreduce_multigpu, barrier, reduce, reduce_multigpu, broadcast,
+    broadcast_coalesced, broadcast_partialgpu, broadcast_multigpu, allgather,
+    allgather_coalesced, allgather_multigpu, reducescatter,
+    reducescatter_multigpu, send, send_multigpu, recv, recv_multigpu,
+    check_and_get_group, record_events, wait_events, comm_wait_compute,
+    compute_wait_comm)
 
 __all__ = [
     "nccl_available", "gloo_available", "is_group_initialized",
     "init_collective_group", "destroy_collective_group",
     "create_collective_group", "get_rank", "get_collective_group_size",
-    "allreduce", "allreduce_multigpu", "barrier", "reduce", "reduce_multigpu",
-    "broadcast", "broadcast_partialgpu", "broadcast_multigpu", "allgather",
-    "allgather_multigpu", "reducescatter", "reducescatter_multigpu", "send",
-    "send_multigpu", "recv", "recv_multigpu", "check_and_get_group",
-    "record_events", "wait_events", "comm_wait_compute", "compute_wait_comm"
+    "allreduce", "allreduce_coalesced", "allreduce_multigpu", "barrier",
+    "reduce", "reduce_multigpu", "broadcast", "broadcast_coalesced",
+    "broadcast_partialgpu", "broadcast_multigpu", "allgather",
+    "allgather_coalesced", "allgather_multigpu", "reducescatter",
+    "reducescatter_multigpu", "send", "send_multigpu", "recv",
+    "recv_multigpu", "check_and_get_group", "record_events", "wait_events",
+    "comm_wait_compute", "compute_wait_comm"
 ]
@@ -1,7 +1,7 @@
 """APIs exposed under the namespace ray.util.collective."""
 import logging
 import os
-from typing import List
+from typing import List, Optional
 
 import numpy as np
 import ray
@@ -320,6 +320,33 @@ def allreduce_multigpu(tensor_list: list,
     g.allreduce(tensor_list, opts)
 
 
+def allreduce_coalesced(tensor_list: list,
+                        group_name: str = "default",
+                        op=types.ReduceOp.SUM,
+                        bucket_bytes: Optional[int] = None):
+    """Collective allreduce a list of tensors across the group.
+
+    The tensors are packed into contiguous buckets, and each bucket is
+    all-reduced with one collective call. All processes must pass tensors of
+    the same shapes and dtypes in the same order.
+
+    Args:
+        tensor_list (List[tensor]): the tensors to be all-reduced in place.
+        group_name (str): the collective group name to perform allreduce.
+        op: The reduce operation.
+        bucket_bytes (Optional[int]): the size cap of a bucket. Defaults to
+            global_config.collective_bucket_bytes.
+
+    Returns:
+        None
+    """
+    _check_tensor_list_input(tensor_list)
+    g = _check_and_get_group(group_name)
+    opts = types.AllReduceOptions()
+    opts.reduce_op = op
+    g.allreduce_coalesced(tensor_list, _get_bucket_bytes(bucket_bytes), opts)
+
+
 def barrier(group_name: str = "default"):
     """Barrier all processes in the collective group.
 
@@ -416,6 +443,38 @@ def broadcast(tensor, src_rank: int = 0, group_name: str = "default"):
     g.broadcast([tensor], opts)
 
 
+def broadcast_coalesced(tensor_list: list,
+                        src_rank: int = 0,
+                        group_name: str = "default",
+                        bucket_bytes: Optional[int] = None):
+    """Broadcast a list of tensors from a source process to all others.
+
+    The tensors are packed into contiguous buckets, and each bucket is
+    broadcast with one collective call. All processes must pass tensors of
+    the same shapes and dtypes in the same order.
+
+    Args:
+        tensor_list (List[tensor]): the tensors to be broadcasted (src) or
+            received (destination).
+        src_rank (int): the rank of the source process.
+        group_name (str): the collective group name to perform broadcast.
+        bucket_bytes (Optional[int]): the size cap of a bucket. Defaults to
+            global_config.collective_bucket_bytes.
+
+    Returns:
+        None
+    """
+    _check_tensor_list_input(tensor_list)
+    g = _check_and_get_group(group_name)
+
+    # check src rank
+    _check_rank_valid(g, src_rank)
+    opts = types.BroadcastOptions()
+    opts.root_rank = src_rank
+    opts.root_tensor = 0
+    g.broadcast_coalesced(tensor_list, _get_bucket_bytes(bucket_bytes), opts)
+
+
 def broadcast_partialgpu(tensor_list,
                          n_elements,
                          comm_key,
@@ -511,6 +570,44 @@ def allgather(tensor_list: list, tensor, group_name: str = "default"):
     g.allgather([tensor_list], [tensor], opts)
 
 
+def allgather_coalesced(output_tensor_lists: list,
+                        tensor_list: list,
+                        group_name: str = "default",
+                        bucket_bytes: Optional[int] = None):
+    """Allgather a list of tensors from each process of the group.
+
+    The tensors are packed into contiguous buckets, and each bucket is
+    allgathered with one collective call. All processes must pass tensors of
+    the same shapes and dtypes in the same order.
+
+    Args:
+        output_tensor_lists (List[List[tensor]]): the results.
+            output_tensor_lists[i][r] receives tensor_list[i] of rank r.
+        tensor_list (List[tensor]): the tensors (to be gathered) in the
+            current process.
+        group_name (str): the name of the collective group.
+        bucket_bytes (Optional[int]): the size cap of a bucket. Defaults to
+            global_config.collective_bucket_bytes.
+
+    Returns:
+        None
+    """
+    _check_tensor_lists_input(output_tensor_lists)
+    _check_tensor_list_input(tensor_list)
+    g = _check_and_get_group(group_name)
+    if len(output_tensor_lists) != len(tensor_list):
+        raise RuntimeError("The number of output tensor lists must be equal "
+                           "to the number of tensors to allgather.")
+    for output_tensor_list in output_tensor_lists:
+        if len(output_tensor_list) != g.world_size:
+            raise RuntimeError(
+                "The length of the tensor list operands to allgather "
+                "must be equal to world_size.")
+    opts = types.AllGatherOptions()
+    g.allgather_coalesced(output_tensor_lists, tensor_list,
+                          _get_bucket_bytes(bucket_bytes), opts)
+
+
 def allgather_multigpu(output_tensor_lists: list,
                        input_tensor_list: list,
                        group_name: str = "default"):
@@ -798,6 +895,15 @@ def compute_wait_comm(group_name, is_send, is_compute, device_id):
     g.compute_wait_comm(is_send, is_compute, device_id)
 
 
+def _get_bucket_bytes(bucket_bytes):
+    """Get the bucket size of coalesced collectives."""
+    if bucket_bytes is None:
+        return global_config.collective_bucket_bytes
+    if bucket_bytes <= 0:
+        raise ValueError(f"bucket_bytes '{bucket_bytes}' must be positive.")
+    return bucket_bytes
+
+
 def _check_single_tensor_input(tensor):
     """Check if the tensor is with a supported type."""
     if isinstance(tensor, (np.ndarray, xe.DeviceArray)):
@@ -188,3 +188,35 @@ class BaseGroup(metaclass=ABCMeta):
     @abstractmethod
     def recv(self, tensors, recv_options):
         raise NotImplementedError()
+
+    def allreduce_coalesced(self,
+                            tensors,
+                            bucket_bytes,
+                            allreduce_options=AllReduceOptions()):
+        """AllReduce a list of tensors in place. Backends without tensor
+        fusion run one allreduce per tensor."""
+        del bucket_bytes
+        for tensor in tensors:
+            self.allreduce([tensor], allreduce_options)
+
+    def allgather_coalesced(self,
+                            tensor_lists,
+                            tensors,
+                            bucket_bytes,
+                            allgather_options=AllGatherOptions()):
+        """Allgather each tensor of a list into the corresponding list of
+        tensor_lists. Backends without tensor fusion run one allgather per
+        tensor."""
+        del bucket_bytes
+        for tensor_list, tensor in zip(tensor_lists, tensors):
+            self.allgather([tensor_list], [tensor], allgather_options)
+
+    def broadcast_coalesced(self,
+                            tensors,
+                            bucket_bytes,
+                            broadcast_options=BroadcastOptions()):
+        """Broadcast a list of tensors. Backends without tensor fusion run one
+        broadcast per tensor."""
+        del bucket_bytes
+        for tensor in tensors:
+            self.broadcast([tensor], broadcast_options)
@@ -190,10 +190,14 @@ class GLOOGroup(BaseGroup):
         self._rendezvous = Rendezvous(self.group_name, self._gloo_context,
                                       store_type, device_type)
         self._rendezvous.meet()
+        # The reused flat buffers of coalesced collectives, keyed by
+        # (usage, dtype)
+        self._bucket_buffers = {}
 
     def destroy_group(self):
         """Destroy the group and release GLOO communicators."""
         self._rendezvous.destroy()
+        self._bucket_buffers.clear()
 
         if self._gloo_context is not None:
             pygloo.barrier(self._gloo_context)
@@ -405,6 +409,115 @@ class GLOOGroup(BaseGroup):
 
         self._point2point(tensors, p2p_fn, recv_options.src_rank)
 
+    def allreduce_coalesced(self,
+                            tensors,
+                            bucket_bytes,
+                            allreduce_options=AllReduceOptions()):
+        """AllReduce a list of CPU tensors in place with one collective call
+        per bucket.
+
+        Args:
+            tensors (List): the tensors to be reduced. All processes must
+                            pass the same shapes and dtypes in the same order.
+            bucket_bytes (int): the size cap of a bucket.
+            allreduce_options: allreduce options.
+
+        Returns:
+            None
+        """
+        reduce_op = gloo_util.get_gloo_reduce_op(allreduce_options.reduce_op)
+
+        def collective_fn(bucket, buffer):
+            ptr = gloo_util.get_tensor_ptr(buffer)
+            pygloo.allreduce(self._gloo_context, ptr, ptr, bucket.n_elements,
+                             gloo_util.get_gloo_tensor_dtype(buffer),
+                             reduce_op)
+
+        self._coalesced_collective(tensors,
+                                   bucket_bytes,
+                                   collective_fn,
+                                   pack=True,
+                                   unpack=True)
+
+    def allgather_coalesced(self,
+                            tensor_lists,
+                            tensors,
+                            bucket_bytes,
+                            allgather_options=AllGatherOptions()):
+        """Allgather a list of CPU tensors with one collective call per
+        bucket.
+
+        Args:
+            tensor_lists (List[List[Tensor]]): tensor_lists[i][r] receives
+                                               tensors[i] of rank r.
+            tensors (List): the tensors to allgather. All processes must pass
+                            the same shapes and dtypes in the same order.
+            bucket_bytes (int): the size cap of a bucket.
+            allgather_options: allgather options.
+
+        Returns:
+            None
+        """
+        if len(tensor_lists) != len(tensors):
+            raise RuntimeError("The number of tensor lists must be equal to "
+                               f"the number of tensors. Got "
+                               f"{len(tensor_lists)} != {len(tensors)}.")
+        world_size = self.world_size
+        rank_outputs = [[tensor_list[r]
+                         for tensor_list in tensor_lists]
+                        for r in range(world_size)]
+        _check_cpu_tensor_list(
+            [tensor for outputs in rank_outputs for tensor in outputs])
+
+        def collective_fn(bucket, buffer):
+            output = self._get_bucket_buffer("output", bucket.dtype,
+                                             world_size * bucket.n_elements)
+            output = output.reshape(world_size, bucket.n_elements)
+            pygloo.allgather(self._gloo_context,
+                             gloo_util.get_tensor_ptr(buffer),
+                             gloo_util.get_tensor_ptr(output),
+                             bucket.n_elements,
+                             gloo_util.get_gloo_tensor_dtype(buffer))
+            for r in range(world_size):
+                bucket.unpack(output[r], rank_outputs[r])
+
+        self._coalesced_collective(tensors,
+                                   bucket_bytes,
+                                   collective_fn,
+                                   pack=True,
+                                   unpack=False)
+
+    def broadcast_coalesced(self,
+                            tensors,
+                            bucket_bytes,
+                            broadcast_options=BroadcastOptions()):
+        """Broadcast a list of CPU tensors with one collective call per
+        bucket.
+
+        Args:
+            tensors (List): tensors to be broadcast or received. All
+                            processes must pass the same shapes and dtypes in
+                            the same order.
+            bucket_bytes (int): the size cap of a bucket.
+            broadcast_options: broadcast options.
+
+        Returns:
+            None
+        """
+        root_rank = broadcast_options.root_rank
+
+        def collective_fn(bucket, buffer):
+            ptr = gloo_util.get_tensor_ptr(buffer)
+            pygloo.broadcast(self._gloo_context, ptr, ptr, bucket.n_elements,
+                             gloo_util.get_gloo_tensor_dtype(buffer),
+                             root_rank)
+
+        self._coalesced_collective(tensors,
+                                   bucket_bytes,
+                                   collective_fn,
+                                   pack=self.rank == root_rank,
+                                   unpack=self.rank != root_rank)
+
     def _collective(self,
                     input_tensors,
                     output_tensors,
@@ -432,6 +545,50 @@ class GLOOGroup(BaseGroup):
         if postprocess_fn:
             postprocess_fn()
 
+    def _coalesced_collective(self, tensors, bucket_bytes, collective_fn,
+                              pack, unpack):
+        """A method to encapsulate all coalesced collective calls.
+
+        Args:
+            tensors: the list of the input tensors.
+            bucket_bytes (int): the size cap of a bucket.
+            collective_fn: the collective function call on a bucket and its
+                           flat input buffer.
+            pack (bool): whether to copy the tensors into the buffer.
+            unpack (bool): whether to copy the buffer back to the tensors.
+
+        Returns:
+            None
+        """
+        _check_cpu_tensor_list(tensors)
+        for bucket in _get_coalesced_buckets(tensors, bucket_bytes):
+            if bucket.n_elements == 0:
+                continue
+            tensor = tensors[bucket.indices[0]]
+            if (len(bucket.indices) == 1 and
+                    isinstance(tensor, numpy.ndarray) and
+                    tensor.flags.c_contiguous):
+                # Run on the tensor itself without copies
+                collective_fn(bucket, tensor.reshape(-1))
+                continue
+            buffer = self._get_bucket_buffer("input", bucket.dtype,
+                                             bucket.n_elements)
+            if pack:
+                bucket.pack(tensors, buffer)
+            collective_fn(bucket, buffer)
+            if unpack:
+                bucket.unpack(buffer, tensors)
+
+    def _get_bucket_buffer(self, usage, dtype, n_elements):
+        """Get a flat buffer of n_elements. The largest buffer of each usage
+        and dtype is kept and reused by later calls."""
+        key = (usage, dtype)
+        buffer = self._bucket_buffers.get(key)
+        if buffer is None or buffer.size < n_elements:
+            buffer = numpy.empty(n_elements, dtype=dtype)
+            self._bucket_buffers[key] = buffer
+        return buffer[:n_elements]
+
     def _point2point(self, tensors, p2p_fn, peer_rank: int):
         """A method to encapsulate all peer-to-peer calls (i.e., send/recv).
 
@@ -448,6 +605,59 @@ class GLOOGroup(BaseGroup):
         p2p_fn(tensors[0], self._gloo_context, peer_rank)
 
 
+class _CoalescedBucket:
+    """Tensors of the same dtype packed into a contiguous flat buffer."""
+
+    def __init__(self, dtype):
+        self.dtype = dtype
+        self.indices = []
+        self.shapes = []
+        self.offsets = [0]
+
+    @property
+    def n_elements(self):
+        return self.offsets[-1]
+
+    def add(self, index, shape, n_elements):
+        self.indices.append(index)
+        self.shapes.append(shape)
+        self.offsets.append(self.offsets[-1] + n_elements)
+
+    def pack(self, tensors, buffer):
+        """Copy tensors[i] of each index i into the buffer."""
+        for k, i in enumerate(self.indices):
+            view = buffer[self.offsets[k]:self.offsets[k + 1]]
+            gloo_util.copy_tensor(view.reshape(self.shapes[k]), tensors[i])
+
+    def unpack(self, buffer, tensors):
+        """Copy the views of the buffer back to tensors[i] of each index i."""
+        for k, i in enumerate(self.indices):
+            view = buffer[self.offsets[k]:self.offsets[k + 1]]
+            gloo_util.copy_tensor(tensors[i], view.reshape(self.shapes[k]))
+
+
+def _get_coalesced_buckets(tensors, bucket_bytes):
+    """Group tensors into buckets of the same dtype in order.
+
+    A bucket holds at most bucket_bytes unless it has a single tensor. The
+    buckets only depend on the shapes and dtypes, so all processes get the
+    same buckets.
+    """
+    buckets = []
+    open_buckets = {}
+    for i, tensor in enumerate(tensors):
+        dtype = numpy.dtype(gloo_util.get_numpy_tensor_dtype(tensor))
+        n_elements = gloo_util.get_tensor_n_elements(tensor)
+        bucket = open_buckets.get(dtype)
+        if (bucket is None or
+            (bucket.n_elements + n_elements) * dtype.itemsize > bucket_bytes):
+            bucket = _CoalescedBucket(dtype)
+            buckets.append(bucket)
+            open_buckets[dtype] = bucket
+        bucket.add(i, gloo_util.get_tensor_shape(tensor), n_elements)
+    return buckets
+
+
 def _check_cpu_tensors(tensors):
     """Check only have one tensor and located on CPU."""
     if not tensors or not isinstance(tensors, list):
@@ -461,6 +671,17 @@ def _check_cpu_tensors(tensors):
                            f" Got {d}.")
 
 
+def _check_cpu_tensor_list(tensors):
+    """Check all tensors in a nonempty list are located on CPU."""
+    if not tensors or not isinstance(tensors, list):
+        raise RuntimeError("'tensors' must be a nonempty list.")
+    for t in tensors:
+        d = gloo_util.get_tensor_device(t)
+        if d != "cpu":
+            raise RuntimeError("Gloo only accept cpu tensor."
+                               f" Got {d}.")
+
+
 def _flatten_for_scatter_gather(tensor_list, copy=False):
     """Flatten the tensor for gather/scatter operations.
 
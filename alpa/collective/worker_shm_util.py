@@ -0,0 +1,432 @@
+"""Shared-memory transport of cross-mesh resharding between mesh workers on
+the same host.
+
+Each (sender device, receiver device) pair owns a single-producer
+single-consumer ring buffer in POSIX shared memory. Tiles are sent in the
+same order as they are received, as in the NCCL path. A tile that fits in the
+ring is never split, so the receiver reads it through a zero-copy view of the
+ring. The data goes through host memory, so the data path works with any
+device type. It is the only transport between meshes of the "cpu" backend.
+
+As an NCCL send, a send task does not wait for the receivers: the tiles are
+written by a background thread of the worker (see ShmSender).
+"""
+from collections import namedtuple, deque
+import logging
+from multiprocessing import resource_tracker, shared_memory
+import sys
+import threading
+import time
+from typing import Sequence
+import uuid
+
+import numpy as np
+
+from alpa.util import is_continuous_subset
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# The name and the data capacity (in bytes) of a shared-memory channel
+ShmChannelSpec = namedtuple("ShmChannelSpec", ["name", "capacity"])
+
+# The write counter and the read counter are on different cache lines
+_WRITE_COUNTER_OFFSET = 0
+_READ_COUNTER_OFFSET = 64
+_HEADER_BYTES = 128
+
+_MAX_BACKOFF = 1e-3
+
+
+def new_channel_spec(capacity: int):
+    """Create the spec of a new channel with a unique name."""
+    return ShmChannelSpec(f"alpa_{uuid.uuid4().hex[:24]}", int(capacity))
+
+
+# Python 3.13 adds SharedMemory(track=False). In older versions, every
+# process that opens a segment registers it to its resource tracker, which
+# unlinks the segment when the process exits.
+_HAS_TRACK_ARG = sys.version_info >= (3, 13)
+
+
+def _open_shared_memory(name: str, create: bool, size: int = 0):
+    """Open a shared memory segment that is not tracked by the resource
+    tracker. It must be unlinked with _unlink_shared_memory."""
+    if _HAS_TRACK_ARG:
+        return shared_memory.SharedMemory(name,
+                                          create=create,
+                                          size=size,
+                                          track=False)
+    shm = shared_memory.SharedMemory(name, create=create, size=size)
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")  # pylint: disable=protected-access
+    except (KeyError, ValueError):
+        pass
+    return shm
+
+
+def _unlink_shared_memory(shm: shared_memory.SharedMemory):
+    """Remove the name of a segment opened by _open_shared_memory."""
+    if _HAS_TRACK_ARG:
+        shm.unlink()
+    else:
+        # shm.unlink() unregisters the name from the resource tracker again,
+        # so call the underlying shm_unlink (a private module before 3.13).
+        shared_memory._posixshmem.shm_unlink(shm._name)  # pylint: disable=protected-access
+
+
+def _attach_shared_memory(name: str, size: int):
+    """Create a shared memory segment, or attach to it if the peer has
+    created it."""
+    backoff = 0
+    while True:
+        try:
+            return _open_shared_memory(name, create=True, size=size)
+        except FileExistsError:
+            pass
+        try:
+            shm = _open_shared_memory(name, create=False)
+            if shm.size >= size:
+                return shm
+            # The peer has not finished the creation
+            shm.close()
+        except (FileNotFoundError, ValueError):
+            pass
+        time.sleep(backoff)
+        backoff = min(max(backoff * 2, 1e-5), _MAX_BACKOFF)
+
+
+class ShmChannel:
+    """A ring buffer in shared memory between one sender and one receiver.
+
+    The header holds the total number of bytes written and read. A message
+    not larger than the ring is written contiguously: if it does not fit in
+    the tail of the ring, the tail is skipped. Both sides see the same
+    counter at the start of a message, so they skip the same bytes. Larger
+    messages are streamed in chunks.
+    """
+
+    def __init__(self, spec: ShmChannelSpec):
+        self.spec = spec
+        self.capacity = spec.capacity
+        self.shm = _attach_shared_memory(spec.name,
+                                         _HEADER_BYTES + self.capacity)
+        buf = self.shm.buf
+        self.write_counter = np.ndarray((1,),
+                                        np.int64,
+                                        buffer=buf,
+                                        offset=_WRITE_COUNTER_OFFSET)
+        self.read_counter = np.ndarray((1,),
+                                       np.int64,
+                                       buffer=buf,
+                                       offset=_READ_COUNTER_OFFSET)
+        self.ring = np.ndarray((self.capacity,),
+                               np.uint8,
+                               buffer=buf,
+                               offset=_HEADER_BYTES)
+
+    def _get_skip(self, counter: int, nbytes: int):
+        pos = counter % self.capacity
+        if nbytes <= self.capacity and pos + nbytes > self.capacity:
+            return self.capacity - pos
+        return 0
+
+    def send_iter(self, array: np.ndarray):
+        """Send an array. A generator that yields whether it made progress
+        and finishes when all bytes are written to the ring."""
+        nbytes = array.nbytes
+        if nbytes == 0:
+            return
+        counter = int(self.write_counter[0])
+        skip = self._get_skip(counter, nbytes)
+        if nbytes <= self.capacity:
+            # The message overwrites the bytes at its position one round
+            # earlier. If the tail is skipped, the message starts at the
+            # head of the ring and only overlaps the bytes before the
+            # current position.
+            if skip:
+                pos = self.capacity - skip
+                min_read = counter - pos + min(nbytes, pos)
+            else:
+                min_read = counter + nbytes - self.capacity
+            while int(self.read_counter[0]) < min_read:
+                yield False
+            start = (counter + skip) % self.capacity
+            dst = self.ring[start:start + nbytes].view(array.dtype)
+            np.copyto(dst.reshape(array.shape), array)
+            self.write_counter[0] = counter + skip + nbytes
+            return
+
+        data = np.ascontiguousarray(array).reshape(-1).view(np.uint8)
+        sent = 0
+        while sent < nbytes:
+            free = self.capacity - (counter - int(self.read_counter[0]))
+            if free <= 0:
+                yield False
+                continue
+            pos = counter % self.capacity
+            size = min(free, self.capacity - pos, nbytes - sent)
+            self.ring[pos:pos + size] = data[sent:sent + size]
+            sent += size
+            counter += size
+            self.write_counter[0] = counter
+            yield True
+
+    def recv_iter(self, dst: np.ndarray, indices: Sequence[slice]):
+        """Receive a tile into dst[indices]. A generator that yields whether
+        it made progress and finishes when the tile is received."""
+        shape = tuple(ind.stop - ind.start for ind in indices)
+        nbytes = int(np.prod(shape)) * dst.dtype.itemsize
+        if nbytes == 0:
+            return
+        counter = int(self.read_counter[0])
+        skip = self._get_skip(counter, nbytes)
+        if nbytes <= self.capacity:
+            while int(self.write_counter[0]) - counter < skip + nbytes:
+                yield False
+            start = (counter + skip) % self.capacity
+            src = self.ring[start:start + nbytes].view(dst.dtype)
+            dst[tuple(indices)] = src.reshape(shape)
+            self.read_counter[0] = counter + skip + nbytes
+            return
+
+        if is_continuous_subset(indices, dst.shape):
+            tmp = None
+            data = dst[tuple(indices)].reshape(-1).view(np.uint8)
+        else:
+            tmp = np.empty(shape, dst.dtype)
+            data = tmp.reshape(-1).view(np.uint8)
+        received = 0
+        while received < nbytes:
+            available = int(self.write_counter[0]) - counter
+            if available == 0:
+                yield False
+                continue
+            pos = counter % self.capacity
+            size = min(available, self.capacity - pos, nbytes - received)
+            data[received:received + size] = self.ring[pos:pos + size]
+            received += size
+            counter += size
+            self.read_counter[0] = counter
+            yield True
+        if tmp is not None:
+            dst[tuple(indices)] = tmp
+
+    def close(self):
+        """Detach from the channel and remove its name."""
+        self.write_counter = self.read_counter = self.ring = None
+        self.shm.close()
+        # The peer may have removed it
+        try:
+            _unlink_shared_memory(self.shm)
+        except FileNotFoundError:
+            pass
+
+
+def run_until_done(generators):
+    """Run the send/recv generators of different channels concurrently, so
+    that a full ring of one channel does not block the other channels."""
+    pending = deque(generators)
+    backoff = 0
+    while pending:
+        progress = False
+        for _ in range(len(pending)):
+            generator = pending.popleft()
+            try:
+                progress = next(generator) or progress
+                pending.append(generator)
+            except StopIteration:
+                progress = True
+        if progress:
+            backoff = 0
+        else:
+            time.sleep(backoff)
+            backoff = min(max(backoff * 2, 1e-6), _MAX_BACKOFF)
+
+
+def _chain(generators):
+    for generator in generators:
+        yield from generator
+
+
+class ShmSender:
+    """Write arrays to channels in a background thread.
+
+    Arrays of the same channel are written in order, and different channels
+    make progress concurrently. A send task only submits its tiles, so two
+    workers that send to each other before receiving do not block each other
+    on full rings.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        # Dict[ShmChannel -> Deque[np.ndarray]]
+        self.queues = {}
+        self.num_pending = 0
+        self.error = None
+        self.closed = False
+        self.thread = None
+
+    def submit(self, channel: ShmChannel, arrays: Sequence[np.ndarray]):
+        """Submit arrays to write to a channel. The arrays must not be
+        modified until they are written."""
+        with self.cond:
+            self._check_error()
+            self.queues.setdefault(channel, deque()).extend(arrays)
+            self.num_pending += len(arrays)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            self.cond.notify_all()
+
+    def wait(self):
+        """Wait until all submitted arrays are written."""
+        with self.cond:
+            while self.num_pending and self.error is None:
+                self.cond.wait()
+            self._check_error()
+
+    def close(self):
+        """Wait for the submitted arrays and stop the thread."""
+        self.wait()
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+
+    def _check_error(self):
+        if self.error is not None:
+            raise RuntimeError("Failed to send tiles through shared memory."
+                              ) from self.error
+
+    def _run(self):
+        active = {}  # Dict[ShmChannel -> generator]
+        backoff = 0
+        try:
+            while True:
+                with self.cond:
+                    for channel, queue in list(self.queues.items()):
+                        if channel not in active:
+                            active[channel] = channel.send_iter(
+                                queue.popleft())
+                        if not queue:
+                            del self.queues[channel]
+                    if not active:
+                        if self.closed:
+                            return
+                        self.cond.wait()
+                        continue
+
+                progress = False
+                num_finished = 0
+                for channel in list(active):
+                    try:
+                        progress = next(active[channel]) or progress
+                    except StopIteration:
+                        del active[channel]
+                        num_finished += 1
+                if num_finished:
+                    with self.cond:
+                        self.num_pending -= num_finished
+                        self.cond.notify_all()
+                if progress or num_finished:
+                    backoff = 0
+                else:
+                    time.sleep(backoff)
+                    backoff = min(max(backoff * 2, 1e-6), _MAX_BACKOFF)
+        except Exception as e:  # pylint: disable=broad-except
+            with self.cond:
+                self.error = e
+                self.cond.notify_all()
+
+
+def get_sender(worker):
+    """Get the background sender of a mesh worker."""
+    if worker.shm_sender is None:
+        worker.shm_sender = ShmSender()
+    return worker.shm_sender
+
+
+def wait_sender(worker):
+    """Wait until the pending sends of a mesh worker are written."""
+    if worker.shm_sender is not None:
+        worker.shm_sender.wait()
+
+
+def get_channel(worker, group_name: str, spec: ShmChannelSpec):
+    """Get the channel of a spec on a mesh worker."""
+    channels = worker.shm_channels.setdefault(group_name, {})
+    if spec.name not in channels:
+        channels[spec.name] = ShmChannel(spec)
+    return channels[spec.name]
+
+
+def destroy_channels(worker, group_name: str):
+    """Close all channels of a collective group on a mesh worker."""
+    wait_sender(worker)
+    for channel in worker.shm_channels.pop(group_name, {}).values():
+        channel.close()
+
+
+def send_tiles(worker, uuid: int, send_specs, group_name: str):
+    """Submit tiles to send to the workers on the same host. It returns
+    before the tiles are received.
+
+    Args:
+        uuid: the uuid of the xla buffers.
+        send_specs (List[ReshardingSendSpec]): the tiles to send.
+        group_name: collective group name.
+    """
+    # Copy each device buffer to the host once. The host copy is owned by
+    # the sender, so the device buffer can be freed or donated after the
+    # task returns.
+    host_buffers = {}
+    per_channel = {}
+    for send_spec in send_specs:
+        device_id = send_spec.device_id
+        if device_id not in host_buffers:
+            host_buffers[device_id] = np.asarray(
+                worker.buffers[uuid][device_id])
+        tile_spec = send_spec.tile_spec
+        channel = get_channel(worker, group_name, tile_spec.shm_channel)
+        tile = host_buffers[device_id][tuple(tile_spec.offset)]
+        if worker.local_devices[device_id].platform == "cpu":
+            # The host array of a CPU buffer is a zero-copy view
+            tile = np.array(tile)
+        per_channel.setdefault(channel, []).append(tile)
+    sender = get_sender(worker)
+    for channel, tiles in per_channel.items():
+        sender.submit(channel, tiles)
+
+
+def recv_tiles(worker, uuid: int, recv_specs, set_empty_buffer: bool,
+               group_name: str):
+    """Receive tiles from the workers on the same host and put the received
+    buffers on devices.
+
+    Args:
+        uuid: the uuid of the xla buffers.
+        recv_specs (List[Tuple[ReshardingRecvSpec, List[ReshardingTileSpec]]]):
+            each recv spec and its tiles to receive through shared memory.
+        set_empty_buffer: whether to create a new buffer.
+        group_name: collective group name.
+    """
+    host_buffers = []
+    per_channel = {}
+    for recv_spec, tile_specs in recv_specs:
+        if set_empty_buffer:
+            host_buffer = np.full(recv_spec.shape, 1e-8, recv_spec.dtype)
+        else:
+            host_buffer = np.array(worker.buffers[uuid][recv_spec.device_id])
+        host_buffers.append(host_buffer)
+        for tile_spec in tile_specs:
+            channel = get_channel(worker, group_name, tile_spec.shm_channel)
+            per_channel.setdefault(channel, []).append(
+                channel.recv_iter(host_buffer, tile_spec.offset))
+    run_until_done([_chain(x) for x in per_channel.values()])
+
+    for (recv_spec, _), host_buffer in zip(recv_specs, host_buffers):
+        device_id = recv_spec.device_id
+        worker.buffers[uuid][device_id] = worker.backend.buffer_from_pyval(
+            host_buffer, worker.local_devices[device_id])
@@ -0,0 +1,334 @@
+"""An on-disk cache of the parallelization decisions of compiled functions.
+
+Restarting a job normally re-runs stage construction (including stage
+profiling) and auto-sharding for the same function. This cache stores the
+results in a directory so that warm restarts can skip them.
+
+The cache is content-addressed. The key hashes the traced jaxpr, the
+abstract arguments, the donated/batch invars, the options of the parallel
+method, the device mesh shape and the versions of alpa and jaxlib. Each
+entry stores the ParallelPlan of the executable. On a hit, the stage
+assignment in the plan replaces the automatic stage construction of
+PipeshardParallel. Other methods have no decision to reuse, so they skip
+the cache. The auto-sharding solutions are reused through the ILP solution
+cache (global_config.ilp_solution_cache_dir).
+
+Executables are not serialized because they are compiled on mesh workers
+and bound to the launched meshes.
+
+Usage of the command line tool:
+    python3 -m alpa.compilation_cache list --cache-dir DIR
+    python3 -m alpa.compilation_cache evict --cache-dir DIR [KEY ...]
+    python3 -m alpa.compilation_cache clear --cache-dir DIR
+"""
+import argparse
+import copy
+import dataclasses
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import time
+from typing import Any, Optional, Sequence
+
+from jax import linear_util as lu
+from jax._src.lib import xla_extension as xe
+from jax.core import AbstractValue
+from jax.interpreters import partial_eval as pe
+import numpy as np
+
+from alpa.device_mesh import (get_global_physical_mesh,
+                              get_global_virtual_physical_mesh)
+from alpa.global_env import global_config
+from alpa.parallel_plan import ParallelPlan
+from alpa.version import __version__
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+CACHE_FILE_SUFFIX = ".pkl"
+
+
+@dataclasses.dataclass
+class CompilationCacheEntry:
+    """A cached compilation result."""
+    fun_name: str
+    create_time: float
+    compilation_time: float
+    parallel_plan: ParallelPlan
+
+
+def _fingerprint_obj(x: Any) -> str:
+    """Return a string that identifies the configuration in an object.
+    Device meshes are represented by their shapes."""
+    if x is None or isinstance(x, (bool, int, float, str, bytes)):
+        return repr(x)
+    if isinstance(x, (list, tuple)):
+        return "(" + ",".join(_fingerprint_obj(y) for y in x) + ")"
+    if isinstance(x, dict):
+        items = sorted((repr(k), _fingerprint_obj(v)) for k, v in x.items())
+        return "{" + ",".join(f"{k}:{v}" for k, v in items) + "}"
+    if isinstance(x, np.ndarray):
+        return f"array({x.dtype},{x.shape},{x.tolist()})"
+    if hasattr(x, "num_hosts") and hasattr(x, "num_devices_per_host"):
+        return (f"{type(x).__name__}({x.num_hosts},"
+                f"{x.num_devices_per_host})")
+    if callable(x) and hasattr(x, "__qualname__"):
+        return f"{getattr(x, '__module__', '')}.{x.__qualname__}"
+    if dataclasses.is_dataclass(x):
+        fields = {
+            f.name: getattr(x, f.name) for f in dataclasses.fields(x)
+        }
+        return type(x).__name__ + _fingerprint_obj(fields)
+    if hasattr(x, "_asdict"):  # namedtuple
+        return type(x).__name__ + _fingerprint_obj(x._asdict())
+    if hasattr(x, "__dict__"):
+        return type(x).__name__ + _fingerprint_obj(vars(x))
+    return repr(x)
+
+
+def _get_default_mesh():
+    virtual_mesh = get_global_virtual_physical_mesh()
+    if virtual_mesh is not None:
+        return virtual_mesh
+    return get_global_physical_mesh()
+
+
+def _get_alpa_jaxlib_version():
+    try:
+        return xe.get_alpa_jaxlib_version()
+    except AttributeError:
+        return None
+
+
+class CompilationCache:
+    """A size-bounded LRU cache of compilation results in a directory."""
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_bytes = max_bytes
+        self.num_hits = 0
+        self.num_misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def compute_key(fun: lu.WrappedFun, static_argnums: Sequence[int],
+                    donated_invars: Sequence[bool],
+                    batch_invars: Sequence[bool], method: "ParallelMethod",
+                    *avals: Sequence[AbstractValue]) -> str:
+        """Trace the function and hash all inputs of the compilation.
+
+        Note that this fills the stores of `fun`. The caller should reset
+        them before compiling it again."""
+        jaxpr, _, consts = pe.trace_to_jaxpr_final(fun, avals)
+
+        hasher = hashlib.sha256()
+        hasher.update(str(jaxpr).encode())
+        for c in consts:
+            c = np.ascontiguousarray(c)
+            hasher.update(repr((c.dtype.str, c.shape)).encode())
+            hasher.update(c.tobytes())
+        hasher.update(
+            repr((tuple(str(aval) for aval in avals), tuple(static_argnums),
+                  tuple(donated_invars), tuple(batch_invars))).encode())
+        hasher.update(_fingerprint_obj(method).encode())
+        if getattr(method, "devices", None) is None:
+            hasher.update(_fingerprint_obj(_get_default_mesh()).encode())
+        hasher.update(repr((__version__, _get_alpa_jaxlib_version())).encode())
+        return hasher.hexdigest()
+
+    def _path(self, key: str):
+        return os.path.join(self.cache_dir, key + CACHE_FILE_SUFFIX)
+
+    def lookup(self, key: str) -> Optional[CompilationCacheEntry]:
+        """Return the cached entry of a key."""
+        try:
+            with open(self._path(key), "rb") as f:
+                entry = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError,
+                ImportError):
+            self.num_misses += 1
+            return None
+
+        self.num_hits += 1
+        try:
+            # Refresh the mtime, which is used as the LRU order.
+            os.utime(self._path(key))
+        except OSError:
+            pass
+        return entry
+
+    def insert(self, key: str, fun_name: str, executable,
+               compilation_time: float):
+        """Insert the compilation result of an executable."""
+        try:
+            plan = executable.get_parallel_plan()
+        except NotImplementedError:
+            return
+        if plan.pipeline_plan is None:
+            return
+        entry = CompilationCacheEntry(fun_name, time.time(),
+                                      compilation_time, plan)
+
+        # Write to a temporary file and rename it, so that concurrent readers
+        # never see a partially written file.
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(entry, f)
+            os.replace(tmp_path, self._path(key))
+        except (OSError, pickle.PicklingError, TypeError,
+                AttributeError) as e:
+            logger.warning(f"Failed to write the compilation cache: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict()
+
+    def list_entries(self):
+        """Return (key, size, mtime, entry) of all entries, the least
+        recently used first."""
+        ret = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(CACHE_FILE_SUFFIX):
+                continue
+            key = name[:-len(CACHE_FILE_SUFFIX)]
+            try:
+                stat = os.stat(self._path(key))
+                with open(self._path(key), "rb") as f:
+                    entry = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError,
+                    AttributeError, ImportError):
+                entry = None
+            ret.append((key, stat.st_size, stat.st_mtime, entry))
+        ret.sort(key=lambda x: x[2])
+        return ret
+
+    def remove(self, key: str):
+        """Remove an entry."""
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def evict(self, max_bytes: Optional[int] = None):
+        """Remove the least recently used entries until the total size fits
+        in max_bytes."""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        files = []
+        total_bytes = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(CACHE_FILE_SUFFIX):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total_bytes += stat.st_size
+
+        files.sort()
+        for _, size, path in files:
+            if total_bytes <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_bytes -= size
+
+    def clear(self):
+        """Remove all entries."""
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(CACHE_FILE_SUFFIX):
+                os.remove(os.path.join(self.cache_dir, name))
+
+    def stats(self):
+        return {"hits": self.num_hits, "misses": self.num_misses}
+
+
+def can_apply_cached_plan(method: "ParallelMethod") -> bool:
+    """Whether a cached entry can change the compilation of a method.
+    Only the automatic stage construction of PipeshardParallel is reused."""
+    # pylint: disable=import-outside-toplevel
+    from alpa.parallel_method import PipeshardParallel
+    from alpa.pipeline_parallel.stage_construction import ManualStageOption
+
+    return (isinstance(method, PipeshardParallel) and
+            not isinstance(method.stage_option, ManualStageOption))
+
+
+def apply_cached_plan(method: "ParallelMethod",
+                      entry: CompilationCacheEntry) -> "ParallelMethod":
+    """Return a copy of the method that reuses the decisions in a cached
+    entry. The method must satisfy can_apply_cached_plan."""
+    assert can_apply_cached_plan(method)
+    method = copy.copy(method)
+    method.stage_option = (
+        entry.parallel_plan.pipeline_plan.manual_stage_option)
+    return method
+
+
+_compilation_cache = None
+
+
+def get_compilation_cache() -> Optional[CompilationCache]:
+    """Get the compilation cache of this process according to
+    global_config. Return None if the cache is disabled."""
+    global _compilation_cache
+
+    cache_dir = global_config.compilation_cache_dir
+    if cache_dir is None:
+        return None
+    if (_compilation_cache is None or
+            _compilation_cache.cache_dir != os.path.expanduser(cache_dir)):
+        _compilation_cache = CompilationCache(
+            cache_dir, global_config.compilation_cache_max_bytes)
+    else:
+        _compilation_cache.max_bytes = global_config.compilation_cache_max_bytes
+    return _compilation_cache
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Manage the on-disk compilation cache of alpa.")
+    parser.add_argument("command", choices=["list", "evict", "clear"])
+    parser.add_argument("keys",
+                        nargs="*",
+                        help="The keys to evict. If not specified, evict "
+                        "the least recently used entries until the cache "
+                        "fits in --max-bytes.")
+    parser.add_argument("--cache-dir",
+                        type=str,
+                        default=global_config.compilation_cache_dir)
+    parser.add_argument("--max-bytes",
+                        type=int,
+                        default=global_config.compilation_cache_max_bytes)
+    args = parser.parse_args()
+    assert args.cache_dir is not None, (
+        "Please specify --cache-dir or ALPA_COMPILATION_CACHE_DIR")
+
+    cache = CompilationCache(args.cache_dir, args.max_bytes)
+    if args.command == "list":
+        for key, size, mtime, entry in cache.list_entries():
+            last_used = time.strftime("%Y-%m-%d %H:%M:%S",
+                                      time.localtime(mtime))
+            if entry is None:
+                print(f"{key}  {size:>10d}B  {last_used}  <unreadable>")
+                continue
+            print(f"{key}  {size:>10d}B  {last_used}  {entry.fun_name}  "
+                  f"compilation time: {entry.compilation_time:.2f} s")
+    elif args.command == "evict":
+        if args.keys:
+            for key in args.keys:
+                cache.remove(key)
+        else:
+            cache.evict()
+    elif args.command == "clear":
+        cache.clear()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,50 @@
 """"Distributed data loaders for loading data into device meshes."""
 import collections
+from concurrent.futures import ThreadPoolExecutor
 import itertools
+import queue
+import threading
+import time
 
 import jax
 from jax.interpreters import pxla
 import numpy as np
 import ray
 
-from alpa.device_mesh import (DistributedArray, LocalPhysicalDeviceMesh,
+from alpa.device_mesh import (BatchDistributedArray, DistributedArray,
+                              LocalPhysicalDeviceMesh,
                               get_global_physical_mesh,
+                              get_global_virtual_physical_mesh,
                               create_remote_array_refs)
+from alpa.timer import timers
+from alpa.util import get_microbatch_sharding_spec
 
 
 class DataLoader:
     """A driver-only dataloader that loads data on the driver process and
-    sends the data to all workers."""
+    sends the data to all workers.
 
-    def __init__(self, input_iter, placement_specs, prefetch_size=1):
+    Args:
+        input_iter: An iterator of batches.
+        placement_specs: The placement specs of batch arguments.
+        prefetch_size: The number of batches to prefetch.
+        num_threads: If positive, pull and shard the next `prefetch_size`
+          batches with this number of background threads while the current
+          batch is used. Otherwise, load batches on the calling thread.
+        max_prefetch_bytes: The maximum number of bytes of the prefetched
+          batches in the async mode. At least one batch is always prefetched.
+    """
+
+    def __init__(self,
+                 input_iter,
+                 placement_specs,
+                 prefetch_size=1,
+                 num_threads=0,
+                 max_prefetch_bytes=None):
         self.input_iter = input_iter
         self.prefetch_size = prefetch_size
+        self.num_threads = num_threads
+        self.max_prefetch_bytes = max_prefetch_bytes
 
         self.physical_mesh = get_global_physical_mesh()
         self.avals = []
@@ -35,6 +61,19 @@ class DataLoader:
 
         self.queue = collections.deque()
 
+    def shard_batch(self, batch):
+        """Shard a batch and wait until it is on the devices."""
+        tic = time.time()
+        flatten_args, tree = jax.tree_flatten(batch)
+        new_args = self.physical_mesh.shard_args_to_arrays(
+            self.avals, self.indices, self.sharding_specs, flatten_args)
+        toc = time.time()
+        for x in new_args:
+            x.block_until_ready()
+        timers("data-loader-shard").record(tic, toc)
+        timers("data-loader-transfer").record(toc, time.time())
+        return jax.tree_unflatten(tree, new_args)
+
     def enqueue(self, num_batches):
         for batch in itertools.islice(self.input_iter, num_batches):
             flatten_args, tree = jax.tree_flatten(batch)
@@ -43,7 +82,9 @@ class DataLoader:
             self.queue.append(jax.tree_unflatten(tree, new_args))
 
     def __iter__(self):
-        if self.prefetch_size:
+        if self.num_threads > 0:
+            yield from self._iter_async()
+        elif self.prefetch_size:
             self.enqueue(self.prefetch_size)
             while self.queue:
                 yield self.queue.popleft()
@@ -56,6 +97,67 @@ class DataLoader:
                 else:
                     break
 
+    def _iter_async(self):
+        # A producer thread pulls batches in order and submits them to the
+        # thread pool. The queue keeps the futures in order.
+        futures = queue.Queue(maxsize=max(self.prefetch_size, 1))
+        stop_event = threading.Event()
+        budget = threading.Condition()
+        inflight_bytes = [0]
+
+        def put(item):
+            while not stop_event.is_set():
+                try:
+                    futures.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce(executor):
+            try:
+                for batch in self.input_iter:
+                    nbytes = sum(
+                        getattr(x, "nbytes", 0)
+                        for x in jax.tree_util.tree_leaves(batch))
+                    with budget:
+                        while (not stop_event.is_set() and
+                               self.max_prefetch_bytes is not None and
+                               inflight_bytes[0] > 0 and inflight_bytes[0] +
+                               nbytes > self.max_prefetch_bytes):
+                            budget.wait(0.1)
+                        inflight_bytes[0] += nbytes
+                    if not put((executor.submit(self.shard_batch,
+                                                batch), nbytes)):
+                        return
+                put(None)
+            except Exception as e:  # pylint: disable=broad-except
+                put(e)
+
+        with ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+            producer = threading.Thread(target=produce,
+                                        args=(executor,),
+                                        daemon=True)
+            producer.start()
+            try:
+                while True:
+                    tic = time.time()
+                    item = futures.get()
+                    if item is None:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    future, nbytes = item
+                    batch = future.result()
+                    timers("data-loader-wait").record(tic, time.time())
+                    with budget:
+                        inflight_bytes[0] -= nbytes
+                        budget.notify_all()
+                    yield batch
+            finally:
+                stop_event.set()
+                producer.join()
+
 
 # The global executable and buffer counter.
 mesh_data_loader_counter = 0
@@ -94,6 +196,18 @@ def get_num_devices_for_whole_batch(sharding_spec, batch_dim=0):
     return num_devices / num_data_chunk
 
 
+def get_physical_mesh_by_id(mesh_id):
+    """Get the launched physical mesh of a mesh id in placement specs."""
+    physical_mesh = get_global_physical_mesh()
+    if physical_mesh is not None and physical_mesh.mesh_id == mesh_id:
+        return physical_mesh
+    virtual_mesh = get_global_virtual_physical_mesh()
+    assert (virtual_mesh is not None and
+            virtual_mesh.launched_physical_mesh_group is not None), (
+                f"Cannot find the physical mesh of mesh id {mesh_id}")
+    return virtual_mesh.launched_physical_mesh_group[mesh_id]
+
+
 class MeshDriverDataLoader:
     """The driver part of a distributed data loader. The driver part creates
     distributed arrays and sends commands to let workers load the data in
@@ -106,13 +220,22 @@ class MeshDriverDataLoader:
           func(start: int, end: int, batch_size: int) -> Iterator
           It returns dataset[start:end] one batch by one batch.
         placement_specs: The placement specs of batch arguments.
-        prefetch_size: The number of batches to prefetch.
+        prefetch_size: The number of batches to prefetch. Workers load and
+          transfer these batches to devices in a background thread.
         repeat: If true, repeat the dataset indefinitely. The
           returned iterator will never stop.
+        num_micro_batches: The number of micro batches of the executable
+          that consumes the data (for gradient accumulation and pipeline
+          parallelism).
 
     Note:
-        Currently, this only works for ShardParallel without
-        gradient accumulation.
+        For ShardParallel without gradient accumulation, every host loads a
+        disjoint part of the dataset and the output is a list of
+        DistributedArray. Otherwise (gradient accumulation, or batch
+        arguments on multiple meshes as in PipeshardParallel), every host
+        iterates over whole batches and only keeps its own shards. The output
+        is then a list of BatchDistributedArray, which the executables
+        consume without resharding.
     """
 
     def __init__(self,
@@ -121,42 +244,50 @@ class MeshDriverDataLoader:
                  input_iter_func,
                  placement_specs,
                  prefetch_size=1,
-                 repeat=False):
+                 repeat=False,
+                 num_micro_batches=1):
         self.repeat = repeat
+        self.num_batches = num_samples // batch_size
+        self.uuid = next_mesh_data_loader_uuid()
 
+        placement_specs = jax.tree_util.tree_leaves(placement_specs)
         physical_mesh = get_global_physical_mesh()
-        assert not isinstance(physical_mesh, LocalPhysicalDeviceMesh), (
-            "Please use alpa.DataLoader instead of alpa.MeshWorkerDataLoader "
-            "for local physical device mesh.")
+        if (num_micro_batches == 1 and physical_mesh is not None and all(
+                ps.mesh_ids == (physical_mesh.mesh_id,)
+                for ps in placement_specs)):
+            assert not isinstance(physical_mesh, LocalPhysicalDeviceMesh), (
+                "Please use alpa.DataLoader instead of "
+                "alpa.MeshWorkerDataLoader for local physical device mesh.")
+            self.physical_meshes = [physical_mesh]
+            self._init_host_partitioned(batch_size, input_iter_func,
+                                        placement_specs, prefetch_size)
+        else:
+            self._init_micro_batched(batch_size, input_iter_func,
+                                     placement_specs, prefetch_size,
+                                     num_micro_batches)
 
+    def _init_host_partitioned(self, batch_size, input_iter_func,
+                               placement_specs, prefetch_size):
+        physical_mesh = self.physical_meshes[0]
         avals = []
         sharding_specs = []
         indices = []
-        for ps in jax.tree_util.tree_leaves(placement_specs):
+        for ps in placement_specs:
             avals.append(ps.aval)
-            assert len(ps.mesh_ids) == 1
-            assert ps.mesh_ids[0] == physical_mesh.mesh_id
             sharding_specs.append(ps.sharding_specs[0])
             indices.append(np.ravel(ps.sharding_specs[0].indices(
                 ps.aval.shape)))
 
-        self.uuid = next_mesh_data_loader_uuid()
-        self.physical_mesh = physical_mesh
-
         # Create output DisributedArray
         ary_refs, ary_uuids = create_remote_array_refs(physical_mesh,
                                                        len(avals))
-        self.output_uuids = ary_uuids
+        output_uuids = [[x] for x in ary_uuids]
         self.output_arrays = []
         for i in range(len(avals)):
             self.output_arrays.append(
                 DistributedArray(physical_mesh, avals[i], sharding_specs[i],
                                  ary_refs[i]))
 
-        # Create worker part data loaders
-        self.worker_data_loaders = []
-        self.num_batches = num_samples // batch_size
-
         # Adjust sharding indices
         # Basic idea:
         # 1. For each host, assign a contiguous range of the whole dataset to it
@@ -185,7 +316,7 @@ class MeshDriverDataLoader:
                 end = (
                     (i // num_hosts_for_one_batch) + 1) * num_samples_per_host
 
-                host_indices.append([])
+                host_indices.append([[]])
                 for k in range(physical_mesh.num_devices_per_host):
                     device_id = i * physical_mesh.num_devices_per_host + k
                     tmp_indices = list(indices[j][device_id])
@@ -194,21 +325,85 @@ class MeshDriverDataLoader:
                         tmp_indices[0] = slice(tmp_indices[0].start - offset,
                                                tmp_indices[0].stop - offset,
                                                tmp_indices[0].step)
-                    host_indices[-1].append(tuple(tmp_indices))
+                    host_indices[-1][0].append(tuple(tmp_indices))
 
             args = (input_iter_func, (start, end, batch_size_per_host),
-                    self.output_uuids, host_indices, prefetch_size)
+                    output_uuids, host_indices, prefetch_size)
             physical_mesh.workers[i].put_data_loader.remote(self.uuid, *args)
 
-    def __iter__(self):
-        # Create the iterators on workers
-        for w in self.physical_mesh.workers:
-            w.data_loader_iter.remote(self.uuid)
+    def _init_micro_batched(self, batch_size, input_iter_func,
+                            placement_specs, prefetch_size, num_micro_batches):
+        assert batch_size % num_micro_batches == 0
+        micro_batch_size = batch_size // num_micro_batches
+
+        mesh_ids = sorted({i for ps in placement_specs for i in ps.mesh_ids})
+        self.physical_meshes = [get_physical_mesh_by_id(i) for i in mesh_ids]
+        for physical_mesh in self.physical_meshes:
+            assert not isinstance(physical_mesh, LocalPhysicalDeviceMesh), (
+                "Please use alpa.DataLoader instead of "
+                "alpa.MeshWorkerDataLoader for local physical device mesh.")
+
+        # output_uuids[mesh][arg] is the uuids of all micro batches.
+        # shard_indices[mesh][arg][micro batch] is the indices of all devices
+        # on the mesh, relative to a whole batch.
+        output_uuids = {mesh_id: [] for mesh_id in mesh_ids}
+        shard_indices = {mesh_id: [] for mesh_id in mesh_ids}
+        self.output_arrays = []
+        for ps in placement_specs:
+            shape = (batch_size,) + ps.aval.shape[1:]
+            micro_batch_aval = ps.aval.update(shape=(micro_batch_size,) +
+                                              ps.aval.shape[1:])
+            micro_batches = []
+            for mesh_id, spec in zip(ps.mesh_ids, ps.sharding_specs):
+                physical_mesh = get_physical_mesh_by_id(mesh_id)
+                ary_refs, ary_uuids = create_remote_array_refs(
+                    physical_mesh, num_micro_batches)
+                output_uuids[mesh_id].append(ary_uuids)
+                micro_batches.append((physical_mesh, [
+                    DistributedArray(physical_mesh, micro_batch_aval, spec,
+                                     ref) for ref in ary_refs
+                ]))
+
+                # The indices of device d and micro batch b are at
+                # [d * num_micro_batches + b]
+                concat_spec = get_microbatch_sharding_spec(
+                    spec, 0, num_micro_batches)
+                indices = np.ravel(concat_spec.indices(shape))
+                shard_indices[mesh_id].append(
+                    indices.reshape(-1, num_micro_batches))
 
+            self.output_arrays.append(
+                BatchDistributedArray(ps.aval.update(shape=shape),
+                                      micro_batches))
+
+        end = self.num_batches * batch_size
+        for mesh_id, physical_mesh in zip(mesh_ids, self.physical_meshes):
+            step = physical_mesh.num_devices_per_host
+            for i in range(physical_mesh.num_hosts):
+                host_indices = []
+                for indices in shard_indices[mesh_id]:
+                    host_indices.append([
+                        list(indices[i * step:(i + 1) * step, b])
+                        for b in range(num_micro_batches)
+                    ])
+                args = (input_iter_func, (0, end, batch_size),
+                        output_uuids[mesh_id], host_indices, prefetch_size)
+                physical_mesh.workers[i].put_data_loader.remote(
+                    self.uuid, *args)
+
+    def _all_workers(self):
+        for physical_mesh in self.physical_meshes:
+            yield from physical_mesh.workers
+
+    def __iter__(self):
         # Yield the next batch
         while True:
+            # Create the iterators on workers
+            for w in self._all_workers():
+                w.data_loader_iter.remote(self.uuid)
+
             for _ in range(self.num_batches):
-                for w in self.physical_mesh.workers:
+                for w in self._all_workers():
                     w.data_loader_next.remote(self.uuid)
                 for a in self.output_arrays:
                     a.flush()
@@ -217,23 +412,45 @@ class MeshDriverDataLoader:
             if not self.repeat:
                 break
 
+    def get_stats(self):
+        """Return the prefetching statistics of all workers."""
+        return ray.get([
+            w.data_loader_stats.remote(self.uuid) for w in self._all_workers()
+        ])
+
     def __del__(self):
-        physical_mesh = self.physical_mesh
-        if physical_mesh.workers is None or not ray.is_initialized():
-            return
+        for physical_mesh in self.physical_meshes:
+            if physical_mesh.workers is None or not ray.is_initialized():
+                continue
+
+            for w in physical_mesh.workers:
+                w.delete_data_loader.remote(self.uuid)
 
-        for i in range(physical_mesh.num_hosts):
-            physical_mesh.workers[i].delete_data_loader.remote(self.uuid)
+
+# The end of an epoch in the prefetch queue
+_END_OF_DATA = object()
 
 
 class MeshWorkerDataLoader:
     """The worker part of a distributed data loader. The driver part creates
     distributed arrays and sends commands to let workers load the data in
-    parallel."""
+    parallel.
+
+    A background thread runs the input iterator, slices the batches and
+    transfers them to devices. It keeps up to `prefetch_size` batches ready
+    on devices.
+
+    Args:
+        output_uuids: output_uuids[i][b] is the uuid of micro batch b of
+          argument i.
+        shard_indices: shard_indices[i][b][k] is the index of micro batch b of
+          argument i on local device k.
+    """
 
     def __init__(self, mesh_host_worker, input_iter_func, input_iter_args,
                  output_uuids, shard_indices, prefetch_size):
-        self.input_iter = input_iter_func(*input_iter_args)
+        self.input_iter_func = input_iter_func
+        self.input_iter_args = input_iter_args
         self.output_uuids = output_uuids
         self.shard_indices = shard_indices
         self.prefetch_size = prefetch_size
@@ -242,38 +459,106 @@ class MeshWorkerDataLoader:
         self.buffers = mesh_host_worker.buffers
 
         # A queue for prefetching
-        self.queue = collections.deque()
-
-    def enqueue(self, num_batches):
-        for args in itertools.islice(self.input_iter, num_batches):
-            batch = []
-            for i in range(len(args)):
-                shards = [
-                    args[i][self.shard_indices[i][k]]
-                    for k in range(len(self.devices))
-                ]
-                buffers = [
-                    jax.device_put(x, d) for x, d in zip(shards, self.devices)
-                ]
-                batch.append(buffers)
-
-            self.queue.append(batch)
-
-    def pop_left(self):
-        batch = self.queue.popleft()
-        for i, shards in enumerate(batch):
-            self.buffers[self.output_uuids[i]] = shards
+        self.queue = None
+        self.thread = None
+        self.stop_event = threading.Event()
+
+        # Statistics
+        self.num_batches = 0
+        self.load_time = 0
+        self.stall_time = 0
+
+    def load_batch(self, args):
+        """Slice a batch and put the shards on local devices."""
+        tic = time.time()
+        batch = []
+        for i, arg in enumerate(args):
+            arg = np.asarray(arg)
+            micro_batches = []
+            for indices in self.shard_indices[i]:
+                # Slice each distinct index only once. Basic slicing returns
+                # views, so replicated shards do not copy on the host.
+                views = {}
+                buffers = []
+                for index, device in zip(indices, self.devices):
+                    key = tuple((s.start, s.stop, s.step) for s in index)
+                    if key not in views:
+                        views[key] = arg[index]
+                    buffers.append(jax.device_put(views[key], device))
+                micro_batches.append(buffers)
+            batch.append(micro_batches)
+
+        # Wait for the transfer, so that the buffers in the queue are ready
+        for micro_batches in batch:
+            for buffers in micro_batches:
+                for x in buffers:
+                    x.block_until_ready()
+        self.load_time += time.time() - tic
+        return batch
+
+    def _prefetch_loop(self, input_iter):
+        try:
+            for args in input_iter:
+                item = self.load_batch(args)
+                if not self._put(item):
+                    return
+            self._put(_END_OF_DATA)
+        except Exception as e:  # pylint: disable=broad-except
+            self._put(e)
+
+    def _put(self, item):
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def pop_left(self, batch):
+        for i, micro_batches in enumerate(batch):
+            for uuid, shards in zip(self.output_uuids[i], micro_batches):
+                self.buffers[uuid] = shards
+        self.num_batches += 1
 
     def __iter__(self):
-        if self.prefetch_size:
-            self.enqueue(self.prefetch_size)
-            while self.queue:
-                yield self.pop_left()
-                self.enqueue(1)
-        else:
-            while True:
-                self.enqueue(1)
-                if self.queue:
-                    yield self.pop_left()
-                else:
-                    break
+        self.close()
+        input_iter = self.input_iter_func(*self.input_iter_args)
+
+        if not self.prefetch_size:
+            for args in input_iter:
+                yield self.pop_left(self.load_batch(args))
+            return
+
+        self.stop_event.clear()
+        self.queue = queue.Queue(maxsize=self.prefetch_size)
+        self.thread = threading.Thread(target=self._prefetch_loop,
+                                       args=(input_iter,),
+                                       daemon=True)
+        self.thread.start()
+        while True:
+            tic = time.time()
+            item = self.queue.get()
+            self.stall_time += time.time() - tic
+            if item is _END_OF_DATA:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield self.pop_left(item)
+
+    def get_stats(self):
+        return {
+            "num_batches": self.num_batches,
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+            "load_time": self.load_time,
+            "stall_time": self.stall_time,
+        }
+
+    def close(self):
+        """Stop the prefetch thread."""
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        self.queue = None
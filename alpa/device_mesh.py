@@ -21,6 +21,9 @@ from abc import ABC, abstractmethod
 import asyncio
 from collections import defaultdict, namedtuple
 from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import heapq
 import logging
 from operator import attrgetter
 import os
@@ -28,12 +31,14 @@ import pickle
 import shutil
 import threading
 import time
+import traceback
 from typing import Any, List, Union, Sequence, Tuple, Optional
+import weakref
 
 from jax import core, xla, device_put
 from jax._src.api import ShapeDtypeStruct
 from jax._src.lib import xla_bridge as xb, xla_extension as xe
-from jax._src.tree_util import tree_leaves
+from jax._src.tree_util import tree_flatten, tree_leaves, tree_unflatten
 from jax.abstract_arrays import array_types
 from jax.core import ShapedArray
 from jax.interpreters import pxla
@@ -47,6 +52,7 @@ from ray.util.placement_group import remove_placement_group
 
 from alpa import mesh_profiling
 import alpa.collective as col
+from alpa.collective import worker_shm_util
 from alpa.global_env import global_config
 from alpa.monkey_patch import set_override_backend
 from alpa.shard_parallel.auto_sharding import (LogicalDeviceMesh)
@@ -56,7 +62,7 @@ from alpa.util import (benchmark_func, list_gpu_info, OrderedSet,
                        update_jax_platform, is_ray_node_resource,
                        try_import_ray_worker, create_placement_group,
                        get_bundle_idx, retrieve_placement_group, get_bundle2ip,
-                       check_server_port)
+                       check_server_port, get_shard_shape)
 
 ray_worker = try_import_ray_worker()
 
@@ -66,8 +72,10 @@ if global_config.backend == "gpu" and global_config.has_cuda:
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# shm_channel is the ShmChannelSpec if the tile is sent through shared memory
 ReshardingTileSpec = namedtuple("ReshardingTileSpec",
-                                ["offset", "rank", "gpu_idx"])
+                                ["offset", "rank", "gpu_idx", "shm_channel"],
+                                defaults=[None])
 ReshardingSendSpec = namedtuple("ReshardingSendSpec",
                                 ["device_id", "tile_spec"])
 ReshardingSendTask = namedtuple("ReshardingSendTask",
@@ -100,6 +108,25 @@ class DaemonMoveWorker:
             to_path = os.path.join(to_dir, file)
             shutil.move(from_path, to_path)
 
+    def save_files(self, save_dir: str, files: Sequence[Tuple[str, str, Any]],
+                   move_to: Optional[str]):
+        """Write checkpoint files with a thread pool and move them to
+        `move_to` if it is not None."""
+        # pylint: disable=import-outside-toplevel
+        from alpa.serialization import write_checkpoint_file
+
+        os.makedirs(save_dir, exist_ok=True)
+        with ThreadPoolExecutor(
+                global_config.checkpoint_save_num_threads) as executor:
+            # Consume the results to re-raise exceptions
+            list(
+                executor.map(
+                    lambda file: write_checkpoint_file(
+                        os.path.join(save_dir, file[0]), file[1], file[2]),
+                    files))
+        if move_to is not None:
+            self.move(save_dir, move_to)
+
     def sync(self):
         """Noop function used to synchronize."""
 
@@ -127,6 +154,13 @@ class MeshHostWorker:
         if global_config.backend == "gpu":
             self.backend = xla_client.make_gpu_client(self.distributed_client,
                                                       node_id=host_id)
+        elif global_config.backend == "cpu":
+            # The number of devices is set by
+            # --xla_force_host_platform_device_count in XLA_FLAGS
+            if num_hosts > 1:
+                raise NotImplementedError(
+                    "A mesh of CPU devices must be on a single host")
+            self.backend = xla_client.make_cpu_client()
         else:
             raise NotImplementedError(
                 f"backend {global_config.backend} is not supported")
@@ -144,10 +178,18 @@ class MeshHostWorker:
         self.recv_tasks = {}  # Dict[uuid -> ReshardingRecvTask]
         self.broadcast_tasks = {}  # Dict[uuid -> BroadcastTask]
         self.broadcast_communicators = {}
+        # Dict[group_name -> Dict[name -> ShmChannel]]
+        self.shm_channels = {}
+        # The background writer of shared-memory sends
+        self.shm_sender = None
 
         self.data_loaders = {}  # Dict[uuid -> MeshWorkerDataLoader]
         self.data_loader_iters = {}  # Dict[uuid -> iterator]
 
+        # Background checkpoint writes: List[(ObjectRef, nbytes)]
+        self.pending_checkpoint_writes = []
+        self.pending_checkpoint_bytes = 0
+
         self.set_runtime_random_seed(runtime_random_seed)
 
         if global_config.pipeline_use_signal_send_recv:
@@ -287,6 +329,9 @@ class MeshHostWorker:
     def get_exec_grad_sync_channel_ids(self, uuid: int):
         return self.executables[uuid].grad_sync_channel_ids
 
+    def get_exec_instruction_latency_stats(self, uuid: int):
+        return self.executables[uuid].get_instruction_latency_stats()
+
     def set_runtime_random_seed(self, seed: int):
         seed = seed + (self.mesh_id << 20 if self.mesh_id else 0)
         for d in self.local_devices:
@@ -296,9 +341,14 @@ class MeshHostWorker:
     def sync_move_worker(self):
         ray.get(self.move_worker.sync.remote())
 
-    def save_array(self, ckpt_dir: str, local_cache_dir: Union[str, None],
-                   uuid: int, device_ids: Sequence[int],
-                   shard_indices: Sequence[Index], global_shape: Sequence[int]):
+    def save_array(self,
+                   ckpt_dir: str,
+                   local_cache_dir: Union[str, None],
+                   uuid: int,
+                   device_ids: Sequence[int],
+                   shard_indices: Sequence[Index],
+                   global_shape: Sequence[int],
+                   async_: bool = False):
         assert uuid in self.buffers
         array_buffers = self.buffers[uuid]
 
@@ -313,6 +363,48 @@ class MeshHostWorker:
             "shard_indices": shard_indices,
         }
 
+        files = [(shard_name, "npy", array_buffers[device_id])
+                 for shard_name, device_id in zip(shard_names, device_ids)]
+        files.append((f"metadata_{self.host_id}", "pickle", metadata))
+        return self._save_checkpoint_files(ckpt_dir, local_cache_dir, files,
+                                           async_)
+
+    def save_array_chunked(self,
+                           ckpt_dir: str,
+                           local_cache_dir: Union[str, None],
+                           uuid: int,
+                           device_ids: Sequence[int],
+                           shard_indices: Sequence[Index],
+                           global_shape: Sequence[int],
+                           chunk_shape: Sequence[int],
+                           compression: Optional[str],
+                           async_: bool = False):
+        # pylint: disable=import-outside-toplevel
+        from alpa.serialization import get_chunk_files
+        assert uuid in self.buffers
+        array_buffers = self.buffers[uuid]
+
+        files = []
+        for index, device_id in zip(shard_indices, device_ids):
+            files.extend(
+                get_chunk_files(np.asarray(array_buffers[device_id]), index,
+                                global_shape, chunk_shape, compression))
+        return self._save_checkpoint_files(ckpt_dir, local_cache_dir, files,
+                                           async_)
+
+    def _save_checkpoint_files(self, ckpt_dir: str,
+                               local_cache_dir: Union[str, None],
+                               files: Sequence[Tuple[str, str, Any]],
+                               async_: bool):
+        """Write checkpoint files to `local_cache_dir` or `ckpt_dir`.
+
+        If async_ is True, the files are snapshotted into the object store
+        and written by the DaemonMoveWorker in the background. Return the
+        reference of the background task in this case.
+        """
+        # pylint: disable=import-outside-toplevel
+        from alpa.serialization import write_checkpoint_file
+
         # create directories if not exist
         os.makedirs(ckpt_dir, exist_ok=True)
         if local_cache_dir is not None:
@@ -320,30 +412,50 @@ class MeshHostWorker:
             save_dir = local_cache_dir
         else:
             save_dir = ckpt_dir
+        move_to = ckpt_dir if local_cache_dir is not None else None
+
+        if not async_:
+            for name, kind, data in files:
+                write_checkpoint_file(os.path.join(save_dir, name), kind, data)
+            # move data
+            if move_to is not None:
+                self.move_worker.move.remote(save_dir, move_to)
+            return None
 
-        for shard_name, device_id in zip(shard_names, device_ids):
-            with open(os.path.join(save_dir, shard_name), "wb") as datafile:
-                np.save(datafile, array_buffers[device_id])
-
-        with open(os.path.join(save_dir, f"metadata_{self.host_id}"),
-                  "wb") as metafile:
-            pickle.dump(metadata, metafile)
-
-        # move data
-        if local_cache_dir is not None:
-            self.move_worker.move.remote(local_cache_dir, ckpt_dir)
+        # Bound the memory of snapshots that are not written yet
+        files = [(name, kind, data if kind == "pickle" else np.asarray(data))
+                 for name, kind, data in files]
+        nbytes = sum(data.nbytes for _, kind, data in files if kind != "pickle")
+        max_bytes = global_config.checkpoint_save_max_inflight_bytes
+        while (self.pending_checkpoint_writes and
+               self.pending_checkpoint_bytes + nbytes > max_bytes):
+            ref, ref_nbytes = self.pending_checkpoint_writes.pop(0)
+            ray.get(ref)
+            self.pending_checkpoint_bytes -= ref_nbytes
+
+        # The arguments are copied into the object store, which takes the
+        # snapshot of the device buffers.
+        ref = self.move_worker.save_files.remote(save_dir, files, move_to)
+        self.pending_checkpoint_writes.append((ref, nbytes))
+        self.pending_checkpoint_bytes += nbytes
+        return ref
 
     def load_array(self, ckpt_dir: str, uuid: Sequence[int],
                    device_ids: Sequence[int], shard_indices: Sequence[Index]):
-        metadatas = list(
-            filter(lambda fname: fname.startswith("metadata"),
-                   os.listdir(ckpt_dir)))
         # pylint: disable=import-outside-toplevel
-        from alpa.serialization import load_sharded_array
-        entire_arr = load_sharded_array(ckpt_dir, metadatas)
+        from alpa.serialization import (has_chunk_index,
+                                        load_chunked_array_slices,
+                                        load_sharded_array_slices)
+        if has_chunk_index(ckpt_dir):
+            datas = load_chunked_array_slices(ckpt_dir, shard_indices)
+        else:
+            metadatas = list(
+                filter(lambda fname: fname.startswith("metadata"),
+                       os.listdir(ckpt_dir)))
+            datas = load_sharded_array_slices(ckpt_dir, metadatas,
+                                              shard_indices)
         array_buffers = [None] * self.num_devices
-        for index, device_id in zip(shard_indices, device_ids):
-            data = entire_arr[index]
+        for data, device_id in zip(datas, device_ids):
             if data.dtype == np.int64:
                 data = data.astype(np.int32)
             array_buffers[device_id] = (self.backend.buffer_from_pyval(
@@ -362,8 +474,13 @@ class MeshHostWorker:
     def data_loader_next(self, uuid: int):
         next(self.data_loader_iters[uuid])
 
+    def data_loader_stats(self, uuid: int):
+        return self.data_loaders[uuid].get_stats()
+
     def delete_data_loader(self, uuid: int):
+        self.data_loaders[uuid].close()
         del self.data_loaders[uuid]
+        self.data_loader_iters.pop(uuid, None)
 
     ##### Cross Mesh Resharding Related Functions #####
     @staticmethod
@@ -399,9 +516,11 @@ class MeshHostWorker:
         g.create_nccl_broadcast_communicator(comm_key, world_size, device_ids,
                                              devices_global_rank, nccl_uid)
 
-    @staticmethod
-    def destroy_collective_group(group_name: str = "default"):
-        col.destroy_collective_group(group_name)
+    def destroy_collective_group(self, group_name: str = "default"):
+        worker_shm_util.destroy_channels(self, group_name)
+        # The group is never initialized if all tiles use shared memory
+        if col.is_group_initialized(group_name):
+            col.destroy_collective_group(group_name)
 
     def create_and_set_cross_mesh_communicators(self, world_size, rank, backend,
                                                 group_name, key):
@@ -426,8 +545,17 @@ class MeshHostWorker:
         if global_config.enable_overlapping:
             col.wait_events(group_name, [ary_uuid], self.num_devices, True)
 
+        shm_send_specs = [
+            x for x in task.tile_specs if x.tile_spec.shm_channel is not None
+        ]
+        if shm_send_specs:
+            worker_shm_util.send_tiles(self, ary_uuid, shm_send_specs,
+                                       group_name)
+
         for send_tile_spec in task.tile_specs:
             send_tile_spec: ReshardingSendSpec
+            if send_tile_spec.tile_spec.shm_channel is not None:
+                continue
             self.send_tile(ary_uuid, send_tile_spec.device_id,
                            send_tile_spec.tile_spec.offset,
                            send_tile_spec.tile_spec.rank,
@@ -444,16 +572,30 @@ class MeshHostWorker:
             col.wait_events(group_name, [ary_uuid], self.num_devices, False)
 
         buffers = self.buffers[ary_uuid]
+        # Tiles from the same host are received into host buffers first,
+        # which are then put on devices.
+        shm_recv_specs = []
         for recv_spec in task.recv_specs:
             recv_spec: ReshardingRecvSpec
-            device_id = recv_spec.device_id
-            if set_empty_buffer:
-                buffers[device_id] = self.backend.buffer_from_pyval(
+            shm_tile_specs = [
+                x for x in recv_spec.tile_specs if x.shm_channel is not None
+            ]
+            if shm_tile_specs:
+                shm_recv_specs.append((recv_spec, shm_tile_specs))
+            elif set_empty_buffer:
+                buffers[recv_spec.device_id] = self.backend.buffer_from_pyval(
                     np.full(recv_spec.shape, 1e-8, recv_spec.dtype),
-                    self.local_devices[device_id])
+                    self.local_devices[recv_spec.device_id])
+        if shm_recv_specs:
+            worker_shm_util.recv_tiles(self, ary_uuid, shm_recv_specs,
+                                       set_empty_buffer, group_name)
 
+        for recv_spec in task.recv_specs:
+            device_id = recv_spec.device_id
             for recv_tile_spec in recv_spec.tile_specs:
                 recv_tile_spec: ReshardingTileSpec
+                if recv_tile_spec.shm_channel is not None:
+                    continue
                 self.recv_tile(ary_uuid, device_id, recv_tile_spec.offset,
                                recv_tile_spec.rank, recv_tile_spec.gpu_idx,
                                task.group_name)
@@ -597,6 +739,7 @@ class MeshHostWorker:
 
     ##### Other Functions #####
     def sync(self, sync_all_devices=False):
+        worker_shm_util.wait_sender(self)
         # We sync one device instead of all for smaller runtime overhead.
         # This is correct because of SPMD.
         if sync_all_devices:
@@ -606,6 +749,7 @@ class MeshHostWorker:
             self.local_devices[0].synchronize_all_activity()
 
     def sync_all(self):
+        worker_shm_util.wait_sender(self)
         for device in self.local_devices:
             device.synchronize_all_activity()
 
@@ -617,6 +761,11 @@ class MeshHostWorker:
         self.sync()
         self.buffers.clear()
         self.executables.clear()
+        for group_name in list(self.shm_channels):
+            worker_shm_util.destroy_channels(self, group_name)
+        if self.shm_sender is not None:
+            self.shm_sender.close()
+            self.shm_sender = None
         self.distributed_client.shutdown()
         # sync & shutdown DaemonMoveWorker
         self.sync_move_worker()
@@ -1012,8 +1161,8 @@ class DistributedPhysicalDeviceMesh(PhysicalDeviceMesh):
             self.service_server, self.workers = self.launch_xla_servers()
             self.launched = True
 
-        self.to_delete_remote_refs = []
-        self.to_delete_remote_ref_ct = 0
+        self.buffer_manager = RemoteBufferManager(self)
+        live_distributed_meshes.add(self)
 
     def get_host_worker_name(self, host_id):
         if self.namespace:
@@ -1058,6 +1207,8 @@ class DistributedPhysicalDeviceMesh(PhysicalDeviceMesh):
             env_vars = {
                 "ALPA_IS_WORKER":
                     "True",
+                "ALPA_BACKEND":
+                    global_config.backend,
                 "NCCL_USE_MULTISTREAM":
                     "False",
                 "XLA_PYTHON_CLIENT_MEM_FRACTION":
@@ -1074,6 +1225,11 @@ class DistributedPhysicalDeviceMesh(PhysicalDeviceMesh):
                 # "RAY_IGNORE_UNHANDLED_ERRORS": "True",
             }
 
+            if global_config.backend == "cpu":
+                env_vars["XLA_FLAGS"] += (
+                    " --xla_force_host_platform_device_count"
+                    f"={self.num_devices_per_host}")
+
             if global_config.resharding_mode == "broadcast":
                 env_vars["NCCL_ALGO"] = "Ring"
                 env_vars["NCCL_PROTO"] = "Simple"
@@ -1105,8 +1261,13 @@ class DistributedPhysicalDeviceMesh(PhysicalDeviceMesh):
                 placement_group_bundle_index=bundle_index).remote()
 
             # Launch the MeshHostWorker
-            cls = ray.remote(num_cpus=0,
-                             num_gpus=self.num_devices_per_host)(MeshHostWorker)
+            if global_config.backend == "cpu":
+                cls = ray.remote(num_cpus=self.num_devices_per_host,
+                                 num_gpus=0)(MeshHostWorker)
+            else:
+                cls = ray.remote(
+                    num_cpus=0,
+                    num_gpus=self.num_devices_per_host)(MeshHostWorker)
             worker = cls.options(placement_group=placement_group,
                                  placement_group_bundle_index=bundle_index,
                                  name=host_worker_name,
@@ -1227,23 +1388,14 @@ class DistributedPhysicalDeviceMesh(PhysicalDeviceMesh):
         if not self.workers or not ray or not ray_worker or not np.array:
             return
 
-        # Put delete requests into a buffer
-        for ary_ref in ary_refs:
-            self.to_delete_remote_refs.append(ary_ref.uuid)
-        self.to_delete_remote_ref_ct += len(ary_refs)
+        self.buffer_manager.delete([ary_ref.uuid for ary_ref in ary_refs])
 
-        # Execute the delete requests if there are enough requests
-        if (self.to_delete_remote_ref_ct >
-                global_config.delete_remote_arrays_threshold):
-            to_delete_remote_refs = np.array(self.to_delete_remote_refs)
-            try:
-                for host_id in range(self.num_hosts):
-                    self.workers[host_id].delete_buffers.remote(
-                        to_delete_remote_refs)
-            except AttributeError:
-                pass
-            self.to_delete_remote_refs = []
-            self.to_delete_remote_ref_ct = 0
+    def flush_deletes(self):
+        """Send all pending delete requests to workers."""
+        if not self.workers or not ray or not ray_worker or not np.array:
+            return
+
+        self.buffer_manager.flush()
 
     def block_until_ready_remote_buffers(self,
                                          ary_refs: List["RemoteArrayRef"]):
@@ -1274,6 +1426,13 @@ class DistributedPhysicalDeviceMesh(PhysicalDeviceMesh):
                         arg.skip_shard_args_check is True):
                     assert num_micro_batches == 1
                     ret_bufs.append([arg.remote_ref])
+                elif (isinstance(arg, BatchDistributedArray) and
+                      _is_expected_micro_batches(
+                          arg.get_micro_batches_on_mesh(self), indices,
+                          num_micro_batches)):
+                    # Fast path for micro batches loaded by data loaders
+                    micro_batches = arg.get_micro_batches_on_mesh(self)
+                    ret_bufs.append([x.remote_ref for x in micro_batches])
                 else:
                     slow_path = True
                     if not isinstance(arg, ShapedArray):
@@ -1426,6 +1585,132 @@ class DistributedPhysicalDeviceMesh(PhysicalDeviceMesh):
 ########################################
 # Distributed Array and Buffers
 ########################################
+@lru_cache(maxsize=4096)
+def _get_per_device_nbytes(shape, dtype, sharding_spec):
+    return int(
+        np.prod(get_shard_shape(ShapedArray(shape, dtype), sharding_spec)) *
+        np.dtype(dtype).itemsize)
+
+
+class RemoteBufferManager:
+    """
+    Manage the lifetime of the remote buffers of a
+    DistributedPhysicalDeviceMesh.
+
+    Delete requests are batched and sent to workers when the number of pending
+    buffers exceeds `global_config.delete_remote_arrays_threshold`, when their
+    bytes exceed `global_config.delete_remote_arrays_bytes_threshold`, or when
+    `flush` is called. It also tracks the live bytes on a device of the mesh
+    from the metadata of distributed arrays.
+
+    It is thread-safe, because arrays can be created by the threads of data
+    loaders and deleted by the garbage collector at any point.
+    """
+
+    def __init__(self, physical_mesh: "DistributedPhysicalDeviceMesh"):
+        self.physical_mesh = physical_mesh
+        # Reentrant, because __del__ of a RemoteArrayRef can run in the
+        # middle of a method on the same thread.
+        self.lock = threading.RLock()
+        self.to_delete_uuids = []
+        self.to_delete_bytes = 0
+        # Map from uuid to (per-device bytes, allocation call site)
+        self.live_buffers = {}
+        self.live_bytes = 0
+
+    def register(self, uuid: int, aval: ShapedArray,
+                 sharding_spec: ShardingSpec):
+        """Record the size of a live buffer."""
+        nbytes = _get_per_device_nbytes(aval.shape, aval.dtype, sharding_spec)
+        call_site = None
+        if global_config.record_remote_buffer_call_sites:
+            # Skip the frames of this function and DistributedArray.__init__
+            call_site = "".join(traceback.format_stack(limit=10)[:-2])
+        with self.lock:
+            if uuid in self.live_buffers:
+                return
+            self.live_buffers[uuid] = (nbytes, call_site)
+            self.live_bytes += nbytes
+
+    def forget(self, uuid: int):
+        """Stop tracking a buffer and return its per-device bytes."""
+        with self.lock:
+            entry = self.live_buffers.pop(uuid, None)
+            if entry is None:
+                return 0
+            self.live_bytes -= entry[0]
+            return entry[0]
+
+    def delete(self, uuids: Sequence[int]):
+        """Put delete requests into a buffer and flush it if it is full."""
+        with self.lock:
+            for uuid in uuids:
+                self.to_delete_bytes += self.forget(uuid)
+            self.to_delete_uuids.extend(uuids)
+
+            if (len(self.to_delete_uuids) >
+                    global_config.delete_remote_arrays_threshold or
+                    self.to_delete_bytes >
+                    global_config.delete_remote_arrays_bytes_threshold):
+                self.flush()
+
+    def flush(self):
+        """Send all pending delete requests to workers."""
+        with self.lock:
+            if not self.to_delete_uuids:
+                return
+            to_delete_uuids = np.array(self.to_delete_uuids)
+            try:
+                for worker in self.physical_mesh.workers:
+                    worker.delete_buffers.remote(to_delete_uuids)
+            except AttributeError:
+                pass
+            self.to_delete_uuids = []
+            self.to_delete_bytes = 0
+
+    def get_largest_live_buffers(self, top_k: int = 10):
+        """Return (uuid, per-device bytes, call site) of the largest live
+        buffers. Call sites are recorded only if
+        `global_config.record_remote_buffer_call_sites` is True."""
+        with self.lock:
+            items = heapq.nlargest(top_k,
+                                   self.live_buffers.items(),
+                                   key=lambda x: x[1][0])
+        return [(uuid, nbytes, call_site)
+                for uuid, (nbytes, call_site) in items]
+
+    def dump_live_buffers(self, top_k: int = 10):
+        """Return a report of the largest live buffers for leak diagnosis."""
+        with self.lock:
+            lines = [
+                f"Mesh {self.physical_mesh.mesh_id}: "
+                f"{len(self.live_buffers)} live buffers, "
+                f"{self.live_bytes / 1024**2:.2f} MB per device, "
+                f"{len(self.to_delete_uuids)} pending deletes "
+                f"({self.to_delete_bytes / 1024**2:.2f} MB)"
+            ]
+        for uuid, nbytes, call_site in self.get_largest_live_buffers(top_k):
+            lines.append(f"  uuid {uuid}: {nbytes / 1024**2:.2f} MB")
+            if call_site:
+                lines.extend("    " + line
+                             for line in call_site.rstrip().split("\n"))
+        return "\n".join(lines)
+
+
+# All alive DistributedPhysicalDeviceMesh
+live_distributed_meshes = weakref.WeakSet()
+
+
+def flush_deletes():
+    """Send the pending delete requests of all meshes to workers.
+
+    Call it at the end of a step to free dead buffers (e.g., large activations)
+    without waiting for the batching thresholds.
+    """
+    for mesh in list(live_distributed_meshes):
+        mesh.flush_deletes()
+
+
 class RemoteArrayRef:
     """
     A reference to all device buffers of a logical array.
@@ -1448,6 +1733,7 @@ class RemoteArrayRef:
         "delete_remote_buffers" again.
         """
         self.is_deleted_on_workers = True
+        self.device_mesh.buffer_manager.forget(self.uuid)
 
     def __repr__(self):
         return (f"RemoteBufferRef(uuid = {self.uuid}, "
@@ -1458,15 +1744,18 @@ class RemoteArrayRef:
             self.device_mesh.delete_remote_buffers((self,))
 
 
-# The global buffer counter
+# The global buffer counter. Arrays can be created by multiple threads (e.g.,
+# the threads of data loaders), so it is protected by a lock.
 remote_buffer_counter = 0
+remote_buffer_counter_lock = threading.Lock()
 
 
 def next_array_uuids(number=1):
     """Return the next uuid of a remote buffer."""
     global remote_buffer_counter
-    ret = np.arange(remote_buffer_counter, remote_buffer_counter + number)
-    remote_buffer_counter = (remote_buffer_counter + number) % (1 << 60)
+    with remote_buffer_counter_lock:
+        ret = np.arange(remote_buffer_counter, remote_buffer_counter + number)
+        remote_buffer_counter = (remote_buffer_counter + number) % (1 << 60)
     return ret
 
 
@@ -1499,6 +1788,8 @@ class DistributedArray:
         self.aval = aval
         self.sharding_spec = sharding_spec
         self.remote_ref = remote_ref
+        device_mesh.buffer_manager.register(remote_ref.uuid, aval,
+                                            sharding_spec)
 
         if indices is None:
             indices = pxla.spec_to_indices(self.aval.shape, self.sharding_spec)
@@ -1552,7 +1843,11 @@ class DistributedArray:
         return self._npy_value
 
     ##### distributed save/load #####
-    def save(self, ckpt_dir: str, local_cache_dir: Union[str, None] = None):
+    def save(self,
+             ckpt_dir: str,
+             local_cache_dir: Union[str, None] = None,
+             checkpoint_format: str = "shard",
+             async_: bool = False):
         """
             Save one replica of the array to `ckpt_dir` distributedly.
 
@@ -1564,7 +1859,14 @@ class DistributedArray:
                 shards have been saved to this local directory.
                 DaemonMoveWorkers will move these shards into `ckpt_dir`
                 in the background.
-
+                checkpoint_format: "shard" or "chunked". See
+                `alpa.save_checkpoint`.
+                async_: If True, the shards are written in the background
+                after they are snapshotted to host memory.
+
+            Returns:
+                The references of the remote save calls. If async_ is True,
+                each of them resolves to the reference of a background write.
         """
         one_replica_indices = [
             self.indices[i] for i in self.one_replica_buffer_ids
@@ -1580,11 +1882,43 @@ class DistributedArray:
             else:
                 indices_per_host[host_id].append(indice)
                 device_ids_per_host[host_id].append(device_id)
+        if checkpoint_format == "chunked":
+            # pylint: disable=import-outside-toplevel
+            from alpa.serialization import (choose_chunk_shape,
+                                            write_chunk_index)
+            shard_shape = [
+                len(range(*index.indices(size)))
+                for index, size in zip(one_replica_indices[0], self.shape)
+            ]
+            shard_shape += self.shape[len(shard_shape):]
+            chunk_shape = choose_chunk_shape(
+                shard_shape, self.dtype, global_config.checkpoint_chunk_bytes)
+            compression = global_config.checkpoint_chunk_compression
+            write_chunk_index(ckpt_dir, self.shape, self.dtype, chunk_shape,
+                              compression)
+            refs = []
+            for host_id, indices in indices_per_host.items():
+                if len(indices) > 0:
+                    refs.append(self.device_mesh.workers[host_id].
+                                save_array_chunked.remote(
+                                    ckpt_dir, local_cache_dir,
+                                    self.remote_ref.uuid,
+                                    np.array(device_ids_per_host[host_id]),
+                                    indices, self.shape, chunk_shape,
+                                    compression, async_))
+            return refs
+
+        assert checkpoint_format == "shard", (
+            f"Invalid checkpoint format: {checkpoint_format}")
+        refs = []
         for host_id, indices in indices_per_host.items():
             if len(indices) > 0:
-                self.device_mesh.workers[host_id].save_array.remote(
-                    ckpt_dir, local_cache_dir, self.remote_ref.uuid,
-                    np.array(device_ids_per_host[host_id]), indices, self.shape)
+                refs.append(
+                    self.device_mesh.workers[host_id].save_array.remote(
+                        ckpt_dir, local_cache_dir, self.remote_ref.uuid,
+                        np.array(device_ids_per_host[host_id]), indices,
+                        self.shape, async_))
+        return refs
 
     @classmethod
     def load(cls, path: str, aval: ShapedArray, device_mesh: PhysicalDeviceMesh,
@@ -1743,6 +2077,225 @@ xla.pytype_aval_mappings[ReplicatedDistributedArray] = attrgetter("aval")
 xla.canonicalize_dtype_handlers[ReplicatedDistributedArray] = lambda x: x
 
 
+class BatchDistributedArray:
+    """A batch argument that is already split into micro batches and sharded
+    on one or more meshes (e.g., by MeshDriverDataLoader).
+
+    Executables with gradient accumulation or pipeline parallelism use the
+    micro batches on their meshes directly without resharding.
+    """
+
+    def __init__(self, aval: ShapedArray,
+                 micro_batches: Sequence[Tuple[PhysicalDeviceMesh,
+                                               Sequence[DistributedArray]]]):
+        self.aval = aval
+        self._mesh_micro_batches_map = dict(micro_batches)
+
+    def get_micro_batches_on_mesh(self, mesh: PhysicalDeviceMesh):
+        return self._mesh_micro_batches_map.get(mesh)
+
+    def flush(self):
+        for arrays in self._mesh_micro_batches_map.values():
+            for array in arrays:
+                array.flush()
+
+    @property
+    def shape(self):
+        return self.aval.shape
+
+    @property
+    def dtype(self):
+        return self.aval.dtype
+
+    @property
+    def _value(self):
+        arrays = list(self._mesh_micro_batches_map.values())[0]
+        return np.concatenate([x._value for x in arrays])
+
+    def __array__(self, dtype=None, context=None):
+        # pylint: disable=unused-argument
+        return np.asarray(self._value, dtype=dtype)
+
+    def __str__(self):
+        return str(self._value)
+
+
+core.pytype_aval_mappings[BatchDistributedArray] = attrgetter("aval")
+xla.pytype_aval_mappings[BatchDistributedArray] = attrgetter("aval")
+xla.canonicalize_dtype_handlers[BatchDistributedArray] = lambda x: x
+
+
+# Statistics of the last call of device_get, for debugging and benchmarking
+last_device_get_stats = None
+
+
+def _plan_host_fetches(arrays: Sequence[DistributedArray]):
+    """Group the one-replica shards of arrays on the same mesh by hosts.
+
+    Returns:
+        For each host with shards, a tuple of (uuids, device_ids, targets),
+        where targets[i] is the list of (array_idx, index) of the buffers
+        returned for uuids[i].
+    """
+    device_mesh = arrays[0].device_mesh
+    per_host = [([], [], []) for _ in range(device_mesh.num_hosts)]
+    for array_idx, array in enumerate(arrays):
+        host_device_ids = defaultdict(list)
+        host_targets = defaultdict(list)
+        for buf_idx, (host_id, device_id) in zip(
+                array.one_replica_buffer_ids, array.one_replica_host_local_ids):
+            host_device_ids[host_id].append(device_id)
+            host_targets[host_id].append((array_idx, array.indices[buf_idx]))
+        for host_id, device_ids in host_device_ids.items():
+            uuids, all_device_ids, targets = per_host[host_id]
+            uuids.append(array.remote_ref.uuid)
+            all_device_ids.append(device_ids)
+            targets.append(host_targets[host_id])
+    return [(host_id, plan) for host_id, plan in enumerate(per_host) if plan[0]]
+
+
+def _assemble_host_buffers(arrays, outputs, targets, host_buffers):
+    """Copy the buffers fetched from a host into the output numpy arrays."""
+    num_bytes = 0
+    for array_targets, buffers in zip(targets, host_buffers):
+        for (array_idx, index), buf in zip(array_targets, buffers):
+            if outputs[array_idx] is None:
+                # Always copy, because the fetched buffers are read-only
+                array = arrays[array_idx]
+                outputs[array_idx] = np.empty(array.shape, array.dtype)
+            outputs[array_idx][index] = buf
+            num_bytes += buf.nbytes
+    return num_bytes
+
+
+def _fetch_distributed_arrays(arrays: Sequence[DistributedArray],
+                              overlap: bool,
+                              out_buffers: Optional[dict] = None):
+    """Fetch one replica of DistributedArrays with one remote call per host
+    and store the results in the arrays. Return the number of fetched bytes.
+
+    If out_buffers maps an array to a preallocated numpy array of its shape,
+    the value of the array is assembled into it.
+    """
+    out_buffers = out_buffers or {}
+    group_by_mesh = defaultdict(list)
+    for array in dict.fromkeys(arrays):
+        if array._npy_value is None:  # pylint: disable=protected-access
+            group_by_mesh[array.device_mesh].append(array)
+
+    ref_to_task = {}
+    mesh_outputs = []
+    for device_mesh, mesh_arrays in group_by_mesh.items():
+        outputs = [out_buffers.get(array) for array in mesh_arrays]
+        mesh_outputs.append((mesh_arrays, outputs))
+        for host_id, (uuids, device_ids,
+                      targets) in _plan_host_fetches(mesh_arrays):
+            ref = device_mesh.workers[host_id].get_buffers.remote(
+                uuids, device_ids)
+            ref_to_task[ref] = (mesh_arrays, outputs, targets)
+
+    num_bytes = 0
+    pending = list(ref_to_task.keys())
+    while pending:
+        if overlap:
+            # Assemble the results of a host while others are being fetched
+            ready, pending = ray.wait(pending, num_returns=1)
+        else:
+            ready, pending = pending, []
+        for ref, host_buffers in zip(ready, ray.get(ready)):
+            mesh_arrays, outputs, targets = ref_to_task[ref]
+            num_bytes += _assemble_host_buffers(mesh_arrays, outputs, targets,
+                                                host_buffers)
+
+    for mesh_arrays, outputs in mesh_outputs:
+        for array, output in zip(mesh_arrays, outputs):
+            array._npy_value = output  # pylint: disable=protected-access
+    return num_bytes
+
+
+def _get_fetch_leaves(leaf):
+    """Return the DistributedArrays needed to get the value of a leaf."""
+    if isinstance(leaf, DistributedArray):
+        return [leaf]
+    if isinstance(leaf, ReplicatedDistributedArray):
+        return [leaf.replica]
+    if isinstance(leaf, BatchDistributedArray):
+        # pylint: disable=protected-access
+        return list(list(leaf._mesh_micro_batches_map.values())[0])
+    return []
+
+
+def device_get(pytree: Any, overlap: bool = True):
+    """Fetch a pytree of arrays to numpy arrays on the driver in a batch.
+
+    The shards of all DistributedArrays are grouped by hosts, so there is only
+    one remote call per host of each mesh, instead of one per shard. The shards
+    are copied into preallocated numpy arrays.
+
+    Args:
+        pytree: A pytree of DistributedArray, ReplicatedDistributedArray,
+          BatchDistributedArray, or jax arrays.
+        overlap: Assemble the buffers of a host while the buffers of other
+          hosts are still being fetched.
+
+    Returns:
+        A pytree of numpy arrays with the same structure. Leaves that are not
+        arrays are returned as is.
+    """
+    global last_device_get_stats
+    tic = time.time()
+    leaves, tree = tree_flatten(pytree)
+    dis_arrays = []
+    batch_outputs = {}
+    out_buffers = {}
+    for i, leaf in enumerate(leaves):
+        if isinstance(leaf, ShardedDeviceArray):
+            leaf.copy_to_host_async()
+        elif isinstance(leaf, BatchDistributedArray):
+            # Assemble the micro batches into the slices of one output
+            output = np.empty(leaf.shape, leaf.dtype)
+            views = []
+            start = 0
+            for array in _get_fetch_leaves(leaf):
+                view = output[start:start + array.shape[0]]
+                out_buffers[array] = view
+                views.append((array, view))
+                start += array.shape[0]
+            batch_outputs[i] = (output, views)
+        dis_arrays.extend(_get_fetch_leaves(leaf))
+
+    num_bytes = _fetch_distributed_arrays(dis_arrays, overlap, out_buffers)
+
+    values = []
+    for i, leaf in enumerate(leaves):
+        if i in batch_outputs:
+            output, views = batch_outputs[i]
+            # pylint: disable=protected-access
+            for array, view in views:
+                # Copy the micro batches fetched before
+                if array._npy_value is not view:
+                    view[...] = array._value
+            values.append(output)
+        elif isinstance(leaf, (DistributedArray, ReplicatedDistributedArray,
+                             BatchDistributedArray, ShardedDeviceArray,
+                             xe.DeviceArray)):
+            values.append(np.asarray(leaf))
+        else:
+            values.append(leaf)
+
+    duration = time.time() - tic
+    last_device_get_stats = {
+        "num_arrays": len(dis_arrays),
+        "num_bytes": num_bytes,
+        "time": duration,
+        "throughput_GBps": num_bytes / max(duration, 1e-9) / 1024**3,
+    }
+    logger.debug(f"device_get: {num_bytes / 1024**2:.2f} MB in "
+                 f"{duration:.4f} s "
+                 f"({last_device_get_stats['throughput_GBps']:.2f} GB/s)")
+    return tree_unflatten(tree, values)
+
+
 def prefetch(dis_arrays: Sequence[Union[ShardedDeviceArray, DistributedArray,
                                         ReplicatedDistributedArray]]):
     """Prefetch a pytree of DistributedArray in a batch.
@@ -1750,31 +2303,16 @@ def prefetch(dis_arrays: Sequence[Union[ShardedDeviceArray, DistributedArray,
     If you want to get a lot of DistributedArrays from remote workers,
     call this batched prefetch can make the later access faster.
     """
-    group_by_mesh = defaultdict(list)
+    dis_arrays_to_fetch = []
     for array in tree_leaves(dis_arrays):
         if isinstance(array, ShardedDeviceArray):
             array.copy_to_host_async()
-        elif isinstance(array, DistributedArray):
-            group_by_mesh[array.device_mesh].append(array)
-        elif isinstance(array, ReplicatedDistributedArray):
-            array = array.replica
-            group_by_mesh[array.device_mesh].append(array)
+        elif isinstance(array, (DistributedArray, ReplicatedDistributedArray)):
+            dis_arrays_to_fetch.extend(_get_fetch_leaves(array))
         else:
             raise ValueError(f"Unhandled array type: {array}")
 
-    for device_mesh, arrays in group_by_mesh.items():
-        buf_refs = []
-        host_local_ids = []
-        for array in arrays:
-            buf_refs.append(array.remote_ref)
-            host_local_ids.append(array.one_replica_host_local_ids)
-
-        np_arrays = device_mesh.get_remote_buffers(buf_refs,
-                                                   host_local_ids,
-                                                   batching=True)
-
-        for array, np_value in zip(arrays, np_arrays):
-            array._fetched_np_buffers = np_value  # pylint: disable=protected-access
+    _fetch_distributed_arrays(dis_arrays_to_fetch, overlap=True)
 
 
 ########################################
@@ -2110,6 +2648,18 @@ class PhysicalDeviceMeshGroup:
 
     @staticmethod
     def _instantiate_nccl_group(cg):
+        if global_config.backend == "cpu":
+            # Meshes of CPU devices only reshard through shared memory, which
+            # does not need a collective group.
+            host_ips = set(cg.src_mesh.host_ips + cg.dst_mesh.host_ips)
+            if (global_config.resharding_mode != "send_recv" or
+                    not global_config.resharding_shm_transport or
+                    len(host_ips) > 1):
+                raise NotImplementedError(
+                    "Resharding between meshes of CPU devices requires the "
+                    "send_recv mode, resharding_shm_transport and meshes "
+                    "on the same host.")
+            return
         if global_config.eagerly_create_communicators:
             cg.instantiate_now()
         else:
@@ -2205,10 +2755,10 @@ class DeviceCluster:
             ips = get_bundle2ip(self.placement_group)
             bundle_specs = self.placement_group.bundle_specs
 
-            # filter out the bundle index with device (GPUs)
+            # filter out the bundle index with devices
             device_bundle_idx_list = [
                 i for i, bundle_spec in enumerate(bundle_specs)
-                if bundle_spec.get("GPU", 0) > 0
+                if bundle_spec.get(global_config.ray_accelerator_name, 0) > 0
             ]
 
             # filter nodes according to the placement group
@@ -2335,7 +2885,7 @@ def shutdown_global_cluster():
 
     global_cluster.delete_placement_group()
     global_cluster = None
-    update_jax_platform("gpu")
+    update_jax_platform(global_config.backend)
 
 
 def set_global_cluster(cluster: DeviceCluster):
@@ -2446,6 +2996,28 @@ def _shard_abstract_array(array,
     return _device_mesh_put_dummy(array, device_mesh, indices, num_batch)
 
 
+def _normalize_index(index, shape):
+    """Convert the slices of an index into (start, stop, step) tuples."""
+    return tuple(
+        index[i].indices(size) if isinstance(index[i], slice) else index[i]
+        for i, size in enumerate(shape))
+
+
+def _is_expected_micro_batches(micro_batches, indices, num_micro_batches):
+    """Whether the micro batches of a BatchDistributedArray on a mesh have the
+    layout of `indices`, where the indices of device d and micro batch b are
+    at [d * num_micro_batches + b], relative to the whole batch."""
+    if micro_batches is None or len(micro_batches) != num_micro_batches:
+        return False
+    # The first micro batch starts at the same offset as the whole batch
+    shape = micro_batches[0].shape
+    expected_indices = indices[::num_micro_batches]
+    actual_indices = micro_batches[0].indices
+    return (len(actual_indices) == len(expected_indices) and all(
+        _normalize_index(x, shape) == _normalize_index(y, shape)
+        for x, y in zip(actual_indices, expected_indices)))
+
+
 def _shard_array(array, device_mesh, indices, num_batch=1, batch_dim=0):
     if global_config.use_dummy_value_for_benchmarking:
         return _device_mesh_put_dummy(array, device_mesh, indices, num_batch)
@@ -2492,4 +3064,5 @@ shard_arg_handlers[ShapeDtypeStruct] = _shard_abstract_array
 shard_arg_handlers[xla._DeviceArray] = _shard_device_array
 shard_arg_handlers[xla._CppDeviceArray] = _shard_device_array
 shard_arg_handlers[DistributedArray] = _shard_distributed_array
+shard_arg_handlers[BatchDistributedArray] = _shard_distributed_array
 shard_arg_handlers[ShardedDeviceArray] = _shard_distributed_array
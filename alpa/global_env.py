@@ -7,7 +7,11 @@ class GlobalConfig:
 
     def __init__(self):
         ########## Options of device mesh ##########
-        self.backend = "gpu"
+        # The backend of the devices. Possible choices: {"gpu", "cpu", "tpu"}.
+        # With "cpu", every mesh is on a single host and cross-mesh
+        # resharding needs resharding_shm_transport. Mesh workers read it
+        # from ALPA_BACKEND.
+        self.backend = os.environ.get("ALPA_BACKEND", "gpu")
         self.has_cuda = os.system("nvidia-smi > /dev/null 2>&1") == 0
 
         # See https://jax.readthedocs.io/en/latest/gpu_memory_allocation.html
@@ -17,6 +21,13 @@ class GlobalConfig:
             "XLA_PYTHON_CLIENT_PREALLOCATE", "true")
         # The threshold to tigger a batched deletion on workers.
         self.delete_remote_arrays_threshold = 50
+        # Also trigger a batched deletion if the per-device bytes of the
+        # pending buffers exceed this threshold.
+        self.delete_remote_arrays_bytes_threshold = 1 << 28
+        # Whether to record the call site that allocates every remote buffer.
+        # It helps to find leaks with RemoteBufferManager.dump_live_buffers
+        # but slows down the creation of arrays.
+        self.record_remote_buffer_call_sites = False
 
         # Random seed used for compilation
         self.compile_random_seed = 42
@@ -35,10 +46,32 @@ class GlobalConfig:
         self.use_aws_efa = os.environ.get("ALPA_USE_AWS_EFA",
                                           "").lower() in ["true", "1"]
 
+        # The directory of the on-disk compilation cache, which stores the
+        # parallel plans of compiled functions across runs.
+        # Set it to None to disable the cache.
+        self.compilation_cache_dir = os.environ.get(
+            "ALPA_COMPILATION_CACHE_DIR", None)
+        # The maximum total size of the compilation cache in bytes.
+        self.compilation_cache_max_bytes = 1 << 30
+
         ########## Options of shard_parallel ##########
         # Whether to sync before and after the executable for accurate internal
         # timer
         self.shard_parallel_sync_for_timer = False
+        # The directory of the on-disk ILP solution cache of the auto-sharding
+        # solver. It can be shared by all processes on a host.
+        # Set it to None to disable the cache.
+        self.ilp_solution_cache_dir = os.environ.get(
+            "ALPA_ILP_SOLUTION_CACHE_DIR", None)
+        # The maximum total size of the ILP solution cache in bytes.
+        self.ilp_solution_cache_max_bytes = 1 << 30
+        # The relative tolerance when matching the cost vectors of an ILP
+        # against the cached ones.
+        self.ilp_solution_cache_rtol = 1e-6
+        # If it is not None, dump the inputs of every ILP solved by the
+        # auto-sharding solver to this directory for replaying.
+        self.ilp_solver_inputs_dump_dir = os.environ.get(
+            "ALPA_ILP_SOLVER_INPUTS_DUMP_DIR", None)
 
         ########## Options of pipeline_parallel ##########
         # Whether to debug with pipeshard runtime. If turned on, no physical
@@ -65,6 +98,19 @@ class GlobalConfig:
         self.pipeline_distributed_compile = True
         self.eagerly_create_communicators = True
         self.pipeline_check_alive = False
+        # Whether to cache the argument routing of pipeshard executables and
+        # pass DistributedArray arguments without re-classifying them.
+        self.pipeline_launch_fast_path = True
+        # Whether to collect per-opcode latency histograms of pipeline
+        # instructions on workers (passed to workers at each launch). See
+        # PipeshardDriverExecutable.get_instruction_latency_stats.
+        self.pipeline_collect_instruction_latency = False
+        # Whether to reorder the allocations and receives of pipeline
+        # instructions to lower the peak memory estimated by the static
+        # memory planner. If pipeline_memory_budget (bytes per device) is not
+        # None, only reorder the meshes whose peak exceeds the budget.
+        self.pipeline_memory_reorder = False
+        self.pipeline_memory_budget = None
         # Whether to use single-byte signal tensor for send/recv.
         # This is a debug option.
         self.pipeline_use_signal_send_recv = False
@@ -76,12 +122,51 @@ class GlobalConfig:
         # Which nccl to use. Possible choices: {"cupy",
         # "xla_extension"}
         self.nccl_mode = "cupy"
+        # The default size cap of a bucket of the coalesced collectives
+        # (e.g., alpa.collective.allreduce_coalesced). A larger tensor gets a
+        # bucket of its own.
+        self.collective_bucket_bytes = 1 << 22
+        # Whether to send tiles between mesh workers on the same host through
+        # shared memory in the "send_recv" mode. Tiles across hosts still use
+        # NCCL. It is the only transport between meshes of the "cpu"
+        # backend. See alpa/collective/worker_shm_util.py.
+        self.resharding_shm_transport = False
+        # The capacity of the shared-memory ring of a (sender, receiver)
+        # device pair. A larger tile is streamed in chunks.
+        self.resharding_shm_ring_bytes = 1 << 26
         self.enable_overlapping = False
         # Cross mesh resharding load balancing mode.
         # Possible choices: {"normal", "no_loadbalance",
         # "loadbalance_size", "loadbalance_order"}
         self.resharding_loadbalance_mode = "normal"
+        # The algorithm of "loadbalance_order". Possible choices: {"greedy",
+        # "search", "lpt"}. "lpt" is deterministic and scales to hundreds of
+        # works. See LoadBalancingTaskSolverLPTAlgo.
         self.loadbalance_order_algo = "greedy"
+        # The max number of works for "lpt" to refine its solution with an
+        # exact ILP. Set to 0 to disable the ILP.
+        self.loadbalance_lpt_ilp_max_works = 12
+        # Whether to share the resharding plans (tile maps and strategies) of
+        # cross-mesh variables with the same shape, sharding specs and mesh
+        # shapes. See ReshardingPlanCache.
+        self.resharding_plan_cache = True
+
+        ########## Options of serialization ##########
+        # The number of threads to read shard files when loading a checkpoint.
+        self.checkpoint_load_num_threads = int(
+            os.environ.get("ALPA_CHECKPOINT_LOAD_NUM_THREADS", "8"))
+        # The maximum size of a chunk in the chunked checkpoint format.
+        self.checkpoint_chunk_bytes = 64 << 20
+        # The compression of chunks in the chunked checkpoint format.
+        # Possible choices: {None, "zlib"}.
+        self.checkpoint_chunk_compression = None
+        # The number of threads per host to write files of an asynchronous
+        # checkpoint.
+        self.checkpoint_save_num_threads = 8
+        # The maximum size of the snapshots per host that are not written
+        # yet when saving checkpoints asynchronously. A save blocks until the
+        # previous snapshots fit in this budget.
+        self.checkpoint_save_max_inflight_bytes = 4 << 30
 
         ########## Options of benchmark ##########
         # If true, the system is allowed to use dummy values during
@@ -102,7 +187,7 @@ class GlobalConfig:
 
     @property
     def ray_accelerator_name(self):
-        backend_to_ray = {"gpu": "GPU"}
+        backend_to_ray = {"gpu": "GPU", "cpu": "CPU"}
         return backend_to_ray[self.backend]
 
 
@@ -170,7 +170,8 @@ class PipeshardParallel(ParallelMethod):
         default_auto_sharding_option: The default options of the auto-sharding
           solver.
         pipeline_schedule: The pipieline schedules.
-          Possible choices: {"1f1b", "gpipe", "inference"}
+          Possible choices: {"1f1b", "gpipe", "inference",
+                             "1f1b_overlap_friendly", "interleaved_1f1b"}
         layer_option: Options of grouping basic operators to layers.
           Possible choices are {"manual", alpa.AutoLayerOption,
                                  alpa.ManualLayerOption}
@@ -179,6 +180,9 @@ class PipeshardParallel(ParallelMethod):
                                  alpa.ManualStageOption}
         stage_input_shardings: Options of input sharding specs for each stage.
           Shape: [num_pipeline_stages, num_input_vars_in_hlo_module].
+        num_virtual_stages: The number of pipeline stages placed on each mesh
+          by the "interleaved_1f1b" schedule. Forward stage i is placed on
+          mesh i % num_meshes.
     """
 
     def __init__(
@@ -191,7 +195,8 @@ class PipeshardParallel(ParallelMethod):
             stage_option: Optional[Union[StageOption, str]] = None,
             stage_input_shardings: Optional[Sequence[Sequence[
                 pxla.ShardingSpec]]] = None,
-            manual_sharding_option: ManualShardingOption = None):
+            manual_sharding_option: ManualShardingOption = None,
+            num_virtual_stages: int = 1):
         self.devices = devices
         self.num_micro_batches = num_micro_batches
         self.as_option = (default_auto_sharding_option or
@@ -216,6 +221,11 @@ class PipeshardParallel(ParallelMethod):
         assert not (stage_input_shardings is not None and
                     manual_sharding_option is not None)
         self.manual_sharding_option = manual_sharding_option
+        assert num_virtual_stages >= 1
+        assert (num_virtual_stages == 1 or
+                pipeline_schedule == "interleaved_1f1b"), (
+                    "Virtual stages require the interleaved_1f1b schedule.")
+        self.num_virtual_stages = num_virtual_stages
 
     def compile_executable(
         self,
@@ -241,7 +251,10 @@ class PipeshardParallel(ParallelMethod):
             fun, in_tree, out_tree_thunk, static_argnums, donated_invars,
             batch_invars, mesh, self.num_micro_batches, self.pipeline_schedule,
             self.as_option, self.layer_option, self.stage_option, None,
-            self.stage_input_shardings, self.manual_sharding_option, *avals)
+            self.stage_input_shardings,
+            self.manual_sharding_option,
+            *avals,
+            num_virtual_stages=self.num_virtual_stages)
 
 
 def get_3d_parallel_method(num_micro_batches: int,
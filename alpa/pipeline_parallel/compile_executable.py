@@ -15,9 +15,7 @@ from alpa.global_env import global_config
 from alpa.pipeline_parallel.pipeshard_executable import PipeshardDriverExecutable
 from alpa.pipeline_parallel.runtime_emitter import (
     OverlapFriendlyPipelineInstEmitter, PipelineInstEmitter)
-from alpa.pipeline_parallel.schedules import (GpipeSchedule,
-                                              OverlapFriendlyPipeDreamSchedule,
-                                              PipeDreamFlush, InferenceSchedule)
+from alpa.pipeline_parallel.schedules import create_pipeline_schedule
 from alpa.pipeline_parallel.computation import (
     create_donation_mapping, generate_computations_from_modules,
     generate_sharded_xla_computations,
@@ -56,7 +54,8 @@ def compile_pipeshard_executable(
         global_input_shardings: Optional[Sequence[pxla.ShardingSpec]],
         stage_input_shardings: Optional[Sequence[Sequence[pxla.ShardingSpec]]],
         manual_shard_options: Optional[ManualShardingOption],
-        *avals: Sequence[AbstractValue]):
+        *avals: Sequence[AbstractValue],
+        num_virtual_stages: int = 1):
     """
     Compile a callable for pipeshard parallel which combines
     pipeline parallelism and 2d shard parallelsim.
@@ -69,6 +68,8 @@ def compile_pipeshard_executable(
           each stage.
         manual_sharding_options: pjit style sharding constraints of global input
           vars.
+        num_virtual_stages: The number of pipeline stages on each mesh. Only
+          used by the "interleaved_1f1b" schedule.
     """
     if global_config.backend == "tpu":
         raise NotImplementedError("Pipeshard Parallel for tpu is not supported")
@@ -113,7 +114,7 @@ def compile_pipeshard_executable(
         closed_jaxpr, full_batch_closed_jaxpr, micro_batch_size, donated_invars,
         batch_invars, virtual_mesh, num_microbatch, pipeline_schedule,
         default_as_option, stage_option, name_base, global_input_shardings,
-        None, stage_input_shardings, parsed_ms_option)
+        None, stage_input_shardings, parsed_ms_option, num_virtual_stages)
 
     executable = PipeshardDriverExecutable(
         mesh_group=virtual_mesh.launched_physical_mesh_group,
@@ -124,6 +125,9 @@ def compile_pipeshard_executable(
         out_tree=out_tree,
         static_argnums=static_argnums)
     debug_compilation_time("driver executable")
+    if global_config.print_compilation_time:
+        executable.wait_for_compilation()
+        debug_compilation_time("backend compilation on workers")
     return executable
 
 
@@ -137,7 +141,8 @@ def compile_pipeshard_executable_internal(
         global_input_shardings: Optional[Sequence[pxla.ShardingSpec]],
         global_output_shardings: Optional[Sequence[pxla.ShardingSpec]],
         stage_input_shardings: Optional[Sequence[Sequence[pxla.ShardingSpec]]],
-        parsed_manual_sharding_option: Optional[ParsedManualShardingOption]):
+        parsed_manual_sharding_option: Optional[ParsedManualShardingOption],
+        num_virtual_stages: int = 1):
     """
     Args:
         fun: The function to be parallelized.
@@ -147,6 +152,7 @@ def compile_pipeshard_executable_internal(
           output vars.
         stage_input_shardings: Forcibly set sharding specs of input vars of
           each stage.
+        num_virtual_stages: The number of pipeline stages on each mesh.
     """
     global_invars = closed_jaxpr.jaxpr.invars
     gensym_func = gensym([closed_jaxpr.jaxpr])
@@ -174,7 +180,7 @@ def compile_pipeshard_executable_internal(
          jax_pipeline_layers, virtual_mesh, accumulator_mapping,
          acc_grad_invars, acc_grad_outvars, num_microbatch, micro_batch_size,
          jax_apply_layers, apply_grad_global_info, pipeline_schedule,
-         default_as_option, stage_option)
+         default_as_option, stage_option, num_virtual_stages)
     num_meshes = len(sliced_virtual_meshes)
     debug_compilation_time("stage construction")
 
@@ -200,29 +206,13 @@ def compile_pipeshard_executable_internal(
     # Generate pipeline schedule and placement
     dependency = gen_dependency_with_stages(jax_pipeline_stages,
                                             sliced_apply_grad_stages)
-    if pipeline_schedule == "gpipe":
-        schedule = GpipeSchedule(dependency=dependency,
-                                 meshes=sliced_virtual_meshes,
-                                 apply_grad_placement=apply_grad_placement,
-                                 num_batch=num_microbatch)
-    elif pipeline_schedule == "1f1b":
-        schedule = PipeDreamFlush(dependency=dependency,
-                                  meshes=sliced_virtual_meshes,
-                                  apply_grad_placement=apply_grad_placement,
-                                  num_batch=num_microbatch)
-    elif pipeline_schedule == "inference":
-        schedule = InferenceSchedule(dependency=dependency,
-                                     meshes=sliced_virtual_meshes,
-                                     apply_grad_placement=apply_grad_placement,
-                                     num_batch=num_microbatch)
-    elif pipeline_schedule == "1f1b_overlap_friendly":
-        schedule = OverlapFriendlyPipeDreamSchedule(
-            dependency=dependency,
-            meshes=sliced_virtual_meshes,
-            apply_grad_placement=apply_grad_placement,
-            num_batch=num_microbatch)
-    else:
-        raise ValueError(f"Invalid schedule: {pipeline_schedule}")
+    schedule = create_pipeline_schedule(
+        pipeline_schedule,
+        dependency=dependency,
+        meshes=sliced_virtual_meshes,
+        apply_grad_placement=apply_grad_placement,
+        num_batch=num_microbatch,
+        num_virtual_stages=num_virtual_stages)
 
     # Forcibly set the sharding specs of global invars and outvars.
     # FIXME(yonghao): the invar can appear on multiple meshes and thus different
@@ -289,9 +279,11 @@ def compile_pipeshard_executable_internal(
         ]
     else:
         emitter_cls = PipelineInstEmitter
-    pipeshard_config = emitter_cls(**emitter_kwargs).compile()
+    emitter = emitter_cls(**emitter_kwargs)
+    pipeshard_config = emitter.compile()
 
-    debug_compilation_time("runtime emitter")
+    debug_compilation_time(f"runtime emitter ({emitter.num_reused_executables} "
+                           f"executables deduplicated)")
     return pipeshard_config
 
 
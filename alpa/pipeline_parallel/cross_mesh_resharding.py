@@ -1,6 +1,7 @@
 """Cross mesh resharding for pipeline parallelism."""
 from abc import ABC, abstractmethod
 from collections import namedtuple
+from functools import partial
 import logging
 import math
 import random
@@ -12,6 +13,7 @@ import numpy as np
 import ray
 
 import alpa.collective as col
+from alpa.collective.worker_shm_util import new_channel_spec
 from alpa.device_mesh import (DistributedArray, RemoteArrayRef,
                               ReshardingRecvSpec, ReshardingSendSpec,
                               ReshardingTileSpec, ReshardingBroadcastSpec,
@@ -21,7 +23,7 @@ from alpa.mesh_executable import (UtilMeshWorkerExecutable,
                                   next_mesh_executable_uuid)
 from alpa.pipeline_parallel.computation import XlaShardedPipelineComputation
 from alpa.pipeline_parallel.resharding_tensor import (VirtualDistributedArray,
-                                                      TileSlice,
+                                                      Tile, TileSlice,
                                                       unflatten_tile_index)
 from alpa.util import OrderedSet, compile_allgather
 
@@ -269,6 +271,8 @@ class SymbolicReshardingTask(ReshardingTask):
                 for tile_spec in tile_specs:
                     src_rank = tile_spec.rank
                     src_gpu_idx = tile_spec.gpu_idx
+                    if tile_spec.shm_channel is not None:
+                        continue
                     param = (src_rank, src_gpu_idx, dst_rank, dst_gpu_idx)
                     if param not in communicator_params:
                         communicator_params.add(param)
@@ -319,6 +323,8 @@ class SymbolicReshardingTask(ReshardingTask):
                 self.collective_group.device_str_to_rank_map[receiver])
             recv_tile_specs = []
             for sender_idx, sender in enumerate(senders):
+                shm_channel = self.collective_group.get_shm_channel_spec(
+                    sender, receiver)
                 # Sender's task
                 sender_worker = (
                     self.collective_group.device_str_to_mesh_worker_map[sender])
@@ -328,14 +334,15 @@ class SymbolicReshardingTask(ReshardingTask):
                     ReshardingSendSpec(
                         src_device_id,
                         ReshardingTileSpec(src_tiles[sender_idx].offset,
-                                           receiver_rank, receiver_gpu_idx)))
+                                           receiver_rank, receiver_gpu_idx,
+                                           shm_channel)))
                 # Receiver's task
                 sender_rank, sender_gpu_idx = \
                     self.collective_group.device_str_to_rank_map[sender]
                 indices_in_dst_tile = indices_in_dst_tiles[sender_idx]
                 recv_tile_specs.append(
                     ReshardingTileSpec(indices_in_dst_tile, sender_rank,
-                                       sender_gpu_idx))
+                                       sender_gpu_idx, shm_channel))
             receiver_task = ReshardingRecvSpec(receiver_device_id,
                                                dst_tile.tile_shape, dtype,
                                                recv_tile_specs)
@@ -590,7 +597,10 @@ class CollectiveGroup:
         self.device_str_to_mesh_worker_map = {}
         self.device_str_to_host_id_map = {}
         self.device_str_to_device_id_map = {}
+        self.device_str_to_host_ip_map = {}
         self.worker_to_rank_map = {}
+        # The shared-memory channels between devices on the same host
+        self.shm_channel_specs = {}
 
         # arranged following the rank order
         num_host = len(self.src_mesh.host_ips) + len(self.dst_mesh.host_ips)
@@ -605,6 +615,8 @@ class CollectiveGroup:
                     device_str] = self.src_mesh.workers[i]
                 self.device_str_to_host_id_map[device_str] = i
                 self.device_str_to_device_id_map[device_str] = j
+                self.device_str_to_host_ip_map[device_str] = (
+                    src_mesh.host_ips[i])
         for i, _ in enumerate(dst_mesh.host_ips):
             self.mesh_workers[
                 i + len(self.src_mesh.host_ips)] = self.dst_mesh.workers[i]
@@ -617,11 +629,26 @@ class CollectiveGroup:
                     device_str] = self.dst_mesh.workers[i]
                 self.device_str_to_host_id_map[device_str] = i
                 self.device_str_to_device_id_map[device_str] = j
+                self.device_str_to_host_ip_map[device_str] = (
+                    dst_mesh.host_ips[i])
 
         self.worker_to_rank_map = {
             worker: r for r, worker in enumerate(self.mesh_workers)
         }
 
+    def get_shm_channel_spec(self, sender, receiver):
+        """Return the shared-memory channel from sender to receiver, or None
+        if they should communicate through NCCL."""
+        if (not global_config.resharding_shm_transport or
+                self.device_str_to_host_ip_map[sender] !=
+                self.device_str_to_host_ip_map[receiver]):
+            return None
+        key = (sender, receiver)
+        if key not in self.shm_channel_specs:
+            self.shm_channel_specs[key] = new_channel_spec(
+                global_config.resharding_shm_ring_bytes)
+        return self.shm_channel_specs[key]
+
     def instantiate(self):
         """Instantiate the collective group in Ray lazily."""
         if self.instantiated:
@@ -671,6 +698,114 @@ class CollectiveGroup:
             pass
 
 
+def _rebase_tile(tile, device_strs):
+    """Copy a tile with the device strs of another mesh of the same shape."""
+    new_tile = Tile(tile.index, tile.index_flat, tile.replica_device_ids,
+                    [device_strs[d] for d in tile.replica_device_ids],
+                    tile.indices)
+    if isinstance(tile, TileSlice):
+        return TileSlice(new_tile, tile.offset)
+    return new_tile
+
+
+def _get_host_pattern(src_mesh, dst_mesh):
+    """Return the host of each device of the two meshes, relabeled by
+    their first appearance."""
+    labels = {}
+    pattern = []
+    for mesh in (src_mesh, dst_mesh):
+        for i in range(mesh.num_hosts):
+            ip = mesh.host_info[i]["NodeManagerAddress"]
+            label = labels.setdefault(ip, len(labels))
+            pattern.extend([label] * len(mesh.devices[i]))
+    return tuple(pattern)
+
+
+class ReshardingPlanCache:
+    """
+    A process-wide cache of the plans of resharding task specs.
+
+    Specs with the same signature (shape, sharding specs and mesh shapes)
+    share the same dst_tile_to_src_tiles_map. Strategies are shared if they do
+    not depend on the loads of other specs, i.e., in all load balancing modes
+    except "normal". Plans are stored with the device strs of the meshes where
+    they are computed and rebased onto the device strs of new meshes.
+    """
+
+    def __init__(self):
+        # Dict[key -> (map, src device strs, dst device strs)]
+        self.tile_maps = {}
+        # Dict[key -> (strategy, src device strs)]
+        self.strategies = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_key(spec: "ReshardingTaskSpec"):
+        return (spec.aval.shape, spec.src_sharding_spec,
+                spec.dst_sharding_spec, spec.final_dst_spec,
+                spec.src.device_mesh.shape, spec.dst.device_mesh.shape)
+
+    def get_tile_map(self, spec: "ReshardingTaskSpec"):
+        """Return the dst_tile_to_src_tiles_map of a spec."""
+        key = self.get_key(spec)
+        src_strs = spec.src.device_mesh.device_strs
+        dst_strs = spec.dst.device_mesh.device_strs
+        if key not in self.tile_maps:
+            self.misses += 1
+            tile_map = spec.generate_src_dst_map()
+            self.tile_maps[key] = (tile_map, src_strs, dst_strs)
+            return tile_map
+
+        self.hits += 1
+        tile_map, cached_src_strs, cached_dst_strs = self.tile_maps[key]
+        if cached_src_strs == src_strs and cached_dst_strs == dst_strs:
+            return tile_map
+        return [(_rebase_tile(dst_tile, dst_strs),
+                 [_rebase_tile(x, src_strs) for x in src_tileslices], indices)
+                for dst_tile, src_tileslices, indices in tile_map]
+
+    def get_strategy(self, spec: "ReshardingTaskSpec", src_mesh, dst_mesh,
+                     generate_fn):
+        """Return the strategy of a spec, generated by generate_fn() on a
+        cache miss."""
+        key = (self.get_key(spec), global_config.resharding_mode,
+               global_config.resharding_loadbalance_mode,
+               global_config.loadbalance_order_algo,
+               global_config.loadbalance_lpt_ilp_max_works,
+               _get_host_pattern(src_mesh, dst_mesh))
+        src_strs = src_mesh.device_strs
+        if key not in self.strategies:
+            strategy = generate_fn()
+            self.strategies[key] = (strategy, src_strs)
+            return strategy
+
+        strategy, cached_src_strs = self.strategies[key]
+        if cached_src_strs == src_strs:
+            return strategy
+        str_map = dict(zip(cached_src_strs, src_strs))
+        per_spec_plans = [
+            np.vectorize(str_map.get, otypes=[object])(plan)
+            for plan in strategy.per_spec_plans
+        ]
+        return ReshardingStrategy(strategy.mode, per_spec_plans,
+                                  strategy.order, strategy.is_local_allgather)
+
+    def clear(self):
+        self.tile_maps.clear()
+        self.strategies.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+_resharding_plan_cache = ReshardingPlanCache()
+
+
+def get_resharding_plan_cache():
+    """Get the resharding plan cache of this process."""
+    return _resharding_plan_cache
+
+
 class ReshardingTaskSpec:
     """
     A helper class specifies how to perform cross-mesh resharding for two
@@ -730,7 +865,11 @@ class ReshardingTaskSpec:
             TileSlice in dst_tile.
         """
         if not self._dst_tile_to_src_tiles_map:
-            self._dst_tile_to_src_tiles_map = self.generate_src_dst_map()
+            if global_config.resharding_plan_cache:
+                self._dst_tile_to_src_tiles_map = (
+                    _resharding_plan_cache.get_tile_map(self))
+            else:
+                self._dst_tile_to_src_tiles_map = self.generate_src_dst_map()
         return self._dst_tile_to_src_tiles_map
 
     def generate_src_dst_map(self):
@@ -894,7 +1033,7 @@ class ReshardingTaskSpec:
             device_strs = device_strs | OrderedSet(
                 tile_strategy.flatten().tolist())
         # receivers
-        for tile in self.dst.tiles.flatten():
+        for tile, _, _ in self.dst_tile_to_src_tiles_map:
             device_strs = device_strs | OrderedSet(tile.replica_device_strs)
         return device_strs
 
@@ -974,17 +1113,33 @@ class CrossMeshCommunicator:
         self._create_resharding_specs()
         # Generate a send/recv strategies for all resharding tasks by looking
         # at their load.
+        # Strategies in the "normal" mode depend on the loads of previous
+        # specs, so they cannot be cached.
+        use_strategy_cache = (
+            global_config.resharding_plan_cache and
+            global_config.resharding_loadbalance_mode != "normal")
         for src_mesh_idx, dst_mesh_idx, var_spec_map in self.task_spec_iter():
+            src_mesh = self._schedule.meshes[src_mesh_idx]
+            dst_mesh = self._schedule.meshes[dst_mesh_idx]
             for _, spec in var_spec_map.items():
                 if global_config.resharding_mode == "send_recv":
-                    strategy = (self._generate_send_recv_resharding_strategy(
-                        spec, self._schedule.meshes[src_mesh_idx],
-                        self._schedule.meshes[dst_mesh_idx]))
+                    generate_fn = partial(
+                        self._generate_send_recv_resharding_strategy, spec,
+                        src_mesh, dst_mesh)
+                else:
+                    generate_fn = partial(
+                        self._generate_broadcast_resharding_strategy, spec,
+                        src_mesh, dst_mesh)
+                if use_strategy_cache:
+                    strategy = _resharding_plan_cache.get_strategy(
+                        spec, src_mesh, dst_mesh, generate_fn)
                 else:
-                    strategy = (self._generate_broadcast_resharding_strategy(
-                        spec, self._schedule.meshes[src_mesh_idx],
-                        self._schedule.meshes[dst_mesh_idx]))
+                    strategy = generate_fn()
                 spec.set_resharding_strategy(strategy)
+        if global_config.resharding_plan_cache:
+            logger.debug(f"Resharding plan cache: "
+                         f"{_resharding_plan_cache.hits} hits, "
+                         f"{_resharding_plan_cache.misses} misses.")
 
     @property
     def num_mesh(self):
@@ -1543,6 +1698,9 @@ class ReshardingLoadBalancingTaskSolver:
             if global_config.loadbalance_order_algo == "search":
                 task = LoadBalancingTaskSolverSearchAlgo(
                     n_workers, abstract_works)
+            elif global_config.loadbalance_order_algo == "lpt":
+                task = LoadBalancingTaskSolverLPTAlgo(n_workers,
+                                                      abstract_works)
             else:
                 task = LoadBalancingTaskSolverGreedyAlgo(
                     n_workers, abstract_works)
@@ -1901,3 +2059,239 @@ class LoadBalancingOverSizeTaskSolver(AbstractedLoadBalancingTaskSolver):
         assert None not in self.sol_assigned_sender_id
 
         return self.sol_assigned_sender_id, self.sol_order
+
+
+class LoadBalancingTaskSolverLPTAlgo(AbstractedLoadBalancingTaskSolver):
+    """Implementation of load balance: deterministic list scheduling.
+
+    Several list schedules (longest-processing-time-first and
+    most-constrained-first priorities, with static and earliest-start
+    dispatching) are evaluated at once with numpy. The best one is refined by
+    a local search over sender choices and, for small instances, by an exact
+    ILP.
+    """
+
+    def __init__(self, n_workers, works):
+        super().__init__(n_workers, works)
+
+        self.durations = np.array([work.duration for work in works],
+                                  dtype=np.float64)
+        self.sender_mask = np.zeros((self.n_works, n_workers), dtype=bool)
+        self.receiver_mask = np.zeros((self.n_works, n_workers), dtype=bool)
+        for i, work in enumerate(works):
+            self.sender_mask[i, work.sender_ids] = True
+            self.receiver_mask[i, work.receiver_ids] = True
+
+        self.max_local_search_rounds = 16
+        self.ilp_time_limit = 10
+        self.makespan = None
+
+    def evaluate_solutions(self, assigned_sender_ids, orders):
+        """Simulate a batch of solutions and return the makespan of each.
+
+        Args:
+            assigned_sender_ids (np.ndarray): (n_solutions, n_works) the
+                sender of each work.
+            orders (np.ndarray): (n_solutions, n_works) the order to submit
+                works.
+        """
+        n_solutions = orders.shape[0]
+        rows = np.arange(n_solutions)
+        current_time = np.zeros((n_solutions, self.n_workers))
+        for step in range(self.n_works):
+            work_ids = orders[:, step]
+            senders = assigned_sender_ids[rows, work_ids]
+            receiver_mask = self.receiver_mask[work_ids]
+            start = np.maximum(
+                current_time[rows, senders],
+                np.where(receiver_mask, current_time, 0).max(axis=1))
+            end = start + self.durations[work_ids]
+            current_time = np.where(receiver_mask, end[:, None], current_time)
+            current_time[rows, senders] = end
+        return current_time.max(axis=1)
+
+    def get_lower_bound(self):
+        """A lower bound of the makespan: the busy time of each worker that
+        must take part in some works."""
+        busy = self.durations @ self.receiver_mask
+        single_sender = self.sender_mask.sum(axis=1) == 1
+        fixed_sender_mask = (self.sender_mask[single_sender] &
+                             ~self.receiver_mask[single_sender])
+        busy += self.durations[single_sender] @ fixed_sender_mask
+        return max(busy.max(), self.durations.max())
+
+    def list_schedule(self, rank, dynamic):
+        """Assign and order works one by one.
+
+        Args:
+            rank (np.ndarray): the priority of each work, lower first.
+            dynamic (bool): If True, always dispatch the remaining work that
+                can start the earliest, with ties broken by the rank.
+                Otherwise, dispatch works by the rank.
+
+        Each work goes to the sender that lets it start the earliest, with
+        ties broken by the load of senders and then the sender id.
+        """
+        current_time = np.zeros(self.n_workers)
+        loads = list(self.loads)
+        assigned_sender_id = np.zeros(self.n_works, dtype=np.int64)
+        order = []
+        remained = np.ones(self.n_works, dtype=bool)
+        static_order = np.argsort(rank, kind="stable")
+        for step in range(self.n_works):
+            if dynamic:
+                start = np.maximum(
+                    np.where(self.sender_mask, current_time, np.inf).min(1),
+                    np.where(self.receiver_mask, current_time, 0).max(1))
+                start[~remained] = np.inf
+                candidates = np.flatnonzero(start == start.min())
+                i = candidates[np.argmin(rank[candidates])]
+            else:
+                i = static_order[step]
+            work = self.works[i]
+            receiver_time = max(
+                (current_time[r] for r in work.receiver_ids), default=0)
+            sender = min(work.sender_ids,
+                         key=lambda s: (max(current_time[s], receiver_time),
+                                        loads[s], s))
+            end = max(current_time[sender], receiver_time) + work.duration
+            current_time[sender] = end
+            current_time[self.receiver_mask[i]] = end
+            loads[sender] += work.duration
+            assigned_sender_id[i] = sender
+            order.append(i)
+            remained[i] = False
+        return assigned_sender_id, np.array(order, dtype=np.int64)
+
+    def improve_senders(self, assigned_sender_id, order, makespan):
+        """Local search: repeatedly move one work to another of its senders
+        if it lowers the makespan. All moves of a round are evaluated in one
+        batch."""
+        moves = [(i, s)
+                 for i, work in enumerate(self.works)
+                 for s in work.sender_ids]
+        if len(moves) == self.n_works:
+            return assigned_sender_id, makespan
+        move_works = np.array([i for i, _ in moves])
+        move_senders = np.array([s for _, s in moves])
+        rows = np.arange(len(moves))
+        orders = np.broadcast_to(order, (len(moves), self.n_works))
+        for _ in range(self.max_local_search_rounds):
+            assigned = np.tile(assigned_sender_id, (len(moves), 1))
+            assigned[rows, move_works] = move_senders
+            makespans = self.evaluate_solutions(assigned, orders)
+            best = int(np.argmin(makespans))
+            if makespans[best] >= makespan:
+                break
+            assigned_sender_id = assigned[best]
+            makespan = makespans[best]
+        return assigned_sender_id, makespan
+
+    def solve_with_ilp(self, upper_bound):
+        """Solve the problem exactly with a disjunctive ILP. Return None if
+        pulp or the CBC solver is not available or no solution is found."""
+        try:
+            import pulp  # pylint: disable=import-outside-toplevel
+        except ImportError:
+            return None
+        if "PULP_CBC_CMD" not in pulp.listSolvers(onlyAvailable=True):
+            return None
+
+        prob = pulp.LpProblem("resharding_load_balance", pulp.LpMinimize)
+        makespan = pulp.LpVariable("makespan", 0, upper_bound)
+        start = [
+            pulp.LpVariable(f"start_{i}", 0, upper_bound - work.duration)
+            for i, work in enumerate(self.works)
+        ]
+        choose = [{
+            s: pulp.LpVariable(f"choose_{i}_{s}", cat="Binary")
+            for s in work.sender_ids
+        } for i, work in enumerate(self.works)]
+        prob += makespan
+        for i, work in enumerate(self.works):
+            prob += pulp.lpSum(choose[i].values()) == 1
+            prob += makespan >= start[i] + work.duration
+
+        def use(i, worker):
+            if self.receiver_mask[i, worker]:
+                return 1
+            return choose[i][worker]
+
+        # If two works use the same worker, one of them runs before the other.
+        big_m = upper_bound
+        for i, work_i in enumerate(self.works):
+            workers_i = set(work_i.sender_ids) | set(work_i.receiver_ids)
+            for j in range(i + 1, self.n_works):
+                work_j = self.works[j]
+                common = workers_i & (set(work_j.sender_ids) |
+                                      set(work_j.receiver_ids))
+                if not common:
+                    continue
+                before = pulp.LpVariable(f"before_{i}_{j}", cat="Binary")
+                for worker in sorted(common):
+                    slack = big_m * (2 - use(i, worker) - use(j, worker))
+                    prob += (start[i] + work_i.duration <= start[j] + big_m *
+                             (1 - before) + slack)
+                    prob += (start[j] + work_j.duration <= start[i] +
+                             big_m * before + slack)
+
+        # Use one thread to keep the solution deterministic.
+        solver = pulp.PULP_CBC_CMD(mip=True,
+                                   msg=False,
+                                   timeLimit=self.ilp_time_limit,
+                                   threads=1)
+        prob.solve(solver)
+        if prob.sol_status not in (pulp.LpSolutionOptimal,
+                                   pulp.LpSolutionIntegerFeasible):
+            return None
+
+        assigned_sender_id = np.array(
+            [max(x, key=lambda s, x=x: x[s].value()) for x in choose],
+            dtype=np.int64)
+        order = np.array(sorted(range(self.n_works),
+                                key=lambda i: (start[i].value(), i)),
+                         dtype=np.int64)
+        return assigned_sender_id, order
+
+    def solve(self):
+        if self.n_works == 0:
+            self.makespan = 0
+            return [], []
+
+        ranks = [
+            # Longest processing time first
+            np.lexsort((np.arange(self.n_works), -self.durations)),
+            # Most constrained (fewest senders) first
+            np.lexsort((np.arange(self.n_works), -self.durations,
+                        self.sender_mask.sum(axis=1))),
+        ]
+        # Convert the sorted indices into the rank of each work
+        ranks = [np.argsort(rank, kind="stable") for rank in ranks]
+        solutions = [
+            self.list_schedule(rank, dynamic)
+            for rank in ranks
+            for dynamic in (False, True)
+        ]
+        makespans = self.evaluate_solutions(
+            np.stack([x[0] for x in solutions]),
+            np.stack([x[1] for x in solutions]))
+        best = int(np.argmin(makespans))
+        assigned_sender_id, order = solutions[best]
+        makespan = makespans[best]
+
+        lower_bound = self.get_lower_bound()
+        if makespan > lower_bound:
+            assigned_sender_id, makespan = self.improve_senders(
+                assigned_sender_id, order, makespan)
+        if (makespan > lower_bound and
+                self.n_works <= global_config.loadbalance_lpt_ilp_max_works):
+            solution = self.solve_with_ilp(makespan)
+            if solution is not None:
+                ilp_makespan = self.evaluate_solutions(solution[0][None, :],
+                                                       solution[1][None, :])[0]
+                if ilp_makespan < makespan:
+                    (assigned_sender_id, order), makespan = (solution,
+                                                             ilp_makespan)
+
+        self.makespan = float(makespan)
+        return ([int(x) for x in assigned_sender_id], [int(x) for x in order])
@@ -287,6 +287,11 @@ def remat_sliced_eqns(origin_jaxpr, sliced_eqns):
 def jaxpr_eqns_input_sizes(jaxpr) -> np.ndarray:
     """Return a list of input sizes for each equation in the jaxpr.
 
+    A variable defined before the l-th equation is an input of the l-th to
+    (r - 1)-th equations iff its first use at or after l is before r. So each
+    row is a prefix sum over the next uses of the defined variables, which
+    only changes at the uses of variables when l increases.
+
     Args:
         jaxpr: Jaxpr to get input sizes for.
 
@@ -297,6 +302,51 @@ def jaxpr_eqns_input_sizes(jaxpr) -> np.ndarray:
     length = len(jaxpr.eqns)
     input_sizes = np.full((length + 1, length + 1), 0, dtype=np.float32)
 
+    # The sorted indices of the equations using each variable defined by
+    # an equation
+    var_uses = {}
+    defined_vars = [[] for _ in range(length)]
+    for idx, eqn in enumerate(jaxpr.eqns):
+        for invar in eqn.invars:
+            if isinstance(invar, Var) and invar in var_uses:
+                uses = var_uses[invar]
+                if not uses or uses[-1] != idx:
+                    uses.append(idx)
+        for outvar in eqn.outvars:
+            var_uses[outvar] = []
+            defined_vars[idx].append(outvar)
+
+    # delta[r] is the total size of the defined variables whose next use is
+    # the (r - 1)-th equation.
+    delta = np.zeros(length + 1, dtype=np.int64)
+    # next_use_vars[i] holds (variable, position in its uses) whose next use
+    # is the i-th equation.
+    next_use_vars = [[] for _ in range(length)]
+    for k in range(1, length + 1):
+        # Variables used by the (k - 1)-th equation move to their next uses
+        for var, pos in next_use_vars[k - 1]:
+            uses = var_uses[var]
+            size = var.aval.size * var.aval.dtype.itemsize
+            delta[k] -= size
+            if pos + 1 < len(uses):
+                delta[uses[pos + 1] + 1] += size
+                next_use_vars[uses[pos + 1]].append((var, pos + 1))
+        next_use_vars[k - 1] = None
+        # Variables defined by the (k - 1)-th equation become inputs
+        for var in defined_vars[k - 1]:
+            uses = var_uses[var]
+            if uses:
+                delta[uses[0] + 1] += var.aval.size * var.aval.dtype.itemsize
+                next_use_vars[uses[0]].append((var, 0))
+        input_sizes[k, k + 1:] = np.cumsum(delta[k + 1:])
+    return input_sizes
+
+
+def jaxpr_eqns_input_sizes_naive(jaxpr) -> np.ndarray:
+    """The quadratic reference implementation of jaxpr_eqns_input_sizes."""
+    length = len(jaxpr.eqns)
+    input_sizes = np.full((length + 1, length + 1), 0, dtype=np.float32)
+
     outvars = OrderedSet()
     for k in range(0, length + 1):
         if k > 0:
@@ -460,26 +510,36 @@ def cluster_jaxpr_by_cost(jaxpr: Jaxpr, layer_num: int, eps: float, costs,
 def search_layer_num(jaxpr,
                      eps,
                      layer_eps=0,
-                     cost_criteria=DEFAULT_COST_CRITERIA):
-    """TODO(zhuohan): docstring."""
-    non_trivial, input_sizes, compute_costs = get_layer_construction_costs(
-        jaxpr)
+                     cost_criteria=DEFAULT_COST_CRITERIA,
+                     costs=None,
+                     solutions=None):
+    """Binary search the largest layer number whose DP cost is within
+    (1 + layer_eps) of the cost with 2 layers.
+
+    Args:
+        costs: The precomputed costs of get_layer_construction_costs with the
+          default cost criteria, to avoid recomputing them.
+        solutions: If not None, a dict to store the results of
+          cluster_jaxpr_by_cost of every probed layer number.
+    """
+    if costs is None:
+        costs = get_layer_construction_costs(jaxpr)
+    if solutions is None:
+        solutions = {}
+
+    def cluster(layer_num):
+        if layer_num not in solutions:
+            solutions[layer_num] = cluster_jaxpr_by_cost(
+                jaxpr, layer_num, eps, costs, cost_criteria=cost_criteria)
+        return solutions[layer_num][1]["total_cost"]
+
+    non_trivial = costs[0]
     layer_num = 2
     r = int(non_trivial.sum() / 3) + 1
-    _, solution_info = cluster_jaxpr_by_cost(
-        jaxpr,
-        layer_num,
-        eps, (non_trivial, input_sizes, compute_costs),
-        cost_criteria=cost_criteria)
-    l_val = solution_info["total_cost"]
+    l_val = cluster(layer_num)
     while r - layer_num > 1:
         mid = int((layer_num + r) / 2)
-        _, solution_info = cluster_jaxpr_by_cost(
-            jaxpr,
-            mid,
-            eps, (non_trivial, input_sizes, compute_costs),
-            cost_criteria=cost_criteria)
-        mid_val = solution_info["total_cost"]
+        mid_val = cluster(mid)
         if mid_val > l_val * (1 + layer_eps):
             r = mid
         else:
@@ -507,15 +567,27 @@ def layer_level_jaxpr_transformation(fn: Callable,
                                            return_shape=True)(*args)
         if auto_layer_boundary:
             nonlocal layer_num
-            if layer_num == "auto":
-                layer_num = search_layer_num(jaxpr, eps, layer_eps)
             costs = get_layer_construction_costs(jaxpr,
                                                  cost_criteria=cost_criteria)
-            sliced_eqns, _ = cluster_jaxpr_by_cost(jaxpr,
-                                                   layer_num,
-                                                   eps,
-                                                   costs,
-                                                   cost_criteria=cost_criteria)
+            # The search always uses the default cost criteria, so its
+            # costs and solutions can only be reused with the default one.
+            reusable = cost_criteria == DEFAULT_COST_CRITERIA
+            solutions = {}
+            if layer_num == "auto":
+                layer_num = search_layer_num(jaxpr,
+                                             eps,
+                                             layer_eps,
+                                             costs=costs if reusable else None,
+                                             solutions=solutions)
+            if reusable and layer_num in solutions:
+                sliced_eqns, _ = solutions[layer_num]
+            else:
+                sliced_eqns, _ = cluster_jaxpr_by_cost(
+                    jaxpr,
+                    layer_num,
+                    eps,
+                    costs,
+                    cost_criteria=cost_criteria)
         else:
             sliced_eqns = slice_eqns_by_layer_boundary(jaxpr)
 
@@ -0,0 +1,174 @@
+"""Static memory planning of pipeline instructions.
+
+The planner walks the instruction list of a worker with the sizes of all
+buffers (derived from avals and sharding specs by the emitter) and computes
+the memory usage of each device over time. It does not include the temporary
+memory used inside XLA executables or communication tasks.
+
+It can also reorder instructions to lower the peak memory: zero-buffer
+allocations (for gradient accumulation and receiving) and RECVs are moved as
+late as their dependencies allow. RECVs are never moved across other
+communication instructions, so the matching order of communication between
+meshes is kept.
+"""
+import dataclasses
+from typing import Dict, Optional, Sequence, Set
+
+import numpy as np
+
+from alpa.pipeline_parallel.runtime_emitter import (PipelineInstruction,
+                                                    PipelineInstType)
+
+_COMM_OPCODES = (PipelineInstType.SEND, PipelineInstType.RECV,
+                 PipelineInstType.BROADCAST)
+
+
+@dataclasses.dataclass
+class MemoryTimeline:
+    """The memory usage of a device of a mesh over instructions."""
+    # The live bytes on a device after each instruction
+    live_bytes: Sequence[int]
+    # The description of each instruction
+    infos: Sequence[str]
+    # The live bytes before the first instruction (i.e., the inputs)
+    initial_bytes: int
+    peak_bytes: int
+    # The index of the instruction at the peak, -1 if the peak is the inputs
+    peak_index: int
+
+    def __str__(self):
+        return (f"MemoryTimeline(peak={self.peak_bytes / 1024**2:.2f} MB at "
+                f"instruction {self.peak_index}, "
+                f"#instructions={len(self.live_bytes)})")
+
+
+def _get_inst_read_uuids(inst: PipelineInstruction):
+    if inst.input_uuids is None:
+        return ()
+    return np.asarray(inst.input_uuids).ravel()
+
+
+def _get_inst_write_uuids(inst: PipelineInstruction):
+    if inst.output_uuids is None:
+        return ()
+    return np.asarray(inst.output_uuids).ravel()
+
+
+def simulate_memory_timeline(instructions: Sequence[PipelineInstruction],
+                             buffer_bytes: Dict[int, int],
+                             input_uuids: Sequence[int],
+                             donated_invars: Dict[int, Sequence[bool]]):
+    """Compute the live bytes on a device after each instruction.
+
+    Args:
+        instructions: The instruction list of a worker.
+        buffer_bytes: The size of each buffer on a device.
+        input_uuids: The buffers that are live before the first instruction.
+        donated_invars: The donation of the inputs of each executable uuid.
+          A donated input is reused by the executable for its outputs.
+    """
+    live: Set[int] = set()
+    cur = 0
+    for uuid in input_uuids:
+        if uuid not in live:
+            live.add(uuid)
+            cur += buffer_bytes.get(uuid, 0)
+    initial_bytes = peak = cur
+    peak_index = -1
+
+    live_bytes = []
+    infos = []
+    for idx, inst in enumerate(instructions):
+        if inst.opcode == PipelineInstType.FREE:
+            for uuid in _get_inst_read_uuids(inst):
+                if uuid in live:
+                    live.remove(uuid)
+                    cur -= buffer_bytes.get(uuid, 0)
+        else:
+            if inst.opcode == PipelineInstType.RUN:
+                donated = donated_invars.get(inst.task_uuid, ())
+                for uuid, donate in zip(_get_inst_read_uuids(inst), donated):
+                    if donate and uuid in live:
+                        live.remove(uuid)
+                        cur -= buffer_bytes.get(uuid, 0)
+            for uuid in _get_inst_write_uuids(inst):
+                if uuid not in live:
+                    live.add(uuid)
+                    cur += buffer_bytes.get(uuid, 0)
+        live_bytes.append(cur)
+        infos.append(str(inst))
+        if cur > peak:
+            peak = cur
+            peak_index = idx
+    return MemoryTimeline(live_bytes, infos, initial_bytes, peak, peak_index)
+
+
+def sink_allocations(instructions: Sequence[PipelineInstruction],
+                     alloc_task_uuids: Set[int]):
+    """Move allocations and RECVs as late as their dependencies allow.
+
+    An allocation (a RUN of a zero-buffer executable) is placed right before
+    the first instruction that uses any of its outputs. A RECV is placed right
+    before the first instruction that uses its output, but not after any other
+    communication instruction.
+    """
+    instructions = list(instructions)
+    # Process from the back, so that an allocation followed by its RECVs sees
+    # the RECVs at their new positions.
+    idx = len(instructions) - 1
+    while idx >= 0:
+        inst = instructions[idx]
+        is_alloc = (inst.opcode == PipelineInstType.RUN and
+                    inst.task_uuid in alloc_task_uuids)
+        is_recv = inst.opcode == PipelineInstType.RECV
+        if not (is_alloc or is_recv):
+            idx -= 1
+            continue
+        outputs = set(_get_inst_write_uuids(inst))
+        target = idx + 1
+        while target < len(instructions):
+            other = instructions[target]
+            if is_recv and other.opcode in _COMM_OPCODES:
+                break
+            if (outputs.intersection(_get_inst_read_uuids(other)) or
+                    outputs.intersection(_get_inst_write_uuids(other))):
+                break
+            target += 1
+        if target > idx + 1:
+            instructions.insert(target, inst)
+            del instructions[idx]
+        idx -= 1
+    return instructions
+
+
+def plan_mesh_memory(instruction_lists: Sequence[Sequence[PipelineInstruction]],
+                     buffer_bytes: Dict[int, int],
+                     input_uuids: Sequence[int],
+                     donated_invars: Dict[int, Sequence[bool]],
+                     alloc_task_uuids: Set[int],
+                     reorder: bool = False,
+                     memory_budget: Optional[int] = None):
+    """Plan the memory of a mesh, whose workers run the same instructions.
+
+    If reorder is True and the peak is larger than memory_budget (or the
+    budget is None), the instructions of all workers are reordered with
+    sink_allocations, if it lowers the peak.
+
+    Returns:
+        The (possibly reordered) instruction lists and the memory timeline.
+    """
+    timeline = simulate_memory_timeline(instruction_lists[0], buffer_bytes,
+                                        input_uuids, donated_invars)
+    if not reorder or (memory_budget is not None and
+                       timeline.peak_bytes <= memory_budget):
+        return instruction_lists, timeline
+
+    new_lists = [
+        sink_allocations(instructions, alloc_task_uuids)
+        for instructions in instruction_lists
+    ]
+    new_timeline = simulate_memory_timeline(new_lists[0], buffer_bytes,
+                                            input_uuids, donated_invars)
+    if new_timeline.peak_bytes < timeline.peak_bytes:
+        return new_lists, new_timeline
+    return instruction_lists, timeline
@@ -0,0 +1,374 @@
+"""A discrete-event simulator of pipeline schedules.
+
+Stage construction scores a plan with
+`sum(stage costs) + (num_micro_batches - 1) * max(stage costs)`, which ignores
+the chosen schedule, cross-mesh resharding and memory. This simulator replays
+the per-mesh task lists of a PipelineSchedule instead. Each mesh runs its
+tasks in the order of the schedule clocks. A task starts when the mesh is
+free and all tasks it depends on have finished and their outputs have been
+resharded to this mesh. It reports the step time, the bubble fraction and the
+peak memory of each mesh.
+"""
+import dataclasses
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from alpa.pipeline_parallel.schedules import (PipelineSchedule,
+                                              create_pipeline_schedule,
+                                              gen_linear_pipeline_dependency)
+
+# The default bandwidth (bytes/s) and latency (s) of cross-mesh resharding if
+# there is no profiling result.
+DEFAULT_CROSS_MESH_BANDWIDTH = 10e9
+DEFAULT_CROSS_MESH_LATENCY = 1e-4
+
+
+@dataclasses.dataclass
+class PipelineSimulationResult:
+    """The result of simulating one iteration of a pipeline."""
+    # The time of an iteration
+    step_time: float
+    # The fraction of idle time on all meshes
+    bubble_fraction: float
+    # The compute time on each mesh
+    mesh_busy_time: Sequence[float]
+    # The peak memory on each mesh. All zeros if no memory info is given.
+    mesh_peak_memory: Sequence[float]
+    # (mesh_idx, batch_idx, stage_idx, start_time, end_time) of all tasks
+    timeline: Sequence[Tuple[int, int, int, float, float]]
+
+
+def _get_backward_stage_mapping(schedule: PipelineSchedule):
+    """Map each forward stage to its backward stage. Return an empty dict for
+    inference schedules."""
+    if schedule.name == "inference":
+        return {}
+    num_compute_stages = schedule.num_stage - len(
+        schedule.apply_grad_placement)
+    return {
+        i: num_compute_stages - 1 - i for i in range(num_compute_stages // 2)
+    }
+
+
+def simulate_pipeline(schedule: PipelineSchedule,
+                      stage_costs: Sequence[float],
+                      comm_costs: Optional[Dict[Tuple[int, int],
+                                                float]] = None,
+                      stage_activation_bytes: Optional[Sequence[float]] = None,
+                      stage_temp_bytes: Optional[Sequence[float]] = None,
+                      mesh_static_bytes: Optional[Sequence[float]] = None,
+                      overlap_communication: bool = False):
+    """Simulate one iteration of a pipeline schedule.
+
+    Args:
+        schedule: The pipeline schedule.
+        stage_costs: The compute time of each stage (including apply_grad
+          stages) for one micro batch.
+        comm_costs: The resharding time from mesh i to mesh j for one micro
+          batch, keyed by (i, j).
+        stage_activation_bytes: The bytes of the intermediates that a forward
+          stage keeps until its backward stage runs, for one micro batch.
+        stage_temp_bytes: The bytes of temporary buffers of each stage while
+          it runs.
+        mesh_static_bytes: The bytes of parameters, optimizer states and
+          other buffers alive for the whole iteration on each mesh.
+        overlap_communication: If False, resharding occupies the receiving
+          mesh, as the send/recv instructions of the runtime do. If True, it
+          only delays the receiving task.
+    """
+    num_mesh = schedule.num_mesh
+    comm_costs = comm_costs or {}
+    dependency = schedule.dependency
+    stage_mesh = {
+        stage_idx: list(meshes)[0]
+        for stage_idx, meshes in schedule.stage_mesh_mapping.items()
+    }
+
+    # The task list of each mesh
+    mesh_tasks = [[] for _ in range(num_mesh)]
+    for tasks in schedule.schedules:
+        for mesh_idx, task in enumerate(tasks):
+            if task is not None:
+                mesh_tasks[mesh_idx].append(tuple(task))
+    scheduled = {task for tasks in mesh_tasks for task in tasks}
+
+    end_time = {}
+    timeline = []
+    mesh_free_time = [0.0] * num_mesh
+    next_task = [0] * num_mesh
+    num_finished = 0
+    num_tasks = len(scheduled)
+    while num_finished < num_tasks:
+        progress = False
+        for mesh_idx in range(num_mesh):
+            while next_task[mesh_idx] < len(mesh_tasks[mesh_idx]):
+                task = mesh_tasks[mesh_idx][next_task[mesh_idx]]
+                batch_idx, stage_idx = task
+                deps = [(batch_idx, src_stage)
+                        for src_stage in np.nonzero(dependency[stage_idx])[0]
+                        if (batch_idx, src_stage) in scheduled]
+                if any(dep not in end_time for dep in deps):
+                    break
+
+                ready_time = mesh_free_time[mesh_idx]
+                comm_time = 0.0
+                src_meshes = set()
+                for dep in deps:
+                    src_mesh = stage_mesh[dep[1]]
+                    if src_mesh == mesh_idx:
+                        ready_time = max(ready_time, end_time[dep])
+                        continue
+                    cost = comm_costs.get((src_mesh, mesh_idx), 0.0)
+                    if src_mesh not in src_meshes:
+                        src_meshes.add(src_mesh)
+                        comm_time += cost
+                    if overlap_communication:
+                        ready_time = max(ready_time, end_time[dep] + cost)
+                    else:
+                        ready_time = max(ready_time, end_time[dep])
+                if not overlap_communication:
+                    ready_time += comm_time
+
+                start = ready_time
+                end = start + stage_costs[stage_idx]
+                end_time[task] = end
+                mesh_free_time[mesh_idx] = end
+                timeline.append((mesh_idx, batch_idx, stage_idx, start, end))
+                next_task[mesh_idx] += 1
+                num_finished += 1
+                progress = True
+        if not progress:
+            raise ValueError("Deadlock in the pipeline schedule: no mesh can "
+                             "run its next task.")
+
+    step_time = max(end_time.values()) if end_time else 0.0
+    mesh_busy_time = [0.0] * num_mesh
+    for mesh_idx, _, _, start, end in timeline:
+        mesh_busy_time[mesh_idx] += end - start
+    if step_time > 0:
+        bubble_fraction = 1 - sum(mesh_busy_time) / (num_mesh * step_time)
+    else:
+        bubble_fraction = 0.0
+
+    mesh_peak_memory = _simulate_memory(schedule, mesh_tasks,
+                                        stage_activation_bytes,
+                                        stage_temp_bytes, mesh_static_bytes)
+    timeline.sort(key=lambda x: (x[3], x[0]))
+    return PipelineSimulationResult(step_time, bubble_fraction, mesh_busy_time,
+                                    mesh_peak_memory, timeline)
+
+
+def _simulate_memory(schedule, mesh_tasks, stage_activation_bytes,
+                     stage_temp_bytes, mesh_static_bytes):
+    """Replay the tasks of each mesh in order and track the live bytes."""
+    num_mesh = schedule.num_mesh
+    num_stage = schedule.num_stage
+    activation_bytes = (np.zeros(num_stage) if stage_activation_bytes is None
+                        else np.asarray(stage_activation_bytes))
+    temp_bytes = (np.zeros(num_stage)
+                  if stage_temp_bytes is None else np.asarray(stage_temp_bytes))
+    static_bytes = (np.zeros(num_mesh) if mesh_static_bytes is None else
+                    np.asarray(mesh_static_bytes))
+    backward_of = _get_backward_stage_mapping(schedule)
+    forward_of = {v: k for k, v in backward_of.items()}
+
+    peak_memory = []
+    for mesh_idx in range(num_mesh):
+        live = static_bytes[mesh_idx]
+        peak = live
+        for _, stage_idx in mesh_tasks[mesh_idx]:
+            if stage_idx in backward_of:
+                # Keep the intermediates until the backward stage
+                peak = max(peak, live + temp_bytes[stage_idx] +
+                           activation_bytes[stage_idx])
+                live += activation_bytes[stage_idx]
+            else:
+                peak = max(peak, live + temp_bytes[stage_idx])
+                if stage_idx in forward_of:
+                    live -= activation_bytes[forward_of[stage_idx]]
+        peak_memory.append(float(peak))
+    return peak_memory
+
+
+########################################
+##### Communication Costs
+########################################
+def get_resharding_bytes(resharding_tasks, meshes) -> Dict[Tuple[int, int],
+                                                           float]:
+    """Get the bytes resharded from mesh i to mesh j for one micro batch."""
+    mesh_indices = {id(mesh): i for i, mesh in enumerate(meshes)}
+    ret = {}
+    for task in resharding_tasks:
+        key = (mesh_indices[id(task.src_mesh)], mesh_indices[id(task.dst_mesh)])
+        aval = task.task_spec.aval
+        num_bytes = np.prod(aval.shape, dtype=np.float64) * aval.dtype.itemsize
+        ret[key] = ret.get(key, 0.0) + num_bytes
+    return ret
+
+
+def estimate_p2p_time(num_bytes: float, prof_result=None):
+    """Estimate the time of sending some bytes between two meshes.
+
+    With a MeshProfilingResult, the bandwidth curve of all-gather within
+    2-device groups is used, where each device receives half of the data.
+    Otherwise, use the default bandwidth and latency."""
+    if prof_result is not None:
+        keys = [
+            key for key in prof_result.all_gather_cost_dict
+            if key[1] == "float32" and len(key[0][0]) == 2
+        ]
+        if keys:
+            return prof_result.estimate_all_gather(keys[0], 2 * num_bytes / 4,
+                                                   "float32")
+    return DEFAULT_CROSS_MESH_LATENCY + num_bytes / DEFAULT_CROSS_MESH_BANDWIDTH
+
+
+def get_comm_costs(resharding_bytes: Dict[Tuple[int, int], float],
+                   prof_result=None):
+    return {
+        key: estimate_p2p_time(num_bytes, prof_result)
+        for key, num_bytes in resharding_bytes.items()
+    }
+
+
+########################################
+##### Validation with Execution Traces
+########################################
+def get_stage_costs_from_execution_info(exec_info):
+    """Get the mean duration of each stage from the result of
+    PipeshardDriverExecutable.get_stage_execution_info."""
+    return [
+        float(np.mean([end - start for start, end, *_ in invocations]))
+        if invocations else 0.0 for invocations in exec_info
+    ]
+
+
+def get_step_times_from_execution_info(exec_info, schedule: PipelineSchedule):
+    """Get the time of each iteration from the result of
+    PipeshardDriverExecutable.get_stage_execution_info."""
+    num_invocations = [0] * schedule.num_stage
+    for tasks in schedule.schedules:
+        for task in tasks:
+            if task is not None:
+                num_invocations[task[1]] += 1
+    num_iterations = min(
+        len(invocations) // max(num_invocations[i], 1)
+        for i, invocations in enumerate(exec_info))
+
+    step_times = []
+    for k in range(num_iterations):
+        starts, ends = [], []
+        for i, invocations in enumerate(exec_info):
+            n = num_invocations[i]
+            for start, end, *_ in invocations[k * n:(k + 1) * n]:
+                starts.append(start)
+                ends.append(end)
+        step_times.append(max(ends) - min(starts))
+    return step_times
+
+
+def simulate_executable(executable,
+                        stage_costs: Optional[Sequence[float]] = None,
+                        prof_result=None,
+                        **kwargs):
+    """Simulate a PipeshardDriverExecutable.
+
+    If stage_costs is None, use the durations measured by the tracer, which
+    requires `global_config.collect_trace = True`.
+    """
+    if stage_costs is None:
+        stage_costs = get_stage_costs_from_execution_info(
+            executable.get_stage_execution_info())
+    resharding_bytes = get_resharding_bytes(executable.resharding_tasks,
+                                            executable.mesh_group.meshes)
+    return simulate_pipeline(executable.schedule, stage_costs,
+                             get_comm_costs(resharding_bytes, prof_result),
+                             **kwargs)
+
+
+########################################
+##### Scoring for Stage Construction
+########################################
+def get_layer_boundary_bytes(layers, num_layers: int):
+    """ret[k] is the bytes of forward variables that are produced by layers
+    before layer k and used by layer k or later ones."""
+    produced_at = {}
+    last_used_at = {}
+    for i in range(num_layers):
+        for var in layers[i].invars:
+            if var in produced_at:
+                last_used_at[var] = i
+        for var in layers[i].outvars:
+            produced_at[var] = i
+
+    ret = np.zeros(num_layers + 1)
+    for var, last_use in last_used_at.items():
+        if last_use > produced_at[var]:
+            aval = var.aval
+            ret[produced_at[var] + 1:last_use + 1] += (
+                np.prod(aval.shape, dtype=np.float64) * aval.dtype.itemsize)
+    return ret
+
+
+class StageConstructionSimulator:
+    """Score the solutions of the stage construction DP by simulation.
+
+    Args:
+        compute_cost: The compute cost of (start layer, end layer, submesh,
+          config), including both forward and backward.
+        num_micro_batches: The number of micro batches.
+        pipeline_schedule: The name of the pipeline schedule.
+        layer_boundary_bytes: See `get_layer_boundary_bytes`.
+        prof_result: The MeshProfilingResult used for resharding costs.
+        forward_cost_ratio: The fraction of the forward pass in a stage cost.
+    """
+
+    def __init__(self,
+                 compute_cost: np.ndarray,
+                 num_micro_batches: int,
+                 pipeline_schedule: str,
+                 layer_boundary_bytes: Optional[np.ndarray] = None,
+                 prof_result=None,
+                 forward_cost_ratio: float = 1 / 3):
+        self.compute_cost = compute_cost
+        self.num_micro_batches = num_micro_batches
+        self.pipeline_schedule = pipeline_schedule
+        self.layer_boundary_bytes = layer_boundary_bytes
+        self.prof_result = prof_result
+        self.forward_cost_ratio = forward_cost_ratio
+        self.last_result = None
+
+    def simulate(self, solution) -> PipelineSimulationResult:
+        """Simulate a solution of the DP, which is a list of
+        ((start layer, end layer + 1), submesh_id, config_id)."""
+        num_meshes = len(solution)
+        costs = [
+            self.compute_cost[start, end - 1, submesh_id, config_id]
+            for (start, end), submesh_id, config_id in solution
+        ]
+        forward_costs = [c * self.forward_cost_ratio for c in costs]
+        backward_costs = [c - f for c, f in zip(costs, forward_costs)]
+        stage_costs = forward_costs + list(reversed(backward_costs))
+
+        comm_costs = {}
+        if self.layer_boundary_bytes is not None:
+            for i in range(num_meshes - 1):
+                boundary = solution[i][0][1]
+                cost = estimate_p2p_time(self.layer_boundary_bytes[boundary],
+                                         self.prof_result)
+                # Activations flow forward and their gradients flow backward
+                comm_costs[(i, i + 1)] = cost
+                comm_costs[(i + 1, i)] = cost
+
+        schedule = create_pipeline_schedule(
+            self.pipeline_schedule,
+            dependency=gen_linear_pipeline_dependency(2 * num_meshes),
+            meshes=[None] * num_meshes,
+            apply_grad_placement={},
+            num_batch=self.num_micro_batches)
+        return simulate_pipeline(schedule, stage_costs, comm_costs)
+
+    def __call__(self, solution) -> float:
+        self.last_result = self.simulate(solution)
+        return self.last_result.step_time
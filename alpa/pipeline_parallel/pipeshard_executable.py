@@ -4,7 +4,8 @@ from functools import partial
 import json
 import os
 import time
-from typing import Optional, Sequence
+from dataclasses import dataclass
+from typing import Any, List, Optional, Sequence
 
 from jax._src import traceback_util
 from jax._src.lib import xla_extension as xe
@@ -13,7 +14,7 @@ import numpy as np
 import ray.exceptions
 
 from alpa.device_mesh import (
-    MeshHostWorker, RemoteArrayRef,
+    DistributedArray, MeshHostWorker, PhysicalDeviceMesh, RemoteArrayRef,
     create_and_record_cross_mesh_collective_communicators, next_array_uuids)
 from alpa.global_env import global_config
 from alpa.device_mesh import PhysicalDeviceMeshGroup
@@ -38,6 +39,25 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
+@dataclass
+class LaunchPlan:
+    """The cached argument routing of a mesh in launch_on_driver."""
+    physical_mesh: PhysicalDeviceMesh
+    # The indices of the arguments of this mesh in the global arguments
+    arg_indices: Sequence[int]
+    # The arguments that are passed by reference if they are DistributedArrays
+    # with the expected sharding
+    fast_path_args: Sequence[int]
+    # The batch arguments, which are always split by shard_args_to_bufs
+    batch_args: Sequence[int]
+    # The indices objects validated in the last launch for each argument
+    known_indices: List[Any]
+    # The offset and number of outputs in the bulk allocated uuids
+    out_offset: int
+    num_outs: int
+    run_executable_methods: Sequence[Any]
+
+
 class PipeshardDriverExecutable:
     """The driver part of the executable for pipeshard parallel."""
 
@@ -62,6 +82,7 @@ class PipeshardDriverExecutable:
         self.schedule = pipeshard_config.schedule
         self.flop_count = pipeshard_config.flop_count
         self.stage_input_shard_specs = pipeshard_config.stage_input_shard_specs
+        self.memory_timelines = pipeshard_config.memory_timelines
         self.input_placement_specs = pipeshard_config.input_placement_specs
         self.output_placement_specs = pipeshard_config.output_placement_specs
         # List[stage_idx -> str]
@@ -72,6 +93,7 @@ class PipeshardDriverExecutable:
             pipeshard_config.sharding_annotated_hlo_texts)
         # List[stage_idx -> executable_uuid]
         self.executable_uuids = pipeshard_config.executable_uuids
+        self.num_reused_executables = pipeshard_config.num_reused_executables
         self.default_auto_sharding_option = (
             pipeshard_config.default_auto_sharding_option)
         self.pipeline_plan = PipelinePlan(
@@ -92,6 +114,8 @@ class PipeshardDriverExecutable:
         ##### For handling outputs of the executable #####
         self.output_local_uuid_list = pipeshard_config.output_local_uuid_list
         self.outs_handler = pipeshard_config.outs_handler
+        # Lazily created by _get_launch_plan
+        self._launch_plan = None
 
         ##### For cross-mesh resharding #####
         self._instantiate_nccl_groups(pipeshard_config.device_str_groups)
@@ -105,6 +129,8 @@ class PipeshardDriverExecutable:
                 task.create_resharding_communicators()
 
         self.exec_uuid = next_mesh_executable_uuid()
+        # The backend compilation runs on workers in parallel
+        self._put_executable_refs = []
         # Create a PipeshardMeshWorkerExecutable for each MeshHostWorker
         for mesh_idx, physical_mesh in enumerate(self.mesh_group):
             mesh_grad_uuids = pipeshard_config.grad_uuids[mesh_idx]
@@ -119,11 +145,17 @@ class PipeshardDriverExecutable:
                         acc_grad_local_uuids,
                         pipeshard_config.reduced_var_uuid_lists[mesh_idx],
                         self.donate_invars[mesh_idx])
-                worker.put_executable.remote(self.exec_uuid,
-                                             PipeshardMeshWorkerExecutable,
-                                             *args)
+                self._put_executable_refs.append(
+                    worker.put_executable.remote(self.exec_uuid,
+                                                 PipeshardMeshWorkerExecutable,
+                                                 *args))
 
     ##### Compilation Related Functions #####
+    def wait_for_compilation(self):
+        """Block until the executables are compiled on all workers."""
+        ray.get(self._put_executable_refs)
+        self._put_executable_refs = []
+
     def _instantiate_nccl_groups(self, device_str_groups):
         """
         Instantiate NCCL groups between two physical meshes.
@@ -144,6 +176,76 @@ class PipeshardDriverExecutable:
             f"Initialize collective group takes {end_time - start_time:.2f}")
 
     ##### Execution Related Functions #####
+    def _get_launch_plan(self):
+        """Precompute the argument routing used by every launch.
+
+        For each mesh, the plan stores the arguments that can take the fast
+        path (non-batch arguments, which are usually DistributedArrays already
+        on the mesh) and the offsets of the outputs in a bulk allocation.
+        """
+        if self._launch_plan is not None:
+            return self._launch_plan
+
+        mesh_plans = []
+        out_offset = 0
+        for mesh_idx, physical_mesh in enumerate(self.mesh_group):
+            arg_indices = self.mesh_arg_indices[mesh_idx]
+            batch_invars = self.batch_invars[mesh_idx]
+            num_outs = len(self.output_local_uuid_list[mesh_idx])
+            mesh_plans.append(
+                LaunchPlan(
+                    physical_mesh=physical_mesh,
+                    arg_indices=arg_indices,
+                    fast_path_args=[
+                        i for i in range(len(arg_indices))
+                        if not batch_invars[i]
+                    ],
+                    batch_args=[
+                        i for i in range(len(arg_indices)) if batch_invars[i]
+                    ],
+                    known_indices=[None] * len(arg_indices),
+                    out_offset=out_offset,
+                    num_outs=num_outs,
+                    run_executable_methods=[
+                        w.run_executable for w in physical_mesh.workers
+                    ]))
+            out_offset += num_outs
+        self._launch_plan = (mesh_plans, out_offset)
+        return self._launch_plan
+
+    def _shard_args_fast(self, mesh_idx, plan, args):
+        """Get the input refs of a mesh. Arguments that are DistributedArrays
+        with the expected layout are passed by reference; the others go
+        through the slow path of shard_args_to_bufs."""
+        physical_mesh = plan.physical_mesh
+        shard_indices = self.input_shard_indices[mesh_idx]
+        tmp_bufs = [None] * len(plan.arg_indices)
+        slow_args = []
+        for i in plan.fast_path_args:
+            arg = args[plan.arg_indices[i]]
+            if (isinstance(arg, DistributedArray) and
+                    arg.device_mesh is physical_mesh):
+                if arg.indices is plan.known_indices[i]:
+                    tmp_bufs[i] = arg.remote_ref
+                    continue
+                if arg.indices == shard_indices[i]:
+                    # Only compare by identity in later launches
+                    plan.known_indices[i] = arg.indices
+                    tmp_bufs[i] = arg.remote_ref
+                    continue
+            slow_args.append(i)
+        slow_args.extend(plan.batch_args)
+
+        if slow_args:
+            slow_bufs = physical_mesh.shard_args_to_bufs(
+                [shard_indices[i] for i in slow_args],
+                [self.delete_after_shard[mesh_idx][i] for i in slow_args],
+                [self.batch_invars[mesh_idx][i] for i in slow_args],
+                self.num_batch, [args[plan.arg_indices[i]] for i in slow_args])
+            for i, bufs in zip(slow_args, slow_bufs):
+                tmp_bufs[i] = bufs
+        return tmp_bufs
+
     def launch_on_driver(self, *args):
         """Launch the executable on the driver.
 
@@ -152,20 +254,20 @@ class PipeshardDriverExecutable:
         """
         input_bufs = [None for _ in range(self.num_mesh)]
         output_bufs = [None for _ in range(self.num_mesh)]
-        output_uuids = [None for _ in range(self.num_mesh)]
-
-        num_outs = [
-            len(self.output_local_uuid_list[mesh_idx])
-            for mesh_idx in range(self.num_mesh)
-        ]
+        mesh_plans, total_num_outs = self._get_launch_plan()
+        all_output_uuids = next_array_uuids(total_num_outs)
+        use_fast_path = global_config.pipeline_launch_fast_path
 
-        for mesh_idx, physical_mesh in enumerate(self.mesh_group):
+        for mesh_idx, plan in enumerate(mesh_plans):
             # Shard inputs
-            mesh_args = [args[idx] for idx in self.mesh_arg_indices[mesh_idx]]
-            tmp_bufs = physical_mesh.shard_args_to_bufs(
-                self.input_shard_indices[mesh_idx],
-                self.delete_after_shard[mesh_idx], self.batch_invars[mesh_idx],
-                self.num_batch, mesh_args)
+            if use_fast_path:
+                tmp_bufs = self._shard_args_fast(mesh_idx, plan, args)
+            else:
+                mesh_args = [args[idx] for idx in plan.arg_indices]
+                tmp_bufs = plan.physical_mesh.shard_args_to_bufs(
+                    self.input_shard_indices[mesh_idx],
+                    self.delete_after_shard[mesh_idx],
+                    self.batch_invars[mesh_idx], self.num_batch, mesh_args)
 
             # Flatten the batch args in tmp_bufs
             flatten_bufs = []
@@ -177,17 +279,20 @@ class PipeshardDriverExecutable:
             input_bufs[mesh_idx] = flatten_bufs
 
             # Convert bufs to uuids
-            input_uuids = np.array([ref.uuid for ref in input_bufs[mesh_idx]])
-            output_uuids[mesh_idx] = next_array_uuids(num_outs[mesh_idx])
+            input_uuids = np.array([ref.uuid for ref in flatten_bufs])
+            output_uuids = all_output_uuids[plan.out_offset:plan.out_offset +
+                                            plan.num_outs]
 
             # Execute
-            for worker in physical_mesh.workers:
-                worker.run_executable.remote(
+            for run_executable in plan.run_executable_methods:
+                run_executable.remote(
                     self.exec_uuid,
                     input_uuids,
-                    output_uuids[mesh_idx],
+                    output_uuids,
                     sync_for_timer=global_config.pipeline_sync_for_timer,
-                    collect_trace=global_config.collect_trace)
+                    collect_trace=global_config.collect_trace,
+                    collect_instruction_latency=(
+                        global_config.pipeline_collect_instruction_latency))
 
         # Handle donation
         for mesh_idx in range(len(self.mesh_group)):
@@ -197,13 +302,15 @@ class PipeshardDriverExecutable:
                     ref.set_deleted_on_workers()
 
         # Construct output_bufs
-        for mesh_idx, physical_mesh in enumerate(self.mesh_group):
-            output_uuid = output_uuids[mesh_idx]
-            output_bufs[mesh_idx] = np.empty((num_outs[mesh_idx],),
-                                             dtype=object)
-            for i in range(num_outs[mesh_idx]):
-                output_bufs[mesh_idx][i] = RemoteArrayRef(
-                    physical_mesh, output_uuid[i])
+        for mesh_idx, plan in enumerate(mesh_plans):
+            output_uuids = all_output_uuids[plan.out_offset:plan.out_offset +
+                                            plan.num_outs]
+            refs = np.empty((plan.num_outs,), dtype=object)
+            refs[:] = [
+                RemoteArrayRef(plan.physical_mesh, uuid)
+                for uuid in output_uuids
+            ]
+            output_bufs[mesh_idx] = refs
 
         # Check if there is OOM
         if global_config.pipeline_check_alive:
@@ -386,6 +493,32 @@ class PipeshardDriverExecutable:
         exec_info = self.get_stage_execution_info()
         dump_stage_execution_trace_internal(exec_info, filename)
 
+    def get_memory_timeline(self):
+        """Get the statically planned memory usage of a device of each mesh.
+
+        Returns:
+            A list of [mesh_idx -> MemoryTimeline]. The timelines count the
+            buffers of inputs, stage outputs, received tensors, and gradient
+            accumulation, but not the temporary memory inside executables.
+        """
+        return self.memory_timelines
+
+    def get_instruction_latency_stats(self):
+        """Get the per-opcode latency histograms of the pipeline instructions
+        on all workers. Requires
+        global_config.pipeline_collect_instruction_latency.
+
+        Returns:
+            A list of [mesh_idx -> [worker_idx -> {opcode: stats}]], where
+            "OVERHEAD" is the time of the interpreter loop itself.
+        """
+        return [
+            ray.get([
+                worker.get_exec_instruction_latency_stats.remote(
+                    self.exec_uuid) for worker in physical_mesh.workers
+            ]) for physical_mesh in self.mesh_group
+        ]
+
     def profile_all_executable_with_dummy_inputs(self):
         """Profile all stage executables with dummy inputs."""
         all_profiled_handles = []
@@ -431,6 +564,31 @@ class PipeshardDriverExecutable:
             mesh.delete_remote_executable(self.exec_uuid)
 
 
+class InstructionLatencyHistogram:
+    """A histogram of instruction latencies with power-of-two buckets in
+    microseconds. Bucket i counts latencies in [2^(i-1), 2^i) us."""
+    num_buckets = 32
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.buckets = np.zeros(self.num_buckets, dtype=np.int64)
+
+    def add(self, latency: float):
+        self.count += 1
+        self.total += latency
+        us = int(latency * 1e6)
+        self.buckets[min(us.bit_length(), self.num_buckets - 1)] += 1
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / max(self.count, 1),
+            "buckets": self.buckets.tolist(),
+        }
+
+
 class PipeshardMeshWorkerExecutable:
     """
     An executable that executes static pipeline runtime instructions on a
@@ -451,6 +609,12 @@ class PipeshardMeshWorkerExecutable:
         self.input_local_uuids = input_local_uuids
         self.output_local_uuids = output_local_uuids
 
+        # Lazily decoded by _decode_instructions, after the executables of
+        # all instructions are created
+        self.decoded_instructions = None
+        # Dict[opcode name -> InstructionLatencyHistogram]
+        self.latency_stats = None
+
         # Buffer management
         self.worker = worker
         self.global_buffers = worker.buffers
@@ -483,8 +647,12 @@ class PipeshardMeshWorkerExecutable:
                 raise ValueError(f"Invalid task config {task_config}")
         self.partial_grad_exec_uuids = list(self.partial_grad_exec_uuids)
 
-    def execute_on_worker(self, input_global_uuids, output_global_uuids,
-                          sync_for_timer, collect_trace):
+    def execute_on_worker(self,
+                          input_global_uuids,
+                          output_global_uuids,
+                          sync_for_timer,
+                          collect_trace,
+                          collect_instruction_latency=False):
         """Execute on the mesh worker given input and output uuids."""
         # create a local buffer environment
         assert len(self.input_local_uuids) == len(input_global_uuids)
@@ -516,43 +684,24 @@ class PipeshardMeshWorkerExecutable:
             log_run_end = log_run_begin
 
         # Execute
+        if self.decoded_instructions is None:
+            self.decoded_instructions = self._decode_instructions()
         timers(self.exec_timer_name).start(sync_func=sync_func)
 
-        for instruction in self.instructions:
-            #self.worker.sync()
-            #print(f"memory_allocated: "
-            #      f"{self.worker.get_memory_allocated()/1024**3:.3f} GB  "
-            #      f"max_memory_allocated: "
-            #      f"{self.worker.get_max_memory_allocated()/1024**3:.3f} GB "
-            #      f"next instruction: {instruction}", flush=True)
-
-            if instruction.opcode == PipelineInstType.RUN:
-                log_run_begin(instruction.info, sync_func=sync_func)
-                self.worker.run_executable(instruction.task_uuid,
-                                           instruction.input_uuids,
-                                           instruction.output_uuids,
-                                           **instruction.opaques["kwargs"])
-                log_run_end(instruction.info, sync_func=sync_func)
-            elif instruction.opcode == PipelineInstType.SEND:
-                self.worker.run_resharding_send_task(instruction.task_uuid,
-                                                     instruction.input_uuids[0])
-            elif instruction.opcode == PipelineInstType.RECV:
-                self.worker.run_resharding_recv_task(
-                    instruction.task_uuid, instruction.output_uuids[0],
-                    instruction.opaques["set_empty_buffer"])
-                # TODO(lmzheng): move this to run_resharding_recv_task
-                if instruction.opaques["allgather_uuid"] is not None:
-                    task_uuid = instruction.opaques["allgather_uuid"]
-                    ary_uuid = instruction.output_uuids[0]
-                    self.worker.run_executable(task_uuid, [ary_uuid],
-                                               [ary_uuid], False, False)
-            elif instruction.opcode == PipelineInstType.BROADCAST:
-                self.worker.run_resharding_broadcast_task(
-                    instruction.task_uuid,
-                    (instruction.input_uuids if instruction.input_uuids
-                     is not None else instruction.output_uuids)[0])
-            elif instruction.opcode == PipelineInstType.FREE:
-                self.worker.delete_buffers(instruction.input_uuids)
+        if collect_instruction_latency:
+            self._execute_with_latency_stats(log_run_begin, log_run_end,
+                                             sync_func)
+        elif collect_trace:
+            for opcode, func, info in self.decoded_instructions:
+                if opcode == PipelineInstType.RUN:
+                    log_run_begin(info, sync_func=sync_func)
+                    func()
+                    log_run_end(info, sync_func=sync_func)
+                else:
+                    func()
+        else:
+            for _, func, _ in self.decoded_instructions:
+                func()
 
         timers(self.exec_timer_name).stop(sync_func=sync_func)
 
@@ -567,6 +716,86 @@ class PipeshardMeshWorkerExecutable:
         if global_config.enable_overlapping:
             xe.reset_event_context(self.worker.backend)
 
+    def _decode_instructions(self):
+        """Lower the instructions into (opcode, callable, info) tuples with
+        all arguments bound, so that the interpreter loop only makes calls.
+        """
+        worker = self.worker
+        decoded = []
+        for instruction in self.instructions:
+            opcode = instruction.opcode
+            if opcode == PipelineInstType.RUN:
+                func = partial(
+                    worker.executables[instruction.task_uuid].execute_on_worker,
+                    instruction.input_uuids, instruction.output_uuids,
+                    **instruction.opaques["kwargs"])
+            elif opcode == PipelineInstType.SEND:
+                func = partial(worker.run_resharding_send_task,
+                               instruction.task_uuid,
+                               instruction.input_uuids[0])
+            elif opcode == PipelineInstType.RECV:
+                func = partial(worker.run_resharding_recv_task,
+                               instruction.task_uuid,
+                               instruction.output_uuids[0],
+                               instruction.opaques["set_empty_buffer"])
+                if instruction.opaques["allgather_uuid"] is not None:
+                    # TODO(lmzheng): move this to run_resharding_recv_task
+                    decoded.append((opcode, func, instruction.info))
+                    ary_uuid = instruction.output_uuids[0]
+                    func = partial(
+                        worker.executables[instruction.opaques[
+                            "allgather_uuid"]].execute_on_worker, [ary_uuid],
+                        [ary_uuid], False, False)
+            elif opcode == PipelineInstType.BROADCAST:
+                uuids = (instruction.input_uuids if instruction.input_uuids
+                         is not None else instruction.output_uuids)
+                func = partial(worker.run_resharding_broadcast_task,
+                               instruction.task_uuid, uuids[0])
+            elif opcode == PipelineInstType.FREE:
+                func = partial(worker.delete_buffers, instruction.input_uuids)
+            else:
+                raise ValueError(f"Invalid instruction: {instruction}")
+            decoded.append((opcode, func, instruction.info))
+        return decoded
+
+    def _execute_with_latency_stats(self, log_run_begin, log_run_end,
+                                    sync_func):
+        """Execute the instructions and record the dispatch latency of each
+        instruction in per-opcode histograms."""
+        if self.latency_stats is None:
+            self.latency_stats = {
+                name: InstructionLatencyHistogram()
+                for name in [x.name for x in PipelineInstType] + ["OVERHEAD"]
+            }
+        histograms = [
+            self.latency_stats[x.name] for x in sorted(PipelineInstType)
+        ]
+        loop_tic = time.perf_counter()
+        total_inst_time = 0
+        for opcode, func, info in self.decoded_instructions:
+            if opcode == PipelineInstType.RUN:
+                log_run_begin(info, sync_func=sync_func)
+            tic = time.perf_counter()
+            func()
+            cost = time.perf_counter() - tic
+            if opcode == PipelineInstType.RUN:
+                log_run_end(info, sync_func=sync_func)
+            histograms[opcode].add(cost)
+            total_inst_time += cost
+        # The time spent in the interpreter loop itself
+        self.latency_stats["OVERHEAD"].add(time.perf_counter() - loop_tic -
+                                           total_inst_time)
+
+    def get_instruction_latency_stats(self):
+        """Return the latency histograms of each opcode as dicts."""
+        if self.latency_stats is None:
+            return {}
+        return {
+            name: hist.to_dict()
+            for name, hist in self.latency_stats.items()
+            if hist.count > 0
+        }
+
     def profile_with_dummy_inputs(self):
         """Profile the executable with dummy inputs."""
         self.worker.reset_memory_stats()
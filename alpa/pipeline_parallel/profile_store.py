@@ -0,0 +1,308 @@
+"""A persistent store of stage profiling results shared across runs.
+
+`AutoStageOption.cached_profile_result` can only reload the results of the
+exact same search, because they are keyed by stage indices. This store keys
+each stage by a canonical fingerprint of its jaxpr (shapes, dtypes, the
+primitive sequence and the dataflow, but not variable or computation names),
+plus the physical and logical mesh shapes, the auto-sharding option, the
+number of micro batches and the profiling method. A search can then reuse the
+measured ModuleProfileResults of another search, even for a different model
+that shares identical layer ranges, e.g., the same transformer blocks.
+
+The results refer to the variables of a stage by their names. They are stored
+as the positions of the variables in the stage, and translated back with the
+names of the stage that reuses them.
+
+The store is a directory with one file per stage. Stores written on different
+clusters (with the same device type) can be merged with the command line tool:
+    python3 -m alpa.pipeline_parallel.profile_store merge --output DIR SRC ...
+    python3 -m alpa.pipeline_parallel.profile_store list DIR
+"""
+import argparse
+import dataclasses
+import hashlib
+import logging
+import os
+import pickle
+import re
+import shutil
+import tempfile
+import time
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from jax.core import ClosedJaxpr, DropVar, Jaxpr, Literal
+import numpy as np
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+STORE_FILE_SUFFIX = ".pkl"
+
+
+########################################
+##### Canonical Fingerprint
+########################################
+# Params that only name a computation and do not change its semantics
+_NAME_PARAMS = ("name",)
+
+
+def _canonical_param(value: Any) -> str:
+    if isinstance(value, ClosedJaxpr):
+        return canonical_jaxpr_str(value.jaxpr, value.consts)
+    if isinstance(value, Jaxpr):
+        return canonical_jaxpr_str(value)
+    if isinstance(value, (list, tuple)):
+        return "(" + ",".join(_canonical_param(x) for x in value) + ")"
+    # Remove object addresses, e.g., in the reprs of functions
+    return re.sub(r" at 0x[0-9a-f]+", "", repr(value))
+
+
+def canonical_jaxpr_str(jaxpr: Jaxpr, consts: Sequence = ()) -> str:
+    """Return a string of a jaxpr that does not depend on the variable
+    names. Variables are numbered in the order of their first appearance."""
+    var_ids = {}
+
+    def var_str(var):
+        if isinstance(var, Literal):
+            return f"lit({var.val!r}:{var.aval.str_short()})"
+        if isinstance(var, DropVar):
+            return f"_:{var.aval.str_short()}"
+        if var not in var_ids:
+            var_ids[var] = len(var_ids)
+        return f"%{var_ids[var]}:{var.aval.str_short()}"
+
+    lines = []
+    lines.append("constvars " + " ".join(var_str(v) for v in jaxpr.constvars))
+    lines.append("invars " + " ".join(var_str(v) for v in jaxpr.invars))
+    for c in consts:
+        c = np.asarray(c)
+        lines.append(f"const {c.dtype} {c.shape} "
+                     f"{hashlib.sha256(c.tobytes()).hexdigest()}")
+    for eqn in jaxpr.eqns:
+        params = ",".join(f"{k}={_canonical_param(v)}"
+                          for k, v in sorted(eqn.params.items())
+                          if k not in _NAME_PARAMS)
+        lines.append(" ".join(var_str(v) for v in eqn.outvars) + " = " +
+                     eqn.primitive.name + "[" + params + "] " +
+                     " ".join(var_str(v) for v in eqn.invars))
+    lines.append("outvars " + " ".join(var_str(v) for v in jaxpr.outvars))
+    return "\n".join(lines)
+
+
+def get_stage_fingerprint(merged_jaxpr: ClosedJaxpr, *extra_info) -> str:
+    """Get the fingerprint of a stage from its merged jaxpr and other
+    information that changes the compiled stage, e.g., donation."""
+    hasher = hashlib.sha256()
+    hasher.update(
+        canonical_jaxpr_str(merged_jaxpr.jaxpr, merged_jaxpr.consts).encode())
+    hasher.update(repr(extra_info).encode())
+    return hasher.hexdigest()
+
+
+def get_stage_var_names(stage_config) -> Sequence[str]:
+    """All variable names of a stage in the order of their first appearance.
+    Stages with the same fingerprint have the same order."""
+    names = {}
+    for config in stage_config.module_profile_configs:
+        for name in (*config.invar_names, *config.outvar_names):
+            names.setdefault(name, len(names))
+    if (stage_config.apply_grad_config is not None and
+            stage_config.apply_grad_config.invars is not None):
+        for var in stage_config.apply_grad_config.invars:
+            names.setdefault(repr(var), len(names))
+    return list(names)
+
+
+########################################
+##### Store
+########################################
+@dataclasses.dataclass
+class StoredStageProfile:
+    """The profiling result of a stage with variables stored as positions."""
+    n_modules: int
+    # ModuleProfileResults whose invar_names and outvar_names are positions
+    module_profile_results: Sequence[Optional[Any]]
+    initial_var_ids: Tuple[int, ...]
+    initial_var_sizes: Tuple[int, ...]
+    create_time: float
+
+    def num_profiled(self):
+        return sum(r is not None for r in self.module_profile_results)
+
+    def merge(self, other: "StoredStageProfile"):
+        """Fill in the module results that are missing in this entry."""
+        assert self.n_modules == other.n_modules
+        self.module_profile_results = [
+            a if a is not None else b for a, b in zip(
+                self.module_profile_results, other.module_profile_results)
+        ]
+
+
+class ProfileStore:
+    """A directory of stage profiling results keyed by stage fingerprints."""
+
+    def __init__(self, store_dir: str):
+        self.store_dir = os.path.expanduser(store_dir)
+        self.num_hits = 0
+        self.num_misses = 0
+        os.makedirs(self.store_dir, exist_ok=True)
+
+    @staticmethod
+    def compute_key(stage_config, submesh_shape: Tuple[int, int],
+                    logical_mesh, as_option, num_micro_batches: int,
+                    use_hlo_cost_model: bool) -> str:
+        """The key of a stage under a profiling setting."""
+        hasher = hashlib.sha256()
+        hasher.update(stage_config.fingerprint.encode())
+        hasher.update(
+            repr((tuple(submesh_shape), tuple(logical_mesh.shape),
+                  tuple(logical_mesh.mesh_alpha),
+                  tuple(logical_mesh.mesh_beta),
+                  sorted(dataclasses.asdict(as_option).items()),
+                  num_micro_batches, use_hlo_cost_model)).encode())
+        return hasher.hexdigest()
+
+    def _path(self, key: str):
+        return os.path.join(self.store_dir, key + STORE_FILE_SUFFIX)
+
+    def _read(self, path: str) -> Optional[StoredStageProfile]:
+        try:
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError,
+                ImportError):
+            return None
+
+    def _write(self, key: str, entry: StoredStageProfile):
+        # Write to a temporary file and rename it, so that concurrent readers
+        # never see a partially written file.
+        fd, tmp_path = tempfile.mkstemp(dir=self.store_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(entry, f)
+            os.replace(tmp_path, self._path(key))
+        except (OSError, pickle.PicklingError) as e:
+            logger.warning(f"Failed to write the profile store: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def lookup(self, key: str, stage_config):
+        """Return the StageProfileResult of a stage, with variable names
+        translated to the given stage."""
+        # pylint: disable=import-outside-toplevel
+        from alpa.pipeline_parallel.stage_profiling import StageProfileResult
+
+        entry = self._read(self._path(key))
+        if entry is None or entry.num_profiled() == 0:
+            self.num_misses += 1
+            return None
+        self.num_hits += 1
+
+        names = get_stage_var_names(stage_config)
+        result = StageProfileResult(
+            entry.n_modules, [names[i] for i in entry.initial_var_ids],
+            entry.initial_var_sizes)
+        for module_idx, module_result in enumerate(
+                entry.module_profile_results):
+            if module_result is None:
+                continue
+            result.add_module_profile_result(
+                module_idx,
+                module_result._replace(
+                    invar_names=tuple(
+                        names[i] for i in module_result.invar_names),
+                    outvar_names=tuple(
+                        names[i] for i in module_result.outvar_names)))
+        return result
+
+    def insert(self, key: str, stage_config, stage_result):
+        """Insert the StageProfileResult of a stage. Module results that are
+        already in the store are kept."""
+        if not any(r is not None for r in stage_result.module_profile_results):
+            return
+        name_ids = {
+            name: i for i, name in enumerate(get_stage_var_names(stage_config))
+        }
+        module_results = [
+            None if r is None else r._replace(
+                invar_names=tuple(name_ids[x] for x in r.invar_names),
+                outvar_names=tuple(name_ids[x] for x in r.outvar_names))
+            for r in stage_result.module_profile_results
+        ]
+        entry = StoredStageProfile(
+            stage_result.n_modules, module_results,
+            tuple(name_ids[x] for x in stage_result.initial_var_names),
+            tuple(stage_result.initial_var_sizes), time.time())
+        old_entry = self._read(self._path(key))
+        if old_entry is not None:
+            old_entry.merge(entry)
+            entry = old_entry
+        self._write(key, entry)
+
+    def keys(self):
+        return [
+            name[:-len(STORE_FILE_SUFFIX)]
+            for name in sorted(os.listdir(self.store_dir))
+            if name.endswith(STORE_FILE_SUFFIX)
+        ]
+
+    def merge_from(self, other_dir: str):
+        """Merge the entries of another store into this store. Return the
+        number of new or updated entries."""
+        other = ProfileStore(other_dir)
+        num_updated = 0
+        for key in other.keys():
+            src_path = other._path(key)
+            entry = self._read(self._path(key))
+            if entry is None:
+                shutil.copyfile(src_path, self._path(key))
+                num_updated += 1
+                continue
+            other_entry = self._read(src_path)
+            if other_entry is None:
+                continue
+            num_profiled = entry.num_profiled()
+            entry.merge(other_entry)
+            if entry.num_profiled() > num_profiled:
+                self._write(key, entry)
+                num_updated += 1
+        return num_updated
+
+    def entries(self) -> Dict[str, Optional[StoredStageProfile]]:
+        return {key: self._read(self._path(key)) for key in self.keys()}
+
+    def stats(self):
+        return {"hits": self.num_hits, "misses": self.num_misses}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Manage the stage profile store of alpa.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    list_parser = subparsers.add_parser("list")
+    list_parser.add_argument("store_dir", type=str)
+    merge_parser = subparsers.add_parser("merge")
+    merge_parser.add_argument("sources", type=str, nargs="+")
+    merge_parser.add_argument("--output", type=str, required=True)
+    args = parser.parse_args()
+
+    if args.command == "list":
+        store = ProfileStore(args.store_dir)
+        for key, entry in store.entries().items():
+            if entry is None:
+                print(f"{key}  <unreadable>")
+                continue
+            costs = [
+                f"{r.compute_cost:.4f}" if r is not None else "-"
+                for r in entry.module_profile_results
+            ]
+            print(f"{key}  compute costs: {', '.join(costs)}")
+    elif args.command == "merge":
+        store = ProfileStore(args.output)
+        for source in args.sources:
+            num_updated = store.merge_from(source)
+            print(f"Merged {num_updated} entries from {source}")
+
+
+if __name__ == "__main__":
+    main()
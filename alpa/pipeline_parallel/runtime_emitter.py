@@ -126,6 +126,21 @@ class PipelineInstruction:
         return ret
 
 
+def merge_adjacent_free_instructions(
+        instructions: Sequence[PipelineInstruction]):
+    """Merge consecutive FREE instructions into one batched FREE."""
+    merged = []
+    for instruction in instructions:
+        if (instruction.opcode == PipelineInstType.FREE and merged and
+                merged[-1].opcode == PipelineInstType.FREE):
+            merged[-1] = PipelineInstruction.free(
+                np.concatenate([merged[-1].input_uuids,
+                                instruction.input_uuids]))
+        else:
+            merged.append(instruction)
+    return merged
+
+
 AllocateZeroWorkerExecutableConfig = namedtuple(
     "AllocateZeroWorkerExecutableConfig",
     ["exec_uuid", "grad_shard_shapes", "grad_shard_dtypes"])
@@ -253,6 +268,10 @@ class PipeshardConfig:
     manual_stage_option: ManualStageOption
     sharding_annotated_hlo_texts: Sequence[str]
     flop_count: int
+    # List[mesh_idx -> MemoryTimeline]
+    memory_timelines: Optional[Sequence[Any]] = None
+    # The number of util executables deduplicated by the emitter
+    num_reused_executables: int = 0
 
 
 class PipelineInstEmitter:
@@ -288,6 +307,14 @@ class PipelineInstEmitter:
 
         ##### Internal states #####
         self.uuid_counter = 0  # counter for local buffer uuid
+        # The size of each buffer on a device, for memory planning
+        # List[mesh_idx -> Dict[uuid -> bytes]]
+        self.buffer_bytes = [{} for _ in range(self.num_mesh)]
+        # Identical util executables (e.g., zero buffer allocations) on a mesh
+        # share one config, so workers compile them only once.
+        # Dict[(mesh_idx, key) -> ExecutableConfig]
+        self._util_exec_configs = {}
+        self.num_reused_executables = 0
         global_invar_set = OrderedSet(global_invars)
         global_batch_invar_set = OrderedSet(
             v for v, b in zip(global_invars, is_batch) if b)
@@ -307,6 +334,30 @@ class PipelineInstEmitter:
         self.uuid_counter += num
         return ret
 
+    def _get_util_exec_config(self, mesh_idx, key, create_fn,
+                              executable_config_lists):
+        """Get the config of a util executable with the deduplication key.
+
+        A new config is created by create_fn(exec_uuid) and dispatched to all
+        workers of the mesh only if no identical executable exists.
+        """
+        cache_key = (mesh_idx, key)
+        config = self._util_exec_configs.get(cache_key)
+        if config is not None:
+            self.num_reused_executables += 1
+            return config
+        config = create_fn(next_mesh_executable_uuid())
+        self._util_exec_configs[cache_key] = config
+        for worker in self.mesh_group[mesh_idx].workers:
+            executable_config_lists[worker].append(config)
+        return config
+
+    def _record_buffer_bytes(self, mesh_idx, uuids, avals, sharding_specs):
+        """Record the per-device sizes of new buffers."""
+        for uuid, aval, spec in zip(uuids, avals, sharding_specs):
+            self.buffer_bytes[mesh_idx][uuid] = int(
+                np.prod(get_shard_shape(aval, spec)) * aval.dtype.itemsize)
+
     def _compile_sharding_specs(self):
         """Run spmd partitioner pass for each stage to get sharding specs."""
         for stage_idx, stage in enumerate(self.stages):
@@ -442,6 +493,12 @@ class PipelineInstEmitter:
             instruction_lists[worker] = self._compile_free(
                 worker, used_outside, donated, instruction_lists)
 
+        # Plan the memory and optionally reorder allocations
+        memory_timelines = self._compile_memory_plan(instruction_lists,
+                                                     input_config,
+                                                     executable_uuids,
+                                                     executable_config_lists)
+
         # Compile load info
         input_placement_specs = self._compile_input_placement_spec(
             input_config.mesh_arg_indices, input_shard_specs)
@@ -477,7 +534,9 @@ class PipelineInstEmitter:
             self.default_auto_sharding_option,
             self.manual_stage_option,
             self.sharding_annotated_hlo_texts,
-            self.flop_count)
+            self.flop_count,
+            memory_timelines,
+            self.num_reused_executables)
 
     def _compile_get_vars_from_mesh(self, invars, dst_specs, mesh_idx,
                                     batch_idx, comm_lists, alloc_lists,
@@ -523,6 +582,9 @@ class PipelineInstEmitter:
         for idx, outvar in enumerate(stage.outvars):
             output_uuids[idx] = self.env.get_var_mesh_uuid(
                 outvar, batch_idx, mesh_idx)
+        self._record_buffer_bytes(mesh_idx, output_uuids,
+                                  [var.aval for var in stage.outvars],
+                                  stage.output_sharding_specs)
         for idx in range(len(stage.invars)):
             if donated_invars[idx]:
                 donation_mapping[mesh_idx].update(input_uuids[idx],
@@ -760,11 +822,18 @@ class PipelineInstEmitter:
             # shape: (num_args, num_hosts, num_devices_per_host)
             if num_args > 0:
                 arg_uuids = self._get_next_uuids(num_args)
+                arg_specs = {
+                    self.global_invars[global_idx]: spec
+                    for global_idx, spec in zip(mesh_arg_indices[mesh_idx],
+                                                input_shard_specs[mesh_idx])
+                }
                 for arg_idx, info in enumerate(mesh_arg_lists[mesh_idx]):
                     var, batch_idx = info
                     self.env.set_var_mesh_uuid(var, batch_idx, mesh_idx,
                                                arg_uuids[arg_idx])
                     input_local_uuid_lists[mesh_idx].append(arg_uuids[arg_idx])
+                    self._record_buffer_bytes(mesh_idx, [arg_uuids[arg_idx]],
+                                              [var.aval], [arg_specs[var]])
         input_config = PipeshardInputConfig(
             input_local_uuid_lists=input_local_uuid_lists,
             donate_invars=donate_invars,
@@ -812,20 +881,32 @@ class PipelineInstEmitter:
                         src_var, batch_idx, mesh_idx)
                 output_uuid = self._get_next_uuids(1)
                 dst_mesh_to_uuids[mesh_idx] = output_uuid[0]
+                self.buffer_bytes[mesh_idx][output_uuid[0]] = sum(
+                    self.buffer_bytes[mesh_idx].get(uuid, 0)
+                    for uuid in input_args)
 
                 # create and run concat executable
-                exec_uuid = next_mesh_executable_uuid()
                 spec = to_concate_specs[mesh_idx][src_var]
-                hlo = compile_concatenate(physical_mesh.shape, spec,
-                                          self.num_batch, batch_dim,
-                                          src_var.aval)
-                exec_config = ConcatWorkerExecutableConfig(exec_uuid, hlo)
+                aval = src_var.aval
+
+                def create_concat_config(exec_uuid,
+                                         mesh_shape=physical_mesh.shape,
+                                         spec=spec,
+                                         aval=aval):
+                    hlo = compile_concatenate(mesh_shape, spec, self.num_batch,
+                                              batch_dim, aval)
+                    return ConcatWorkerExecutableConfig(exec_uuid, hlo)
+
+                exec_config = self._get_util_exec_config(
+                    mesh_idx, ("concat", spec, self.num_batch, batch_dim,
+                               aval.shape, aval.dtype), create_concat_config,
+                    executable_config_lists)
+                exec_uuid = exec_config.exec_uuid
                 kwargs = {
                     "sync_before": False,
                     "sync_after": False,
                 }
                 for worker in physical_mesh.workers:
-                    executable_config_lists[worker].append(exec_config)
                     instruction_lists[worker].append(
                         PipelineInstruction.run(exec_uuid, input_args,
                                                 output_uuid, kwargs))
@@ -900,13 +981,16 @@ class PipelineInstEmitter:
             for aval, spec in zip(avals, sharding_specs)
         ]
         dtypes = [aval.dtype for aval in avals]
-        exec_uuid = next_mesh_executable_uuid()
-        config = config_class(exec_uuid, sharded_shapes, dtypes)
+        config = self._get_util_exec_config(
+            mesh_idx, ("alloc", tuple(sharded_shapes), tuple(dtypes)),
+            lambda exec_uuid: config_class(exec_uuid, sharded_shapes, dtypes),
+            executable_config_lists)
 
         physical_mesh = self.mesh_group[mesh_idx]
         output_uuids = self._get_next_uuids(len(variables))
+        self._record_buffer_bytes(mesh_idx, output_uuids, avals,
+                                  sharding_specs)
         for worker in physical_mesh.workers:
-            executable_config_lists[worker].append(config)
             in_uuids = []
             out_uuids = output_uuids
             instruction_lists[worker].append(
@@ -1083,6 +1167,38 @@ class PipelineInstEmitter:
                 PipelineInstruction.broadcast(task_uuid, input_uuid,
                                               output_uuid, "broadcast"))
 
+    def _compile_memory_plan(self, instruction_lists, input_config,
+                             executable_uuids, executable_config_lists):
+        """Compute the memory timeline of each mesh. If
+        global_config.pipeline_memory_reorder is set, reorder the
+        instructions to lower the peak memory."""
+        # pylint: disable=import-outside-toplevel
+        from alpa.pipeline_parallel.memory_planner import plan_mesh_memory
+
+        donated_invars = {
+            exec_uuid: stage.donated_invars
+            for exec_uuid, stage in zip(executable_uuids, self.stages)
+        }
+        alloc_task_uuids = {
+            config.exec_uuid
+            for configs in executable_config_lists.values()
+            for config in configs
+            if isinstance(config, AllocateZeroWorkerExecutableConfig)
+        }
+        memory_timelines = []
+        for mesh_idx, physical_mesh in enumerate(self.mesh_group):
+            workers = physical_mesh.workers
+            new_lists, timeline = plan_mesh_memory(
+                [instruction_lists[worker] for worker in workers],
+                self.buffer_bytes[mesh_idx],
+                input_config.input_local_uuid_lists[mesh_idx], donated_invars,
+                alloc_task_uuids, global_config.pipeline_memory_reorder,
+                global_config.pipeline_memory_budget)
+            for worker, instructions in zip(workers, new_lists):
+                instruction_lists[worker] = instructions
+            memory_timelines.append(timeline)
+        return memory_timelines
+
     @staticmethod
     def _compile_free(worker, used_outside, donated, instruction_lists):
         """Compile and generate FREE PipelineInstruction to recycle memory."""
@@ -1103,7 +1219,7 @@ class PipelineInstEmitter:
                         PipelineInstruction.free(np.array(list(unused_uuids))))
             cannot_free_uuids.update(input_uuids)
             new_list.append(instruction)
-        return list(reversed(new_list))
+        return merge_adjacent_free_instructions(list(reversed(new_list)))
 
 
 class OverlapFriendlyPipelineInstEmitter(PipelineInstEmitter):
@@ -510,3 +510,172 @@ class OverlapFriendlyPipeDreamSchedule(PipeDreamFlush):
             scheds[mesh_idx] = (self.last_backward_batch_index, stage_idx)
         schedules.append(scheds)
         return schedules
+
+
+class InterleavedPipeDreamFlush(PipelineSchedule):
+    """
+    Generate an interleaved 1F1B schedule (a.k.a. virtual pipeline stages).
+
+    Each mesh holds `num_virtual_stages` non-contiguous chunks of the model:
+    forward stage i is placed on mesh i % num_mesh, and backward stage
+    2 * num_forward_stages - 1 - i is placed on the same mesh. Compared with
+    PipeDreamFlush, the pipeline bubble is cut by about num_virtual_stages
+    times, at the cost of more cross-mesh communication.
+    """
+
+    def __init__(self,
+                 *,
+                 dependency,
+                 meshes,
+                 apply_grad_placement,
+                 num_batch=1,
+                 num_virtual_stages=2):
+        self.num_virtual_stages = num_virtual_stages
+        super().__init__(dependency=dependency,
+                         meshes=meshes,
+                         apply_grad_placement=apply_grad_placement,
+                         num_batch=num_batch)
+
+    @property
+    def name(self):
+        return "interleaved_1f1b"
+
+    def _get_mesh_task_orders(self):
+        """The Megatron-LM order of tasks on each mesh.
+
+        Micro batches are processed in groups of num_mesh. In the warm-up
+        phase, a mesh runs forward tasks of all chunks so that the later
+        meshes are filled. Then it alternates one forward and one backward
+        task, and finally drains the backward tasks.
+        """
+        m = self.num_batch
+        n = self.num_mesh
+        v = self.num_virtual_stages
+        num_forward_stages = n * v
+        num_tasks = m * v
+
+        def get_task(k, mesh_idx, forward):
+            chunk = (k % (n * v)) // n
+            batch_idx = (k // (n * v)) * n + k % n
+            if not forward:
+                chunk = v - 1 - chunk
+            stage_idx = chunk * n + mesh_idx
+            if not forward:
+                stage_idx = 2 * num_forward_stages - 1 - stage_idx
+            return batch_idx, stage_idx
+
+        orders = []
+        for mesh_idx in range(n):
+            num_warmup = min((n - mesh_idx - 1) * 2 + (v - 1) * n, num_tasks)
+            order = [get_task(k, mesh_idx, True) for k in range(num_warmup)]
+            for k in range(num_tasks - num_warmup):
+                order.append(get_task(k + num_warmup, mesh_idx, True))
+                order.append(get_task(k, mesh_idx, False))
+            for k in range(num_tasks - num_warmup, num_tasks):
+                order.append(get_task(k, mesh_idx, False))
+            orders.append(order)
+        return orders
+
+    def _generate_schedule(self):
+        """
+        Assign the tasks on each mesh to clocks in the order of
+        `_get_mesh_task_orders`. A task is put in the earliest clock after
+        the tasks it depends on. E.g., with 2 meshes, 2 virtual stages and
+        4 micro batches (stages 0-3 are forward, 4-7 are backward):
+        k (i,j)   (i,j)
+        - ------- -------
+        0 (0,0)
+        1 (1,0)   (0,1)
+        2 (0,2)   (1,1)
+        3 (1,2)   (0,3)
+        4 (2,0)   (0,4)
+        ...
+        """
+        m = self.num_batch
+        n = self.num_mesh
+        assert m % n == 0, (
+            f"The number of micro batches ({m}) must be a multiple of the "
+            f"number of meshes ({n}) in the interleaved 1F1B schedule.")
+        num_compute_stages = 2 * n * self.num_virtual_stages
+        assert self.num_stage >= num_compute_stages, (
+            "The number of stages does not match num_virtual_stages.")
+
+        orders = self._get_mesh_task_orders()
+        next_task = [0] * n
+        finish_clock = {}
+        schedules = []
+        while any(next_task[i] < len(orders[i]) for i in range(n)):
+            clock = len(schedules)
+            scheds = [None] * n
+            for mesh_idx in range(n):
+                if next_task[mesh_idx] == len(orders[mesh_idx]):
+                    continue
+                batch_idx, stage_idx = orders[mesh_idx][next_task[mesh_idx]]
+                deps = np.nonzero(
+                    self.dependency[stage_idx, :num_compute_stages])[0]
+                if all(
+                        finish_clock.get((batch_idx, dep), clock) < clock
+                        for dep in deps):
+                    scheds[mesh_idx] = (batch_idx, stage_idx)
+            if all(task is None for task in scheds):
+                raise RuntimeError("Deadlock in the interleaved 1F1B schedule.")
+            for mesh_idx, task in enumerate(scheds):
+                if task is not None:
+                    finish_clock[task] = clock
+                    next_task[mesh_idx] += 1
+            schedules.append(scheds)
+
+        # append apply_grad schedules
+        scheds = [None] * n
+        for stage_idx, mesh_idx in self.apply_grad_placement.items():
+            scheds[mesh_idx] = (self.last_backward_batch_index, stage_idx)
+        schedules.append(scheds)
+        return schedules
+
+    @property
+    def first_backward_batch_index(self):
+        """Return the index of the first microbatch at backward pass."""
+        return 0
+
+    @property
+    def last_backward_batch_index(self):
+        """Return the index of the last microbatch at backward pass."""
+        return self.num_batch - 1
+
+    def previous_backward_batch_index(self, batch_idx):
+        """Return the index of the previous microbatch at backward pass."""
+        assert batch_idx > 0
+        return batch_idx - 1
+
+
+def create_pipeline_schedule(name,
+                             *,
+                             dependency,
+                             meshes,
+                             apply_grad_placement,
+                             num_batch,
+                             num_virtual_stages=1):
+    """Create a pipeline schedule by its name."""
+    if name == "interleaved_1f1b":
+        return InterleavedPipeDreamFlush(
+            dependency=dependency,
+            meshes=meshes,
+            apply_grad_placement=apply_grad_placement,
+            num_batch=num_batch,
+            num_virtual_stages=num_virtual_stages)
+    assert num_virtual_stages == 1, (
+        f"The schedule {name} does not support virtual stages.")
+    if name == "gpipe":
+        schedule_cls = GpipeSchedule
+    elif name == "1f1b":
+        schedule_cls = PipeDreamFlush
+    elif name == "inference":
+        schedule_cls = InferenceSchedule
+    elif name == "1f1b_overlap_friendly":
+        schedule_cls = OverlapFriendlyPipeDreamSchedule
+    else:
+        raise ValueError(f"Invalid schedule: {name}")
+    return schedule_cls(dependency=dependency,
+                        meshes=meshes,
+                        apply_grad_placement=apply_grad_placement,
+                        num_batch=num_batch)
@@ -12,8 +12,11 @@ import numpy as np
 
 from alpa.device_mesh import VirtualPhysicalMesh
 from alpa.global_env import global_config
+from alpa.mesh_profiling import ProfilingResultDatabase
 from alpa.pipeline_parallel.computation import (
     JaxPipelineComputation, merge_marked_jaxprs_with_named_call)
+from alpa.pipeline_parallel.pipeline_simulator import (
+    StageConstructionSimulator, get_layer_boundary_bytes)
 from alpa.pipeline_parallel.stage_profiling import (get_compute_cost,
                                                     last_compute_cost_file_name)
 from alpa.shard_parallel.auto_sharding import AutoShardingOption
@@ -51,6 +54,28 @@ class AutoStageOption:
     profiling_database_filename: Optional[str] = None
     # The file name of the cached compute cost.
     cached_profile_result: Optional[str] = None
+    # The directory of the persistent profile store. Stage profiling results
+    # are keyed by the canonical fingerprints of stages and reused across
+    # runs and models. See alpa/pipeline_parallel/profile_store.py.
+    profile_store_dir: Optional[str] = None
+    # If not None, use a learned cost model to prune profiling in the
+    # "composition" mode. For each submesh, all configs of a few seed layer
+    # ranges are profiled. For the other layer ranges, only the top-k configs
+    # ranked by the predicted cost are profiled and the others are estimated.
+    cost_predictor_top_k: Optional[int] = None
+    # The number of seed layer ranges per submesh of the cost model.
+    cost_predictor_num_seed_ranges: int = 4
+    # Whether to save the features and profiled costs of the candidates to
+    # stage-cost-samples-*.pkl in the "composition" mode. The samples are
+    # used to evaluate the cost model with
+    # benchmark/alpa/benchmark_stage_cost_predictor.py.
+    dump_cost_predictor_samples: bool = False
+    # How to score the candidate solutions of the training DP.
+    # Possible choices: {"formula", "simulator"}.
+    # "formula" uses sum(stage costs) + (B - 1) * max(stage costs).
+    # "simulator" replays the pipeline schedule with resharding costs.
+    # See alpa/pipeline_parallel/pipeline_simulator.py.
+    stage_plan_scorer: str = "formula"
 
 
 @dataclass
@@ -58,7 +83,9 @@ class ManualStageOption:
     """Options of manual stage assignment."""
     # Layer IDs of each forward stage.
     forward_stage_layer_ids: Sequence[Sequence[int]]
-    # The physical shapes of submeshes of each stage.
+    # The physical shapes of submeshes of each stage. With virtual stages
+    # (the interleaved 1F1B schedule), the shapes and options below are
+    # given for each mesh instead.
     submesh_physical_shapes: Sequence[Sequence[int]]
     # The logical shapes of submeshes of each stage.
     submesh_logical_shapes: Sequence[Sequence[int]]
@@ -298,9 +325,18 @@ def training_dp_impl(num_layers, num_devices, num_microbatches, submesh_choices,
     return total_cost, res
 
 
-def training_dp(num_layers, num_devices, num_microbatches, submesh_choices,
-                num_autosharding_configs, compute_cost, max_n_succ_stages):
-    """Auto stage dynamic programming."""
+def training_dp(num_layers,
+                num_devices,
+                num_microbatches,
+                submesh_choices,
+                num_autosharding_configs,
+                compute_cost,
+                max_n_succ_stages,
+                score_func=None):
+    """Auto stage dynamic programming.
+
+    If score_func is not None, it maps a solution to its cost and replaces
+    the cost given by the DP."""
     timers("stage-construction-dp").start()
 
     all_possible_stage_costs = np.sort(np.unique(compute_cost))
@@ -321,6 +357,8 @@ def training_dp(num_layers, num_devices, num_microbatches, submesh_choices,
                                           num_autosharding_configs,
                                           compute_cost, max_n_succ_stages,
                                           max_stage_cost)
+        if score_func is not None and solution is not None:
+            cost = score_func(solution)
         if cost < best_cost:
             best_cost = cost
             best_solution = solution
@@ -330,6 +368,192 @@ def training_dp(num_layers, num_devices, num_microbatches, submesh_choices,
     return best_cost, best_solution
 
 
+@maybe_numba_jit
+def training_dp_incremental_impl(num_layers, num_devices, num_microbatches,
+                                 submesh_sizes, num_autosharding_configs,
+                                 compute_cost, max_n_succ_stages,
+                                 all_possible_stage_costs, sorted_tuple_idxs,
+                                 sorted_tuple_costs):
+    """
+    The core implementation of the incremental DP algorithm.
+
+    The DP tables are kept across the sweep of max_stage_cost. When the
+    threshold grows, only the (layer range, submesh, config) tuples whose
+    cost falls under the new threshold are admitted, and only the cells
+    (s, l, d) that can read one of these tuples or a cell changed in the
+    previous stage count are recomputed. Each recomputed cell scans its
+    candidates in the same order as `training_dp_impl`, so the result is
+    bit-identical to the non-incremental version.
+    """
+    # pylint: disable=too-many-nested-blocks
+    num_submesh_choices = len(submesh_sizes)
+    f = np.full((num_layers + 1, num_layers + 1, num_devices + 1),
+                np.inf,
+                dtype=np.float32)
+    f_stage_max = np.full((num_layers + 1, num_layers + 1, num_devices + 1),
+                          0.0,
+                          dtype=np.float32)
+    f_argmin = np.full((num_layers + 1, num_layers + 1, num_devices + 1, 3),
+                       -1,
+                       dtype=np.int32)
+    f[0, num_layers, 0] = 0
+    # admitted[i, k, m, n]: whether compute_cost[i, k, m, n] is under the
+    # current max_stage_cost.
+    admitted = np.zeros(
+        (num_layers, num_layers, num_submesh_choices, num_autosharding_configs),
+        dtype=np.bool_)
+    # Number of admitted configs for a (layer range, submesh) pair.
+    num_admitted = np.zeros((num_layers, num_layers, num_submesh_choices),
+                            dtype=np.int32)
+    # Per stage-count worklists of dirty cells, encoded as l * (D + 1) + d.
+    num_cells = (num_layers + 1) * (num_devices + 1)
+    is_dirty = np.zeros((num_layers + 1, num_layers + 1, num_devices + 1),
+                        dtype=np.bool_)
+    dirty_cells = np.empty((num_layers + 1, num_cells), dtype=np.int64)
+    num_dirty = np.zeros(num_layers + 1, dtype=np.int64)
+
+    best_cost = np.inf
+    best_solution = None
+    last_max_stage_cost = 0.0
+    gap = 1e-6
+    next_tuple = 0
+    for max_stage_cost in all_possible_stage_costs:
+        if max_stage_cost * num_microbatches >= best_cost:
+            break
+        if max_stage_cost - last_max_stage_cost < gap:
+            continue
+
+        # Admit the new tuples and mark the cells that can use them.
+        while (next_tuple < len(sorted_tuple_costs) and
+               sorted_tuple_costs[next_tuple] <= max_stage_cost):
+            i = sorted_tuple_idxs[next_tuple, 0]
+            k = sorted_tuple_idxs[next_tuple, 1]
+            m = sorted_tuple_idxs[next_tuple, 2]
+            n_config = sorted_tuple_idxs[next_tuple, 3]
+            next_tuple += 1
+            admitted[i, k, m, n_config] = True
+            num_admitted[i, k, m] += 1
+            max_s = min(num_layers, max_n_succ_stages[i, k, m, n_config] + 1)
+            for s in range(1, max_s + 1):
+                for j in range(submesh_sizes[m], num_devices + 1):
+                    if not is_dirty[s, i, j]:
+                        is_dirty[s, i, j] = True
+                        dirty_cells[s, num_dirty[s]] = i * (num_devices + 1) + j
+                        num_dirty[s] += 1
+
+        for s in range(1, num_layers + 1):
+            for idx in range(num_dirty[s]):
+                i = dirty_cells[s, idx] // (num_devices + 1)
+                j = dirty_cells[s, idx] % (num_devices + 1)
+                is_dirty[s, i, j] = False
+                old_cost = f[s, i, j]
+                old_stage_max = f_stage_max[s, i, j]
+                f[s, i, j] = np.inf
+                f_stage_max[s, i, j] = 0.0
+                f_argmin[s, i, j] = (-1, -1, -1)
+                for k in range(num_layers, i, -1):
+                    for m in range(num_submesh_choices):
+                        n_submesh_devices = submesh_sizes[m]
+                        if n_submesh_devices <= j:
+                            for n_config in range(num_autosharding_configs):
+                                if (admitted[i, k - 1, m, n_config] and
+                                        s - 1 <= max_n_succ_stages[i, k - 1, m,
+                                                                   n_config]):
+                                    stage_cost = compute_cost[i, k - 1, m,
+                                                              n_config]
+                                    new_cost = f[s - 1, k, j -
+                                                 n_submesh_devices] + stage_cost
+                                    if new_cost < f[s, i, j]:
+                                        f[s, i, j] = new_cost
+                                        f_stage_max[s, i, j] = max(
+                                            f_stage_max[s - 1, k,
+                                                        j - n_submesh_devices],
+                                            stage_cost)
+                                        f_argmin[s, i, j] = (k, m, n_config)
+                if (s == num_layers or (f[s, i, j] == old_cost and
+                                        f_stage_max[s, i, j] == old_stage_max)):
+                    continue
+                # Propagate the change to the cells that read this one.
+                for prev_i in range(i):
+                    for m in range(num_submesh_choices):
+                        next_j = j + submesh_sizes[m]
+                        if (next_j <= num_devices and
+                                num_admitted[prev_i, i - 1, m] > 0 and
+                                not is_dirty[s + 1, prev_i, next_j]):
+                            is_dirty[s + 1, prev_i, next_j] = True
+                            dirty_cells[s + 1, num_dirty[s + 1]] = (
+                                prev_i * (num_devices + 1) + next_j)
+                            num_dirty[s + 1] += 1
+            num_dirty[s] = 0
+        last_max_stage_cost = max_stage_cost
+
+        best_s = -1
+        best_total_cost = np.inf
+        for s in range(1, num_layers + 1):
+            if f[s, 0, num_devices] < best_total_cost:
+                best_s = s
+                best_total_cost = f[s, 0, num_devices]
+        if np.isinf(best_total_cost):
+            continue
+        total_cost = f[best_s, 0, num_devices] + (
+            num_microbatches - 1) * f_stage_max[best_s, 0, num_devices]
+        if total_cost < best_cost:
+            best_cost = total_cost
+            # Backtrack now because later sweeps overwrite f_argmin.
+            current_s = best_s
+            current_layer = 0
+            current_devices = num_devices
+            res = []
+            while (current_s > 0 and current_layer < num_layers and
+                   current_devices > 0):
+                next_start_layer, submesh_choice, autosharding_choice = (
+                    f_argmin[current_s, current_layer, current_devices])
+                assert next_start_layer != -1 and current_devices != -1
+                res.append(((current_layer, next_start_layer), submesh_choice,
+                            autosharding_choice))
+                current_s -= 1
+                current_layer = next_start_layer
+                current_devices -= submesh_sizes[submesh_choice]
+            assert (current_s == 0 and current_layer == num_layers and
+                    current_devices == 0)
+            best_solution = res
+
+    return best_cost, best_solution
+
+
+def training_dp_incremental(num_layers, num_devices, num_microbatches,
+                            submesh_choices, num_autosharding_configs,
+                            compute_cost, max_n_succ_stages):
+    """Auto stage dynamic programming that reuses the DP tables across the
+    sweep of max_stage_cost. Returns the same solution as `training_dp`."""
+    timers("stage-construction-dp").start()
+
+    all_possible_stage_costs = np.sort(np.unique(compute_cost))
+    assert len(
+        all_possible_stage_costs), "no solution in auto stage construction."
+    submesh_sizes = np.array([np.prod(submesh) for submesh in submesh_choices],
+                             dtype=np.int64)
+    # All (start layer, end layer, submesh, config) tuples sorted by cost.
+    tuple_idxs = np.argwhere(
+        np.broadcast_to(
+            np.triu(np.ones((num_layers, num_layers), dtype=bool))[:, :, None,
+                                                                   None],
+            compute_cost.shape))
+    tuple_costs = compute_cost[tuple(tuple_idxs.T)]
+    order = np.argsort(tuple_costs, kind="stable")
+    sorted_tuple_idxs = np.ascontiguousarray(tuple_idxs[order], dtype=np.int64)
+    sorted_tuple_costs = np.ascontiguousarray(tuple_costs[order])
+
+    best_cost, best_solution = training_dp_incremental_impl(
+        num_layers, num_devices, num_microbatches, submesh_sizes,
+        num_autosharding_configs, compute_cost,
+        np.asarray(max_n_succ_stages, dtype=np.int64), all_possible_stage_costs,
+        sorted_tuple_idxs, sorted_tuple_costs)
+
+    timers("stage-construction-dp").stop()
+    return best_cost, best_solution
+
+
 @maybe_numba_jit
 def inference_dp_impl(num_layers, num_devices, submesh_choices,
                       num_autosharding_configs, compute_cost):
@@ -565,7 +789,8 @@ def cluster_layers_and_slice_mesh(
         num_micro_batches: int, batch_size: int,
         jax_apply_layers: Sequence[JaxPipelineComputation],
         apply_grad_global_info: Tuple, pipeline_schedule: str,
-        default_as_option: AutoShardingOption, stage_option: StageOption):
+        default_as_option: AutoShardingOption, stage_option: StageOption,
+        num_virtual_stages: int = 1):
     """
     Stage-mesh assignment.
 
@@ -587,6 +812,10 @@ def cluster_layers_and_slice_mesh(
         pipeline_schedule: The pipeline schedule.
         default_as_option: The default auto-sharding option.
         stage_option: The options controling how to construct stages.
+        num_virtual_stages: The number of forward stages on each mesh. If it is
+          larger than 1, forward stage i is placed on mesh
+          i % (num_forward_stages // num_virtual_stages), and the mesh shapes
+          in a ManualStageOption are given per mesh instead of per stage.
     """
     timers("stage-construction").start()
 
@@ -603,6 +832,11 @@ def cluster_layers_and_slice_mesh(
         assert len(layers) % 2 == 0
         num_layers = len(layers) // 2
 
+    if num_virtual_stages > 1 and isinstance(stage_option, AutoStageOption):
+        raise NotImplementedError(
+            "Auto stage construction with virtual stages is not supported yet. "
+            "Please use ManualStageOption or UniformStageOption.")
+
     if isinstance(stage_option, AutoStageOption):
         if given_mesh:
             # TODO(zhuohan): Implement the auto slicing with given mesh.
@@ -629,11 +863,32 @@ def cluster_layers_and_slice_mesh(
             _, solution = inference_dp(num_layers, virtual_mesh.num_devices,
                                        submesh_choices,
                                        num_autosharding_configs, compute_cost)
-        else:
+        elif stage_option.stage_plan_scorer == "simulator":
+            prof_result = None
+            if stage_option.profiling_database_filename:
+                prof_database = ProfilingResultDatabase()
+                prof_database.load(stage_option.profiling_database_filename)
+                prof_result = prof_database.query(
+                    "default", (1, virtual_mesh.num_devices_per_host))
+            simulator = StageConstructionSimulator(
+                compute_cost, num_micro_batches, pipeline_schedule,
+                get_layer_boundary_bytes(layers, num_layers), prof_result)
             _, solution = training_dp(num_layers, virtual_mesh.num_devices,
                                       num_micro_batches, submesh_choices,
                                       num_autosharding_configs, compute_cost,
-                                      max_n_succ_stages)
+                                      max_n_succ_stages, simulator)
+            if solution is not None:
+                result = simulator.simulate(solution)
+                print(f"Simulated step time: {result.step_time:.4f} s, "
+                      f"bubble fraction: {result.bubble_fraction:.3f}")
+        elif stage_option.stage_plan_scorer == "formula":
+            _, solution = training_dp_incremental(
+                num_layers, virtual_mesh.num_devices, num_micro_batches,
+                submesh_choices, num_autosharding_configs, compute_cost,
+                max_n_succ_stages)
+        else:
+            raise ValueError(f"Invalid stage plan scorer: "
+                             f"{stage_option.stage_plan_scorer}")
 
         assert solution is not None, "no solution in auto stage construction."
 
@@ -683,8 +938,11 @@ def cluster_layers_and_slice_mesh(
         autosharding_option_dicts = (
             stage_option.submesh_autosharding_option_dicts)
     elif isinstance(stage_option, UniformStageOption):
+        assert num_layers % num_virtual_stages == 0, (
+            f"{num_layers} layers cannot be evenly placed as "
+            f"{num_virtual_stages} virtual stages on each mesh")
         if given_mesh:
-            num_stages = num_layers
+            num_stages = num_layers // num_virtual_stages
             submesh_shapes = [
                 x.shape
                 for x in virtual_mesh.launched_physical_mesh_group.meshes
@@ -692,7 +950,7 @@ def cluster_layers_and_slice_mesh(
             logical_mesh_shapes = submesh_shapes
         else:
             num_devices = virtual_mesh.num_devices
-            num_stages = num_layers
+            num_stages = num_layers // num_virtual_stages
 
             assert num_devices >= num_stages, "No enough devices"
             assert num_devices % num_stages == 0
@@ -725,17 +983,22 @@ def cluster_layers_and_slice_mesh(
                                                      submesh_shapes)
 
     num_forward_stages = len(forward_stage_layer_ids)
+    num_meshes = len(sliced_meshes)
+    assert num_forward_stages == num_meshes * num_virtual_stages, (
+        f"{num_forward_stages} forward stages cannot be placed as "
+        f"{num_virtual_stages} virtual stages on each of {num_meshes} meshes")
+    forward_stage_to_mesh = [i % num_meshes for i in range(num_forward_stages)]
 
     if inference_mode:
         stage_layer_ids = forward_stage_layer_ids
-        stage_to_mesh = list(range(num_forward_stages))
+        stage_to_mesh = forward_stage_to_mesh
     else:
         backward_stage_layer_ids = [[
             2 * num_layers - 1 - i for i in reversed(layer_ids)
         ] for layer_ids in reversed(forward_stage_layer_ids)]
         stage_layer_ids = forward_stage_layer_ids + backward_stage_layer_ids
-        stage_to_mesh = list(range(num_forward_stages)) + list(
-            reversed(range(num_forward_stages)))
+        stage_to_mesh = forward_stage_to_mesh + list(
+            reversed(forward_stage_to_mesh))
 
     stage_outvars = get_stage_outvars(layers, stage_layer_ids, acc_grad_outvars)
     merged_stages = []
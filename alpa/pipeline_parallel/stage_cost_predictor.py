@@ -0,0 +1,219 @@
+"""A learned cost model to prune stage profiling.
+
+Profiling all (layer range, submesh, auto-sharding config) candidates
+dominates the time of auto stage construction. For each submesh, the
+predictor first profiles all configs of a few seed layer ranges. It then
+fits one linear model per (submesh, config) over features that are known
+before compilation: the flops of the layer range, the bytes of its inputs
+and outputs, the bytes of its gradients and, if a profiling database is
+given, the estimated all-reduce time of the gradients. For the other layer
+ranges, only the top-k configs ranked by the predicted cost are compiled and
+profiled. The costs of the others are filled in with predictions and
+flagged as estimated.
+"""
+from collections import defaultdict
+import logging
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# The index of a candidate: (start_layer, end_layer, submesh_id, config_idx)
+StageIndex = Tuple[int, int, int, int]
+
+
+def _aval_bytes(aval):
+    return np.prod(aval.shape, dtype=np.float64) * aval.dtype.itemsize
+
+
+def get_stage_features(stage_config, flops: float, num_devices: int,
+                       prof_result=None):
+    """Get the features of a stage candidate.
+
+    Returns (flops, input/output bytes, gradient bytes, all-reduce time of
+    the gradients). The all-reduce time is 0 without a profiling result."""
+    io_bytes = 0.0
+    grad_bytes = 0.0
+    for config in stage_config.module_profile_configs:
+        io_bytes += sum(_aval_bytes(x) for x in config.invar_avals)
+        io_bytes += sum(_aval_bytes(x) for x in config.outvar_avals)
+        grad_bytes += sum(
+            _aval_bytes(config.invar_avals[i])
+            for i in config.acc_grad_invars_indices)
+
+    all_reduce_time = 0.0
+    if prof_result is not None and grad_bytes > 0:
+        group = (tuple(range(num_devices)),)
+        try:
+            all_reduce_time = prof_result.estimate_all_reduce(
+                group, grad_bytes / 4, "float32")
+        except (AssertionError, IndexError):
+            pass
+    return np.array([flops, io_bytes, grad_bytes, all_reduce_time],
+                    dtype=np.float64)
+
+
+class StageCostPredictor:
+    """Predict the compute costs of stage candidates from profiled ones.
+
+    Args:
+        top_k: The number of configs to profile for each layer range and
+          submesh after the seed ranges.
+        num_seed_ranges: The number of layer ranges per submesh whose configs
+          are all profiled.
+    """
+
+    def __init__(self, top_k: int, num_seed_ranges: int):
+        assert top_k >= 1 and num_seed_ranges >= 1
+        self.top_k = top_k
+        self.num_seed_ranges = num_seed_ranges
+
+        self.features: Dict[StageIndex, np.ndarray] = {}
+        self.costs: Dict[StageIndex, float] = {}
+        self.models = {}
+
+    def add_candidate(self, index: StageIndex, features: np.ndarray):
+        self.features[index] = features
+
+    def add_result(self, index: StageIndex, cost: float):
+        """Record the profiled cost of a candidate. Failed candidates have an
+        infinite cost."""
+        self.costs[index] = cost
+        self.models.pop(index[2:], None)
+
+    @staticmethod
+    def _group_by_range(indices: Sequence[StageIndex]):
+        ranges = defaultdict(list)
+        for index in indices:
+            ranges[index[:2]].append(index)
+        return ranges
+
+    def select_seed_candidates(self, indices: Sequence[StageIndex]):
+        """Select all candidates of the seed layer ranges, which are evenly
+        spaced in the flops order."""
+        ranges = self._group_by_range(indices)
+        keys = sorted(ranges, key=lambda r: self.features[ranges[r][0]][0])
+        num_seeds = min(self.num_seed_ranges, len(keys))
+        seed_positions = np.unique(
+            np.round(np.linspace(0, len(keys) - 1, num_seeds)).astype(int))
+        return [x for i in seed_positions for x in ranges[keys[i]]]
+
+    def select_top_k_candidates(self, indices: Sequence[StageIndex]):
+        """Select the top-k candidates of each layer range by the predicted
+        cost."""
+        selected = []
+        for candidates in self._group_by_range(indices).values():
+            predicted = [self.predict(index) for index in candidates]
+            order = np.argsort(predicted, kind="stable")
+            selected.extend(candidates[i]
+                            for i in order[:self.top_k]
+                            if np.isfinite(predicted[i]))
+        return selected
+
+    def _fit(self, group: Tuple[int, int]):
+        """Fit the model of a (submesh, config) pair."""
+        xs, ys = [], []
+        for index, cost in self.costs.items():
+            if index[2:] == group:
+                xs.append(self.features[index])
+                ys.append(cost)
+        xs, ys = np.array(xs), np.array(ys)
+
+        if len(ys) == 0 or not np.any(np.isfinite(ys)):
+            # Compilation or profiling always fails with this config
+            return None
+        finite = np.isfinite(ys)
+        xs, ys = xs[finite], ys[finite]
+
+        # Use the full model only with enough samples. Otherwise, only use
+        # flops.
+        if len(ys) <= xs.shape[1] + 1:
+            xs = xs[:, :1]
+        scale = np.maximum(np.abs(xs).max(axis=0), 1e-12)
+        a = np.concatenate([xs / scale, np.ones((len(ys), 1))], axis=1)
+        # A small ridge term keeps under-determined fits stable
+        reg = 1e-3 * np.eye(a.shape[1])
+        reg[-1, -1] = 0
+        coef = np.linalg.solve(a.T @ a + reg, a.T @ ys)
+        return coef, scale, float(ys.min())
+
+    def predict(self, index: StageIndex) -> float:
+        """Predict the compute cost of a candidate."""
+        if index in self.costs:
+            return self.costs[index]
+        group = index[2:]
+        if group not in self.models:
+            self.models[group] = self._fit(group)
+        model = self.models[group]
+        if model is None:
+            return np.inf
+        coef, scale, min_cost = model
+        x = self.features[index][:len(scale)] / scale
+        ret = float(x @ coef[:-1] + coef[-1])
+        # Costs are positive. Clamp bad extrapolations with a fraction of the
+        # smallest observed cost.
+        return max(ret, min_cost * 0.1)
+
+    def estimated_indices(self):
+        return [index for index in self.features if index not in self.costs]
+
+
+def evaluate_predictor(samples: Dict[StageIndex, Tuple[np.ndarray, float]],
+                       top_k: int,
+                       num_seed_ranges: int,
+                       submesh_ids: Optional[Sequence[int]] = None):
+    """Replay the pruned profiling on fully profiled candidates.
+
+    Args:
+        samples: A dict mapping stage indices to (features, profiled cost).
+        top_k, num_seed_ranges: The options of the predictor.
+        submesh_ids: The submeshes to evaluate. Use all if None.
+
+    Returns:
+        A dict with the fraction of profiled candidates, the mean absolute
+        percentage error of the estimated costs, and the fraction of layer
+        ranges whose best config is profiled.
+    """
+    predictor = StageCostPredictor(top_k, num_seed_ranges)
+    for index, (features, _) in samples.items():
+        predictor.add_candidate(index, features)
+
+    if submesh_ids is None:
+        submesh_ids = sorted({index[2] for index in samples})
+    for submesh_id in submesh_ids:
+        indices = [index for index in samples if index[2] == submesh_id]
+        seeds = predictor.select_seed_candidates(indices)
+        for index in seeds:
+            predictor.add_result(index, samples[index][1])
+        seeds = set(seeds)
+        rest = [index for index in indices if index not in seeds]
+        for index in predictor.select_top_k_candidates(rest):
+            predictor.add_result(index, samples[index][1])
+
+    errors = []
+    for index in predictor.estimated_indices():
+        actual = samples[index][1]
+        if np.isfinite(actual) and actual > 0:
+            errors.append(abs(predictor.predict(index) - actual) / actual)
+
+    num_ranges = 0
+    num_best_profiled = 0
+    for (start, end), candidates in StageCostPredictor._group_by_range(
+            list(samples)).items():
+        for submesh_id in submesh_ids:
+            group = [x for x in candidates if x[2] == submesh_id]
+            if not group:
+                continue
+            best = min(group, key=lambda x: samples[x][1])
+            if not np.isfinite(samples[best][1]):
+                continue
+            num_ranges += 1
+            num_best_profiled += best in predictor.costs
+
+    return {
+        "profiled_fraction": len(predictor.costs) / max(len(samples), 1),
+        "mape": float(np.mean(errors)) if errors else 0.0,
+        "best_config_recall": num_best_profiled / max(num_ranges, 1),
+    }
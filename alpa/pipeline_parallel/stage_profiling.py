@@ -35,7 +35,11 @@ from alpa.pipeline_parallel.cross_mesh_resharding import (
     CrossMeshCommunicator, SymbolicReshardingTask, CollectiveGroup,
     ReshardingTaskSpec, SymbolicBroadcastReshardingTask)
 from alpa.pipeline_parallel.layer_stats import eqn_flops
+from alpa.pipeline_parallel.profile_store import (ProfileStore,
+                                                  get_stage_fingerprint)
 from alpa.pipeline_parallel.resharding_tensor import VirtualDistributedArray
+from alpa.pipeline_parallel.stage_cost_predictor import (StageCostPredictor,
+                                                         get_stage_features)
 from alpa.shard_parallel.auto_sharding import (AutoShardingOption,
                                                LogicalDeviceMesh,
                                                run_auto_sharding_pass,
@@ -51,6 +55,8 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 last_compute_cost_file_name = None
+# The candidates whose compute costs are estimated by the cost predictor
+last_estimated_stage_indices = []
 
 INFINITY_N_STAGES = 2**20
 GB = 1024**3
@@ -77,7 +83,8 @@ ApplyGradConfig = namedtuple("ApplyGradConfig",
                              ["invars", "apply_grad_only_invars"])
 
 StageConfig = namedtuple("StageConfig", [
-    "n_modules", "compile_config", "module_profile_configs", "apply_grad_config"
+    "n_modules", "compile_config", "module_profile_configs",
+    "apply_grad_config", "fingerprint"
 ])
 
 
@@ -1152,6 +1159,116 @@ def check_profile_results_consistent(stages,
                     module_profile_config.required_outvars_indices)
 
 
+def load_from_profile_store(stages, store: ProfileStore, submesh,
+                            num_micro_batches, default_as_option,
+                            auto_stage_option, profile_results):
+    """Load the results of the stages that are not fully profiled from the
+    profile store. Return the keys of all stages."""
+    keys = {}
+    num_loaded = 0
+    for stage_idx, stage_config, auto_sharding_config in stages:
+        logical_mesh, autosharding_option_dict = auto_sharding_config
+        as_option = dataclasses.replace(default_as_option,
+                                        **autosharding_option_dict)
+        keys[stage_idx] = store.compute_key(
+            stage_config, submesh, logical_mesh, as_option, num_micro_batches,
+            auto_stage_option.use_hlo_cost_model)
+        if (stage_idx in profile_results and
+                profile_results[stage_idx].fully_profiled()):
+            continue
+        stored_result = store.lookup(keys[stage_idx], stage_config)
+        if stored_result is None:
+            continue
+        if stage_idx in profile_results:
+            for module_idx, module_result in enumerate(
+                    profile_results[stage_idx].module_profile_results):
+                if module_result is not None:
+                    stored_result.add_module_profile_result(
+                        module_idx, module_result)
+        profile_results[stage_idx] = stored_result
+        num_loaded += 1
+    print(f"- Load {num_loaded} stages from the profile store")
+    return keys
+
+
+def save_to_profile_store(stages, store: ProfileStore, keys, profile_results):
+    for stage_idx, stage_config, _ in stages:
+        if stage_idx in profile_results:
+            store.insert(keys[stage_idx], stage_config,
+                         profile_results[stage_idx])
+
+
+def _get_stage_flops(layer_flops_prefix_sum, start, end, inference_mode):
+    """The flops of forward layers start...end and their backward layers."""
+    if inference_mode:
+        return layer_flops_prefix_sum[end + 1] - layer_flops_prefix_sum[start]
+    num_layers = (len(layer_flops_prefix_sum) - 1) // 2
+    return (layer_flops_prefix_sum[end + 1] - layer_flops_prefix_sum[start] +
+            layer_flops_prefix_sum[2 * num_layers - start] -
+            layer_flops_prefix_sum[2 * num_layers - end - 1])
+
+
+def _get_profiled_cost(profile_results, stage_idx):
+    if (stage_idx not in profile_results or
+            not profile_results[stage_idx].fully_profiled()):
+        return np.inf
+    return sum(result.compute_cost
+               for result in profile_results[stage_idx].module_profile_results)
+
+
+def profile_with_cost_predictor(stages, predictor: StageCostPredictor, meshes,
+                                num_micro_batches, default_as_option,
+                                auto_stage_option, profile_results):
+    """Profile the seed candidates and then the top-k candidates ranked by
+    the cost predictor."""
+    stage_dict = {stage[0]: stage for stage in stages}
+    indices = list(stage_dict)
+    for stage_idx in indices:
+        if stage_idx in profile_results:
+            predictor.add_result(
+                stage_idx, _get_profiled_cost(profile_results, stage_idx))
+
+    for step in ["seed", "top-k"]:
+        if step == "seed":
+            selected = predictor.select_seed_candidates(indices)
+        else:
+            rest = [x for x in indices if x not in predictor.costs]
+            selected = predictor.select_top_k_candidates(rest)
+        selected = [x for x in selected if x not in profile_results]
+        print(f"- Profile {len(selected)} {step} candidates")
+        profile_results = distributed_profile_on_mesh(
+            [stage_dict[x] for x in selected], meshes, num_micro_batches,
+            default_as_option, auto_stage_option, profile_results)
+        for stage_idx in selected:
+            predictor.add_result(
+                stage_idx, _get_profiled_cost(profile_results, stage_idx))
+    return profile_results
+
+
+def fill_estimated_costs(predictor: StageCostPredictor, compute_cost,
+                         max_n_succ_stages):
+    """Fill in the predicted costs of the candidates that are not profiled.
+    Their max_n_succ_stages is the smallest one of the profiled configs of
+    the same layer range and submesh."""
+    estimated = predictor.estimated_indices()
+    for stage_idx in estimated:
+        compute_cost[stage_idx] = predictor.predict(stage_idx)
+        if max_n_succ_stages is None:
+            continue
+        start, end, mesh_id, _ = stage_idx
+        profiled = [
+            max_n_succ_stages[start, end, mesh_id, c]
+            for c in range(max_n_succ_stages.shape[-1])
+            if (start, end, mesh_id, c) in predictor.costs and
+            np.isfinite(compute_cost[start, end, mesh_id, c])
+        ]
+        if profiled:
+            max_n_succ_stages[stage_idx] = min(profiled)
+        else:
+            compute_cost[stage_idx] = np.inf
+    return estimated
+
+
 def _get_layer_flops_prefix_sum(layers):
     layer_flops_prefix_sum = [0]
     for layer in layers:
@@ -1229,6 +1346,22 @@ def get_compute_cost(
             profile_results = pickle.load(f)
     else:
         profile_results = {}
+    profile_store = None
+    if auto_stage_option.profile_store_dir is not None:
+        profile_store = ProfileStore(auto_stage_option.profile_store_dir)
+    # The features of all candidates are collected if the cost predictor is
+    # enabled or its samples are requested
+    use_predictor = auto_stage_option.cost_predictor_top_k is not None
+    predictor = None
+    if (auto_stage_option.layer_profile_mode == "composition" and
+            (use_predictor or auto_stage_option.dump_cost_predictor_samples)):
+        predictor = StageCostPredictor(
+            auto_stage_option.cost_predictor_top_k or 1,
+            auto_stage_option.cost_predictor_num_seed_ranges)
+        prof_database = None
+        if auto_stage_option.profiling_database_filename:
+            prof_database = ProfilingResultDatabase()
+            prof_database.load(auto_stage_option.profiling_database_filename)
     print("-" * 20 + " Automatic stage clustering " + "-" * 20)
     print(f"submesh_choices: {submesh_choices}")
 
@@ -1281,9 +1414,36 @@ def get_compute_cost(
 
         check_profile_results_consistent(stages, profile_results)
 
-        profile_results = distributed_profile_on_mesh(
-            stages, sliced_virtual_meshes, num_micro_batches, default_as_option,
-            auto_stage_option, profile_results)
+        if profile_store is not None:
+            profile_store_keys = load_from_profile_store(
+                stages, profile_store, submesh, num_micro_batches,
+                default_as_option, auto_stage_option, profile_results)
+
+        if predictor is not None:
+            prof_result = None
+            if prof_database is not None:
+                prof_result = prof_database.query("default", submesh)
+            for stage_idx, stage_config, _ in stages:
+                flops = _get_stage_flops(layer_flops_prefix_sum, stage_idx[0],
+                                         stage_idx[1], inference_mode)
+                predictor.add_candidate(
+                    stage_idx,
+                    get_stage_features(stage_config, flops,
+                                       sliced_virtual_meshes[0].num_devices,
+                                       prof_result))
+
+        if predictor is not None and use_predictor:
+            profile_results = profile_with_cost_predictor(
+                stages, predictor, sliced_virtual_meshes, num_micro_batches,
+                default_as_option, auto_stage_option, profile_results)
+        else:
+            profile_results = distributed_profile_on_mesh(
+                stages, sliced_virtual_meshes, num_micro_batches,
+                default_as_option, auto_stage_option, profile_results)
+
+        if profile_store is not None:
+            save_to_profile_store(stages, profile_store, profile_store_keys,
+                                  profile_results)
 
         toc = time()
         print(f"Profiling for submesh {mesh_id} {submesh} takes {toc - tic:.2f}"
@@ -1296,6 +1456,19 @@ def get_compute_cost(
     global last_compute_cost_file_name
     last_compute_cost_file_name = profile_result_file_name
     print(f"Profile result saved to: {profile_result_file_name}")
+    if (predictor is not None and
+            auto_stage_option.dump_cost_predictor_samples):
+        # Save the features and profiled costs for evaluating the predictor
+        samples = {}
+        for stage_idx, features in predictor.features.items():
+            if stage_idx in profile_results:
+                samples[stage_idx] = (features,
+                                      _get_profiled_cost(
+                                          profile_results, stage_idx))
+        samples_file_name = f"stage-cost-samples-{timestamp}.pkl"
+        with open(samples_file_name, "wb") as f:
+            pickle.dump(samples, f)
+        print(f"Stage cost samples saved to: {samples_file_name}")
     print("-" * 70)
 
     if auto_stage_option.layer_profile_mode == "composition":
@@ -1324,6 +1497,15 @@ def get_compute_cost(
         raise ValueError(f"Unknown layer profile mode: "
                          f"{auto_stage_option.layer_profile_mode}")
 
+    global last_estimated_stage_indices
+    last_estimated_stage_indices = []
+    if predictor is not None and use_predictor:
+        last_estimated_stage_indices = fill_estimated_costs(
+            predictor, compute_cost, max_n_succ_stages)
+        print(f"Estimated the compute costs of "
+              f"{len(last_estimated_stage_indices)} out of "
+              f"{len(predictor.features)} candidates")
+
     return compute_cost, max_n_succ_stages
 
 
@@ -1498,8 +1680,12 @@ def generate_stage_info(all_layers, selected_indices,
     hlo = jaxpr_to_hlo(name, all_modules_merged_jaxpr, all_modules_is_donated)
     compile_config = CompileConfig(hlo, module_names, all_modules_donate_invars,
                                    all_modules_acc_grad_outvars_indices)
+    fingerprint = get_stage_fingerprint(
+        all_modules_merged_jaxpr, n_modules, all_modules_is_donated,
+        all_modules_donate_invars, all_modules_acc_grad_outvars_indices,
+        [config.acc_grad_invars_indices for config in module_profile_configs])
     stage_config = StageConfig(n_modules, compile_config,
-                               module_profile_configs, apply_info)
+                               module_profile_configs, apply_info, fingerprint)
     return stage_config
 
 
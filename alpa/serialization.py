@@ -3,9 +3,14 @@ Serialization utilities for Alpa.
 Support DistributedArray and ReplicatedDistributedArray serialization in Alpa.
 """
 
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import json
 import logging
 import os
 import pickle
+import shutil
+import zlib
 from typing import Union
 
 from flax.serialization import to_state_dict, from_state_dict
@@ -13,13 +18,19 @@ import jax
 from jax._src.tree_util import tree_flatten, tree_leaves, tree_unflatten, PyTreeDef
 import msgpack
 import numpy as np
+import ray
 
 from alpa.device_mesh import (DistributedArray, ReplicatedDistributedArray,
                               get_global_virtual_physical_mesh)
+from alpa.global_env import global_config
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# The executor and futures of asynchronous checkpoints
+_checkpoint_executor = None
+_pending_checkpoints = []
+
 
 def _dfs_pytree(tree, prefix):
     paths = []
@@ -50,31 +61,363 @@ def _save_unsharded_array(ckpt_dir, arr):
         pickle.dump(metadata, metafile)
 
 
+def _index_to_ranges(index, shape):
+    """Convert an index of slices into a list of [start, stop) pairs."""
+    if index is None:
+        index = ()
+    ranges = []
+    for i, size in enumerate(shape):
+        idx = index[i] if i < len(index) else slice(None)
+        assert isinstance(idx, slice), f"Unsupported index: {index}"
+        start, stop, step = idx.indices(size)
+        assert step == 1, f"Unsupported index: {index}"
+        ranges.append((start, stop))
+    return tuple(ranges)
+
+
 def load_sharded_array(ckpt_dir, metadatas):
     """
-        Used by MeshHostWorker.load_tensor to first load the entire shared
-        array from disk.
+        Load the entire sharded array from disk.
+    """
+    return load_sharded_array_slices(ckpt_dir, metadatas, [None])[0]
+
+
+def _load_slices(global_shape, dtype, sources, indices):
+    """Load the slices at `indices` of an array.
+
+    Args:
+        global_shape: The shape of the array.
+        dtype: The dtype of the array.
+        sources: A dict that maps the [start, stop) ranges of a block of the
+          array to a function that reads the block.
+        indices: The indices of the requested slices.
+    """
+    # Requested slices. Identical requests share the same output array.
+    requested = [_index_to_ranges(index, global_shape) for index in indices]
+    outputs = {}
+    for ranges in requested:
+        if ranges not in outputs:
+            outputs[ranges] = np.empty([stop - start for start, stop in ranges],
+                                       dtype)
+
+    # Compute the overlapping parts between the sources and requests
+    copy_tasks = []
+    for source_ranges, read_fn in sources.items():
+        copies = []
+        for out_ranges, out in outputs.items():
+            src, dst = [], []
+            for (s_start, s_stop), (o_start, o_stop) in zip(
+                    source_ranges, out_ranges):
+                start, stop = max(s_start, o_start), min(s_stop, o_stop)
+                if start >= stop:
+                    break
+                src.append(slice(start - s_start, stop - s_start))
+                dst.append(slice(start - o_start, stop - o_start))
+            else:
+                copies.append((out, tuple(src), tuple(dst)))
+        if copies:
+            copy_tasks.append((read_fn, copies))
+
+    def copy_source(read_fn, copies):
+        data = read_fn()
+        for out, src, dst in copies:
+            out[dst] = data[src]
+
+    num_threads = min(global_config.checkpoint_load_num_threads,
+                      len(copy_tasks))
+    if num_threads <= 1:
+        for task in copy_tasks:
+            copy_source(*task)
+    else:
+        with ThreadPoolExecutor(num_threads) as executor:
+            # Consume the results to re-raise exceptions
+            list(executor.map(lambda task: copy_source(*task), copy_tasks))
+
+    return [outputs[ranges] for ranges in requested]
+
+
+def load_sharded_array_slices(ckpt_dir, metadatas, indices):
+    """
+        Used by MeshHostWorker.load_array to load the slices of a sharded
+        array at `indices` from disk.
+
+        Only the shard files that overlap with the requested slices are
+        memory-mapped, and only the overlapping parts are copied, so the
+        peak host memory is bounded by the size of the requested slices.
+        The shard files are read concurrently by a thread pool.
     """
+    global_shape, dtype, sources = _load_shard_sources(ckpt_dir, metadatas)
+    return _load_slices(global_shape, dtype, sources, indices)
+
+
+def _load_shard_sources(ckpt_dir, metadatas):
+    """Read the metadata files of a sharded array. Return its global shape,
+    dtype and a dict that maps the [start, stop) ranges of each saved shard
+    to a function that memory-maps the shard file."""
     assert len(metadatas) > 0
-    with open(os.path.join(ckpt_dir, metadatas[0]), "rb") as metafile:
-        meta = pickle.load(metafile)
-    if meta["shard_indices"] is None:
-        return np.load(os.path.join(ckpt_dir, meta["shard_names"][0]))
-    entire_array = np.empty(meta["global_shape"], meta["dtype"])
+    metas = []
     for metadata in metadatas:
         with open(os.path.join(ckpt_dir, metadata), "rb") as metafile:
-            meta = pickle.load(metafile)
-        for shard_name, shard_indice in zip(meta["shard_names"],
-                                            meta["shard_indices"]):
-            entire_array[shard_indice] = np.load(
-                os.path.join(ckpt_dir, shard_name))
-    return entire_array
+            metas.append(pickle.load(metafile))
+    global_shape = tuple(metas[0]["global_shape"])
+
+    def read_fn(shard_name):
+        return lambda: np.load(os.path.join(ckpt_dir, shard_name),
+                               mmap_mode="r")
+
+    # Saved shards. Replicated shards are only read once.
+    sources = {}
+    for meta in metas:
+        if meta["shard_indices"] is None:
+            sources[_index_to_ranges(None, global_shape)] = read_fn(
+                meta["shard_names"][0])
+            continue
+        for shard_name, shard_index in zip(meta["shard_names"],
+                                           meta["shard_indices"]):
+            ranges = _index_to_ranges(shard_index, global_shape)
+            if ranges not in sources:
+                sources[ranges] = read_fn(shard_name)
+    return global_shape, metas[0]["dtype"], sources
+
+
+##### Chunked checkpoint format #####
+# In the chunked format, an array is split into chunks of the same shape,
+# which is independent of the sharding used to load it. The shape, dtype,
+# chunk shape and compression are recorded in a single index file.
+CHUNK_INDEX_NAME = "chunk_index"
+
+
+def has_chunk_index(ckpt_dir):
+    """Whether the array in `ckpt_dir` is saved in the chunked format."""
+    return os.path.exists(os.path.join(ckpt_dir, CHUNK_INDEX_NAME))
+
+
+def choose_chunk_shape(shard_shape, dtype, max_chunk_bytes):
+    """Split a shard shape into a chunk shape that divides it and has at most
+    `max_chunk_bytes` bytes if possible."""
+    chunk_shape = list(shard_shape)
+    itemsize = np.dtype(dtype).itemsize
+    while np.prod(chunk_shape) * itemsize > max_chunk_bytes:
+        even_dims = [i for i, x in enumerate(chunk_shape) if x % 2 == 0]
+        if not even_dims:
+            break
+        dim = max(even_dims, key=lambda i: chunk_shape[i])
+        chunk_shape[dim] //= 2
+    return tuple(chunk_shape)
+
+
+def write_chunk_index(ckpt_dir, global_shape, dtype, chunk_shape,
+                      compression):
+    os.makedirs(ckpt_dir, exist_ok=True)
+    chunk_index = {
+        "global_shape": list(global_shape),
+        "dtype": np.dtype(dtype).str,
+        "chunk_shape": list(chunk_shape),
+        "compression": compression,
+    }
+    with open(os.path.join(ckpt_dir, CHUNK_INDEX_NAME), "w") as indexfile:
+        json.dump(chunk_index, indexfile)
+
+
+def _chunk_name(coords):
+    return "chunk_" + (".".join(str(x) for x in coords) or "0")
+
+
+def _chunks_in_ranges(ranges, global_shape, chunk_shape):
+    """Get the coordinates and ranges of all chunks overlapping `ranges`."""
+    coords_per_dim = [
+        range(start // size, -(-stop // size))
+        for (start, stop), size in zip(ranges, chunk_shape)
+    ]
+    for coords in itertools.product(*coords_per_dim):
+        chunk_ranges = tuple(
+            (c * size, min((c + 1) * size, dim_size))
+            for c, size, dim_size in zip(coords, chunk_shape, global_shape))
+        yield coords, chunk_ranges
+
+
+def get_chunk_files(data, index, global_shape, chunk_shape, compression):
+    """Get the files of the chunks of the slice `data` at `index` of an
+    array as a list of (name, kind, data). The slice must consist of whole
+    chunks."""
+    if compression is None:
+        kind = "raw"
+    else:
+        assert compression == "zlib", f"Invalid compression: {compression}"
+        kind = compression
+    files = []
+    ranges = _index_to_ranges(index, global_shape)
+    for coords, chunk_ranges in _chunks_in_ranges(ranges, global_shape,
+                                                  chunk_shape):
+        src = []
+        for (start, stop), (c_start, c_stop) in zip(ranges, chunk_ranges):
+            assert start <= c_start and c_stop <= stop, (
+                "The slice is not aligned with chunks")
+            src.append(slice(c_start - start, c_stop - start))
+        files.append((_chunk_name(coords), kind, data[tuple(src)]))
+    return files
+
+
+def save_chunks(save_dir, data, index, global_shape, chunk_shape,
+                compression):
+    """Save the chunks of the slice `data` at `index` of an array."""
+    os.makedirs(save_dir, exist_ok=True)
+    for name, kind, chunk in get_chunk_files(data, index, global_shape,
+                                             chunk_shape, compression):
+        write_checkpoint_file(os.path.join(save_dir, name), kind, chunk)
+
+
+def write_checkpoint_file(path, kind, data):
+    """Write a checkpoint file.
+
+    Args:
+        path: The path of the file.
+        kind: "npy" for a numpy file, "raw" or "zlib" for the (compressed)
+          bytes of an array, "pickle" for a pickled object.
+        data: The content of the file.
+    """
+    with open(path, "wb") as datafile:
+        if kind == "npy":
+            np.save(datafile, data)
+        elif kind == "raw":
+            datafile.write(np.ascontiguousarray(data).tobytes())
+        elif kind == "zlib":
+            datafile.write(
+                zlib.compress(np.ascontiguousarray(data).tobytes()))
+        elif kind == "pickle":
+            pickle.dump(data, datafile)
+        else:
+            raise ValueError(f"Invalid kind: {kind}")
+
+
+def load_chunked_array_slices(ckpt_dir, indices):
+    """
+        Used by MeshHostWorker.load_array to load the slices of an array
+        saved in the chunked format. Only the chunks overlapping with the
+        requested slices are read.
+    """
+    with open(os.path.join(ckpt_dir, CHUNK_INDEX_NAME)) as indexfile:
+        chunk_index = json.load(indexfile)
+    global_shape = tuple(chunk_index["global_shape"])
+    chunk_shape = tuple(chunk_index["chunk_shape"])
+    dtype = np.dtype(chunk_index["dtype"])
+    compression = chunk_index["compression"]
+
+    def read_fn(coords, chunk_ranges):
+
+        def read():
+            with open(os.path.join(ckpt_dir, _chunk_name(coords)),
+                      "rb") as datafile:
+                buf = datafile.read()
+            if compression == "zlib":
+                buf = zlib.decompress(buf)
+            return np.frombuffer(buf, dtype).reshape(
+                [stop - start for start, stop in chunk_ranges])
+
+        return read
+
+    sources = {}
+    for index in indices:
+        ranges = _index_to_ranges(index, global_shape)
+        for coords, chunk_ranges in _chunks_in_ranges(ranges, global_shape,
+                                                      chunk_shape):
+            if chunk_ranges not in sources:
+                sources[chunk_ranges] = read_fn(coords, chunk_ranges)
+
+    return _load_slices(global_shape, dtype, sources, indices)
+
+
+def _save_unsharded_array_chunked(ckpt_dir, arr):
+    arr = np.asarray(arr)
+    chunk_shape = choose_chunk_shape(arr.shape, arr.dtype,
+                                     global_config.checkpoint_chunk_bytes)
+    compression = global_config.checkpoint_chunk_compression
+    write_chunk_index(ckpt_dir, arr.shape, arr.dtype, chunk_shape,
+                      compression)
+    save_chunks(ckpt_dir, arr, None, arr.shape, chunk_shape, compression)
+
+
+def convert_checkpoint_to_chunked(ckpt_dir: Union[str, os.PathLike],
+                                  step: int, new_ckpt_dir: Union[str,
+                                                                 os.PathLike]):
+    """
+        Convert a checkpoint saved in the shard format into the chunked
+        format. The arrays are converted chunk by chunk, so the peak host
+        memory is bounded by the chunk size.
+
+        Args:
+            ckpt_dir: the directory of the checkpoint to convert.
+            step: step number of the checkpoint.
+            new_ckpt_dir: the directory to save the converted checkpoint.
+    """
+    metapath = os.path.join(ckpt_dir, f"checkpoint_{step}")
+    with open(metapath, "rb") as metafile:
+        metadata = msgpack.unpackb(metafile.read())
+    os.makedirs(new_ckpt_dir, exist_ok=True)
+    shutil.copy(metapath, os.path.join(new_ckpt_dir, f"checkpoint_{step}"))
+
+    compression = global_config.checkpoint_chunk_compression
+    for arr_dir in tree_leaves(metadata):
+        if not isinstance(arr_dir, str):
+            continue
+        arr_path = os.path.join(ckpt_dir, arr_dir)
+        if not os.path.isdir(arr_path):
+            continue
+        metadatas = [
+            fname for fname in os.listdir(arr_path)
+            if fname.startswith("metadata")
+        ]
+        global_shape, dtype, sources = _load_shard_sources(
+            arr_path, metadatas)
+        shard_shape = [stop - start for start, stop in next(iter(sources))]
+        chunk_shape = choose_chunk_shape(shard_shape, dtype,
+                                         global_config.checkpoint_chunk_bytes)
+
+        new_arr_path = os.path.join(new_ckpt_dir, arr_dir)
+        write_chunk_index(new_arr_path, global_shape, dtype, chunk_shape,
+                          compression)
+
+        # Save the chunks inside a shard from its file, which is opened once
+        saved_chunks = set()
+        for shard_ranges, read_fn in sources.items():
+            data = None
+            for coords, chunk_ranges in _chunks_in_ranges(
+                    shard_ranges, global_shape, chunk_shape):
+                if coords in saved_chunks or not all(
+                        s_start <= start and stop <= s_stop
+                        for (start, stop), (s_start, s_stop) in zip(
+                            chunk_ranges, shard_ranges)):
+                    continue
+                if data is None:
+                    data = read_fn()
+                src = tuple(
+                    slice(start - s_start, stop - s_start)
+                    for (start, stop), (s_start, _) in zip(
+                        chunk_ranges, shard_ranges))
+                index = tuple(
+                    slice(start, stop) for start, stop in chunk_ranges)
+                save_chunks(new_arr_path, data[src], index, global_shape,
+                            chunk_shape, compression)
+                saved_chunks.add(coords)
+
+        # Assemble the chunks across shards, e.g., of uneven shards
+        for coords, chunk_ranges in _chunks_in_ranges(
+                _index_to_ranges(None, global_shape), global_shape,
+                chunk_shape):
+            if coords in saved_chunks:
+                continue
+            index = tuple(slice(start, stop) for start, stop in chunk_ranges)
+            data = _load_slices(global_shape, dtype, sources, [index])[0]
+            save_chunks(new_arr_path, data, index, global_shape, chunk_shape,
+                        compression)
 
 
 def save_checkpoint(ckpt_dir: Union[str, os.PathLike],
                     target: PyTreeDef,
                     step: int,
-                    local_cache_dir: Union[str, os.PathLike, None] = None):
+                    local_cache_dir: Union[str, os.PathLike, None] = None,
+                    checkpoint_format: str = "shard",
+                    async_: bool = False):
     """
         Save a checkpoint of the `target` to `ckpt_dir`.
 
@@ -98,7 +441,17 @@ def save_checkpoint(ckpt_dir: Union[str, os.PathLike],
            shared filesystem path, and this function will return as soon as
            the shards have been saved to this local directory. DaemonMoveWorkers
            will move these shards into `ckpt_dir` in the background.
+           checkpoint_format: "shard" saves one file per shard. "chunked"
+           saves fixed-size chunks and a single index file per array, so that
+           restoring with any sharding only reads the intersecting chunks.
+           `restore_checkpoint` detects the format automatically.
+           async_: If True, return a future as soon as the arrays are
+           snapshotted to host memory. The files are written in the
+           background, and `checkpoint_{step}` is written after all of them.
+           Use `wait_checkpoint` or the future to wait for the save.
     """
+    assert checkpoint_format in ["shard", "chunked"], (
+        f"Invalid checkpoint format: {checkpoint_format}")
     # create directories if not exist
     os.makedirs(ckpt_dir, exist_ok=True)
     if local_cache_dir is not None:
@@ -108,6 +461,8 @@ def save_checkpoint(ckpt_dir: Union[str, os.PathLike],
     flat_dirs = _dfs_pytree(target, "state")
     flat_target, target_tree = tree_flatten(target)
     flat_metadata = []
+    save_refs = []
+    unsharded_arrays = []
     assert (len(flat_dirs) == len(flat_target))
     for arr_dir, x in zip(flat_dirs, flat_target):
         arr_path = os.path.join(ckpt_dir, arr_dir)
@@ -118,26 +473,70 @@ def save_checkpoint(ckpt_dir: Union[str, os.PathLike],
         if isinstance(x, (DistributedArray, ReplicatedDistributedArray,
                           np.ndarray, jax.xla.DeviceArray)):
             if isinstance(x, DistributedArray):
-                x.save(arr_path, arr_cache_path)
+                save_refs.extend(
+                    x.save(arr_path, arr_cache_path, checkpoint_format,
+                           async_))
             elif isinstance(x, ReplicatedDistributedArray):
-                x.replica.save(arr_path, arr_cache_path)
-            elif isinstance(x, (np.ndarray, jax.xla.DeviceArray)):
-                _save_unsharded_array(arr_path, x)
+                save_refs.extend(
+                    x.replica.save(arr_path, arr_cache_path,
+                                   checkpoint_format, async_))
+            else:
+                # Take a snapshot if the array is saved asynchronously
+                unsharded_arrays.append(
+                    (arr_path, np.array(x) if async_ else x))
             flat_metadata.append(arr_dir)
         else:
             flat_metadata.append(x)
 
     metapath = os.path.join(ckpt_dir, f"checkpoint_{step}")
     metadata = tree_unflatten(target_tree, flat_metadata)
+    if not async_:
+        _finish_checkpoint(save_refs, unsharded_arrays, checkpoint_format,
+                           metapath, metadata)
+        return None
+
+    global _checkpoint_executor
+    if _checkpoint_executor is None:
+        # A single thread keeps the order of checkpoints
+        _checkpoint_executor = ThreadPoolExecutor(1)
+    future = _checkpoint_executor.submit(_finish_checkpoint, save_refs,
+                                         unsharded_arrays, checkpoint_format,
+                                         metapath, metadata)
+    _pending_checkpoints.append(future)
+    return future
+
+
+def _finish_checkpoint(save_refs, unsharded_arrays, checkpoint_format,
+                       metapath, metadata):
+    for arr_path, x in unsharded_arrays:
+        if checkpoint_format == "chunked":
+            _save_unsharded_array_chunked(arr_path, x)
+        else:
+            _save_unsharded_array(arr_path, x)
+
+    # Asynchronous save calls return the references of background writes
+    write_refs = [ref for ref in ray.get(save_refs) if ref is not None]
+    ray.get(write_refs)
+
     with open(metapath, "wb") as metafile:
         metafile.write(msgpack.packb(metadata))
 
 
+def wait_checkpoint():
+    """
+        Block until all checkpoints saved by `save_checkpoint(...,
+        async_=True)` are written.
+    """
+    while _pending_checkpoints:
+        _pending_checkpoints.pop(0).result()
+
+
 def restore_checkpoint(ckpt_dir: Union[str, os.PathLike], step: int,
                        placement_specs: PyTreeDef):
     """
         Restore the specified checkpoint from `ckpt_dir` and reshard it
-        according to the `placement_specs`.
+        according to the `placement_specs`. Both the shard format and the
+        chunked format are supported and detected automatically.
 
         Args:
             ckpt_dir: directory of checkpoints to restore from. If you
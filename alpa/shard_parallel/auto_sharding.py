@@ -22,6 +22,7 @@ import dataclasses
 import logging
 import multiprocessing
 import os
+import pickle
 import time
 import traceback
 from typing import Sequence, Optional, Union, Tuple
@@ -34,6 +35,11 @@ from jax.interpreters import pxla
 
 from alpa.global_env import global_config
 from alpa.parallel_plan import StagePlan
+from alpa.shard_parallel.cost_graph import CostGraph, num_ilp_variables
+from alpa.shard_parallel.solution_cache import get_ilp_solution_cache
+from alpa.shard_parallel.sparse_solver import (SparseILP, STATUS_OPTIMAL,
+                                               STATUS_INFEASIBLE,
+                                               STATUS_FEASIBLE)
 from alpa.timer import timers
 from alpa.util import check_arithmetic_sequence, get_compile_options, XlaPassContext
 from alpa.wrapped_hlo import HloStatus, WrappedHlo
@@ -76,6 +82,16 @@ class AutoShardingOption:
     force_simple_heuristic: str = ""
     # The threshold of all-reduce combiner in bytes.
     all_reduce_threshold: int = 1 << 60
+    # The backend of the ILP solver.
+    # Possible choices: {"pulp", "scipy_milp", "cbc_mps"}.
+    # "pulp" builds the ILP with pulp expressions. The other two build the
+    # constraint matrix as sparse arrays, and solve it with
+    # scipy.optimize.milp or with CBC through an MPS file.
+    solver_backend: str = "pulp"
+    # Whether to reduce the ILP before solving it. The reduction merges
+    # followers, removes dominated strategies, and eliminates nodes with at
+    # most two neighbors. It does not change the optimal objective.
+    solver_graph_reduction: bool = True
 
 
 class LogicalDeviceMesh:
@@ -271,6 +287,11 @@ def run_auto_sharding_pass(
     # Temporarily disable this.
     grad_acc_num_micro_batches = None
 
+    # The solver is called by the XLA pass, so pass the options by globals
+    global solver_backend, solver_graph_reduction
+    solver_backend = as_option.solver_backend
+    solver_graph_reduction = as_option.solver_graph_reduction
+
     with XlaPassContext({
             # Auto-sharding solver options
             "auto_sharding::enable":
@@ -612,6 +633,18 @@ last_s_val = None
 # The last objective value of the best ILP solution.
 last_objective = None
 
+# The backend of the ILP solver. It is set by run_auto_sharding_pass
+# according to AutoShardingOption.solver_backend.
+solver_backend = "pulp"
+
+# Whether to reduce the ILP before solving it. It is set by
+# run_auto_sharding_pass according to
+# AutoShardingOption.solver_graph_reduction.
+solver_graph_reduction = True
+
+# The number of solver inputs dumped by this process.
+num_dumped_solver_inputs = 0
+
 
 # pylint: disable=import-outside-toplevel
 def _call_solver_serialized_args(N,
@@ -629,21 +662,87 @@ def _call_solver_serialized_args(N,
                                  s_init_np=None):
     """Call the solver with serialized arguments."""
     # pylint: disable=invalid-name
-    global last_s_val, last_objective
-
-    import pulp
-    from pulp import LpVariable, LpProblem, LpMinimize, lpSum, lpDot, LpStatus
-    tic = time.time()
+    global last_s_val, last_objective, num_dumped_solver_inputs
 
     for x in [s_len_np, E_np, A_np, L_np, c_np, d_np, m_np, r_np, v_np]:
         assert isinstance(x, np.ndarray)
     assert len(s_len_np) == N, "s_len_np"
+    args = (N, M, s_len_np, s_follow_np, E_np, A_np, L_np, c_np, d_np, m_np,
+            r_np, v_np, s_init_np)
 
     # Dump arguments for re-solving
-    # pickle.dump([N, M, s_len_np, s_follow_np, E_np, A_np, L_np,
-    #              c_np, d_np, m_np, r_np, v_np, s_init_np],
-    #              open("args.pkl", "wb"))
-    # TODO(lmzheng): cache the ILP solution.
+    dump_dir = global_config.ilp_solver_inputs_dump_dir
+    if dump_dir is not None:
+        os.makedirs(dump_dir, exist_ok=True)
+        filename = os.path.join(
+            dump_dir,
+            f"ilp_inputs_{os.getpid()}_{num_dumped_solver_inputs}.pkl")
+        with open(filename, "wb") as f:
+            pickle.dump(args, f)
+        num_dumped_solver_inputs += 1
+
+    # Look up the solution cache
+    solution_cache = get_ilp_solution_cache()
+    if solution_cache is not None:
+        cache_key = solution_cache.compute_key(N, M, s_len_np, s_follow_np,
+                                               E_np, A_np, L_np, v_np,
+                                               s_init_np)
+        cache_costs = (c_np, d_np, m_np, r_np)
+        ret = solution_cache.lookup(cache_key, cache_costs)
+        if ret is not None and _check_memory_constraint(
+                N, M, s_len_np, L_np, m_np, ret[0]):
+            last_s_val, last_objective = ret[0], ret[2]
+            return ret
+
+    # Reduce the ILP
+    solve_args = args
+    cost_graph = None
+    if solver_graph_reduction:
+        tic = time.time()
+        cost_graph = CostGraph(*args)
+        cost_graph.simplify()
+        solve_args = cost_graph.export_reduced_problem()
+        logger.debug(
+            f"Graph reduction time: {time.time() - tic:.2f} s. "
+            f"#vars: {num_ilp_variables(s_len_np, s_follow_np, E_np)} -> "
+            f"{num_ilp_variables(solve_args[2], solve_args[3], solve_args[4])}")
+
+    if solver_backend == "pulp":
+        s_val, e_val, objective, status = _solve_with_pulp(*solve_args)
+    else:
+        s_val, e_val, objective, status = _solve_with_sparse_backend(
+            solver_backend, *solve_args)
+
+    if cost_graph is not None:
+        s_val, e_val, objective = cost_graph.expand_solution(s_val)
+
+    last_s_val = s_val
+    last_objective = objective
+
+    if objective > INFINITY_COST:
+        warnings.warn("Detect unexpected behaviors in the auto-sharding pass.")
+
+    # Only cache solutions that are proven optimal
+    if solution_cache is not None and status == STATUS_OPTIMAL:
+        solution_cache.insert(cache_key, cache_costs,
+                              (s_val, e_val, objective, status))
+
+    if status == STATUS_FEASIBLE:
+        logger.warning("The ILP solver stopped before proving optimality. "
+                       f"Use a feasible solution with objective {objective}.")
+        # The compiler expects the status codes of pulp, where a feasible
+        # solution of CBC stopped on time is reported as optimal.
+        status = STATUS_OPTIMAL
+    return s_val, e_val, objective, status
+
+
+def _solve_with_pulp(N, M, s_len_np, s_follow_np, E_np, A_np, L_np, c_np,
+                     d_np, m_np, r_np, v_np, s_init_np):
+    """Build the ILP with pulp expressions and solve it with CBC."""
+    # pylint: disable=invalid-name
+    import pulp
+    from pulp import LpVariable, LpProblem, LpMinimize, lpSum, lpDot, LpStatus
+    tic = time.time()
 
     def get_non_zero_index(binary_vector):
         """Get the index of non-zero item in a vector."""
@@ -836,10 +935,13 @@ def _call_solver_serialized_args(N,
     prob.solve(solver)
 
     status = prob.status
+    if (status == pulp.LpStatusOptimal and
+            prob.sol_status == pulp.LpSolutionIntegerFeasible):
+        status = STATUS_FEASIBLE
     objective = pulp.value(prob.objective)
     objective = float(objective) if objective is not None else -1.0
     if verbose:
-        print(f"ILP Status: {LpStatus[status]}\tObjective: {objective}\t"
+        print(f"ILP Status: {LpStatus[prob.status]}\tObjective: {objective}\t"
               f"Time: {time.time() - tic}")
         print(f"#nodes: {num_nodes},  #edges: {num_edges}")
 
@@ -863,15 +965,62 @@ def _call_solver_serialized_args(N,
         if verbose and r[idx][e_val[idx]] > 0:
             print(f"Edge cost {(i, j)} : {r[idx][e_val[idx]]}")
 
-    last_s_val = s_val
-    last_objective = objective
+    return s_val, e_val, objective, status
 
-    if objective > INFINITY_COST:
-        warnings.warn("Detect unexpected behaviors in the auto-sharding pass.")
 
+def _solve_with_sparse_backend(backend, N, M, s_len_np, s_follow_np, E_np,
+                               A_np, L_np, c_np, d_np, m_np, r_np, v_np,
+                               s_init_np):
+    """Build the ILP as sparse matrices and solve it with the backend."""
+    # pylint: disable=invalid-name
+    verbose = False
+    time_limit = 600
+
+    tic = time.time()
+    ilp = SparseILP(N, M, s_len_np, s_follow_np, E_np, A_np, L_np, c_np, d_np,
+                    m_np, r_np, v_np, s_init_np)
+    build_time = time.time() - tic
+    x, objective, status = ilp.solve(backend, time_limit)
+    if verbose:
+        print(f"ILP Status: {status}\tObjective: {objective}\t"
+              f"Build time: {build_time}\tTime: {time.time() - tic}")
+        print(f"#vars: {ilp.num_vars},  #constraints: {ilp.num_rows}")
+
+    if status == STATUS_INFEASIBLE:
+        raise RuntimeError(
+            "Cannot run the function under the given memory budget. "
+            "Please increase the memory budget.")
+    assert x is not None, f"ILP solver backend {backend} failed."
+    objective = float(objective) if objective is not None else -1.0
+
+    s_val, e_val = ilp.extract_solution(x)
     return s_val, e_val, objective, status
 
 
+def _check_memory_constraint(N, M, s_len_np, L_np, m_np, s_val):
+    """Check whether a solution satisfies the memory constraint (c)."""
+    # pylint: disable=invalid-name
+    if M <= 0:
+        return True
+    node_offsets = np.concatenate([[0], np.cumsum(s_len_np)[:-1]])
+    node_mem = m_np[node_offsets + s_val]
+    pt = N
+    for t in range(N):
+        live_nodes = L_np[pt:pt + L_np[t]]
+        pt += L_np[t]
+        if node_mem[live_nodes].sum() > M:
+            return False
+    return True
+
+
+def get_ilp_solution_cache_stats():
+    """Get the hit/miss counters of the ILP solution cache in this process."""
+    solution_cache = get_ilp_solution_cache()
+    if solution_cache is None:
+        return None
+    return solution_cache.stats()
+
+
 # Auto-sharded pipeline stages.
 # These global variables are used to receive values from XLA c++ passes.
 auto_sharded_hlo_stage_names: Sequence[str] = []
@@ -0,0 +1,318 @@
+"""Graph reduction for the auto-sharding ILP.
+
+The cost graph merges followers into the nodes they follow, removes
+dominated strategies, and eliminates nodes with at most two neighbors by
+folding their costs into the neighbors. All reductions are exact, i.e.,
+the reduced ILP has the same optimal objective as the original one.
+
+The reduced ILP is exported in the same serialized format as the input of
+`_call_solver_serialized_args`. An eliminated node becomes a node with a
+single strategy, which does not create any ILP variable. After the reduced
+ILP is solved, `expand_solution` recovers s_val and e_val of the original
+ILP.
+"""
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class CostGraph:
+    """The cost graph of an auto-sharding ILP."""
+
+    def __init__(self, N, M, s_len_np, s_follow_np, E_np, A_np, L_np, c_np,
+                 d_np, m_np, r_np, v_np, s_init_np):
+        # pylint: disable=invalid-name
+        self.N = N
+        self.M = M
+        self.s_len = s_len_np.astype(np.int64)
+        self.s_follow = s_follow_np
+        self.E = E_np.reshape((-1, 2)).astype(np.int64)
+        self.A_np = A_np
+        self.L_np = L_np
+        self.v_np = v_np
+        self.s_init_np = s_init_np
+        self.c_np = c_np
+        self.d_np = d_np
+        self.m_np = m_np
+        self.r_np = r_np
+
+        node_offsets = np.concatenate([[0], np.cumsum(self.s_len)])
+        self.node_cost_offsets = node_offsets
+
+        # The root of each node and the members of each root
+        self.root = np.arange(N)
+        for i in range(N):
+            visited = 0
+            while s_follow_np[self.root[i]] >= 0:
+                self.root[i] = s_follow_np[self.root[i]]
+                visited += 1
+                assert visited <= N, "Cyclic follow"
+        self.members = {}
+        for i in range(N):
+            self.members.setdefault(self.root[i], []).append(i)
+
+        # The original strategy indices kept for each root
+        self.kept = {
+            i: np.arange(self.s_len[i]) for i in range(N) if self.root[i] == i
+        }
+        # Roots that cannot be reduced because of alias or warm start
+        self.frozen = set()
+        for i in A_np.reshape(-1).tolist():
+            self.frozen.add(self.root[i])
+        if s_init_np is not None:
+            for i in s_init_np.reshape((-1, 3))[:, 0].tolist():
+                self.frozen.add(self.root[i])
+
+        # Memory of each node
+        self.mem = [
+            m_np[node_offsets[i]:node_offsets[i + 1]].astype(np.float64)
+            for i in range(N)
+        ]
+
+        # 1. Absorb followers: move their node costs and edges to the roots
+        self.node_cost = {i: np.zeros(self.s_len[i]) for i in self.kept}
+        for i in range(N):
+            self.node_cost[self.root[i]] += (
+                c_np[node_offsets[i]:node_offsets[i + 1]].astype(np.float64) +
+                d_np[node_offsets[i]:node_offsets[i + 1]].astype(np.float64))
+
+        self.adjacency = {i: set() for i in self.kept}
+        self.edge_costs = {}
+        pt = 0
+        for (i, j) in self.E.tolist():
+            length = self.s_len[i] * self.s_len[j]
+            cost = r_np[pt:pt + length].astype(np.float64).reshape(
+                (self.s_len[i], self.s_len[j]))
+            pt += length
+            ri, rj = self.root[i], self.root[j]
+            if ri == rj:
+                # Both ends always use the same strategy index
+                self.node_cost[ri] += np.diag(cost)
+            else:
+                self.add_edge_cost(ri, rj, cost)
+        assert pt == len(r_np)
+
+        # Eliminated roots in the order of elimination. Each item is
+        # (root, neighbors, best), where best maps the original strategy
+        # indices of the neighbors to the original strategy index of the root.
+        self.eliminated = []
+        self.eliminated_set = set()
+
+    def get_edge_cost(self, i, j):
+        if i <= j:
+            return self.edge_costs[(i, j)]
+        else:
+            return self.edge_costs[(j, i)].transpose()
+
+    def add_edge_cost(self, i, j, cost):
+        if i > j:
+            i, j = j, i
+            cost = cost.transpose()
+
+        if (i, j) in self.edge_costs:
+            self.edge_costs[(i, j)] = self.edge_costs[(i, j)] + cost
+        else:
+            self.adjacency[i].add(j)
+            self.adjacency[j].add(i)
+            self.edge_costs[(i, j)] = cost
+
+    def remove_edge(self, i, j):
+        if i > j:
+            i, j = j, i
+        self.adjacency[i].remove(j)
+        self.adjacency[j].remove(i)
+        del self.edge_costs[(i, j)]
+
+    def member_mem(self, i):
+        """The memory costs of the kept strategies of all members of root i,
+        in the shape of (#members, #kept strategies)."""
+        return np.stack([self.mem[g][self.kept[i]] for g in self.members[i]])
+
+    def simplify(self, max_rounds: int = 4):
+        """Apply the reductions until nothing changes."""
+        for _ in range(max_rounds):
+            changed = self.remove_dominated_strategies()
+            changed |= self.eliminate_nodes()
+            if not changed:
+                break
+
+    def remove_dominated_strategies(self):
+        """Remove strategy a of a root if another strategy b is no worse
+        than a in node cost, all edge costs and all memory costs."""
+        changed = False
+        for i in self.kept:
+            if i in self.frozen or i in self.eliminated_set:
+                continue
+            if len(self.kept[i]) <= 1:
+                continue
+            features = [self.node_cost[i][:, None]]
+            features.extend(self.get_edge_cost(i, j) for j in self.adjacency[i])
+            if self.M > 0:
+                features.append(self.member_mem(i).T)
+            features = np.concatenate(features, axis=1)
+
+            # no_worse[b, a]: strategy b is no worse than strategy a
+            no_worse = np.all(features[:, None, :] <= features[None, :, :],
+                              axis=2)
+            alive = np.ones(len(features), dtype=bool)
+            for a in range(len(features)):
+                others = alive.copy()
+                others[a] = False
+                if np.any(no_worse[others, a]):
+                    alive[a] = False
+            if alive.all():
+                continue
+
+            changed = True
+            self.kept[i] = self.kept[i][alive]
+            self.node_cost[i] = self.node_cost[i][alive]
+            for j in list(self.adjacency[i]):
+                self.edge_costs[(min(i, j), max(i, j))] = (
+                    self.get_edge_cost(i, j)[alive] if i < j else
+                    self.get_edge_cost(j, i)[:, alive])
+        return changed
+
+    def eliminate_nodes(self):
+        """Eliminate roots with at most two neighbors."""
+        changed = False
+        worklist = list(self.kept)
+        while worklist:
+            i = worklist.pop()
+            if (i in self.frozen or i in self.eliminated_set or
+                    len(self.adjacency[i]) > 2):
+                continue
+            neighbors = sorted(self.adjacency[i])
+            if len(neighbors) == 2 and not self.is_profitable(i, *neighbors):
+                continue
+            # cost[s_j0, s_j1, s_i] for all strategies of the neighbors
+            cost = self.node_cost[i]
+            if len(neighbors) == 1:
+                cost = cost[None, :] + self.get_edge_cost(neighbors[0], i)
+            elif len(neighbors) == 2:
+                cost = (cost[None, None, :] +
+                        self.get_edge_cost(neighbors[0], i)[:, None, :] +
+                        self.get_edge_cost(neighbors[1], i)[None, :, :])
+            best = self.choose_best_strategy(i, cost)
+            if best is None:
+                continue
+
+            # Fold the cost into the neighbors
+            best_cost = np.take_along_axis(cost, best[..., None],
+                                           axis=-1)[..., 0]
+            for j in neighbors:
+                self.remove_edge(i, j)
+            if len(neighbors) == 1:
+                self.node_cost[neighbors[0]] = (self.node_cost[neighbors[0]] +
+                                                best_cost)
+            elif len(neighbors) == 2:
+                self.add_edge_cost(neighbors[0], neighbors[1], best_cost)
+
+            # Record the choice in original strategy indices
+            best_orig = np.full([self.s_len[j] for j in neighbors],
+                                -1,
+                                dtype=np.int64)
+            best_orig[np.ix_(*[self.kept[j] for j in neighbors])] = (
+                self.kept[i][best])
+            self.eliminated.append((i, neighbors, best_orig))
+            self.eliminated_set.add(i)
+            worklist.extend(neighbors)
+            changed = True
+        return changed
+
+    def is_profitable(self, i, j, k):
+        """Whether replacing root i and edges (i, j), (i, k) with an edge
+        (j, k) does not increase the number of ILP variables."""
+        if (min(j, k), max(j, k)) in self.edge_costs:
+            return True
+        len_i, len_j, len_k = (
+            len(self.kept[i]), len(self.kept[j]), len(self.kept[k]))
+        return len_j * len_k <= len_i * (len_j + len_k + 1)
+
+    def choose_best_strategy(self, i, cost):
+        """Choose the best strategy of root i for all strategies of its
+        neighbors. Return None if the choice can violate the memory
+        constraint."""
+        min_cost = cost.min(axis=-1, keepdims=True)
+        if self.M <= 0:
+            return np.argmin(cost, axis=-1)
+
+        # Break ties by memory. The choice must also be the one with the
+        # least memory for every member, so that it does not make any
+        # memory constraint tighter.
+        member_mem = self.member_mem(i)
+        score = np.where(cost == min_cost, member_mem.sum(axis=0), np.inf)
+        best = np.argmin(score, axis=-1)
+        if not np.all(member_mem[:, best] == member_mem.min(
+                axis=1).reshape((-1,) + (1,) * best.ndim)):
+            return None
+        return best
+
+    def export_reduced_problem(self):
+        """Export the reduced ILP in the serialized format."""
+        N = self.N  # pylint: disable=invalid-name
+        s_len = np.empty(N, dtype=np.int32)
+        s_follow = np.full(N, -1, dtype=np.int32)
+        c, m = [], []
+        for i in range(N):
+            root = self.root[i]
+            if root in self.eliminated_set:
+                s_len[i] = 1
+                c.append(np.zeros(1))
+                m.append(self.mem[i][self.kept[root]].min(keepdims=True))
+                continue
+            s_len[i] = len(self.kept[root])
+            if root != i:
+                s_follow[i] = self.s_follow[i]
+                c.append(np.zeros(s_len[i]))
+            else:
+                c.append(self.node_cost[i])
+            m.append(self.mem[i][self.kept[root]])
+
+        edges = sorted(self.edge_costs)
+        E = np.array(edges, dtype=np.int32).reshape(-1)  # pylint: disable=invalid-name
+        r = [self.edge_costs[e].reshape(-1) for e in edges]
+        c = np.concatenate(c).astype(np.float64)
+        return (N, self.M, s_len, s_follow, E, self.A_np, self.L_np, c,
+                np.zeros_like(c), np.concatenate(m),
+                np.concatenate(r) if r else np.zeros(0), self.v_np,
+                self.s_init_np)
+
+    def expand_solution(self, s_val_reduced):
+        """Get s_val, e_val and the objective of the original ILP from
+        s_val of the reduced ILP."""
+        s_val = np.full(self.N, -1, dtype=np.int32)
+        for i in self.kept:
+            if i not in self.eliminated_set:
+                s_val[i] = self.kept[i][s_val_reduced[i]]
+        for i, neighbors, best_orig in reversed(self.eliminated):
+            if neighbors:
+                s_val[i] = best_orig[tuple(s_val[j] for j in neighbors)]
+            else:
+                s_val[i] = best_orig
+            assert s_val[i] >= 0
+        s_val = s_val[self.root]
+
+        e_val = (s_val[self.E[:, 0]] * self.s_len[self.E[:, 1]] +
+                 s_val[self.E[:, 1]]).astype(np.int32)
+
+        offsets = self.node_cost_offsets
+        edge_offsets = np.concatenate([[0],
+                                       np.cumsum(self.s_len[self.E[:, 0]] *
+                                                 self.s_len[self.E[:, 1]])])
+        objective = float(
+            self.c_np[offsets[:-1] + s_val].astype(np.float64).sum() +
+            self.d_np[offsets[:-1] + s_val].astype(np.float64).sum() +
+            self.r_np[edge_offsets[:-1] + e_val].astype(np.float64).sum())
+        return s_val, e_val, objective
+
+
+def num_ilp_variables(s_len_np, s_follow_np, E_np):
+    """Count the binary variables of an ILP in the serialized format."""
+    E = np.asarray(E_np).reshape((-1, 2))  # pylint: disable=invalid-name
+    num_vars = int(s_len_np[(s_follow_np < 0) & (s_len_np > 1)].sum())
+    full = (s_len_np[E[:, 0]] > 1) & (s_len_np[E[:, 1]] > 1)
+    num_vars += int((s_len_np[E[full, 0]] * s_len_np[E[full, 1]]).sum())
+    return num_vars
@@ -0,0 +1,167 @@
+"""An on-disk cache of the ILP solutions of the auto-sharding solver.
+
+The cache is keyed by a hash of the structural inputs of the ILP (graph,
+liveness, aliases, memory budget, warm start). Each key maps to a file that
+stores the cost vectors and solutions of all problems with that structure,
+so that a lookup can match the cost vectors with a tolerance.
+All processes on a host can share the same cache directory. Files are
+written atomically and the least recently used ones are evicted when the
+total size exceeds a budget.
+"""
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+from alpa.global_env import global_config
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+CACHE_FILE_SUFFIX = ".pkl"
+
+
+class ILPSolutionCache:
+    """A size-bounded LRU cache of ILP solutions stored in a directory."""
+
+    def __init__(self, cache_dir: str, max_bytes: int, rtol: float):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_bytes = max_bytes
+        self.rtol = rtol
+        self.num_hits = 0
+        self.num_misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def compute_key(N, M, s_len_np, s_follow_np, E_np, A_np, L_np, v_np,
+                    s_init_np) -> str:
+        """Hash the structural inputs of an ILP."""
+        # pylint: disable=invalid-name
+        hasher = hashlib.sha256()
+        hasher.update(repr((int(N), float(M))).encode())
+        for x in [s_len_np, s_follow_np, E_np, A_np, L_np, v_np, s_init_np]:
+            if x is None:
+                hasher.update(b"None")
+                continue
+            x = np.ascontiguousarray(x)
+            hasher.update(repr((x.dtype.str, x.shape)).encode())
+            hasher.update(x.tobytes())
+        return hasher.hexdigest()
+
+    def _path(self, key: str):
+        return os.path.join(self.cache_dir, key + CACHE_FILE_SUFFIX)
+
+    def _load_entries(self, key: str):
+        try:
+            with open(self._path(key), "rb") as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return []
+
+    def _match(self, costs: Sequence[np.ndarray],
+               cached_costs: Sequence[np.ndarray]):
+        for x, y in zip(costs, cached_costs):
+            if x.shape != y.shape or not np.allclose(
+                    x, y, rtol=self.rtol, atol=0):
+                return False
+        return True
+
+    def lookup(self, key: str,
+               costs: Sequence[np.ndarray]) -> Optional[Tuple]:
+        """Return the cached (s_val, e_val, objective, status) of the problem
+        with the given key whose cost vectors match `costs`."""
+        for cached_costs, solution in self._load_entries(key):
+            if self._match(costs, cached_costs):
+                self.num_hits += 1
+                try:
+                    # Refresh the mtime, which is used as the LRU order.
+                    os.utime(self._path(key))
+                except OSError:
+                    pass
+                return solution
+        self.num_misses += 1
+        return None
+
+    def insert(self, key: str, costs: Sequence[np.ndarray], solution: Tuple):
+        """Insert a solution and evict old files if the cache is too large."""
+        entries = self._load_entries(key)
+        entries = [(cached_costs, cached_solution)
+                   for cached_costs, cached_solution in entries
+                   if not self._match(costs, cached_costs)]
+        entries.append((tuple(np.array(x) for x in costs), solution))
+
+        # Write to a temporary file and rename it, so that concurrent readers
+        # never see a partially written file.
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(entries, f)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.warning(f"Failed to write the ILP solution cache: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used files until the total size fits in
+        max_bytes."""
+        files = []
+        total_bytes = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(CACHE_FILE_SUFFIX):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total_bytes += stat.st_size
+
+        files.sort()
+        for _, size, path in files:
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_bytes -= size
+
+    def clear(self):
+        """Remove all cached solutions."""
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(CACHE_FILE_SUFFIX):
+                os.remove(os.path.join(self.cache_dir, name))
+
+    def stats(self):
+        return {"hits": self.num_hits, "misses": self.num_misses}
+
+
+_ilp_solution_cache = None
+
+
+def get_ilp_solution_cache() -> Optional[ILPSolutionCache]:
+    """Get the ILP solution cache of this process according to
+    global_config. Return None if the cache is disabled."""
+    global _ilp_solution_cache
+
+    cache_dir = global_config.ilp_solution_cache_dir
+    if cache_dir is None:
+        return None
+    if (_ilp_solution_cache is None or
+            _ilp_solution_cache.cache_dir != os.path.expanduser(cache_dir)):
+        _ilp_solution_cache = ILPSolutionCache(
+            cache_dir, global_config.ilp_solution_cache_max_bytes,
+            global_config.ilp_solution_cache_rtol)
+    else:
+        _ilp_solution_cache.max_bytes = (
+            global_config.ilp_solution_cache_max_bytes)
+        _ilp_solution_cache.rtol = global_config.ilp_solution_cache_rtol
+    return _ilp_solution_cache
@@ -0,0 +1,418 @@
+"""A sparse backend of the auto-sharding ILP solver.
+
+Instead of building one pulp expression per constraint, this backend
+assembles the objective and the constraint matrix of the ILP directly as
+CSR arrays from the serialized numpy inputs of
+`_call_solver_serialized_args`, and then solves it with
+`scipy.optimize.milp` (HiGHS) or with CBC through an MPS file.
+"""
+import multiprocessing
+import os
+import subprocess
+import tempfile
+
+import numpy as np
+
+# Solver status codes. They are the same as the ones in pulp.
+STATUS_NOT_SOLVED = 0
+STATUS_OPTIMAL = 1
+STATUS_INFEASIBLE = -1
+# A feasible solution that is not proven optimal, e.g., when the time limit
+# is hit. It is the same as pulp.LpSolutionIntegerFeasible.
+STATUS_FEASIBLE = 2
+
+
+class SparseILP:
+    """The ILP of the auto-sharding solver in the form of
+        min  obj @ x + obj_const
+        s.t. row_lb <= A @ x <= row_ub,  var_lb <= x <= var_ub,  x binary.
+
+    Attributes:
+      node_var_offset: The offset of the strategy variables of each node,
+        or -1 if the node has only one strategy.
+      edge_var_offset: The offset of the resharding variables of each edge,
+        or -1 if the edge reuses the strategy variables of one endpoint.
+    """
+
+    def __init__(self, N, M, s_len_np, s_follow_np, E_np, A_np, L_np, c_np,
+                 d_np, m_np, r_np, v_np, s_init_np):
+        # pylint: disable=invalid-name
+        self.N = N
+        s_len = s_len_np.astype(np.int64)
+        E = E_np.reshape((-1, 2)).astype(np.int64)
+        A = A_np.reshape((-1, 2)).astype(np.int64)
+        if len(set(map(tuple, E.tolist()))) != len(E):
+            raise ValueError("Duplicated edges")
+
+        # 1. Variables of nodes. Followers share the variables of their roots.
+        root = np.arange(N)
+        for i in range(N):
+            visited = 0
+            while s_follow_np[root[i]] >= 0:
+                root[i] = s_follow_np[root[i]]
+                visited += 1
+                assert visited <= N, "Cyclic follow"
+        root_len = s_len[root]
+        has_var = (s_follow_np < 0) & (s_len > 1)
+        assert np.all(s_len == root_len), "Followers must have the same length"
+        var_offset = np.full(N, -1, dtype=np.int64)
+        var_offset[has_var] = np.cumsum(s_len[has_var]) - s_len[has_var]
+        num_node_vars = int(s_len[has_var].sum())
+        self.node_var_offset = var_offset[root]
+        self.node_len = root_len
+
+        # 2. Variables of edges
+        num_edges = len(E)
+        edge_len = root_len[E[:, 0]] * root_len[E[:, 1]]
+        full_edge = (root_len[E[:, 0]] > 1) & (root_len[E[:, 1]] > 1)
+        edge_var_offset = np.full(num_edges, -1, dtype=np.int64)
+        edge_var_offset[full_edge] = (num_node_vars +
+                                      np.cumsum(edge_len[full_edge]) -
+                                      edge_len[full_edge])
+        self.edge_var_offset = edge_var_offset
+        self.edges = E
+        self.num_vars = num_node_vars + int(edge_len[full_edge].sum())
+
+        # 3. Objective
+        obj = np.zeros(self.num_vars)
+        obj_const = 0.0
+        node_ids, strategy_ids = _expand(np.arange(N), s_len)
+        node_vars = self._node_var(node_ids, strategy_ids)
+        node_costs = (c_np.astype(np.float64) + d_np.astype(np.float64))
+        obj_const += node_costs[node_vars < 0].sum()
+        np.add.at(obj, node_vars[node_vars >= 0], node_costs[node_vars >= 0])
+
+        edge_ids, edge_pos = _expand(np.arange(num_edges), edge_len)
+        edge_vars = self._edge_var(edge_ids, edge_pos)
+        edge_costs = r_np.astype(np.float64)
+        assert len(edge_costs) == len(edge_vars)
+        obj_const += edge_costs[edge_vars < 0].sum()
+        np.add.at(obj, edge_vars[edge_vars >= 0], edge_costs[edge_vars >= 0])
+        self.obj = obj
+        self.obj_const = obj_const
+
+        # 4. Constraints. Each block is (rows, cols, vals, row_lb, row_ub).
+        blocks = []
+
+        # (b)
+        roots = np.nonzero(has_var)[0]
+        rows, strategies = _expand(np.arange(len(roots)), s_len[roots])
+        blocks.append((rows, var_offset[roots][rows] + strategies,
+                       np.ones(len(rows)), np.ones(len(roots)),
+                       np.ones(len(roots))))
+
+        # (c)
+        if M > 0:
+            live_t, live_node = (np.repeat(np.arange(N), L_np[:N]),
+                                 L_np[N:].astype(np.int64))
+            assert len(live_node) == L_np[:N].sum()
+            node_cost_offset = np.concatenate([[0], np.cumsum(s_len)[:-1]])
+            idx, strategies = _expand(np.arange(len(live_node)),
+                                      s_len[live_node])
+            blocks.append(
+                (live_t[idx],
+                 self._node_var(live_node[idx], strategies),
+                 m_np[node_cost_offset[live_node[idx]] + strategies].astype(
+                     np.float64), np.full(N, -np.inf), np.full(N, float(M))))
+
+        # (e)
+        full_ids = np.nonzero(full_edge)[0]
+        num_full = len(full_ids)
+        is_full_entry = full_edge[edge_ids]
+        full_entry_edge = edge_ids[is_full_entry]
+        full_entry_pos = edge_pos[is_full_entry]
+        full_entry_var = edge_vars[is_full_entry]
+        full_row_id = np.full(num_edges, -1, dtype=np.int64)
+        full_row_id[full_ids] = np.arange(num_full)
+        blocks.append((full_row_id[full_entry_edge], full_entry_var,
+                       np.ones(len(full_entry_var)), np.ones(num_full),
+                       np.ones(num_full)))
+
+        # (f) and (g)
+        for side in [0, 1]:
+            # side 0: sum_col e[row, col] <= s_i[row]
+            # side 1: sum_row e[row, col] <= s_j[col]
+            n_cols = root_len[E[full_ids, 1]]
+            side_len = root_len[E[full_ids, side]]
+            side_offset = np.concatenate([[0], np.cumsum(side_len)[:-1]])
+            entry_cols = n_cols[full_row_id[full_entry_edge]]
+            if side == 0:
+                entry_side_idx = full_entry_pos // entry_cols
+            else:
+                entry_side_idx = full_entry_pos % entry_cols
+            edge_rows = (side_offset[full_row_id[full_entry_edge]] +
+                         entry_side_idx)
+            node_rows, node_strategies = _expand(np.arange(num_full), side_len)
+            node_cols = self._node_var(E[full_ids[node_rows], side],
+                                       node_strategies)
+            num_rows = int(side_len.sum())
+            blocks.append((np.concatenate(
+                [edge_rows, side_offset[node_rows] + node_strategies]),
+                           np.concatenate([full_entry_var, node_cols]),
+                           np.concatenate([
+                               np.ones(len(edge_rows)), -np.ones(len(node_cols))
+                           ]), np.full(num_rows, -np.inf), np.zeros(num_rows)))
+
+        # (h)
+        alias_pairs = set()
+        for (i, j) in A.tolist():
+            if (i, j) in alias_pairs:
+                raise ValueError(f"Duplicated edges: {(i, j)}")
+            alias_pairs.add((i, j))
+            alias_pairs.add((j, i))
+        alias_len = s_len[A[:, 0]] * s_len[A[:, 1]]
+        alias_ids, alias_pos = _expand(np.arange(len(A)), alias_len)
+        assert len(alias_ids) == len(v_np)
+        mask = v_np > 0.5
+        alias_ids, alias_pos = alias_ids[mask], alias_pos[mask]
+        alias_cols = s_len[A[alias_ids, 1]]
+        alias_rows = np.arange(len(alias_ids))
+        blocks.append((np.concatenate([alias_rows, alias_rows]),
+                       np.concatenate([
+                           self._node_var(A[alias_ids, 0],
+                                          alias_pos // alias_cols),
+                           self._node_var(A[alias_ids, 1],
+                                          alias_pos % alias_cols)
+                       ]), np.ones(2 * len(alias_rows)),
+                       np.full(len(alias_rows), -np.inf),
+                       np.ones(len(alias_rows))))
+
+        self._assemble(blocks)
+
+        # 5. Bounds and warm start
+        self.var_lb = np.zeros(self.num_vars)
+        self.var_ub = np.ones(self.num_vars)
+        if s_init_np is not None:
+            for (idx, value, fix) in s_init_np.reshape((-1, 3)).tolist():
+                if not fix or self.node_var_offset[idx] < 0:
+                    continue
+                cols = self.node_var_offset[idx] + np.arange(
+                    self.node_len[idx])
+                self.var_ub[cols] = 0
+                self.var_lb[cols[value]] = self.var_ub[cols[value]] = 1
+
+    def _node_var(self, nodes, strategies):
+        """Get the variable index of (node, strategy), or -1 for constants."""
+        offset = self.node_var_offset[nodes]
+        return np.where(offset >= 0, offset + strategies, -1)
+
+    def _edge_var(self, edges, pos):
+        """Get the variable index of (edge, pos), or -1 for constants."""
+        E = self.edges  # pylint: disable=invalid-name
+        offset = self.edge_var_offset[edges]
+        # Edges with a single-strategy endpoint reuse the variables of the
+        # other endpoint.
+        reuse_j = self.node_len[E[edges, 0]] == 1
+        reuse_node = np.where(reuse_j, E[edges, 1], E[edges, 0])
+        reuse_var = self._node_var(reuse_node, pos)
+        return np.where(offset >= 0, offset + pos, reuse_var)
+
+    def _assemble(self, blocks):
+        """Concatenate constraint blocks into a CSR matrix. Entries on
+        constant variables are moved to the row bounds."""
+        rows, cols, vals, row_lb, row_ub = [], [], [], [], []
+        row_offset = 0
+        for (b_rows, b_cols, b_vals, b_lb, b_ub) in blocks:
+            rows.append(b_rows + row_offset)
+            cols.append(b_cols)
+            vals.append(b_vals)
+            row_lb.append(b_lb)
+            row_ub.append(b_ub)
+            row_offset += len(b_lb)
+        rows = np.concatenate(rows).astype(np.int64)
+        cols = np.concatenate(cols).astype(np.int64)
+        vals = np.concatenate(vals)
+        row_lb = np.concatenate(row_lb)
+        row_ub = np.concatenate(row_ub)
+
+        # Move constants (variables fixed to 1) to the bounds.
+        is_const = cols < 0
+        const = np.bincount(rows[is_const],
+                            weights=vals[is_const],
+                            minlength=row_offset)
+        row_lb = row_lb - const
+        row_ub = row_ub - const
+        rows, cols, vals = rows[~is_const], cols[~is_const], vals[~is_const]
+
+        # Drop rows without variables, but remember if any is violated.
+        nnz_per_row = np.bincount(rows, minlength=row_offset)
+        empty = nnz_per_row == 0
+        self.trivially_infeasible = bool(
+            np.any((row_lb[empty] > 1e-9) | (row_ub[empty] < -1e-9)))
+        new_row_id = np.cumsum(~empty) - 1
+        rows = new_row_id[rows]
+        row_lb, row_ub = row_lb[~empty], row_ub[~empty]
+        self.num_rows = len(row_lb)
+
+        # Sort entries by row and sum the duplicates to get CSR arrays.
+        order = np.lexsort((cols, rows))
+        rows, cols, vals = rows[order], cols[order], vals[order]
+        if len(rows):
+            new_entry = np.concatenate([[True], (rows[1:] != rows[:-1]) |
+                                        (cols[1:] != cols[:-1])])
+            entry_id = np.cumsum(new_entry) - 1
+            vals = np.bincount(entry_id, weights=vals)
+            rows, cols = rows[new_entry], cols[new_entry]
+        self.indptr = np.concatenate(
+            [[0], np.cumsum(np.bincount(rows, minlength=self.num_rows))])
+        self.indices = cols
+        self.data = vals
+        self.row_lb = row_lb
+        self.row_ub = row_ub
+
+    def extract_solution(self, x):
+        """Get s_val and e_val from the value of variables."""
+        E = self.edges  # pylint: disable=invalid-name
+        x = np.round(x).astype(np.int64)
+        s_val = np.zeros(self.N, dtype=np.int32)
+        for i in range(self.N):
+            if self.node_var_offset[i] >= 0:
+                vals = x[self.node_var_offset[i]:self.node_var_offset[i] +
+                         self.node_len[i]]
+                assert vals.sum() == 1
+                s_val[i] = np.argmax(vals)
+
+        e_val = np.zeros(len(E), dtype=np.int32)
+        for idx, (i, j) in enumerate(E):
+            if self.edge_var_offset[idx] >= 0:
+                length = self.node_len[i] * self.node_len[j]
+                vals = x[self.edge_var_offset[idx]:self.edge_var_offset[idx] +
+                         length]
+                assert vals.sum() == 1
+                e_val[idx] = np.argmax(vals)
+            else:
+                e_val[idx] = s_val[i] * self.node_len[j] + s_val[j]
+            assert e_val[idx] // self.node_len[j] == s_val[i], (
+                f"e_val[{i}][{j}]")
+            assert e_val[idx] % self.node_len[j] == s_val[j], (
+                f"e_val[{i}][{j}]")
+        return s_val, e_val
+
+    def solve(self, backend: str, time_limit: float):
+        """Solve the ILP. Return (x, objective, status)."""
+        if self.trivially_infeasible:
+            return None, -1.0, STATUS_INFEASIBLE
+        if self.num_vars == 0:
+            return np.zeros(0), self.obj_const, STATUS_OPTIMAL
+        if backend == "scipy_milp":
+            x, objective, status = self._solve_scipy_milp(time_limit)
+        elif backend == "cbc_mps":
+            x, objective, status = self._solve_cbc_mps(time_limit)
+        else:
+            raise ValueError(f"Invalid ILP solver backend: {backend}")
+        if objective is not None:
+            objective += self.obj_const
+        return x, objective, status
+
+    def _solve_scipy_milp(self, time_limit):
+        # pylint: disable=import-outside-toplevel
+        from scipy.optimize import milp, LinearConstraint, Bounds
+        from scipy.sparse import csr_matrix
+
+        A = csr_matrix((self.data, self.indices, self.indptr),
+                       shape=(self.num_rows, self.num_vars))
+        constraints = ([LinearConstraint(A, self.row_lb, self.row_ub)]
+                       if self.num_rows else [])
+        res = milp(self.obj,
+                   constraints=constraints,
+                   integrality=np.ones(self.num_vars),
+                   bounds=Bounds(self.var_lb, self.var_ub),
+                   options={"time_limit": time_limit})
+        if res.status == 2:
+            return None, None, STATUS_INFEASIBLE
+        if res.x is None:
+            return None, None, STATUS_NOT_SOLVED
+        # Status 1 means the time or iteration limit is hit
+        status = STATUS_OPTIMAL if res.status == 0 else STATUS_FEASIBLE
+        return res.x, float(res.fun), status
+
+    def write_mps(self, filename):
+        """Write the ILP to a fixed-format MPS file."""
+        # Names in the fixed format have at most 8 characters.
+        assert max(self.num_vars, self.num_rows) < 10**7
+        csc_order = np.argsort(self.indices, kind="stable")
+        entry_rows = np.repeat(np.arange(self.num_rows),
+                               np.diff(self.indptr))[csc_order]
+        entry_cols = self.indices[csc_order]
+        entry_vals = self.data[csc_order]
+        col_ptr = np.searchsorted(entry_cols, np.arange(self.num_vars + 1))
+
+        # All rows are either "==" or "<=".
+        is_eq = self.row_lb == self.row_ub
+        assert np.all(is_eq | np.isneginf(self.row_lb))
+        lines = ["NAME          alpa", "ROWS", " N  OBJ"]
+        for r in range(self.num_rows):
+            lines.append(f" {'E' if is_eq[r] else 'L'}  r{r}")
+        lines.append("COLUMNS")
+        for col in range(self.num_vars):
+            # Always write the objective so that every column is declared.
+            lines.append(f"    {'x' + str(col):<8}  {'OBJ':<8}  "
+                         f"{self.obj[col]:.12e}")
+            for k in range(col_ptr[col], col_ptr[col + 1]):
+                lines.append(f"    {'x' + str(col):<8}  "
+                             f"{'r' + str(entry_rows[k]):<8}  "
+                             f"{entry_vals[k]:.12e}")
+        lines.append("RHS")
+        for r in range(self.num_rows):
+            if self.row_ub[r] != 0:
+                lines.append(f"    {'RHS':<8}  {'r' + str(r):<8}  "
+                             f"{self.row_ub[r]:.12e}")
+        lines.append("BOUNDS")
+        for col in range(self.num_vars):
+            if self.var_lb[col] == self.var_ub[col]:
+                lines.append(f" FX BND       {'x' + str(col):<8}  "
+                             f"{self.var_lb[col]:.12e}")
+            else:
+                lines.append(f" BV BND       {'x' + str(col):<8}")
+        lines.append("ENDATA")
+        with open(filename, "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def _solve_cbc_mps(self, time_limit):
+        # pylint: disable=import-outside-toplevel
+        import pulp
+
+        cbc_path = pulp.PULP_CBC_CMD().path
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mps_file = os.path.join(tmp_dir, "model.mps")
+            sol_file = os.path.join(tmp_dir, "model.sol")
+            self.write_mps(mps_file)
+            subprocess.run([
+                cbc_path, mps_file, "-sec",
+                str(time_limit), "-threads",
+                str(multiprocessing.cpu_count()), "-timeMode", "elapsed",
+                "-branch", "-printingOptions", "all", "-solution", sol_file
+            ],
+                           stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL,
+                           check=False)
+            if not os.path.exists(sol_file):
+                return None, None, STATUS_NOT_SOLVED
+            with open(sol_file) as f:
+                status_line = f.readline()
+                x = np.zeros(self.num_vars)
+                for line in f:
+                    tokens = line.replace("**", "").split()
+                    if len(tokens) >= 3 and tokens[1].startswith("x"):
+                        x[int(tokens[1][1:])] = float(tokens[2])
+
+        if status_line.startswith("Infeasible"):
+            return None, None, STATUS_INFEASIBLE
+        if status_line.startswith("Optimal"):
+            status = STATUS_OPTIMAL
+        elif "objective value" in status_line:
+            # e.g., "Stopped on time - objective value ..."
+            status = STATUS_FEASIBLE
+        else:
+            return None, None, STATUS_NOT_SOLVED
+        return x, float(self.obj @ np.round(x)), status
+
+
+def _expand(ids, lengths):
+    """Expand each id into `length` entries. Return the expanded ids and
+    the position of each entry within its id."""
+    lengths = np.asarray(lengths, dtype=np.int64)
+    expanded = np.repeat(ids, lengths)
+    starts = np.cumsum(lengths) - lengths
+    pos = np.arange(len(expanded)) - np.repeat(starts, lengths)
+    return expanded.astype(np.int64), pos
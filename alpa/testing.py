@@ -243,15 +243,19 @@ class PipelineBasicTest(unittest.TestCase):
                 use_remat: bool = False,
                 stage_option: Optional[StageOption] = None,
                 as_option: Optional[AutoShardingOption] = None,
-                do_numerical_test: bool = True):
+                do_numerical_test: bool = True,
+                pipeline_schedule: str = "1f1b",
+                num_virtual_stages: int = 1):
         method = PipeshardParallel(
             num_micro_batches=4,
             default_auto_sharding_option=as_option or AutoShardingOption(),
+            pipeline_schedule=pipeline_schedule,
             layer_option=ManualLayerOption(remat_layer=use_remat)
             if manual_pipeline_layer else AutoLayerOption(
-                layer_num=2,
+                layer_num=2 * num_virtual_stages,
                 remat_mode="coarse_grained_remat" if use_remat else "none"),
-            stage_option=stage_option or UniformStageOption())
+            stage_option=stage_option or UniformStageOption(),
+            num_virtual_stages=num_virtual_stages)
 
         # Init model
         state, batch, train_step = get_mlp_train_state_and_step(
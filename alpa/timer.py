@@ -38,6 +38,13 @@ class _Timer:
         self.stop_times.append(stop_time)
         self.started = False
 
+    def record(self, start_time: float, stop_time: float):
+        """Record a cost measured outside of the timer, e.g., by another
+        thread."""
+        self.start_times.append(start_time)
+        self.stop_times.append(stop_time)
+        self.costs.append(stop_time - start_time)
+
     def reset(self):
         """Reset timer."""
         self.started = False
@@ -1491,11 +1491,12 @@ def create_placement_group(num_hosts,
         # `should_create_placement_group` is always True when using alpa alone.
         # `should_create_placement_group` can be false when integrated with Tune
         additional_resources_per_host = (additional_resources_per_host or {})
-        bundles = [{
-            "CPU": 1,
-            "GPU": host_num_devices[i],
-            **additional_resources_per_host
-        } for i in range(num_hosts)]
+        bundles = []
+        for i in range(num_hosts):
+            bundle = {"CPU": 1, **additional_resources_per_host}
+            # With the "cpu" backend, the devices are the CPUs of the bundle
+            bundle[global_config.ray_accelerator_name] = host_num_devices[i]
+            bundles.append(bundle)
 
         # Alpa Placement Group: `SPREAD` strategy is required
         # https://docs.ray.io/en/latest/ray-core/placement-group.html#strategy-types
@@ -1532,7 +1533,7 @@ def get_bundle_idx(placement_group: PlacementGroup, node_ips: List[str]):
     The placement group is a list of resource bundles.
     Each bundle will be assigned to **one** node.
 
-    First, we need to find the bundle index with GPU resources.
+    First, we need to find the bundle index with device resources.
     Then, we can find the node IP for the bundle index.
     Lastly, we sort bundle index according to the node IP list given.
 
@@ -1547,14 +1548,14 @@ def get_bundle_idx(placement_group: PlacementGroup, node_ips: List[str]):
     bundle_ips = get_bundle2ip(placement_group)
     bundle_specs = placement_group.bundle_specs
 
-    # filter out the bundle index with node (GPUs)
+    # filter out the bundle index with node (devices)
     node_bundle_idx_list = [
         i for i, bundle_spec in enumerate(bundle_specs)
-        if bundle_spec.get("GPU", 0) > 0
+        if bundle_spec.get(global_config.ray_accelerator_name, 0) > 0
     ]
 
     if len(node_bundle_idx_list) < len(node_ips):
-        raise ValueError("The number of bundles with GPU resources "
+        raise ValueError("The number of bundles with device resources "
                          "is less than the number of node IPs.")
 
     # node IP -> bundle index
@@ -0,0 +1,115 @@
+"""Benchmark the latency of per-tensor and coalesced GLOO collectives over the
+number of tensors.
+
+Usages:
+python3 benchmark_collective_coalesced.py
+python3 benchmark_collective_coalesced.py --num-tensors 16 256 --tensor-size 64
+"""
+import argparse
+import time
+
+import numpy as np
+import ray
+
+from alpa import collective as col
+
+
+@ray.remote(num_cpus=1)
+class Worker:
+
+    def __init__(self, world_size, rank, group_name):
+        self.world_size = world_size
+        self.rank = rank
+        self.group_name = group_name
+        col.init_collective_group(world_size, rank, "gloo", group_name)
+
+    def run_one_case(self, op, num_tensors, tensor_size, coalesced, niter,
+                     bucket_bytes):
+        tensors = [
+            np.ones((tensor_size,), dtype=np.float32)
+            for _ in range(num_tensors)
+        ]
+        outputs = [[np.empty_like(x)
+                    for _ in range(self.world_size)]
+                   for x in tensors]
+
+        def func():
+            if op == "allreduce":
+                if coalesced:
+                    col.allreduce_coalesced(tensors,
+                                            self.group_name,
+                                            bucket_bytes=bucket_bytes)
+                else:
+                    for x in tensors:
+                        col.allreduce(x, self.group_name)
+            elif op == "allgather":
+                if coalesced:
+                    col.allgather_coalesced(outputs,
+                                            tensors,
+                                            self.group_name,
+                                            bucket_bytes=bucket_bytes)
+                else:
+                    for x, y in zip(tensors, outputs):
+                        col.allgather(y, x, self.group_name)
+            else:
+                if coalesced:
+                    col.broadcast_coalesced(tensors,
+                                            0,
+                                            self.group_name,
+                                            bucket_bytes=bucket_bytes)
+                else:
+                    for x in tensors:
+                        col.broadcast(x, 0, self.group_name)
+
+        # Warmup
+        func()
+        col.barrier(self.group_name)
+
+        tic = time.time()
+        for _ in range(niter):
+            func()
+        return (time.time() - tic) / niter
+
+
+def benchmark_one_case(workers, op, num_tensors, tensor_size, coalesced, niter,
+                       bucket_bytes):
+    costs = ray.get([
+        w.run_one_case.remote(op, num_tensors, tensor_size, coalesced, niter,
+                              bucket_bytes) for w in workers
+    ])
+    return max(costs) * 1e3
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ops",
+                        type=str,
+                        nargs="+",
+                        default=["allreduce", "allgather", "broadcast"])
+    parser.add_argument("--num-tensors",
+                        type=int,
+                        nargs="+",
+                        default=[1, 16, 64, 256, 1024])
+    # The number of float32 elements of each tensor
+    parser.add_argument("--tensor-size", type=int, default=16)
+    parser.add_argument("--world-size", type=int, default=2)
+    parser.add_argument("--bucket-bytes", type=int)
+    parser.add_argument("--niter", type=int, default=10)
+    args = parser.parse_args()
+
+    ray.init(address="auto")
+    workers = [
+        Worker.remote(args.world_size, rank, "benchmark_coalesced")
+        for rank in range(args.world_size)
+    ]
+
+    print("op\t#tensors\tper-tensor (ms)\tcoalesced (ms)\tspeedup")
+    for op in args.ops:
+        for num_tensors in args.num_tensors:
+            ret = [
+                benchmark_one_case(workers, op, num_tensors, args.tensor_size,
+                                   coalesced, args.niter, args.bucket_bytes)
+                for coalesced in [False, True]
+            ]
+            print(f"{op}\t{num_tensors}\t{ret[0]:.3f}\t{ret[1]:.3f}\t"
+                  f"{ret[0] / ret[1]:.1f}x")
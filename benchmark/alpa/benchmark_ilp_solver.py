@@ -0,0 +1,67 @@
+"""Benchmark the backends of the auto-sharding ILP solver by replaying
+dumped solver inputs.
+
+Dump the inputs by setting ALPA_ILP_SOLVER_INPUTS_DUMP_DIR before running a
+model, then replay them:
+python3 benchmark_ilp_solver.py --inputs "ilp_inputs/*.pkl"
+"""
+import argparse
+import glob
+import pickle
+import time
+
+import numpy as np
+
+from alpa.global_env import global_config
+from alpa.shard_parallel import auto_sharding
+from alpa.shard_parallel.sparse_solver import SparseILP
+from alpa.util import write_tsv
+
+
+def benchmark_one_case(args, backend):
+    auto_sharding.solver_backend = backend
+    tic = time.time()
+    if backend == "pulp":
+        build_time = None
+    else:
+        SparseILP(*args)
+        build_time = time.time() - tic
+        tic = time.time()
+    _, _, objective, _ = auto_sharding._call_solver_serialized_args(*args)  # pylint: disable=protected-access
+    return build_time, time.time() - tic, objective
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--inputs", type=str, required=True)
+    parser.add_argument("--backends",
+                        type=str,
+                        default="pulp,scipy_milp,cbc_mps")
+    args = parser.parse_args()
+
+    # Do not hit the solution cache or dump the inputs again
+    global_config.ilp_solution_cache_dir = None
+    global_config.ilp_solver_inputs_dump_dir = None
+
+    heads = [
+        "Input", "#Nodes", "#Edges", "Backend", "Build Time (s)",
+        "Total Time (s)", "Objective"
+    ]
+    for filename in sorted(glob.glob(args.inputs)):
+        with open(filename, "rb") as f:
+            solver_args = pickle.load(f)
+        num_nodes = solver_args[0]
+        num_edges = len(solver_args[4]) // 2
+        objectives = []
+        for backend in args.backends.split(","):
+            build_time, total_time, objective = benchmark_one_case(
+                solver_args, backend)
+            objectives.append(objective)
+            values = [
+                filename, num_nodes, num_edges, backend,
+                "N/A" if build_time is None else f"{build_time:.3f}",
+                f"{total_time:.3f}", f"{objective:.6g}"
+            ]
+            write_tsv(heads, values, "result_ilp_solver.tsv")
+        if not np.allclose(objectives, objectives[0], rtol=1e-4):
+            print(f"Warning: objectives mismatch on {filename}: {objectives}")
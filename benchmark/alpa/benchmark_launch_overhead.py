@@ -0,0 +1,79 @@
+"""Benchmark the driver overhead of launching a pipeshard executable.
+
+The function has many small parameter leaves, so the time is dominated by
+the driver (argument routing, remote calls, and output allocation).
+
+Usages:
+python3 benchmark_launch_overhead.py
+python3 benchmark_launch_overhead.py --num-leaves 100 1000 4000 --niter 50
+"""
+import argparse
+import time
+
+import jax.numpy as jnp
+import numpy as np
+
+import alpa
+from alpa import (init, shutdown, parallelize, global_config,
+                  mark_pipeline_boundary, PipeshardParallel)
+
+
+def create_func(num_leaves):
+    method = PipeshardParallel(num_micro_batches=1,
+                               pipeline_schedule="inference",
+                               layer_option="manual")
+
+    @parallelize(method=method, batch_argnums=(1,), donate_argnums=())
+    def func(params, x):
+        outs = {}
+        for i in range(num_leaves):
+            if i == num_leaves // 2:
+                mark_pipeline_boundary()
+            outs[i] = params[i] + x
+        return outs
+
+    return func
+
+
+def benchmark_one_case(num_leaves, niter):
+    func = create_func(num_leaves)
+    params = {i: np.ones((4,), dtype=np.float32) for i in range(num_leaves)}
+    x = jnp.ones((4,), dtype=jnp.float32)
+    params, x = func.preshard_dynamic_args(params, x)
+    executable = func.get_executable(params, x)
+
+    results = {}
+    for fast_path in [False, True]:
+        global_config.pipeline_launch_fast_path = fast_path
+        # Warmup
+        outs = func(params, x)
+        executable.sync()
+
+        costs = []
+        for _ in range(niter):
+            tic = time.time()
+            outs = func(params, x)
+            costs.append(time.time() - tic)
+            executable.sync()
+        results[fast_path] = np.mean(costs) * 1e6
+        del outs
+    global_config.pipeline_launch_fast_path = True
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-leaves",
+                        type=int,
+                        nargs="+",
+                        default=[16, 256, 1024, 4096])
+    parser.add_argument("--niter", type=int, default=20)
+    args = parser.parse_args()
+
+    init(cluster="ray")
+    print("#leaves\tslow path (us/step)\tfast path (us/step)")
+    for num_leaves in args.num_leaves:
+        ret = benchmark_one_case(num_leaves, args.niter)
+        print(f"{num_leaves}\t{ret[False]:.1f}\t{ret[True]:.1f}")
+        alpa.clear_executable_cache()
+    shutdown()
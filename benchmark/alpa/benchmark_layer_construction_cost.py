@@ -0,0 +1,88 @@
+"""Benchmark the cost precomputation and the DP of auto layer construction on
+synthetic long jaxprs.
+
+Usages:
+python3 benchmark_layer_construction_cost.py --num-blocks 16 64
+python3 benchmark_layer_construction_cost.py --num-blocks 512 --skip-naive
+"""
+import argparse
+import time
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+
+from alpa.pipeline_parallel.layer_construction import (
+    jaxpr_eqns_input_sizes, jaxpr_eqns_input_sizes_naive,
+    get_layer_construction_costs, cluster_jaxpr_by_cost, search_layer_num,
+    DEFAULT_EPS)
+
+
+def get_synthetic_jaxpr(num_blocks, hidden_size=64):
+    """A transformer-like chain of blocks. Each block has two matmuls and
+    several elementwise ops with a residual connection."""
+
+    def func(x, weights):
+        for w1, w2 in weights:
+            h = jnp.tanh(x @ w1)
+            h = h * 0.5 + jnp.exp(-h)
+            x = x + h @ w2
+            x = x / (jnp.mean(x, axis=-1, keepdims=True) + 1.0)
+        return jnp.sum(x)
+
+    x = jnp.ones((8, hidden_size))
+    weights = [(jnp.ones((hidden_size, hidden_size)),
+                jnp.ones((hidden_size, hidden_size)))
+               for _ in range(num_blocks)]
+    return jax.make_jaxpr(jax.grad(func, argnums=1))(x, weights)
+
+
+def benchmark_one_case(num_blocks, skip_naive):
+    jaxpr = get_synthetic_jaxpr(num_blocks)
+    ret = {"num_eqns": len(jaxpr.eqns)}
+
+    tic = time.time()
+    input_sizes = jaxpr_eqns_input_sizes(jaxpr)
+    ret["input_sizes"] = time.time() - tic
+
+    if not skip_naive:
+        tic = time.time()
+        expected = jaxpr_eqns_input_sizes_naive(jaxpr)
+        ret["input_sizes_naive"] = time.time() - tic
+        assert np.array_equal(input_sizes, expected)
+
+    # Search with and without reusing the costs and DP solutions
+    tic = time.time()
+    layer_num = search_layer_num(jaxpr, DEFAULT_EPS)
+    cluster_jaxpr_by_cost(jaxpr, layer_num, DEFAULT_EPS,
+                          get_layer_construction_costs(jaxpr), "flops")
+    ret["search"] = time.time() - tic
+
+    tic = time.time()
+    costs = get_layer_construction_costs(jaxpr)
+    solutions = {}
+    reused_layer_num = search_layer_num(jaxpr,
+                                        DEFAULT_EPS,
+                                        costs=costs,
+                                        solutions=solutions)
+    assert reused_layer_num == layer_num
+    ret["search_reuse"] = time.time() - tic
+    return ret
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-blocks",
+                        type=int,
+                        nargs="+",
+                        default=[16, 32, 64, 128])
+    parser.add_argument("--skip-naive", action="store_true")
+    args = parser.parse_args()
+
+    print("#blocks\t#eqns\tinput sizes (s)\tnaive (s)\tsearch (s)\t"
+          "search with reuse (s)")
+    for num_blocks in args.num_blocks:
+        ret = benchmark_one_case(num_blocks, args.skip_naive)
+        naive = ret.get("input_sizes_naive", float("nan"))
+        print(f"{num_blocks}\t{ret['num_eqns']}\t{ret['input_sizes']:.3f}\t"
+              f"{naive:.3f}\t{ret['search']:.3f}\t{ret['search_reuse']:.3f}")
@@ -0,0 +1,95 @@
+"""Benchmark the load balancing solvers of cross-mesh resharding on synthetic
+works. It runs on CPU and does not need a cluster.
+
+Usages:
+python3 benchmark_resharding_loadbalance.py
+python3 benchmark_resharding_loadbalance.py --num-works 64 256 --num-workers 16
+"""
+import argparse
+import time
+
+import numpy as np
+
+from alpa.pipeline_parallel.cross_mesh_resharding import (
+    SingleAbstractedLoadBalancingWork, LoadBalancingOverSizeTaskSolver,
+    LoadBalancingTaskSolverGreedyAlgo, LoadBalancingTaskSolverSearchAlgo,
+    LoadBalancingTaskSolverLPTAlgo)
+
+solvers = {
+    "size": LoadBalancingOverSizeTaskSolver,
+    "greedy": LoadBalancingTaskSolverGreedyAlgo,
+    "search": LoadBalancingTaskSolverSearchAlgo,
+    "lpt": LoadBalancingTaskSolverLPTAlgo,
+}
+
+
+def get_synthetic_works(num_workers, num_works, max_senders, max_receivers,
+                        seed):
+    """Half of the workers are senders and the other half are receivers.
+    Each work can be sent by a few replicas to a few receivers."""
+    rng = np.random.RandomState(seed)
+    num_senders = num_workers // 2
+    num_receivers = num_workers - num_senders
+    works = []
+    for _ in range(num_works):
+        sender_ids = rng.choice(num_senders,
+                                rng.randint(1, max_senders + 1),
+                                replace=False)
+        receiver_ids = num_senders + rng.choice(
+            num_receivers, rng.randint(1, max_receivers + 1), replace=False)
+        works.append(
+            SingleAbstractedLoadBalancingWork(sorted(sender_ids.tolist()),
+                                              sorted(receiver_ids.tolist()),
+                                              int(rng.randint(1, 1024))))
+    return works
+
+
+def benchmark_one_case(num_workers, num_works, max_senders, max_receivers,
+                       seed, solver_names):
+    works = get_synthetic_works(num_workers, num_works, max_senders,
+                                max_receivers, seed)
+    evaluator = LoadBalancingTaskSolverLPTAlgo(num_workers, works)
+    ret = {"lower_bound": evaluator.get_lower_bound()}
+    for name in solver_names:
+        tic = time.time()
+        try:
+            assigned_sender_id, order = solvers[name](num_workers,
+                                                      works).solve()
+        except AssertionError:
+            # The search algorithm finds no solution within its time limit
+            ret[name] = (float("nan"), time.time() - tic)
+            continue
+        cost = time.time() - tic
+        makespan = evaluator.evaluate_solutions(np.array([assigned_sender_id]),
+                                                np.array([order]))[0]
+        ret[name] = (makespan, cost)
+    return ret
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-workers", type=int, default=32)
+    parser.add_argument("--num-works",
+                        type=int,
+                        nargs="+",
+                        default=[8, 32, 128, 512])
+    parser.add_argument("--max-senders", type=int, default=4)
+    parser.add_argument("--max-receivers", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--solvers",
+                        type=str,
+                        nargs="+",
+                        default=list(solvers.keys()),
+                        choices=list(solvers.keys()))
+    args = parser.parse_args()
+
+    print("#works\tlower bound\t" + "\t".join(
+        f"{name} makespan\t{name} time (s)" for name in args.solvers))
+    for num_works in args.num_works:
+        ret = benchmark_one_case(args.num_workers, num_works, args.max_senders,
+                                 args.max_receivers, args.seed, args.solvers)
+        line = f"{num_works}\t{ret['lower_bound']:.0f}"
+        for name in args.solvers:
+            makespan, cost = ret[name]
+            line += f"\t{makespan:.0f}\t{cost:.3f}"
+        print(line)
@@ -0,0 +1,93 @@
+"""Benchmark the inter-op stage construction DP on synthetic cost tensors.
+
+Usages:
+python3 benchmark_stage_construction_dp.py --num-layers 32 --num-hosts 4
+python3 benchmark_stage_construction_dp.py --num-layers 96 --num-hosts 8 --skip-old
+"""
+import argparse
+import time
+
+import numpy as np
+
+from alpa.pipeline_parallel.stage_construction import (get_submesh_choices,
+                                                       training_dp,
+                                                       training_dp_incremental)
+
+
+def generate_cost(num_layers, num_devices, submesh_choices,
+                  num_autosharding_configs, device_memory_size_factor):
+    """Generate compute_cost and max_n_succ_stages with a transformer-like
+    structure: costs grow with the layer range and shrink sub-linearly with
+    the submesh size."""
+    num_submesh_choices = len(submesh_choices)
+    layer_cost = np.random.rand(num_layers) + 1.0
+    layer_memory = np.random.rand(num_layers) + 1.0
+    layer_cost_prefix = np.concatenate([[0], np.cumsum(layer_cost)])
+    layer_memory_prefix = np.concatenate([[0], np.cumsum(layer_memory)])
+
+    start, end = np.meshgrid(np.arange(num_layers),
+                             np.arange(num_layers),
+                             indexing="ij")
+    range_cost = layer_cost_prefix[end + 1] - layer_cost_prefix[start]
+    range_memory = np.where(
+        start <= end, layer_memory_prefix[end + 1] - layer_memory_prefix[start],
+        np.inf)
+    submesh_sizes = np.array([np.prod(submesh) for submesh in submesh_choices])
+    config_factor = np.random.rand(num_layers, num_layers, num_submesh_choices,
+                                   num_autosharding_configs) + 1.0
+
+    compute_cost = (range_cost[:, :, None, None] /
+                    submesh_sizes[None, None, :, None]**0.8 * config_factor)
+    compute_cost[start > end] = np.inf
+    max_n_succ_stages = (device_memory_size_factor * num_layers *
+                         submesh_sizes[None, None, :, None] / num_devices /
+                         (range_memory[:, :, None, None] /
+                          layer_memory_prefix[-1]) / config_factor)
+    max_n_succ_stages = max_n_succ_stages.astype(np.int64)
+    max_n_succ_stages[start > end] = -1
+    return compute_cost, max_n_succ_stages
+
+
+def benchmark_one_case(func, *args):
+    # Warmup for numba compilation
+    func(*args)
+    tic = time.time()
+    cost, solution = func(*args)
+    return time.time() - tic, cost, solution
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-layers", type=int, default=32)
+    parser.add_argument("--num-hosts", type=int, default=4)
+    parser.add_argument("--num-devices-per-host", type=int, default=8)
+    parser.add_argument("--num-micro-batches", type=int, default=64)
+    parser.add_argument("--num-autosharding-configs", type=int, default=4)
+    parser.add_argument("--device-memory-size-factor", type=float, default=2.0)
+    parser.add_argument("--skip-old", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    np.random.seed(args.seed)
+    num_devices = args.num_hosts * args.num_devices_per_host
+    submesh_choices = get_submesh_choices(args.num_hosts,
+                                          args.num_devices_per_host, "all")
+    compute_cost, max_n_succ_stages = generate_cost(
+        args.num_layers, num_devices, submesh_choices,
+        args.num_autosharding_configs, args.device_memory_size_factor)
+    dp_args = (args.num_layers, num_devices, args.num_micro_batches,
+               submesh_choices, args.num_autosharding_configs, compute_cost,
+               max_n_succ_stages)
+
+    print(f"#layers: {args.num_layers}, #devices: {num_devices}, "
+          f"#submesh choices: {len(submesh_choices)}, "
+          f"#unique costs: {len(np.unique(compute_cost))}")
+    new_time, new_cost, new_solution = benchmark_one_case(
+        training_dp_incremental, *dp_args)
+    print(f"training_dp_incremental: {new_time:.3f} s, cost: {new_cost:.4f}")
+    if not args.skip_old:
+        old_time, old_cost, old_solution = benchmark_one_case(
+            training_dp, *dp_args)
+        print(f"training_dp: {old_time:.3f} s, cost: {old_cost:.4f}, "
+              f"speedup: {old_time / new_time:.2f}x")
+        assert (old_cost, old_solution) == (new_cost, new_solution)
@@ -0,0 +1,38 @@
+"""Evaluate the stage cost predictor on the samples of a fully profiled run.
+
+Run the auto stage construction with the "composition" layer profile mode and
+AutoStageOption(dump_cost_predictor_samples=True) to get a
+stage-cost-samples-*.pkl file, then replay the pruned profiling on it.
+
+Usages:
+python3 benchmark_stage_cost_predictor.py stage-cost-samples-xxx.pkl
+python3 benchmark_stage_cost_predictor.py stage-cost-samples-xxx.pkl --top-k 1 2
+"""
+import argparse
+import pickle
+
+from alpa.pipeline_parallel.stage_cost_predictor import evaluate_predictor
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("samples_file", type=str)
+    parser.add_argument("--top-k", type=int, nargs="+", default=[1, 2, 3])
+    parser.add_argument("--num-seed-ranges",
+                        type=int,
+                        nargs="+",
+                        default=[2, 4, 8])
+    args = parser.parse_args()
+
+    with open(args.samples_file, "rb") as f:
+        samples = pickle.load(f)
+    print(f"#candidates: {len(samples)}")
+
+    heads = ("top_k", "#seed ranges", "profiled fraction", "MAPE",
+             "best config recall")
+    print("\t".join(heads))
+    for top_k in args.top_k:
+        for num_seed_ranges in args.num_seed_ranges:
+            ret = evaluate_predictor(samples, top_k, num_seed_ranges)
+            print(f"{top_k}\t{num_seed_ranges}\t"
+                  f"{ret['profiled_fraction']:.3f}\t{ret['mape']:.3f}\t"
+                  f"{ret['best_config_recall']:.3f}")
@@ -0,0 +1,101 @@
+"""Test pipeshard parallel on CPU devices without GPUs.
+
+Run this file in its own process, because the backend of alpa is global.
+"""
+import unittest
+
+import jax
+import jax.numpy as jnp
+import optax
+
+from alpa import (init, shutdown, global_config, parallelize, PipeshardParallel)
+from alpa.model.model_util import TrainState
+from alpa.pipeline_parallel.layer_construction import manual_layer_construction
+from alpa.testing import MLPModel, assert_allclose
+
+
+class CPUPipeshardTest(unittest.TestCase):
+
+    def setUp(self):
+        self.old_backend = global_config.backend
+        global_config.backend = "cpu"
+        global_config.resharding_shm_transport = True
+        # Two meshes of one CPU device each
+        init(cluster="ray", num_nodes=1, num_devices_per_node=2)
+
+    def tearDown(self):
+        shutdown()
+        global_config.backend = self.old_backend
+        global_config.resharding_shm_transport = False
+
+    def run_2_layer_mlp(self, num_micro_batches):
+
+        def train_step(state, batch):
+
+            @manual_layer_construction
+            def loss_func(params, x, y):
+                out = state.apply_fn(params, x)
+                loss = jnp.mean((out - y)**2)
+                return loss
+
+            grads = jax.grad(loss_func)(state.params, batch["x"], batch["y"])
+            return grads
+
+        batch_size = 16
+        hidden_size = 64
+
+        x = jnp.ones((batch_size, hidden_size))
+        y = jnp.ones((batch_size, hidden_size))
+
+        # Init model and optimizer
+        model = MLPModel(num_layers=4,
+                         hidden_size=hidden_size,
+                         add_manual_pipeline_marker=True)
+        rngkey = jax.random.PRNGKey(0)
+        params = model.init(rngkey, x)
+        tx = optax.sgd(learning_rate=1e-2)
+        state = TrainState.create(apply_fn=model.apply,
+                                  params=params,
+                                  tx=tx,
+                                  dynamic_scale=None)
+
+        # Train step
+        batch = {"x": x, "y": y}
+        gradients = train_step(state, batch)
+        method = PipeshardParallel(num_micro_batches=num_micro_batches,
+                                   layer_option="manual")
+        p_train_step = parallelize(train_step, donate_argnums=(), method=method)
+        gradients_with_pipeline = p_train_step(state, batch)
+
+        # Check results
+        assert_allclose(gradients, gradients_with_pipeline)
+
+        # All tiles are resharded through shared memory without NCCL
+        executable = p_train_step.get_last_executable()
+        mesh_group = executable.mesh_group
+        assert len(mesh_group) == 2
+        collective_groups = [
+            cg for row in mesh_group.collective_groups for cg in row if cg
+        ]
+        assert collective_groups
+        for cg in collective_groups:
+            assert not cg.instantiated
+            assert cg.shm_channel_specs
+
+    def test_2_layer_mlp(self):
+        self.run_2_layer_mlp(1)
+
+    def test_2_layer_mlp_micro_batches(self):
+        self.run_2_layer_mlp(4)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(CPUPipeshardTest("test_2_layer_mlp"))
+    suite.addTest(CPUPipeshardTest("test_2_layer_mlp_micro_batches"))
+    return suite
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
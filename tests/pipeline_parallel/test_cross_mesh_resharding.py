@@ -1,4 +1,7 @@
 """Test cross-mesh resharding."""
+import multiprocessing
+import time
+from types import SimpleNamespace
 import unittest
 from alpa.pipeline_parallel.runtime_emitter import PipelineInstEmitter
 
@@ -13,12 +16,19 @@ import numpy as np
 
 from alpa import init
 from alpa.device_mesh import (DistributedArray, create_remote_array_refs,
-                              get_global_virtual_physical_mesh)
+                              get_global_virtual_physical_mesh,
+                              ReshardingTileSpec, ReshardingSendSpec,
+                              ReshardingRecvSpec)
+from alpa.collective import worker_shm_util
+from alpa.collective.worker_shm_util import (ShmChannel, ShmSender,
+                                             new_channel_spec, run_until_done)
 from alpa.mesh_executable import next_mesh_executable_uuid
 from alpa.global_env import global_config
 from alpa.pipeline_parallel.cross_mesh_resharding import (
     CollectiveGroup, ReshardingTaskSpec, CrossMeshCommunicator,
-    SymbolicReshardingTask, SymbolicBroadcastReshardingTask)
+    SymbolicReshardingTask, SymbolicBroadcastReshardingTask,
+    ReshardingPlanCache, SingleAbstractedLoadBalancingWork,
+    LoadBalancingOverSizeTaskSolver, LoadBalancingTaskSolverLPTAlgo)
 from alpa.pipeline_parallel.pipeshard_executable import (
     AllocateZeroWorkerExecutableConfig, PipelineInstruction,
     PipeshardMeshWorkerExecutable)
@@ -365,6 +375,296 @@ class ReshardingTest(unittest.TestCase):
     def test_8gpu_broadcast(self):
         self._test_8gpu_broadcast("cupy")
 
+    def test_4gpu_send_recv_shm(self):
+        global_config.resharding_shm_transport = True
+        try:
+            self._test_4gpu_send_recv("cupy")
+            self._test_4gpu_allgather("cupy")
+            # Stream the tiles in chunks
+            global_config.resharding_shm_ring_bytes = 1000
+            self._test_4gpu_send_recv("cupy")
+        finally:
+            global_config.resharding_shm_transport = False
+            global_config.resharding_shm_ring_bytes = 1 << 26
+
+
+def get_shm_test_tiles():
+    array = np.arange(64 * 48, dtype=np.float32).reshape(64, 48)
+    return [
+        (array, (slice(0, 64), slice(0, 48))),
+        (array, (slice(8, 40), slice(0, 48))),
+        (array, (slice(3, 61), slice(5, 17))),
+        (array > 100, (slice(0, 7), slice(1, 9))),
+        (array, (slice(0, 0), slice(0, 48))),
+    ]
+
+
+def send_shm_test_tiles(channel_specs):
+    channels = [ShmChannel(spec) for spec in channel_specs]
+
+    def send_all(channel):
+        for array, indices in get_shm_test_tiles():
+            yield from channel.send_iter(array[indices])
+
+    run_until_done([send_all(channel) for channel in channels])
+    wait_and_close_channels(channels)
+
+
+def wait_and_close_channels(channels):
+    # Wait for the receiver before removing the channels
+    for channel in channels:
+        while channel.read_counter[0] < channel.write_counter[0]:
+            time.sleep(1e-3)
+        channel.close()
+
+
+def get_exchange_tiles(value, nbytes_list):
+    return [
+        np.full((nbytes // 4,), value + i, dtype=np.float32)
+        for i, nbytes in enumerate(nbytes_list)
+    ]
+
+
+def exchange_shm_tiles(send_spec, recv_spec, value, peer_value, nbytes_list):
+    """Send tiles to the peer, and then receive the tiles of the peer."""
+    send_channel = ShmChannel(send_spec)
+    recv_channel = ShmChannel(recv_spec)
+    sender = ShmSender()
+    # It does not wait for the peer to receive
+    sender.submit(send_channel, get_exchange_tiles(value, nbytes_list))
+
+    expected = get_exchange_tiles(peer_value, nbytes_list)
+    outputs = [np.zeros_like(x) for x in expected]
+
+    def recv_all():
+        for dst in outputs:
+            yield from recv_channel.recv_iter(dst, (slice(0, dst.shape[0]),))
+
+    run_until_done([recv_all()])
+    sender.close()
+    wait_and_close_channels([send_channel])
+    recv_channel.close()
+    for dst, array in zip(outputs, expected):
+        np.testing.assert_array_equal(dst, array)
+
+
+def get_cpu_shm_worker():
+    backend = jax.lib.xla_bridge.get_backend("cpu")
+    return SimpleNamespace(buffers={},
+                           backend=backend,
+                           local_devices=backend.local_devices()[:1],
+                           shm_channels={},
+                           shm_sender=None)
+
+
+def get_cpu_resharding_array():
+    return np.arange(8 * 6, dtype=np.float32).reshape(8, 6)
+
+
+def send_cpu_resharding_tiles(channel_spec):
+    """Send two tiles of a buffer on a CPU device."""
+    worker = get_cpu_shm_worker()
+    worker.buffers[0] = [
+        worker.backend.buffer_from_pyval(get_cpu_resharding_array(),
+                                         worker.local_devices[0])
+    ]
+    send_specs = [
+        ReshardingSendSpec(
+            0,
+            ReshardingTileSpec([slice(0, 4), slice(0, 6)], 0, 0,
+                               channel_spec)),
+        ReshardingSendSpec(
+            0,
+            ReshardingTileSpec([slice(4, 8), slice(0, 6)], 0, 0,
+                               channel_spec)),
+    ]
+    worker_shm_util.send_tiles(worker, 0, send_specs, "test")
+    # The buffer can be freed before the tiles are received
+    worker.buffers[0][0].delete()
+    del worker.buffers[0]
+    worker_shm_util.wait_sender(worker)
+    wait_and_close_channels(worker.shm_channels["test"].values())
+
+
+class ReshardingPlanCacheTest(unittest.TestCase):
+
+    @staticmethod
+    def get_virtual_mesh(ips, num_devices_per_host):
+        devices = [list(range(num_devices_per_host)) for _ in ips]
+        return SimpleNamespace(
+            shape=(len(ips), num_devices_per_host),
+            num_hosts=len(ips),
+            num_devices=len(ips) * num_devices_per_host,
+            host_info=[{"NodeManagerAddress": ip} for ip in ips],
+            devices=devices,
+            device_strs=[f"{ip}:gpu:{d}" for ip in ips for d in range(
+                num_devices_per_host)])
+
+    @staticmethod
+    def get_task_spec(src_mesh, dst_mesh):
+        aval = ShapedArray((8, 8), jnp.float32)
+        src_spec = ShardingSpec([Chunked([2]), NoSharding()],
+                                [ShardedAxis(0), Replicated(2)])
+        dst_spec = ShardingSpec([NoSharding(), Chunked([2, 2])],
+                                [ShardedAxis(0), ShardedAxis(1)])
+        src_array = VirtualDistributedArray(device_mesh=src_mesh,
+                                            aval=aval,
+                                            sharding_spec=src_spec)
+        dst_array = VirtualDistributedArray(device_mesh=dst_mesh,
+                                            aval=aval,
+                                            sharding_spec=dst_spec)
+        return ReshardingTaskSpec(src_array, dst_array, dst_spec)
+
+    @staticmethod
+    def flatten_tile_map(tile_map):
+        return [(dst_tile.replica_device_strs, dst_tile.indices,
+                 [(x.replica_device_strs, x.indices, x.offset)
+                  for x in src_tileslices], indices)
+                for dst_tile, src_tileslices, indices in tile_map]
+
+    def test_rebase_tile_map(self):
+        cache = ReshardingPlanCache()
+        meshes = [
+            self.get_virtual_mesh([ip], 4)
+            for ip in ["1.1.1.1", "2.2.2.2", "3.3.3.3", "4.4.4.4"]
+        ]
+
+        spec = self.get_task_spec(meshes[0], meshes[1])
+        tile_map = cache.get_tile_map(spec)
+        # The same mesh pair reuses the plan
+        same_spec = self.get_task_spec(meshes[0], meshes[1])
+        assert cache.get_tile_map(same_spec) is tile_map
+        # Another mesh pair gets a rebased plan
+        other_spec = self.get_task_spec(meshes[2], meshes[3])
+        assert (self.flatten_tile_map(cache.get_tile_map(other_spec)) ==
+                self.flatten_tile_map(other_spec.generate_src_dst_map()))
+        assert cache.hits == 2 and cache.misses == 1
+
+
+class LoadBalancingSolverTest(unittest.TestCase):
+
+    @staticmethod
+    def get_random_works(n_senders, n_receivers, n_works, seed=0):
+        rng = np.random.RandomState(seed)
+        works = []
+        for _ in range(n_works):
+            sender_ids = rng.choice(n_senders,
+                                    rng.randint(1, 5),
+                                    replace=False)
+            receiver_ids = n_senders + rng.choice(
+                n_receivers, rng.randint(1, 3), replace=False)
+            works.append(
+                SingleAbstractedLoadBalancingWork(sorted(sender_ids.tolist()),
+                                                  sorted(receiver_ids.tolist()),
+                                                  rng.randint(1, 100)))
+        return n_senders + n_receivers, works
+
+    def test_lpt_optimal(self):
+        # Workers 0 and 1 send to workers 2 and 3. The optimal schedule runs
+        # the works with a fixed sender first.
+        works = [
+            SingleAbstractedLoadBalancingWork([0, 1], [2], 5),
+            SingleAbstractedLoadBalancingWork([0, 1], [3], 5),
+            SingleAbstractedLoadBalancingWork([0], [2], 3),
+            SingleAbstractedLoadBalancingWork([1], [3], 3),
+        ]
+        solver = LoadBalancingTaskSolverLPTAlgo(4, works)
+        solver.solve()
+        assert solver.makespan == solver.get_lower_bound() == 8
+
+    def test_lpt_large(self):
+        n_workers, works = self.get_random_works(16, 16, 256)
+        solver = LoadBalancingTaskSolverLPTAlgo(n_workers, works)
+        assigned_sender_id, order = solver.solve()
+        assert sorted(order) == list(range(len(works)))
+        for work, sender in zip(works, assigned_sender_id):
+            assert sender in work.sender_ids
+        assert solver.makespan == solver.evaluate_solutions(
+            np.array([assigned_sender_id]), np.array([order]))[0]
+        assert solver.makespan >= solver.get_lower_bound()
+
+        # Deterministic and no worse than only balancing the sizes
+        assert LoadBalancingTaskSolverLPTAlgo(
+            n_workers, works).solve() == (assigned_sender_id, order)
+        size_solution = LoadBalancingOverSizeTaskSolver(n_workers,
+                                                        works).solve()
+        assert solver.makespan <= solver.evaluate_solutions(
+            np.array([size_solution[0]]), np.array([size_solution[1]]))[0]
+
+
+class ShmChannelTest(unittest.TestCase):
+
+    def test_send_recv_tiles(self):
+        # A ring larger than all tiles, and rings that split or wrap tiles
+        for capacity in [1 << 20, 4096, 1000]:
+            specs = [new_channel_spec(capacity) for _ in range(3)]
+            ctx = multiprocessing.get_context("spawn")
+            sender = ctx.Process(target=send_shm_test_tiles, args=(specs,))
+            sender.start()
+
+            channels = [ShmChannel(spec) for spec in specs]
+            outputs = [[np.zeros_like(array)
+                        for array, _ in get_shm_test_tiles()]
+                       for _ in channels]
+
+            def recv_all(channel, output):
+                for dst, (_, indices) in zip(output, get_shm_test_tiles()):
+                    yield from channel.recv_iter(dst, indices)
+
+            run_until_done([
+                recv_all(channel, output)
+                for channel, output in zip(channels, outputs)
+            ])
+            sender.join()
+            for channel in channels:
+                channel.close()
+
+            for output in outputs:
+                for dst, (array, indices) in zip(output, get_shm_test_tiles()):
+                    expected = np.zeros_like(array)
+                    expected[indices] = array[indices]
+                    np.testing.assert_array_equal(dst, expected)
+
+
+    def test_bidirectional_send_recv(self):
+        # Both sides send more bytes than the rings hold before receiving,
+        # including tiles larger than the rings
+        capacity = 4096
+        nbytes_list = [3000, 10000, 4096, 20000, 12]
+        spec_a, spec_b = new_channel_spec(capacity), new_channel_spec(capacity)
+        ctx = multiprocessing.get_context("spawn")
+        peer = ctx.Process(target=exchange_shm_tiles,
+                           args=(spec_b, spec_a, 100, 0, nbytes_list))
+        peer.start()
+        exchange_shm_tiles(spec_a, spec_b, 0, 100, nbytes_list)
+        peer.join()
+        assert peer.exitcode == 0
+
+    def test_cpu_resharding_tiles(self):
+        spec = new_channel_spec(1 << 20)
+        ctx = multiprocessing.get_context("spawn")
+        sender = ctx.Process(target=send_cpu_resharding_tiles, args=(spec,))
+        sender.start()
+
+        worker = get_cpu_shm_worker()
+        array = get_cpu_resharding_array()
+        # Receive the two tiles in transposed positions
+        tile_specs = [
+            ReshardingTileSpec([slice(4, 8), slice(0, 6)], 0, 0, spec),
+            ReshardingTileSpec([slice(0, 4), slice(0, 6)], 0, 0, spec),
+        ]
+        recv_spec = ReshardingRecvSpec(0, array.shape, array.dtype,
+                                       tile_specs)
+        worker_shm_util.recv_tiles(worker, 0, [(recv_spec, tile_specs)], True,
+                                   "test")
+        sender.join()
+        assert sender.exitcode == 0
+        worker_shm_util.destroy_channels(worker, "test")
+
+        expected = np.concatenate([array[4:8], array[0:4]])
+        np.testing.assert_array_equal(np.asarray(worker.buffers[0][0]),
+                                      expected)
+
 
 def suite():
     suite = unittest.TestSuite()
@@ -373,6 +673,13 @@ def suite():
     suite.addTest(ReshardingTest("test_8gpu_2_dim_allgather"))
     suite.addTest(ReshardingTest("test_4gpu_broadcast"))
     suite.addTest(ReshardingTest("test_8gpu_broadcast"))
+    suite.addTest(ReshardingTest("test_4gpu_send_recv_shm"))
+    suite.addTest(ReshardingPlanCacheTest("test_rebase_tile_map"))
+    suite.addTest(LoadBalancingSolverTest("test_lpt_optimal"))
+    suite.addTest(LoadBalancingSolverTest("test_lpt_large"))
+    suite.addTest(ShmChannelTest("test_send_recv_tiles"))
+    suite.addTest(ShmChannelTest("test_bidirectional_send_recv"))
+    suite.addTest(ShmChannelTest("test_cpu_resharding_tiles"))
     return suite
 
 
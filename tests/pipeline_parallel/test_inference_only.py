@@ -4,8 +4,8 @@ import jax
 import jax.numpy as jnp
 import numpy as np
 
-from alpa import (init, shutdown, parallelize, PipeshardParallel,
-                  mark_pipeline_boundary)
+from alpa import (init, shutdown, parallelize, global_config,
+                  PipeshardParallel, mark_pipeline_boundary)
 from alpa.model.bert_model import BertConfig, FlaxBertLayerCollection
 from alpa.testing import (MLPModel, create_train_state, mlp_inference_step,
                           bert_layer_collection_inference_step, assert_allclose)
@@ -114,12 +114,36 @@ class PipelineInferenceTest(unittest.TestCase):
         assert_allclose(b, np.ones(32) * (2 + 1))
         assert_allclose(c, 3)
 
+    def test_launch_fast_path(self):
+        method = PipeshardParallel(num_micro_batches=2,
+                                   pipeline_schedule="inference",
+                                   layer_option="manual")
+
+        @parallelize(method=method, batch_argnums=(1,), donate_argnums=())
+        def func(w, x):
+            a = w + x
+            mark_pipeline_boundary()
+            b = a * 2
+            return w + 1, b
+
+        # Outputs are fed back as inputs, which takes the fast path
+        for fast_path in [True, False]:
+            global_config.pipeline_launch_fast_path = fast_path
+            w = np.ones(32, dtype=np.float32)
+            x = np.ones(32, dtype=np.float32)
+            for i in range(3):
+                w, b = func(w, x)
+                assert_allclose(w, np.ones(32) * (i + 2))
+                assert_allclose(b, (np.ones(32) * (i + 1) + 1) * 2)
+        global_config.pipeline_launch_fast_path = True
+
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(PipelineInferenceTest("test_mlp"))
     suite.addTest(PipelineInferenceTest("test_bert"))
     suite.addTest(PipelineInferenceTest("test_output"))
+    suite.addTest(PipelineInferenceTest("test_launch_fast_path"))
     return suite
 
 
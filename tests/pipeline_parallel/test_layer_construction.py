@@ -1,7 +1,14 @@
 import unittest
 
 import jax
-from alpa.testing import PipelineBasicTest
+import numpy as np
+
+from alpa.pipeline_parallel.layer_construction import (
+    jaxpr_eqns_input_sizes, jaxpr_eqns_input_sizes_naive,
+    get_layer_construction_costs, cluster_jaxpr_by_cost, search_layer_num,
+    DEFAULT_EPS)
+from alpa.testing import (PipelineBasicTest,
+                          get_bert_layer_train_state_and_step)
 
 
 class LayerConstructionTest(PipelineBasicTest):
@@ -17,11 +24,49 @@ class LayerConstructionTest(PipelineBasicTest):
         self.run_n_layer_bert(num_layers=8, manual_pipeline_layer=False)
 
 
+class LayerConstructionCostTest(unittest.TestCase):
+
+    def get_bert_jaxpr(self, num_layers):
+        state, batch, train_step = get_bert_layer_train_state_and_step(
+            batch_size=4,
+            seq_len=16,
+            num_layers=num_layers,
+            hidden_size=32,
+            num_heads=4,
+            clip_by_global_norm=False,
+            use_dynamic_scale=False,
+            add_manual_pipeline_marker=False)
+        return jax.make_jaxpr(train_step)(state, batch)
+
+    def test_input_sizes(self):
+        jaxpr = self.get_bert_jaxpr(num_layers=2)
+        assert np.array_equal(jaxpr_eqns_input_sizes(jaxpr),
+                              jaxpr_eqns_input_sizes_naive(jaxpr))
+
+    def test_search_layer_num_reuse(self):
+        jaxpr = self.get_bert_jaxpr(num_layers=4)
+        expected = search_layer_num(jaxpr, DEFAULT_EPS)
+
+        costs = get_layer_construction_costs(jaxpr)
+        solutions = {}
+        layer_num = search_layer_num(jaxpr,
+                                     DEFAULT_EPS,
+                                     costs=costs,
+                                     solutions=solutions)
+        assert layer_num == expected
+        sliced_eqns, _ = cluster_jaxpr_by_cost(jaxpr, layer_num, DEFAULT_EPS,
+                                               costs, "flops")
+        assert [len(x) for x in solutions[layer_num][0]
+               ] == [len(x) for x in sliced_eqns]
+
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(LayerConstructionTest('test_mlp_layer_construction'))
     suite.addTest(LayerConstructionTest('test_2_layer_bert_layer_construction'))
     suite.addTest(LayerConstructionTest('test_8_layer_bert_layer_construction'))
+    suite.addTest(LayerConstructionCostTest('test_input_sizes'))
+    suite.addTest(LayerConstructionCostTest('test_search_layer_num_reuse'))
     return suite
 
 
@@ -0,0 +1,121 @@
+"""Test the static memory planner of pipeline instructions."""
+import unittest
+
+import numpy as np
+
+from alpa import init, shutdown, parallelize, global_config, PipeshardParallel
+from alpa.pipeline_parallel.memory_planner import (simulate_memory_timeline,
+                                                   sink_allocations,
+                                                   plan_mesh_memory)
+from alpa.pipeline_parallel.runtime_emitter import (PipelineInstruction,
+                                                    PipelineInstType)
+from alpa.testing import get_mlp_train_state_and_step, assert_allclose
+
+
+def get_test_instructions():
+    # Buffer 0 is the input. Task 50 allocates the gradient buffer 1 and task
+    # 51 allocates the receiving buffer 3. Task 8 donates buffer 1.
+    instructions = [
+        PipelineInstruction.run(50, [], np.array([1]), {}),
+        PipelineInstruction.run(7, np.array([0]), np.array([2]), {}),
+        PipelineInstruction.run(51, [], np.array([3]), {}),
+        PipelineInstruction.send(9, np.array([2])),
+        PipelineInstruction.recv(10, np.array([3]), True),
+        PipelineInstruction.free(np.array([0])),
+        PipelineInstruction.run(8, np.array([2, 3, 1]), np.array([4]), {}),
+        PipelineInstruction.free(np.array([2, 3])),
+    ]
+    buffer_bytes = {0: 10, 1: 100, 2: 20, 3: 30, 4: 5}
+    donated_invars = {8: (False, False, True)}
+    return instructions, buffer_bytes, donated_invars
+
+
+class MemoryPlannerTest(unittest.TestCase):
+
+    def test_simulate_memory_timeline(self):
+        instructions, buffer_bytes, donated_invars = get_test_instructions()
+        timeline = simulate_memory_timeline(instructions, buffer_bytes, [0],
+                                            donated_invars)
+        assert timeline.initial_bytes == 10
+        assert timeline.live_bytes == [110, 130, 160, 160, 160, 150, 55, 5]
+        assert timeline.peak_bytes == 160
+        assert timeline.peak_index == 2
+
+    def test_sink_allocations(self):
+        instructions, buffer_bytes, donated_invars = get_test_instructions()
+        new_instructions = sink_allocations(instructions, {50, 51})
+        assert sorted(map(id, new_instructions)) == sorted(
+            map(id, instructions))
+        opcodes = [(x.opcode, x.task_uuid) for x in new_instructions]
+        # The RECV does not cross the SEND, and the allocations are right
+        # before their first uses.
+        assert opcodes.index((PipelineInstType.SEND, 9)) < opcodes.index(
+            (PipelineInstType.RECV, 10))
+        assert opcodes.index((PipelineInstType.RUN, 51)) + 1 == opcodes.index(
+            (PipelineInstType.RECV, 10))
+        assert opcodes.index((PipelineInstType.RUN, 50)) + 1 == opcodes.index(
+            (PipelineInstType.RUN, 8))
+
+        new_lists, timeline = plan_mesh_memory([instructions], buffer_bytes,
+                                               [0], donated_invars, {50, 51},
+                                               True, None)
+        assert timeline.peak_bytes == 150
+        # No reordering if the peak is within the budget
+        new_lists, timeline = plan_mesh_memory([instructions], buffer_bytes,
+                                               [0], donated_invars, {50, 51},
+                                               True, 1000)
+        assert new_lists[0] is instructions and timeline.peak_bytes == 160
+
+
+class MemoryPlannerRuntimeTest(unittest.TestCase):
+
+    def setUp(self):
+        init(cluster="ray")
+
+    def tearDown(self):
+        global_config.pipeline_memory_reorder = False
+        shutdown()
+
+    def run_mlp(self, reorder):
+        global_config.pipeline_memory_reorder = reorder
+        state, batch, train_step = get_mlp_train_state_and_step(
+            batch_size=64,
+            hidden_size=256,
+            num_layers=4,
+            add_manual_pipeline_marker=True)
+        method = PipeshardParallel(num_micro_batches=4, layer_option="manual")
+        p_train_step = parallelize(train_step, method=method)
+        executable = p_train_step.get_executable(state, batch)
+        for mesh in executable.mesh_group:
+            mesh.reset_memory_stats()
+
+        expected_state, _ = train_step(state, batch)
+        actual_state, _ = p_train_step(state, batch)
+        assert_allclose(expected_state.params, actual_state.params, 1e-3,
+                        1e-3)
+
+        timelines = executable.get_memory_timeline()
+        assert len(timelines) == len(executable.mesh_group)
+        for timeline, mesh in zip(timelines, executable.mesh_group):
+            # The planner does not count temporary buffers
+            assert 0 < timeline.peak_bytes <= mesh.get_max_memory_allocated()
+        return [timeline.peak_bytes for timeline in timelines]
+
+    def test_memory_timeline(self):
+        peaks = self.run_mlp(reorder=False)
+        reordered_peaks = self.run_mlp(reorder=True)
+        for peak, reordered_peak in zip(peaks, reordered_peaks):
+            assert reordered_peak <= peak
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(MemoryPlannerTest("test_simulate_memory_timeline"))
+    suite.addTest(MemoryPlannerTest("test_sink_allocations"))
+    suite.addTest(MemoryPlannerRuntimeTest("test_memory_timeline"))
+    return suite
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
@@ -3,13 +3,16 @@ import os
 
 import jax
 import jax.numpy as jnp
+import numpy as np
 import optax
 import ray
 
-from alpa import init, parallelize, PipeshardParallel
+from alpa import init, global_config, parallelize, PipeshardParallel
 from alpa.model.model_util import TrainState
 from alpa.parallel_method import LocalPipelineParallel
 from alpa.pipeline_parallel.layer_construction import manual_layer_construction
+from alpa.pipeline_parallel.runtime_emitter import (
+    PipelineInstruction, PipelineInstType, merge_adjacent_free_instructions)
 from alpa.testing import MLPModel, assert_allclose
 
 
@@ -66,6 +69,7 @@ class PipelineMLPTest(unittest.TestCase):
         if isinstance(method, PipeshardParallel):
             executable = p_train_step.get_last_executable()
             executable.dump_debug_info("tmp")
+        return p_train_step
 
     def test_2_layer_mlp_local_pipeline_parallel(self):
         self.train_2_layer_mlp(LocalPipelineParallel())
@@ -74,11 +78,56 @@ class PipelineMLPTest(unittest.TestCase):
         init(cluster="ray")
         self.train_2_layer_mlp(PipeshardParallel(layer_option="manual"))
 
+    def test_deduplicate_util_executables(self):
+        init(cluster="ray")
+        global_config.print_compilation_time = True
+        try:
+            # Receiving buffers of all micro batches are allocated by the same
+            # executable
+            p_train_step = self.train_2_layer_mlp(
+                PipeshardParallel(num_micro_batches=4, layer_option="manual"))
+        finally:
+            global_config.print_compilation_time = False
+        executable = p_train_step.get_last_executable()
+        assert executable.num_reused_executables > 0
+
+    def test_instruction_latency_stats(self):
+        init(cluster="ray")
+        global_config.pipeline_collect_instruction_latency = True
+        try:
+            p_train_step = self.train_2_layer_mlp(
+                PipeshardParallel(layer_option="manual"))
+        finally:
+            global_config.pipeline_collect_instruction_latency = False
+        executable = p_train_step.get_last_executable()
+        for mesh_stats in executable.get_instruction_latency_stats():
+            for worker_stats in mesh_stats:
+                assert worker_stats["RUN"]["count"] > 0
+                assert sum(worker_stats["RUN"]["buckets"]) == (
+                    worker_stats["RUN"]["count"])
+                assert worker_stats["OVERHEAD"]["count"] == 1
+
+    def test_merge_adjacent_free_instructions(self):
+        instructions = [
+            PipelineInstruction.free(np.array([0, 1])),
+            PipelineInstruction.free(np.array([2])),
+            PipelineInstruction.run(0, [3], [4], {}),
+            PipelineInstruction.free(np.array([3])),
+        ]
+        merged = merge_adjacent_free_instructions(instructions)
+        assert [x.opcode for x in merged] == [
+            PipelineInstType.FREE, PipelineInstType.RUN, PipelineInstType.FREE
+        ]
+        assert list(merged[0].input_uuids) == [0, 1, 2]
+
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(PipelineMLPTest("test_2_layer_mlp_local_pipeline_parallel"))
     suite.addTest(PipelineMLPTest("test_2_layer_mlp_pipeshard_parallel"))
+    suite.addTest(PipelineMLPTest("test_deduplicate_util_executables"))
+    suite.addTest(PipelineMLPTest("test_instruction_latency_stats"))
+    suite.addTest(PipelineMLPTest("test_merge_adjacent_free_instructions"))
     return suite
 
 
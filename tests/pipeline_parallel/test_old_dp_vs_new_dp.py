@@ -1,9 +1,9 @@
 import unittest
 import numpy as np
 
-from alpa.pipeline_parallel.stage_construction import (get_submesh_choices,
-                                                       training_dp as dp,
-                                                       training_dp_2 as dp_2)
+from alpa.pipeline_parallel.stage_construction import (
+    get_submesh_choices, training_dp as dp, training_dp_2 as dp_2,
+    training_dp_incremental as dp_incremental)
 
 
 def default_num_auto_sharding_configs(num_devices):
@@ -104,6 +104,41 @@ class OldNewDPTest(unittest.TestCase):
                                            max_n_succ_stages)
                             assert res_new == res_old
 
+    def test_incremental_dp(self):
+        num_runs = 2
+        np.random.seed(0)
+
+        for num_layers in [4, 8]:
+            for num_hosts in [1, 4]:
+                for num_devices_per_host in [1, 4]:
+                    submesh_choices = get_submesh_choices(
+                        num_hosts, num_devices_per_host, "all")
+                    for num_micro_batches in [1, 16, 512]:
+                        for i in range(num_runs):
+                            compute_cost_factor = np.random.rand() * 4 - 2
+                            device_memory_size_factor = np.random.rand() * 4
+                            num_devices = num_hosts * num_devices_per_host
+                            num_autosharding_configs = np.random.randint(1, 5)
+                            (compute_cost, max_n_succ_stages
+                            ) = generate_stage_construction_test_case(
+                                num_devices, submesh_choices, num_layers,
+                                num_autosharding_configs, compute_cost_factor,
+                                device_memory_size_factor)
+                            # Round the costs to create ties in the DP.
+                            if i % 2 == 1:
+                                compute_cost = np.round(compute_cost, 1)
+
+                            res_old = dp(num_layers, num_devices,
+                                         num_micro_batches, submesh_choices,
+                                         num_autosharding_configs, compute_cost,
+                                         max_n_succ_stages)
+
+                            res_new = dp_incremental(
+                                num_layers, num_devices, num_micro_batches,
+                                submesh_choices, num_autosharding_configs,
+                                compute_cost, max_n_succ_stages)
+                            assert res_new == res_old
+
 
 def suite():
     suite = unittest.TestSuite()
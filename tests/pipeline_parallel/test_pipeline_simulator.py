@@ -0,0 +1,109 @@
+"""Test the pipeline simulator."""
+import unittest
+
+import numpy as np
+
+from alpa import init, shutdown, parallelize, PipeshardParallel
+from alpa.global_env import global_config
+from alpa.pipeline_parallel.pipeline_simulator import (
+    StageConstructionSimulator, get_step_times_from_execution_info,
+    simulate_executable, simulate_pipeline)
+from alpa.pipeline_parallel.schedules import (create_pipeline_schedule,
+                                              gen_linear_pipeline_dependency)
+from alpa.test_install import get_mlp_train_state_and_step
+
+
+def create_schedule(name, num_meshes, num_batch):
+    return create_pipeline_schedule(
+        name,
+        dependency=gen_linear_pipeline_dependency(2 * num_meshes),
+        meshes=[None] * num_meshes,
+        apply_grad_placement={},
+        num_batch=num_batch)
+
+
+class PipelineSimulatorTest(unittest.TestCase):
+
+    def test_balanced_stages(self):
+        num_meshes, num_batch = 3, 4
+        stage_costs = [1.0] * num_meshes + [2.0] * num_meshes
+        for name in ["gpipe", "1f1b", "1f1b_overlap_friendly"]:
+            schedule = create_schedule(name, num_meshes, num_batch)
+            result = simulate_pipeline(schedule, stage_costs)
+            # Equal to sum(stage costs) + (B - 1) * max(stage costs)
+            assert result.step_time == 3 * num_meshes + 3 * (num_batch - 1)
+            assert np.isclose(result.bubble_fraction,
+                              1 - 3 * num_batch / result.step_time)
+
+    def test_communication_and_memory(self):
+        num_meshes, num_batch = 3, 4
+        stage_costs = [1.0] * num_meshes + [2.0] * num_meshes
+        comm_costs = {(0, 1): 0.5, (1, 2): 0.5, (2, 1): 0.5, (1, 0): 0.5}
+        activation_bytes = [10] * num_meshes + [0] * num_meshes
+
+        results = {}
+        for name in ["gpipe", "1f1b"]:
+            schedule = create_schedule(name, num_meshes, num_batch)
+            results[name] = simulate_pipeline(
+                schedule,
+                stage_costs,
+                comm_costs,
+                stage_activation_bytes=activation_bytes)
+        gpipe, one_f_one_b = results["gpipe"], results["1f1b"]
+        assert gpipe.step_time > 18 and one_f_one_b.step_time > 18
+        # GPipe keeps the activations of all micro batches
+        assert gpipe.mesh_peak_memory == [40] * num_meshes
+        # 1F1B keeps at most (num_meshes - mesh_idx) micro batches
+        assert one_f_one_b.mesh_peak_memory == [30, 20, 10]
+
+    def test_stage_construction_scorer(self):
+        compute_cost = np.ones((4, 4, 1, 1))
+        layer_boundary_bytes = np.full(5, 1e9)
+        simulator = StageConstructionSimulator(compute_cost, 4, "1f1b",
+                                               layer_boundary_bytes)
+        solution = [((0, 2), 0, 0), ((2, 4), 0, 0)]
+        simulator_no_comm = StageConstructionSimulator(compute_cost, 4, "1f1b")
+        # 2 stages with cost 1 and 4 micro batches
+        assert np.isclose(simulator_no_comm(solution), 5)
+        assert simulator(solution) > simulator_no_comm(solution)
+
+    def test_validate_with_trace(self):
+        global_config.collect_trace = True
+        init()
+        try:
+            state, batch, train_step = get_mlp_train_state_and_step(
+                batch_size=128,
+                hidden_size=128,
+                add_manual_pipeline_marker=True)
+            train_step = parallelize(train_step,
+                                     method=PipeshardParallel(
+                                         num_micro_batches=2,
+                                         layer_option="manual"))
+            for _ in range(3):
+                state, _ = train_step(state, batch)
+
+            executable = train_step.get_last_executable()
+            exec_info = executable.get_stage_execution_info()
+            measured = get_step_times_from_execution_info(
+                exec_info, executable.schedule)[-1]
+            predicted = simulate_executable(executable).step_time
+            # The simulation ignores the launch overhead between instructions
+            assert predicted <= measured * 1.05
+            assert predicted >= measured * 0.3
+        finally:
+            shutdown()
+            global_config.collect_trace = False
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(PipelineSimulatorTest("test_balanced_stages"))
+    suite.addTest(PipelineSimulatorTest("test_communication_and_memory"))
+    suite.addTest(PipelineSimulatorTest("test_stage_construction_scorer"))
+    suite.addTest(PipelineSimulatorTest("test_validate_with_trace"))
+    return suite
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
@@ -0,0 +1,102 @@
+"""Test the persistent stage profile store."""
+import os
+import tempfile
+import unittest
+
+import jax
+import jax.numpy as jnp
+
+from alpa.pipeline_parallel.profile_store import (ProfileStore,
+                                                  canonical_jaxpr_str)
+from alpa.pipeline_parallel.stage_profiling import (ModuleProfileConfig,
+                                                    ModuleProfileResult,
+                                                    StageConfig,
+                                                    StageProfileResult)
+
+
+def make_stage_config(invar_names, outvar_names, fingerprint="stage"):
+    config = ModuleProfileConfig(invar_names, outvar_names, None, None,
+                                 (False,) * len(invar_names), (), ())
+    return StageConfig(1, None, [config], None, fingerprint)
+
+
+def make_stage_result(stage_config, compute_cost):
+    config = stage_config.module_profile_configs[0]
+    result = StageProfileResult(1, (), ())
+    result.add_module_profile_result(
+        0,
+        ModuleProfileResult(compute_cost, 100, 10, config.invar_names,
+                            config.outvar_names, [8] * len(config.invar_names),
+                            [8] * len(config.outvar_names),
+                            config.donated_invars, (), (), 1000))
+    return result
+
+
+class ProfileStoreTest(unittest.TestCase):
+
+    def test_canonical_jaxpr(self):
+
+        def block(x, w):
+            return jnp.tanh(x @ w)
+
+        def block_renamed(a, b):
+            c = a @ b
+            return jnp.tanh(c)
+
+        x = jnp.ones((4, 8))
+        w = jnp.ones((8, 8))
+        jaxpr_a = jax.make_jaxpr(block)(x, w)
+        jaxpr_b = jax.make_jaxpr(block_renamed)(x, w)
+        jaxpr_c = jax.make_jaxpr(block)(jnp.ones((2, 8)), w)
+
+        assert canonical_jaxpr_str(jaxpr_a.jaxpr) == canonical_jaxpr_str(
+            jaxpr_b.jaxpr)
+        assert canonical_jaxpr_str(jaxpr_a.jaxpr) != canonical_jaxpr_str(
+            jaxpr_c.jaxpr)
+
+    def test_insert_lookup(self):
+        with tempfile.TemporaryDirectory() as store_dir:
+            store = ProfileStore(store_dir)
+            config_a = make_stage_config(("a", "b"), ("c",))
+            store.insert("key", config_a, make_stage_result(config_a, 1.5))
+
+            # The same stage in another model with different variable names
+            config_b = make_stage_config(("x", "y"), ("z",))
+            result = store.lookup("key", config_b)
+            assert result.fully_profiled()
+            module_result = result.module_profile_results[0]
+            assert module_result.compute_cost == 1.5
+            assert module_result.invar_names == ("x", "y")
+            assert module_result.outvar_names == ("z",)
+            assert store.lookup("missing", config_b) is None
+            assert store.stats() == {"hits": 1, "misses": 1}
+
+    def test_merge(self):
+        with tempfile.TemporaryDirectory() as root:
+            dirs = [os.path.join(root, name) for name in ("a", "b", "out")]
+            config = make_stage_config(("a",), ("b",))
+            ProfileStore(dirs[0]).insert("key_a", config,
+                                         make_stage_result(config, 1.0))
+            ProfileStore(dirs[1]).insert("key_b", config,
+                                         make_stage_result(config, 2.0))
+
+            out = ProfileStore(dirs[2])
+            assert out.merge_from(dirs[0]) == 1
+            assert out.merge_from(dirs[1]) == 1
+            assert out.merge_from(dirs[1]) == 0
+            assert out.keys() == ["key_a", "key_b"]
+            assert out.lookup("key_b", config).module_profile_results[
+                0].compute_cost == 2.0
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(ProfileStoreTest("test_canonical_jaxpr"))
+    suite.addTest(ProfileStoreTest("test_insert_lookup"))
+    suite.addTest(ProfileStoreTest("test_merge"))
+    return suite
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
@@ -1,7 +1,10 @@
 import unittest
 
+import numpy as np
+
 from alpa.pipeline_parallel.schedules import (gen_linear_pipeline_dependency,
-                                              GpipeSchedule, PipeDreamFlush)
+                                              GpipeSchedule, PipeDreamFlush,
+                                              InterleavedPipeDreamFlush)
 
 
 class PipelineScheduleTest(unittest.TestCase):
@@ -92,10 +95,52 @@ class PipelineScheduleTest(unittest.TestCase):
                     if schedule_type == "1f1b":
                         self.run_1f1b(num_stage, num_mesh, num_batch)
 
+    def run_interleaved_1f1b(self, num_mesh, num_virtual_stages, num_batch):
+        num_fwd_stage = num_mesh * num_virtual_stages
+        num_stage = num_fwd_stage * 2
+        deps = gen_linear_pipeline_dependency(num_stage)
+        apply_grad_placement = {num_stage + i: i for i in range(num_mesh)}
+        s = InterleavedPipeDreamFlush(dependency=deps,
+                                      meshes=[None] * num_mesh,
+                                      apply_grad_placement=apply_grad_placement,
+                                      num_batch=num_batch,
+                                      num_virtual_stages=num_virtual_stages)
+
+        # check the placement of virtual stages
+        for i in range(num_fwd_stage):
+            assert list(s.stage_placement(i)) == [i % num_mesh]
+            assert list(s.stage_placement(num_stage - 1 - i)) == [i % num_mesh]
+        for i in range(num_mesh):
+            assert len(s.mesh_placement(i)) == 2 * num_virtual_stages + 1
+
+        # check every task runs once and after its dependencies
+        finish_clock = {}
+        for clock, sched in enumerate(s.schedules[:-1]):
+            for task in sched:
+                if task:
+                    assert task not in finish_clock
+                    finish_clock[task] = clock
+        assert len(finish_clock) == num_batch * num_stage
+        for (batch_idx, stage_idx), clock in finish_clock.items():
+            for dep in np.nonzero(deps[stage_idx])[0]:
+                assert finish_clock[(batch_idx, dep)] < clock
+
+        # the bubble should be smaller than the one of 1f1b
+        num_1f1b_clock = (num_mesh + num_batch - 1) * 2 * num_virtual_stages
+        assert s.num_clock - 1 < num_1f1b_clock
+
+    def test_interleaved_1f1b(self):
+        for num_mesh in [2, 3, 4]:
+            for num_virtual_stages in [2, 3]:
+                for num_batch in [num_mesh, num_mesh * 2, num_mesh * 4]:
+                    self.run_interleaved_1f1b(num_mesh, num_virtual_stages,
+                                              num_batch)
+
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(PipelineScheduleTest("test_schedules"))
+    suite.addTest(PipelineScheduleTest("test_interleaved_1f1b"))
     return suite
 
 
@@ -1,27 +1,78 @@
 import unittest
 
-from alpa.pipeline_parallel.stage_construction import AutoStageOption
+import numpy as np
+
+from alpa.pipeline_parallel import stage_profiling
+from alpa.pipeline_parallel.stage_construction import (AutoStageOption,
+                                                       ManualStageOption)
+from alpa.pipeline_parallel.stage_cost_predictor import evaluate_predictor
 from alpa.testing import PipelineBasicTest
 
 
-def auto_stage():
+def auto_stage(**kwargs):
     return AutoStageOption(submesh_physical_shape_space="small_power_of_two",
-                           submesh_logical_shape_space="same_as_physical")
+                           submesh_logical_shape_space="same_as_physical",
+                           **kwargs)
 
 
 class StageConstructionTest(PipelineBasicTest):
 
     def test_mlp_stage_construction(self):
         self.run_mlp(stage_option=auto_stage())
+        # The cost predictor is off by default
+        assert len(stage_profiling.last_estimated_stage_indices) == 0
 
     def test_mlp_layer_and_stage(self):
         self.run_mlp(manual_pipeline_layer=False, stage_option=auto_stage())
 
+    def test_mlp_stage_construction_cost_predictor(self):
+        self.run_mlp(stage_option=auto_stage(cost_predictor_top_k=1,
+                                             cost_predictor_num_seed_ranges=1))
+        assert len(stage_profiling.last_estimated_stage_indices) > 0
+
+    def test_mlp_stage_construction_simulator(self):
+        self.run_mlp(stage_option=auto_stage(stage_plan_scorer="simulator"))
+
+    def test_mlp_interleaved_1f1b(self):
+        # Four layers as two virtual stages on each of two meshes
+        stage_option = ManualStageOption([[0], [1], [2], [3]],
+                                         [(1, 1), (1, 1)], [(1, 1), (1, 1)],
+                                         [{}, {}])
+        self.run_mlp(manual_pipeline_layer=False,
+                     stage_option=stage_option,
+                     pipeline_schedule="interleaved_1f1b",
+                     num_virtual_stages=2)
+        self.run_mlp(manual_pipeline_layer=False,
+                     pipeline_schedule="interleaved_1f1b",
+                     num_virtual_stages=2)
+
+    def test_cost_predictor_synthetic(self):
+        # Config c has a cost of (c + 1) * flops + 1 on all submeshes.
+        samples = {}
+        for start in range(8):
+            for end in range(start, 8):
+                flops = float(end - start + 1)
+                for mesh_id in range(2):
+                    for c in range(4):
+                        features = np.array([flops, 2 * flops, flops, 0.0])
+                        samples[start, end, mesh_id, c] = (features,
+                                                           (c + 1) * flops + 1)
+        ret = evaluate_predictor(samples, top_k=1, num_seed_ranges=3)
+        assert ret["profiled_fraction"] < 0.5
+        assert ret["mape"] < 1e-2
+        assert ret["best_config_recall"] == 1.0
+
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(StageConstructionTest('test_mlp_stage_construction'))
     suite.addTest(StageConstructionTest('test_mlp_layer_and_stage'))
+    suite.addTest(
+        StageConstructionTest('test_mlp_stage_construction_cost_predictor'))
+    suite.addTest(
+        StageConstructionTest('test_mlp_stage_construction_simulator'))
+    suite.addTest(StageConstructionTest('test_mlp_interleaved_1f1b'))
+    suite.addTest(StageConstructionTest('test_cost_predictor_synthetic'))
     return suite
 
 
@@ -0,0 +1,180 @@
+"""Test the coalesced collectives of the GLOO backend."""
+import unittest
+
+import numpy as np
+import ray
+
+from alpa import collective as col
+
+
+def get_test_tensors(rank):
+    """Tensors of mixed dtypes and shapes, with values depending on rank."""
+    base = [
+        np.arange(12, dtype=np.float32).reshape(3, 4),
+        np.arange(5, dtype=np.int64),
+        np.array(2.0, dtype=np.float64),
+        np.zeros((0, 3), dtype=np.float32),
+        np.arange(300, dtype=np.float32),
+        np.arange(60, dtype=np.float64).reshape(6, 10)[:, ::2],
+        np.ones((7,), dtype=np.int64),
+    ]
+    return [np.asarray(x * (rank + 1)) for x in base]
+
+
+@ray.remote(num_cpus=1)
+class Worker:
+
+    def __init__(self, world_size, rank, group_name):
+        self.world_size = world_size
+        self.rank = rank
+        self.group_name = group_name
+        col.init_collective_group(world_size, rank, "gloo", group_name)
+
+    def allreduce(self, bucket_bytes):
+        tensors = get_test_tensors(self.rank)
+        col.allreduce_coalesced(tensors,
+                                self.group_name,
+                                bucket_bytes=bucket_bytes)
+        return tensors
+
+    def allgather(self, bucket_bytes):
+        tensors = get_test_tensors(self.rank)
+        outputs = [[np.empty_like(x)
+                    for _ in range(self.world_size)]
+                   for x in tensors]
+        col.allgather_coalesced(outputs,
+                                tensors,
+                                self.group_name,
+                                bucket_bytes=bucket_bytes)
+        return outputs
+
+    def broadcast(self, src_rank, bucket_bytes):
+        tensors = get_test_tensors(self.rank)
+        col.broadcast_coalesced(tensors,
+                                src_rank,
+                                self.group_name,
+                                bucket_bytes=bucket_bytes)
+        return tensors
+
+    def destroy(self):
+        col.destroy_collective_group(self.group_name)
+
+
+@unittest.skipIf(not col.gloo_available(), "GLOO is not available")
+class CollectiveCoalescedTest(unittest.TestCase):
+
+    def setUp(self):
+        ray.init(address="auto", ignore_reinit_error=True)
+        self.world_size = 2
+        self.workers = [
+            Worker.remote(self.world_size, rank, "test_coalesced")
+            for rank in range(self.world_size)
+        ]
+
+    def tearDown(self):
+        ray.get([w.destroy.remote() for w in self.workers])
+        for w in self.workers:
+            ray.kill(w)
+        ray.shutdown()
+
+    def check_equal(self, actual, expected):
+        assert len(actual) == len(expected)
+        for x, y in zip(actual, expected):
+            assert x.dtype == y.dtype and x.shape == y.shape
+            np.testing.assert_array_equal(x, y)
+
+    def test_allreduce_coalesced(self):
+        expected = [
+            np.asarray(sum(xs)) for xs in zip(*[
+                get_test_tensors(rank) for rank in range(self.world_size)
+            ])
+        ]
+        # A small bucket size splits the tensors into many buckets
+        for bucket_bytes in [64, None]:
+            results = ray.get(
+                [w.allreduce.remote(bucket_bytes) for w in self.workers])
+            for result in results:
+                self.check_equal(result, expected)
+
+    def test_allgather_coalesced(self):
+        expected = [
+            list(xs) for xs in zip(*[
+                get_test_tensors(rank) for rank in range(self.world_size)
+            ])
+        ]
+        for bucket_bytes in [64, None]:
+            results = ray.get(
+                [w.allgather.remote(bucket_bytes) for w in self.workers])
+            for result in results:
+                for outputs, expected_outputs in zip(result, expected):
+                    self.check_equal(outputs, expected_outputs)
+
+    def test_broadcast_coalesced(self):
+        src_rank = 1
+        expected = get_test_tensors(src_rank)
+        for bucket_bytes in [64, None]:
+            results = ray.get([
+                w.broadcast.remote(src_rank, bucket_bytes)
+                for w in self.workers
+            ])
+            for result in results:
+                self.check_equal(result, expected)
+
+
+@unittest.skipIf(not col.gloo_available(), "GLOO is not available")
+class CoalescedBucketTest(unittest.TestCase):
+
+    def get_buckets(self, tensors, bucket_bytes):
+        # pylint: disable=import-outside-toplevel
+        from alpa.collective.collective_group.gloo_collective_group import (
+            _get_coalesced_buckets)
+        buckets = _get_coalesced_buckets(tensors, bucket_bytes)
+        return [(b.dtype, b.indices, b.n_elements) for b in buckets]
+
+    def test_bucket_cap(self):
+        tensors = [np.ones((n,), dtype=np.float32) for n in [4, 4, 6, 2]]
+        # The third tensor does not fit in the first bucket of 32 bytes
+        self.assertEqual(self.get_buckets(tensors, 32),
+                         [(np.float32, [0, 1], 8), (np.float32, [2, 3], 8)])
+        self.assertEqual(self.get_buckets(tensors, 1 << 20),
+                         [(np.float32, [0, 1, 2, 3], 16)])
+
+    def test_bucket_per_dtype(self):
+        tensors = [
+            np.ones((2, 2), dtype=np.float32),
+            np.ones((3,), dtype=np.int64),
+            np.ones((4,), dtype=np.float32),
+            np.ones((), dtype=np.int64),
+        ]
+        # Interleaved dtypes are grouped in separate buckets in order
+        self.assertEqual(self.get_buckets(tensors, 1 << 20),
+                         [(np.float32, [0, 2], 8), (np.int64, [1, 3], 4)])
+
+    def test_oversized_tensor(self):
+        tensors = [
+            np.ones((2,), dtype=np.float32),
+            np.ones((100,), dtype=np.float32),
+            np.ones((2,), dtype=np.float32),
+        ]
+        # A tensor larger than the cap gets a bucket of its own
+        self.assertEqual(self.get_buckets(tensors, 16),
+                         [(np.float32, [0], 2), (np.float32, [1], 100),
+                          (np.float32, [2], 2)])
+        self.assertEqual(self.get_buckets(tensors[1:2], 16),
+                         [(np.float32, [0], 100)])
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(CollectiveCoalescedTest("test_allreduce_coalesced"))
+    suite.addTest(CollectiveCoalescedTest("test_allgather_coalesced"))
+    suite.addTest(CollectiveCoalescedTest("test_broadcast_coalesced"))
+    suite.addTest(CoalescedBucketTest("test_bucket_cap"))
+    suite.addTest(CoalescedBucketTest("test_bucket_per_dtype"))
+    suite.addTest(CoalescedBucketTest("test_oversized_tensor"))
+    return suite
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
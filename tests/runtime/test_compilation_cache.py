@@ -0,0 +1,79 @@
+"""Test the on-disk compilation cache."""
+import os
+import tempfile
+import unittest
+
+from alpa import (init, shutdown, parallelize, PipeshardParallel,
+                  AutoLayerOption, clear_executable_cache)
+from alpa.compilation_cache import get_compilation_cache
+from alpa.global_env import global_config
+from alpa.pipeline_parallel.stage_construction import ManualStageOption
+from alpa.testing import get_mlp_train_state_and_step
+
+
+class CompilationCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        init(cluster="ray")
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.old_cache_dir = global_config.compilation_cache_dir
+        global_config.compilation_cache_dir = self.tmp_dir.name
+
+    def tearDown(self):
+        global_config.compilation_cache_dir = self.old_cache_dir
+        self.tmp_dir.cleanup()
+        shutdown()
+
+    def test_pipeshard_parallel(self):
+        state, batch, train_step = get_mlp_train_state_and_step(batch_size=128,
+                                                                hidden_size=128,
+                                                                num_layers=4)
+
+        method = PipeshardParallel(num_micro_batches=2,
+                                   layer_option=AutoLayerOption(layer_num=2),
+                                   stage_option="uniform")
+        p_train_step = parallelize(train_step, method=method)
+        executable1 = p_train_step.get_executable(state, batch)
+        cache = get_compilation_cache()
+        assert cache.stats() == {"hits": 0, "misses": 1}
+        assert len(os.listdir(self.tmp_dir.name)) == 1
+
+        # Compile again as in a new process
+        clear_executable_cache()
+        p_train_step = parallelize(train_step, method=method)
+        executable2 = p_train_step.get_executable(state, batch)
+        assert cache.stats() == {"hits": 1, "misses": 1}
+        assert isinstance(executable2.pipeline_plan.manual_stage_option,
+                          ManualStageOption)
+        assert (executable1.get_input_placement_specs() ==
+                executable2.get_input_placement_specs())
+
+        # A different function does not hit the cache
+        state, batch, train_step = get_mlp_train_state_and_step(batch_size=128,
+                                                                hidden_size=64,
+                                                                num_layers=4)
+        p_train_step = parallelize(train_step, method=method)
+        p_train_step.get_executable(state, batch)
+        assert cache.stats() == {"hits": 1, "misses": 2}
+
+        # A method without automatic decisions skips the cache
+        clear_executable_cache()
+        method = PipeshardParallel(
+            num_micro_batches=2,
+            layer_option=AutoLayerOption(layer_num=2),
+            stage_option=executable2.pipeline_plan.manual_stage_option)
+        p_train_step = parallelize(train_step, method=method)
+        p_train_step.get_executable(state, batch)
+        assert cache.stats() == {"hits": 1, "misses": 2}
+        assert len(os.listdir(self.tmp_dir.name)) == 2
+
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTest(CompilationCacheTest("test_pipeshard_parallel"))
+    return s
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
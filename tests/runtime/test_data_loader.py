@@ -7,8 +7,11 @@ import jax
 import jax.numpy as jnp
 from jax.interpreters import pxla
 import numpy as np
+import optax
 
-from alpa import init, MeshDriverDataLoader
+from alpa import (init, parallelize, value_and_grad, DataLoader,
+                  MeshDriverDataLoader, ShardParallel)
+from alpa.model.model_util import TrainState
 from alpa.parallel_plan import PlacementSpec
 from alpa.device_mesh import get_global_physical_mesh
 from alpa.testing import assert_allclose
@@ -21,7 +24,7 @@ class DataLoaderTest(unittest.TestCase):
         init(cluster="ray")
         self.physical_mesh = get_global_physical_mesh(create_if_not_exist=True)
 
-    def run_test(self, sharding_specs):
+    def run_test(self, sharding_specs, num_micro_batches=1):
         batch_size = 64
         num_samples = 256
         feature_dim = 32
@@ -35,9 +38,12 @@ class DataLoaderTest(unittest.TestCase):
         ]
         prefetch_size = 2
 
-        data_loader = MeshDriverDataLoader(batch_size, num_samples,
-                                           input_iter_func, placement_specs,
-                                           prefetch_size)
+        data_loader = MeshDriverDataLoader(batch_size,
+                                           num_samples,
+                                           input_iter_func,
+                                           placement_specs,
+                                           prefetch_size,
+                                           num_micro_batches=num_micro_batches)
         expected_data_loader = input_iter_func(0, num_samples, batch_size)
 
         actual_x = []
@@ -62,6 +68,9 @@ class DataLoaderTest(unittest.TestCase):
         # Check that actual_y is a permutation of expected_y.
         assert np.sum(actual_y) == np.sum(expected_y)
 
+        stats = data_loader.get_stats()
+        assert all(x["num_batches"] == num_samples // batch_size for x in stats)
+
     def test_data_parallel(self):
         num_devices = self.physical_mesh.num_devices
 
@@ -84,6 +93,121 @@ class DataLoaderTest(unittest.TestCase):
         ]
         self.run_test(sharding_specs)
 
+    def test_data_parallel_micro_batches(self):
+        num_devices = self.physical_mesh.num_devices
+
+        sharding_specs = [
+            pxla.ShardingSpec((pxla.Chunked((num_devices,)), pxla.NoSharding()),
+                              (pxla.ShardedAxis(0),)),
+            pxla.ShardingSpec((pxla.NoSharding(),),
+                              (pxla.Replicated(num_devices),))
+        ]
+        self.run_test(sharding_specs, num_micro_batches=2)
+
+    def test_driver_data_loader_async(self):
+        batch_size = 64
+        num_samples = 256
+        num_devices = self.physical_mesh.num_devices
+        avals = [
+            jax.core.ShapedArray((batch_size, 32), jnp.float32),
+            jax.core.ShapedArray((batch_size,), jnp.int32)
+        ]
+        sharding_specs = [
+            pxla.ShardingSpec((pxla.Chunked((num_devices,)), pxla.NoSharding()),
+                              (pxla.ShardedAxis(0),)),
+            pxla.ShardingSpec((pxla.Chunked((num_devices,)),),
+                              (pxla.ShardedAxis(0),))
+        ]
+        placement_specs = [
+            PlacementSpec(aval, (self.physical_mesh.mesh_id,), (sharding_spec,))
+            for aval, sharding_spec in zip(avals, sharding_specs)
+        ]
+
+        # The byte budget only allows one batch in flight
+        data_loader = DataLoader(input_iter_func(0, num_samples, batch_size),
+                                 placement_specs,
+                                 prefetch_size=3,
+                                 num_threads=2,
+                                 max_prefetch_bytes=batch_size * 33 * 4)
+        expected_data_loader = input_iter_func(0, num_samples, batch_size)
+        num_batches = 0
+        uuids = []
+        for actual_batch, expected_batch in zip(data_loader,
+                                                expected_data_loader):
+            assert_allclose(np.array(actual_batch[0]), expected_batch[0])
+            assert_allclose(np.array(actual_batch[1]), expected_batch[1])
+            uuids.extend(x.remote_ref.uuid for x in actual_batch)
+            num_batches += 1
+        assert num_batches == num_samples // batch_size
+        # Batches sharded by different threads never share remote buffers
+        assert len(set(uuids)) == len(uuids)
+
+    def test_grad_accumulation_micro_batches(self):
+        batch_size = 64
+        num_samples = 256
+        num_micro_batches = 2
+        num_devices = self.physical_mesh.num_devices
+
+        model = nn.Dense(1)
+        params = model.init(jax.random.PRNGKey(0), jnp.ones((1, 32)))
+        state = TrainState.create(apply_fn=model.apply,
+                                  params=params,
+                                  tx=optax.sgd(learning_rate=0.1),
+                                  dynamic_scale=None)
+
+        def train_step(state, x, y):
+
+            def loss_func(params):
+                out = state.apply_fn(params, x / (1024 * 32))[:, 0]
+                return jnp.mean((out - y / 1024)**2)
+
+            grads = value_and_grad(loss_func)(state.params)[1]
+            return state.apply_gradients(grads=grads)
+
+        method = ShardParallel(num_micro_batches=num_micro_batches)
+        p_train_step = parallelize(train_step,
+                                   method=method,
+                                   donate_argnums=(),
+                                   batch_argnums=(1, 2))
+        avals = [
+            jax.core.ShapedArray((batch_size, 32), jnp.float32),
+            jax.core.ShapedArray((batch_size,), jnp.int32)
+        ]
+        executable = p_train_step.get_executable(state, *avals)
+        placement_specs = executable.get_input_placement_specs()[1:3]
+
+        def train(batches):
+            new_state = state
+            for x, y in batches:
+                new_state = p_train_step(new_state, x, y)
+            return [np.array(x) for x in jax.tree_leaves(new_state.params)]
+
+        expected = train(input_iter_func(0, num_samples, batch_size))
+
+        # The micro batches are passed to the executable without resharding
+        data_loader = MeshDriverDataLoader(batch_size,
+                                           num_samples,
+                                           input_iter_func,
+                                           placement_specs,
+                                           num_micro_batches=num_micro_batches)
+        for x, y in zip(train(data_loader), expected):
+            assert_allclose(x, y)
+
+        # Micro batches with another layout fall back to resharding
+        replicated_specs = []
+        for ps in placement_specs:
+            spec = pxla.ShardingSpec((pxla.NoSharding(),) * len(ps.aval.shape),
+                                     (pxla.Replicated(num_devices),))
+            replicated_specs.append(PlacementSpec(ps.aval, ps.mesh_ids,
+                                                  (spec,)))
+        data_loader = MeshDriverDataLoader(batch_size,
+                                           num_samples,
+                                           input_iter_func,
+                                           replicated_specs,
+                                           num_micro_batches=num_micro_batches)
+        for x, y in zip(train(data_loader), expected):
+            assert_allclose(x, y)
+
     def test_data_model_parallel(self):
         dp = 2
         mp = self.physical_mesh.num_devices // dp
@@ -103,6 +227,9 @@ def suite():
     suite.addTest(DataLoaderTest("test_data_parallel"))
     suite.addTest(DataLoaderTest("test_model_parallel"))
     suite.addTest(DataLoaderTest("test_data_model_parallel"))
+    suite.addTest(DataLoaderTest("test_data_parallel_micro_batches"))
+    suite.addTest(DataLoaderTest("test_driver_data_loader_async"))
+    suite.addTest(DataLoaderTest("test_grad_accumulation_micro_batches"))
 
     return suite
 
@@ -10,7 +10,9 @@ from jax.interpreters import pxla
 import numpy as np
 import ray
 
-from alpa import init, shutdown, parallelize, DistributedArray
+from alpa import (init, shutdown, parallelize, device_get, prefetch,
+                  DistributedArray)
+from alpa import device_mesh
 from alpa.device_mesh import get_global_physical_mesh
 from alpa.testing import assert_allclose
 
@@ -53,6 +55,45 @@ class DeviceMeshTest(unittest.TestCase):
 
         assert_allclose(array, dis_a)
 
+    def test_device_get(self):
+        physical_mesh = get_global_physical_mesh(create_if_not_exist=True)
+        logical_mesh = physical_mesh.get_logical_mesh()
+
+        arrays = [
+            jnp.arange(64).reshape([8, 8]),
+            jnp.ones((16, 4)),
+            jnp.arange(8.0),
+        ]
+        dis_arrays = []
+        for array, tile_dims in zip(arrays, [[0, 1], [0], []]):
+            sharding_spec = logical_mesh.make_tile_spec(
+                array, tile_dims, list(range(len(tile_dims))))
+            indices = sharding_spec.indices(array.shape).flatten()
+            dis_arrays.append(
+                physical_mesh.shard_args_to_arrays([array.aval], [indices],
+                                                   [sharding_spec],
+                                                   [array])[0])
+
+        tree = {"a": dis_arrays[0], "b": (dis_arrays[1], dis_arrays[2], 1)}
+        values = device_get(tree)
+        assert values["b"][2] == 1
+        for array, value in zip(arrays, [values["a"], *values["b"][:2]]):
+            assert isinstance(value, np.ndarray)
+            # Also true for a replicated array with a single full shard
+            assert value.flags.writeable
+            assert_allclose(array, value)
+        stats = device_mesh.last_device_get_stats
+        assert stats["num_arrays"] == 3
+        assert stats["num_bytes"] >= sum(x.nbytes for x in arrays)
+
+        # prefetch uses the same batched fetch
+        for array in dis_arrays:
+            array.flush()
+        prefetch(dis_arrays)
+        for array, dis_array in zip(arrays, dis_arrays):
+            assert dis_array._npy_value is not None
+            assert_allclose(array, dis_array)
+
     def test_preshard_args(self):
 
         @parallelize
@@ -85,6 +126,7 @@ def suite():
     suite = unittest.TestSuite()
     suite.addTest(DeviceMeshTest("test_add_one"))
     suite.addTest(DeviceMeshTest("test_distributed_array"))
+    suite.addTest(DeviceMeshTest("test_device_get"))
     suite.addTest(DeviceMeshTest("test_preshard_args"))
     suite.addTest(DeviceMeshTest("test_preshard_args"))
     suite.addTest(DeviceMesh_ResourceAwareness("test_resource_check"))
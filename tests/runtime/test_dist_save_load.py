@@ -1,5 +1,7 @@
 """Test distributed save and load."""
 
+import os
+import pickle
 import subprocess
 import tempfile
 import unittest
@@ -10,8 +12,12 @@ import numpy as np
 import optax
 
 from alpa import (init, shutdown, parallelize, DistributedArray,
-                  PipeshardParallel, save_checkpoint, restore_checkpoint)
+                  PipeshardParallel, save_checkpoint, restore_checkpoint,
+                  wait_checkpoint)
 from alpa.device_mesh import get_global_cluster
+from alpa.serialization import (choose_chunk_shape, load_chunked_array_slices,
+                                load_sharded_array_slices, save_chunks,
+                                write_chunk_index)
 from alpa.testing import (get_mlp_train_state_and_step,
                           get_bert_layer_train_state_and_step, assert_allclose)
 
@@ -191,6 +197,46 @@ class DistSaveLoadTest(unittest.TestCase):
             # Check results
             assert_allclose(serial_state.params, load_state.params, 1e-3, 1e-3)
 
+    def test_distributed_mlp_async_save_load(self):
+        save_prefix = self._get_save_prefix()
+
+        # Init model
+        state, batch, train_step = get_mlp_train_state_and_step(
+            batch_size=128,
+            hidden_size=16,
+            num_layers=4,
+            add_manual_pipeline_marker=True)
+
+        # Compile
+        method = PipeshardParallel(num_micro_batches=1, layer_option="manual")
+        serial_train_step = train_step
+        parallel_train_step = parallelize(train_step, method=method)
+        executable = parallel_train_step.get_executable(state, batch)
+
+        # Run before save
+        serial_state = serial_train_step(state, batch)[0]
+        parallel_state = parallel_train_step(state, batch)[0]
+
+        for checkpoint_format in ["shard", "chunked"]:
+            with tempfile.TemporaryDirectory(prefix=save_prefix) as ckpt_dir:
+                # Save checkpoint and overlap it with a train step
+                future = save_checkpoint(ckpt_dir,
+                                         parallel_state,
+                                         1,
+                                         checkpoint_format=checkpoint_format,
+                                         async_=True)
+                parallel_train_step(parallel_state, batch)
+                wait_checkpoint()
+                assert future.done()
+
+                # Restore checkpoint
+                state_ps, _ = executable.get_input_placement_specs()
+                load_state = restore_checkpoint(ckpt_dir, 1, state_ps)
+
+                # Check results
+                assert_allclose(serial_state.params, load_state.params, 1e-3,
+                                1e-3)
+
     def test_distributed_bert_cached_save_load(self):
         save_prefix = self._get_save_prefix()
 
@@ -240,11 +286,85 @@ class DistSaveLoadTest(unittest.TestCase):
                                 1e-3)
 
 
+class CheckpointFileTest(unittest.TestCase):
+    """Test reading and writing checkpoint files without ray."""
+
+    def test_load_sharded_array_slices(self):
+        global_shape = (6, 4)
+        data = np.arange(np.prod(global_shape)).reshape(global_shape)
+        # Two hosts, each saves two row blocks. The last block is replicated.
+        host_shard_indices = [
+            [(slice(0, 2), slice(None)), (slice(2, 4), slice(None))],
+            [(slice(4, 6), slice(None)), (slice(4, 6), slice(None))],
+        ]
+
+        with tempfile.TemporaryDirectory() as ckpt_dir:
+            for host_id, shard_indices in enumerate(host_shard_indices):
+                shard_names = [
+                    f"shard_{host_id}.{i}" for i in range(len(shard_indices))
+                ]
+                for name, index in zip(shard_names, shard_indices):
+                    with open(os.path.join(ckpt_dir, name), "wb") as datafile:
+                        np.save(datafile, data[index])
+                with open(os.path.join(ckpt_dir, f"metadata_{host_id}"),
+                          "wb") as metafile:
+                    pickle.dump(
+                        {
+                            "global_shape": global_shape,
+                            "dtype": data.dtype,
+                            "shard_names": shard_names,
+                            "shard_indices": shard_indices,
+                        }, metafile)
+
+            # Load with a different sharding that crosses the saved shards
+            indices = [
+                (slice(1, 5), slice(0, 2)),
+                (slice(1, 5), slice(2, 4)),
+                (slice(None), slice(None)),
+                (slice(1, 5), slice(0, 2)),
+            ]
+            loaded = load_sharded_array_slices(ckpt_dir,
+                                               ["metadata_0", "metadata_1"],
+                                               indices)
+            for index, x in zip(indices, loaded):
+                assert_allclose(x, data[index])
+
+    def test_chunked_array_slices(self):
+        global_shape = (8, 12)
+        data = np.arange(np.prod(global_shape),
+                         dtype=np.float32).reshape(global_shape)
+        shard_indices = [(slice(i, i + 4), slice(j, j + 6))
+                         for i in [0, 4]
+                         for j in [0, 6]]
+        for compression in [None, "zlib"]:
+            with tempfile.TemporaryDirectory() as ckpt_dir:
+                chunk_shape = choose_chunk_shape((4, 6), data.dtype, 64)
+                assert chunk_shape == (4, 3)
+                write_chunk_index(ckpt_dir, global_shape, data.dtype,
+                                  chunk_shape, compression)
+                for index in shard_indices:
+                    save_chunks(ckpt_dir, data[index], index, global_shape,
+                                chunk_shape, compression)
+
+                indices = [
+                    (slice(1, 7), slice(None)),
+                    (slice(None), slice(3, 5)),
+                    (slice(None), slice(None)),
+                ]
+                loaded = load_chunked_array_slices(ckpt_dir, indices)
+                for index, x in zip(indices, loaded):
+                    assert_allclose(x, data[index])
+
+
 def suite():
     suite = unittest.TestSuite()
+    suite.addTest(
+        CheckpointFileTest("test_load_sharded_array_slices"))
+    suite.addTest(CheckpointFileTest("test_chunked_array_slices"))
     suite.addTest(DistSaveLoadTest("test_distributed_array_save_load"))
     suite.addTest(DistSaveLoadTest("test_jax_mlp_save_dist_load"))
     suite.addTest(DistSaveLoadTest("test_distributed_mlp_uncached_save_load"))
+    suite.addTest(DistSaveLoadTest("test_distributed_mlp_async_save_load"))
     suite.addTest(DistSaveLoadTest("test_distributed_bert_cached_save_load"))
     return suite
 
@@ -4,7 +4,7 @@ import unittest
 import ray
 
 from alpa import (init, shutdown, parallelize, global_config, ShardParallel,
-                  PipeshardParallel)
+                  PipeshardParallel, flush_deletes)
 from alpa.device_mesh import get_global_cluster
 from alpa.test_install import get_mlp_train_state_and_step
 
@@ -16,6 +16,9 @@ class MemoryLeakTest(unittest.TestCase):
         global_config.delete_remote_arrays_threshold = 0
 
     def tearDown(self):
+        global_config.delete_remote_arrays_threshold = 50
+        global_config.delete_remote_arrays_bytes_threshold = 1 << 28
+        global_config.record_remote_buffer_call_sites = False
         shutdown()
 
     def test_shard_parallel(self):
@@ -56,11 +59,40 @@ class MemoryLeakTest(unittest.TestCase):
             for w in mesh.workers:
                 assert len(ray.get(w.get_live_buffer_uuids.remote())) == 0
 
+    def test_flush_deletes(self):
+        global_config.delete_remote_arrays_threshold = 1 << 30
+        global_config.record_remote_buffer_call_sites = True
+        init_state, batch, train_step = get_mlp_train_state_and_step(
+            batch_size=128, hidden_size=128)
+        train_step = parallelize(train_step,
+                                 method=ShardParallel(num_micro_batches=2))
+
+        state, loss = train_step(init_state, batch)
+        executable = train_step.get_last_executable()
+        manager = executable.physical_mesh.buffer_manager
+        assert manager.live_bytes > 0
+        assert "File" in manager.dump_live_buffers(top_k=3)
+
+        # Nothing is sent to workers before the flush due to the threshold
+        del state, loss
+        assert manager.to_delete_uuids
+        flush_deletes()
+        assert not manager.to_delete_uuids and manager.to_delete_bytes == 0
+        for w in executable.physical_mesh.workers:
+            assert len(ray.get(w.get_live_buffer_uuids.remote())) <= 1
+
+        # Large pending bytes trigger the deletion
+        global_config.delete_remote_arrays_bytes_threshold = 0
+        state, loss = train_step(init_state, batch)
+        del state, loss
+        assert not manager.to_delete_uuids
+
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(MemoryLeakTest("test_shard_parallel"))
     suite.addTest(MemoryLeakTest("test_pipeline_parallel"))
+    suite.addTest(MemoryLeakTest("test_flush_deletes"))
     return suite
 
 
@@ -0,0 +1,68 @@
+"""Test the graph reduction of the auto-sharding ILP."""
+
+import unittest
+
+import numpy as np
+
+from alpa.shard_parallel import auto_sharding
+from alpa.shard_parallel.auto_sharding import _call_solver_serialized_args
+from alpa.shard_parallel.cost_graph import CostGraph, num_ilp_variables
+from tests.shard_parallel.test_ilp_solver_backend import generate_solver_inputs
+
+
+class CostGraphTest(unittest.TestCase):
+    """Test that the graph reduction does not change the optimal objective."""
+
+    def tearDown(self):
+        auto_sharding.solver_graph_reduction = True
+
+    def test_chain(self):
+        # A chain 0 - 1 - 2 - 3 is reduced to constants
+        s_len = np.array([2, 3, 3, 2], dtype=np.int32)
+        s_follow = np.full(4, -1, dtype=np.int32)
+        E = np.array([0, 1, 1, 2, 2, 3], dtype=np.int32)  # noqa
+        L = np.array([0, 0, 0, 0], dtype=np.int32)  # noqa
+        c = np.arange(10, dtype=np.float32)
+        r = np.ones(6 + 9 + 6, dtype=np.float32)
+        args = (4, -1, s_len, s_follow, E, np.zeros(0, np.int32), L, c,
+                np.zeros_like(c), np.zeros_like(c), r, np.zeros(0, np.float32),
+                None)
+        graph = CostGraph(*args)
+        graph.simplify()
+        reduced = graph.export_reduced_problem()
+        assert num_ilp_variables(reduced[2], reduced[3], reduced[4]) == 0
+
+        s_val, e_val, objective = graph.expand_solution(np.zeros(4, np.int32))
+        assert s_val.tolist() == [0, 0, 0, 0]
+        assert e_val.tolist() == [0, 0, 0]
+        self.assertAlmostEqual(objective, 0 + 2 + 5 + 8 + 3)
+
+    def test_random_problems(self):
+        for seed, num_nodes in enumerate([5, 20, 60, 100]):
+            args = generate_solver_inputs(num_nodes, 4, seed)
+            # Test both with and without the memory constraint
+            for M in [args[1], -1]:  # pylint: disable=invalid-name
+                args = args[:1] + (M,) + args[2:]
+                auto_sharding.solver_graph_reduction = False
+                _, _, expected_objective, _ = (
+                    _call_solver_serialized_args(*args))
+                auto_sharding.solver_graph_reduction = True
+                s_val, e_val, objective, status = (
+                    _call_solver_serialized_args(*args))
+                assert status == 1
+                assert s_val.shape == (num_nodes,)
+                assert e_val.shape == (len(args[4]) // 2,)
+                assert auto_sharding._check_memory_constraint(
+                    num_nodes, M, args[2], args[6], args[9], s_val)
+                self.assertAlmostEqual(objective, expected_objective, 3)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(CostGraphTest))
+    return suite
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
@@ -0,0 +1,92 @@
+"""Test the sparse backends of the auto-sharding ILP solver."""
+
+import unittest
+
+import numpy as np
+
+from alpa.shard_parallel import auto_sharding
+from alpa.shard_parallel.auto_sharding import _call_solver_serialized_args
+
+
+def generate_solver_inputs(num_nodes, max_num_strategies, seed):
+    """Generate the serialized inputs of a random auto-sharding ILP."""
+    rng = np.random.RandomState(seed)
+    s_len = rng.randint(1, max_num_strategies + 1,
+                        size=num_nodes).astype(np.int32)
+    s_follow = np.full(num_nodes, -1, dtype=np.int32)
+    for i in range(1, num_nodes):
+        if rng.rand() < 0.15:
+            j = rng.randint(0, i)
+            if s_follow[j] < 0:
+                s_follow[i] = j
+                s_len[i] = s_len[j]
+
+    edges = sorted({(int(j), i)
+                    for i in range(1, num_nodes)
+                    for j in rng.choice(i, size=min(i, 2), replace=False)})
+    aliases = [(i, i + 1) for i in range(0, num_nodes - 1, 10)]
+    liveness = [
+        rng.choice(num_nodes, size=rng.randint(1, 5), replace=False)
+        for _ in range(num_nodes)
+    ]
+    m = [rng.rand(n).astype(np.float32) * 10 for n in s_len]
+    for x in m:
+        x[0] = 0.1
+    v = []
+    for i, j in aliases:
+        x = (rng.rand(s_len[i] * s_len[j]) < 0.3).astype(np.float32)
+        x[0] = 0
+        v.append(x)
+
+    N = num_nodes  # pylint: disable=invalid-name
+    M = float(sum(x.mean() for x in m))  # pylint: disable=invalid-name
+    E = np.array(edges, dtype=np.int32).reshape(-1)  # noqa
+    A = np.array(aliases, dtype=np.int32).reshape(-1)  # noqa
+    L = np.concatenate([[len(x) for x in liveness]] +  # noqa
+                       liveness).astype(np.int32)
+    c = rng.rand(s_len.sum()).astype(np.float32)
+    d = rng.rand(s_len.sum()).astype(np.float32)
+    r = np.concatenate([
+        rng.rand(s_len[i] * s_len[j]).astype(np.float32) * 10
+        for i, j in edges
+    ])
+    return (N, M, s_len, s_follow, E, A, L, c, d, np.concatenate(m), r,
+            np.concatenate(v))
+
+
+class ILPSolverBackendTest(unittest.TestCase):
+    """Test the sparse backends against the pulp backend."""
+
+    def tearDown(self):
+        auto_sharding.solver_backend = "pulp"
+
+    def run_backends(self, backends):
+        for seed, num_nodes in enumerate([5, 20, 60]):
+            args = generate_solver_inputs(num_nodes, 4, seed)
+            auto_sharding.solver_backend = "pulp"
+            _, _, expected_objective, _ = _call_solver_serialized_args(*args)
+            for backend in backends:
+                auto_sharding.solver_backend = backend
+                s_val, e_val, objective, status = (
+                    _call_solver_serialized_args(*args))
+                assert status == 1
+                assert s_val.shape == (num_nodes,)
+                assert e_val.shape == (len(args[4]) // 2,)
+                self.assertAlmostEqual(objective, expected_objective, 3)
+
+    def test_scipy_milp(self):
+        self.run_backends(["scipy_milp"])
+
+    def test_cbc_mps(self):
+        self.run_backends(["cbc_mps"])
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(ILPSolverBackendTest))
+    return suite
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
@@ -0,0 +1,80 @@
+"""Test the on-disk ILP solution cache."""
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from alpa.shard_parallel.solution_cache import ILPSolutionCache
+
+
+class ILPSolutionCacheTest(unittest.TestCase):
+    """Test ILPSolutionCache."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = ILPSolutionCache(self.tmp_dir.name, 1 << 20, 1e-6)
+        s_len = np.array([2, 3], dtype=np.int32)
+        s_follow = np.array([-1, -1], dtype=np.int32)
+        E = np.array([0, 1], dtype=np.int32)  # noqa
+        A = np.array([], dtype=np.int32)  # noqa
+        L = np.array([1, 1, 0, 1], dtype=np.int32)  # noqa
+        v = np.array([], dtype=np.float32)
+        self.key = self.cache.compute_key(2, -1, s_len, s_follow, E, A, L, v,
+                                          None)
+        self.costs = (np.arange(5, dtype=np.float32),) * 3 + (np.arange(
+            6, dtype=np.float32),)
+        self.solution = (np.array([1, 2], dtype=np.int32),
+                         np.array([5], dtype=np.int32), 3.0, 1)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_lookup_and_insert(self):
+        self.assertIsNone(self.cache.lookup(self.key, self.costs))
+        self.cache.insert(self.key, self.costs, self.solution)
+
+        # A new cache object sees the solution written by another one.
+        cache = ILPSolutionCache(self.tmp_dir.name, 1 << 20, 1e-6)
+        s_val, e_val, objective, status = cache.lookup(self.key, self.costs)
+        np.testing.assert_array_equal(s_val, self.solution[0])
+        np.testing.assert_array_equal(e_val, self.solution[1])
+        assert (objective, status) == (3.0, 1)
+        assert cache.stats() == {"hits": 1, "misses": 0}
+
+    def test_tolerance(self):
+        self.cache.insert(self.key, self.costs, self.solution)
+        close_costs = tuple(x * (1 + 1e-8) for x in self.costs)
+        far_costs = tuple(x * 1.1 for x in self.costs)
+        assert self.cache.lookup(self.key, close_costs) is not None
+        assert self.cache.lookup(self.key, far_costs) is None
+        assert self.cache.stats() == {"hits": 1, "misses": 1}
+
+    def test_eviction(self):
+        self.cache.insert(self.key, self.costs, self.solution)
+        file_size = os.path.getsize(
+            os.path.join(self.tmp_dir.name, self.key + ".pkl"))
+        self.cache.max_bytes = file_size * 2
+
+        other_keys = ["a" * 64, "b" * 64]
+        for i, key in enumerate(other_keys):
+            # Make the mtime order deterministic
+            os.utime(os.path.join(self.tmp_dir.name, self.key + ".pkl"),
+                     (i, i))
+            self.cache.insert(key, self.costs, self.solution)
+
+        assert self.cache.lookup(self.key, self.costs) is None
+        for key in other_keys:
+            assert self.cache.lookup(key, self.costs) is not None
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(ILPSolutionCacheTest))
+    return suite
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(suite())